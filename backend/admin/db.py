@@ -0,0 +1,504 @@
+"""
+Доступ к базе: пул соединений, схема проекта и каталог подготовленных запросов
+Схема определяется один раз (DB_SCHEMA) и ставится соединению в search_path при
+подключении, поэтому неквалифицированные имена таблиц и {schema} в тексте запросов
+указывают на одно и то же. Соединения живут в пуле на уровне модуля и переживают
+теплые вызовы функции: conn.close() возвращает соединение в пул, а не закрывает его.
+Открытых соединений у пула не больше DB_POOL_MAX_SIZE: когда все заняты, следующий
+ждет возврата до DB_POOL_ACQUIRE_TIMEOUT секунд (в порядке очереди) и получает PoolExhausted.
+
+Горячие запросы регистрируются в каталоге по имени: {schema} подставляется один раз
+при импорте, на каждом соединении запрос готовится (PREPARE) при первом выполнении,
+дальше идет EXECUTE без разбора и планирования. Запрос, удаленный с соединения мимо
+каталога (DEALLOCATE, DISCARD ALL), готовится заново.
+
+Чтения можно отдать реплике (DATABASE_READ_URL) через connect_read(). Отстающая или
+недоступная реплика заменяется основной базой; клиент, только что записавший данные,
+передает позицию своей записи (X-Read-After) и читает их не со старой реплики.
+
+Каждый запрос через курсор соединения из пула попадает в метрики (metrics.py):
+длительность по запросам каталога, время текущего вызова функции в базе, попадания
+в подготовленные запросы и статистика пулов.
+
+Функции деплоятся отдельными папками, поэтому модуль лежит копией рядом с каждым
+index.py, которому нужен. Копии должны оставаться одинаковыми.
+"""
+import os
+import re
+import select
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+import metrics
+
+SCHEMA_NAME = os.environ.get('DB_SCHEMA', 't_p41246523_jobsapp_mobile_proje')
+SCHEMA = '"' + SCHEMA_NAME.replace('"', '""') + '"'
+
+POOL_MAX_IDLE = int(os.environ.get('DB_POOL_MAX_IDLE', '4'))
+# Потолок открытых соединений инстанса (выданные и простаивающие): база делит
+# max_connections между всеми инстансами всех функций
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '10'))
+POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '5'))
+# Дольше простаивавшее соединение закрывается: сервер или балансировщик мог его уже оборвать
+POOL_IDLE_SECONDS = float(os.environ.get('DB_POOL_IDLE_SECONDS', '60'))
+# За PgBouncer в режиме транзакций подготовленные запросы не живут - там DB_PREPARE=0
+PREPARE_STATEMENTS = os.environ.get('DB_PREPARE', '1') != '0'
+
+# Реплика отстает сильнее - чтения уходят на основную базу; состояние реплики
+# перепроверяется не чаще раза в DB_REPLICA_CHECK_SECONDS
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('DB_REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_CHECK_SECONDS = float(os.environ.get('DB_REPLICA_CHECK_SECONDS', '5'))
+# Недоступная реплика не должна задерживать чтение дольше, чем стоит переход на основную
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('DB_REPLICA_CONNECT_TIMEOUT', '2'))
+READ_AFTER_HEADER = 'X-Read-After'
+
+_PARAM_RE = re.compile(r'%\((\w+)\)s|%s|%%')
+_LSN_RE = re.compile(r'[0-9A-F]{1,8}/[0-9A-F]{1,8}')
+
+QUERY_SECONDS = metrics.histogram(
+    'db_query_duration_seconds', 'Длительность запроса к базе (statement - имя в каталоге, sql - прочие)',
+    ('pool', 'statement'))
+CACHE_REQUESTS = metrics.counter('cache_requests_total', 'Обращения к кэшам', ('cache', 'result'))
+POOL_OPENED = metrics.counter('db_pool_connections_opened_total', 'Открытые соединения с базой', ('pool',))
+POOL_REUSED = metrics.counter('db_pool_connections_reused_total', 'Соединения, выданные пулом повторно', ('pool',))
+POOL_IDLE = metrics.gauge('db_pool_idle_connections', 'Простаивающие соединения в пуле', ('pool',))
+POOL_SIZE = metrics.gauge('db_pool_connections', 'Открытые соединения пула, выданные и простаивающие', ('pool',))
+POOL_EXHAUSTED = metrics.counter(
+    'db_pool_exhausted_total', 'Запросы соединения, не дождавшиеся свободного за DB_POOL_ACQUIRE_TIMEOUT', ('pool',))
+REPLICA_LAG = metrics.gauge('db_replica_lag_seconds', 'Отставание реплики при последней проверке')
+REPLICA_HEALTHY = metrics.gauge('db_replica_healthy', 'Реплика отвечала и не отставала при последней проверке')
+
+
+class TimedCursor:
+    """
+    Примесь к классу курсора: время каждого запроса - в метрики и во время вызова функции.
+    statement - метка следующего запроса; ее ставит execute() для запросов каталога.
+    """
+
+    statement = 'sql'
+
+    def execute(self, query: Any, vars: Any = None) -> None:
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._timed(started)
+
+    def executemany(self, query: Any, vars_list: Any) -> None:
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._timed(started)
+
+    def _timed(self, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        QUERY_SECONDS.observe(elapsed, self.connection.pool_name, self.statement)
+        metrics.spend(metrics.DB, elapsed)
+        self.statement = 'sql'
+
+
+_timed_cursors: Dict[type, type] = {}
+
+
+def _timed_cursor(factory: type) -> type:
+    cls = _timed_cursors.get(factory)
+    if cls is None:
+        cls = _timed_cursors[factory] = type(f'Timed{factory.__name__}', (TimedCursor, factory), {})
+    return cls
+
+
+class PoolExhausted(psycopg2.OperationalError):
+    """Все DB_POOL_MAX_SIZE соединений пула заняты дольше DB_POOL_ACQUIRE_TIMEOUT"""
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """
+    Соединение из пула: close() возвращает его в пул (повторный close() ничего не делает),
+    discard() закрывает по-настоящему
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.pool: Optional['Pool'] = None
+        self.pool_name = ''
+        self.checked_out = False
+        self.prepared = set()
+
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        """Курсор заданного класса (cursor_factory), запросы которого учитываются в метриках"""
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _timed_cursor(factory)
+        return super().cursor(*args, **kwargs)
+
+    def close(self) -> None:
+        if self.pool is None:
+            super().close()
+        elif self.checked_out:
+            self.checked_out = False
+            self.pool.release(self)
+
+    def discard(self) -> None:
+        pool, self.pool = self.pool, None
+        super().close()
+        if pool is not None:
+            pool.forget()
+
+
+class Pool:
+    """
+    Потокобезопасный пул соединений (последнее вернувшееся выдается первым)
+    Открыто не больше max_size; из вернувшихся простаивают не больше max_idle, лишние закрываются
+    """
+
+    def __init__(self, dsn_env: str = 'DATABASE_URL', max_idle: int = POOL_MAX_IDLE,
+                 idle_seconds: float = POOL_IDLE_SECONDS, connect_timeout: Optional[int] = None,
+                 name: str = 'primary', max_size: int = POOL_MAX_SIZE,
+                 acquire_timeout: float = POOL_ACQUIRE_TIMEOUT):
+        self.dsn_env = dsn_env
+        self.name = name
+        self.connect_timeout = connect_timeout
+        self.max_idle = max_idle
+        self.idle_seconds = idle_seconds
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self._idle: List[Tuple[PooledConnection, float]] = []
+        self._lock = threading.Lock()
+        # Ждущие acquire() просыпаются, когда соединение вернулось или закрылось;
+        # место получает первый в очереди, а не тот, кто пришел позже всех
+        self._returned = threading.Condition(self._lock)
+        self._waiting: Deque[object] = deque()
+        self.size = 0
+        self.opened = 0
+        self.reused = 0
+        self.exhausted = 0
+
+    def _connect(self) -> PooledConnection:
+        dsn = os.environ.get(self.dsn_env)
+        if not dsn:
+            raise ValueError(f'{self.dsn_env} not configured')
+        params = psycopg2.extensions.parse_dsn(dsn)
+        params['options'] = f"{params.get('options', '')} -c search_path={SCHEMA_NAME},public".strip()
+        if self.connect_timeout is not None:
+            params.setdefault('connect_timeout', str(self.connect_timeout))
+        conn = psycopg2.connect(connection_factory=PooledConnection, **params)
+        conn.pool_name = self.name
+        self.opened += 1
+        return conn
+
+    def acquire(self) -> PooledConnection:
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            with self._returned:
+                self._wait_turn(deadline)
+                if not self._idle:
+                    # Место под новое соединение занимается до подключения
+                    self.size += 1
+                    break
+                conn, released_at = self._idle.pop()
+            # Простаивающее соединение не должно ничего получать: данные в сокете -
+            # это сообщение сервера о закрытии
+            if (conn.closed or time.monotonic() - released_at > self.idle_seconds
+                    or select.select([conn], [], [], 0)[0]):
+                conn.discard()
+                continue
+            self.reused += 1
+            conn.checked_out = True
+            return conn
+        try:
+            conn = self._connect()
+        except BaseException:
+            self.forget()
+            raise
+        conn.pool = self
+        conn.checked_out = True
+        return conn
+
+    def _wait_turn(self, deadline: float) -> None:
+        """Ждет своей очереди и свободного соединения или места; вызывается под блокировкой"""
+        if not self._waiting and (self._idle or self.size < self.max_size):
+            return
+        turn = object()
+        self._waiting.append(turn)
+        try:
+            while self._waiting[0] is not turn or (not self._idle and self.size >= self.max_size):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.exhausted += 1
+                    raise PoolExhausted(f'{self.name} pool: all {self.max_size} connections in use')
+                self._returned.wait(remaining)
+        finally:
+            self._waiting.remove(turn)
+            self._returned.notify_all()
+
+    def release(self, conn: PooledConnection) -> None:
+        # Оборванное соединение закрывается и освобождает место в пуле
+        status = None if conn.closed else conn.info.transaction_status
+        if status in (None, psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN):
+            conn.discard()
+            return
+        try:
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT',
+                             deferrable='DEFAULT', autocommit=False)
+        except psycopg2.Error:
+            conn.discard()
+            return
+        with self._returned:
+            # Ждущему соединение нужно сейчас: его не закрывают даже сверх max_idle
+            if len(self._idle) < self.max_idle or self._waiting:
+                self._idle.append((conn, time.monotonic()))
+                self._returned.notify_all()
+                return
+        conn.discard()
+
+    def forget(self) -> None:
+        """Соединение пула закрыто: его место свободно"""
+        with self._returned:
+            self.size -= 1
+            self._returned.notify_all()
+
+    def close(self) -> None:
+        """Закрывает все простаивающие соединения"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.discard()
+
+    def stats(self) -> Dict[str, int]:
+        return {'opened': self.opened, 'reused': self.reused, 'idle': len(self._idle),
+                'size': self.size, 'exhausted': self.exhausted}
+
+
+POOL = Pool()
+REPLICA_POOL = Pool('DATABASE_READ_URL', connect_timeout=REPLICA_CONNECT_TIMEOUT, name='replica')
+
+# Результат последней проверки реплики, общий для вызовов инстанса
+_replica = {'checked_at': float('-inf'), 'healthy': True, 'lag': 0.0}
+_replica_lock = threading.Lock()
+
+# Отставание реплики в секундах и проиграна ли позиция %(lsn)s. Если все полученное уже
+# проиграно, отставание 0: при простое основной базы время последней проигранной
+# транзакции стареет, хотя реплика ничего не ждет. После перезапуска реплики позиция
+# приема начинается с начала сегмента WAL и бывает меньше проигранной.
+REPLICA_STATUS_SQL = """
+    SELECT CASE
+               WHEN NOT pg_is_in_recovery() THEN 0
+               WHEN pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn() THEN 0
+               ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 'Infinity')
+           END,
+           %(lsn)s::pg_lsn IS NULL OR NOT pg_is_in_recovery() OR pg_last_wal_replay_lsn() >= %(lsn)s::pg_lsn
+"""
+
+
+@metrics.on_scrape
+def _pool_metrics() -> None:
+    pools = [POOL]
+    if os.environ.get(REPLICA_POOL.dsn_env):
+        pools.append(REPLICA_POOL)
+        with _replica_lock:
+            healthy, lag = _replica['healthy'], _replica['lag']
+        REPLICA_HEALTHY.set(int(healthy))
+        if lag is not None:
+            REPLICA_LAG.set(lag)
+    for pool in pools:
+        stats = pool.stats()
+        POOL_OPENED.set(stats['opened'], pool.name)
+        POOL_REUSED.set(stats['reused'], pool.name)
+        POOL_IDLE.set(stats['idle'], pool.name)
+        POOL_SIZE.set(stats['size'], pool.name)
+        POOL_EXHAUSTED.set(stats['exhausted'], pool.name)
+
+
+def connect() -> PooledConnection:
+    """Соединение из пула; вернуть - conn.close()"""
+    return POOL.acquire()
+
+
+def _replica_checked(healthy: bool, lag: Optional[float]) -> None:
+    with _replica_lock:
+        _replica.update(checked_at=time.monotonic(), healthy=healthy, lag=lag)
+
+
+def _replica_status(conn: PooledConnection, lsn: Optional[str]) -> Tuple[float, bool]:
+    # Вне транзакции: вызывающий код получает соединение таким же, как из connect()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(REPLICA_STATUS_SQL, {'lsn': lsn})
+        lag, caught_up = cur.fetchone()
+    conn.autocommit = False
+    return float(lag), caught_up
+
+
+def connect_read(read_after: Optional[str] = None) -> PooledConnection:
+    """
+    Соединение только для чтения. Реплика (DATABASE_READ_URL) выдается, если она отвечает,
+    отстает не больше DB_REPLICA_MAX_LAG_SECONDS и уже проиграла read_after - позицию WAL
+    последней записи клиента (см. read_after()). Иначе - основная база, как connect().
+    """
+    if not os.environ.get(REPLICA_POOL.dsn_env):
+        return connect()
+    with _replica_lock:
+        check_due = time.monotonic() - _replica['checked_at'] >= REPLICA_CHECK_SECONDS
+        healthy = _replica['healthy']
+    if not check_due and not healthy:
+        return connect()
+    try:
+        conn = REPLICA_POOL.acquire()
+    except PoolExhausted:
+        # Реплика исправна, заняты соединения инстанса к ней
+        return connect()
+    except psycopg2.OperationalError as e:
+        _replica_checked(False, None)
+        print(f'[db] Replica unavailable, reading from primary: {e}')
+        return connect()
+    if not check_due and not read_after:
+        return conn
+    try:
+        lag, caught_up = _replica_status(conn, read_after)
+    except psycopg2.Error as e:
+        conn.discard()
+        _replica_checked(False, None)
+        print(f'[db] Replica check failed, reading from primary: {e}')
+        return connect()
+    _replica_checked(lag <= REPLICA_MAX_LAG_SECONDS, lag)
+    if lag <= REPLICA_MAX_LAG_SECONDS and caught_up:
+        return conn
+    conn.close()
+    return connect()
+
+
+def write_position(conn: PooledConnection) -> Optional[str]:
+    """
+    Позиция WAL после завершенной записи на conn - клиент передает ее в X-Read-After.
+    None, если реплики нет или транзакция на соединении не завершена.
+    """
+    if not os.environ.get(REPLICA_POOL.dsn_env):
+        return None
+    if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        return None
+    autocommit = conn.autocommit
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute('SELECT pg_current_wal_lsn()::text')
+            position = cur.fetchone()[0]
+        conn.autocommit = autocommit
+    except psycopg2.Error as e:
+        print(f'[db] WAL position unavailable: {e}')
+        return None
+    return position
+
+
+def read_after(event: Dict[str, Any]) -> Optional[str]:
+    """Позиция из заголовка X-Read-After запроса; некорректное значение не учитывается"""
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == READ_AFTER_HEADER.lower():
+            value = str(value).strip().upper()
+            return value if _LSN_RE.fullmatch(value) else None
+    return None
+
+
+def with_write_position(response: Dict[str, Any], position: Optional[str]) -> Dict[str, Any]:
+    """Добавляет позицию записи в заголовок X-Read-After успешного ответа"""
+    if position and response.get('statusCode', 500) < 400:
+        headers = response.setdefault('headers', {})
+        headers[READ_AFTER_HEADER] = position
+        headers['Access-Control-Expose-Headers'] = READ_AFTER_HEADER
+    return response
+
+
+class Statement:
+    """
+    Именованный запрос каталога
+    Параметры - только %s или только %(имя)s, как в cursor.execute; {schema} - схема проекта
+    """
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql.replace('{schema}', SCHEMA)
+        names: List[str] = []
+        positional = 0
+
+        def number(match: 're.Match[str]') -> str:
+            nonlocal positional
+            if match.group(0) == '%%':
+                return '%'
+            if match.group(1) is None:
+                positional += 1
+                return f'${positional}'
+            if match.group(1) not in names:
+                names.append(match.group(1))
+            return f'${names.index(match.group(1)) + 1}'
+
+        body = _PARAM_RE.sub(number, self.sql)
+        if names and positional:
+            raise ValueError(f'statement {name}: mixed %s and %(name)s parameters')
+        self.prepare_sql = f'PREPARE {name} AS {body}'
+        args = [f'%({n})s' for n in names] if names else ['%s'] * positional
+        self.execute_sql = f'EXECUTE {name} ({", ".join(args)})' if args else f'EXECUTE {name}'
+
+
+CATALOG: Dict[str, Statement] = {}
+
+
+def statement(name: str, sql: str) -> Statement:
+    """Регистрирует запрос в каталоге; имя - идентификатор SQL, уникальный в функции"""
+    if not re.fullmatch(r'[a-z_][a-z0-9_]*', name):
+        raise ValueError(f'invalid statement name: {name}')
+    existing = CATALOG.get(name)
+    if existing is not None and existing.sql != sql.replace('{schema}', SCHEMA):
+        raise ValueError(f'statement {name} already registered with different SQL')
+    CATALOG[name] = existing or Statement(name, sql)
+    return CATALOG[name]
+
+
+def _prepare(cur, stmt: Statement, prepared: set) -> None:
+    CACHE_REQUESTS.inc('prepared_statement', 'miss')
+    cur.execute(stmt.prepare_sql)
+    prepared.add(stmt.name)
+    cur.statement = stmt.name
+
+
+def execute(cur, stmt: Statement, params: Any = None) -> None:
+    """
+    Выполняет запрос каталога. На соединении из пула он готовится при первом вызове
+    (PREPARE переживает откат транзакции, поэтому готовится ровно раз); на обычном
+    соединении или при DB_PREPARE=0 выполняется текст запроса.
+
+    Если запрос удалили с соединения (DEALLOCATE, DISCARD ALL), он готовится заново и
+    выполняется повторно - когда EXECUTE открывал транзакцию и откат ничего не теряет.
+    Внутри начатой транзакции ошибка уходит вызывающему, следующий вызов готовит запрос.
+    """
+    conn = cur.connection
+    prepared = getattr(conn, 'prepared', None)
+    if prepared is None:
+        cur.execute(stmt.sql, params)
+        return
+    cur.statement = stmt.name
+    if not PREPARE_STATEMENTS:
+        cur.execute(stmt.sql, params)
+        return
+    fresh = conn.autocommit or conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    if stmt.name not in prepared:
+        _prepare(cur, stmt, prepared)
+    else:
+        CACHE_REQUESTS.inc('prepared_statement', 'hit')
+    try:
+        cur.execute(stmt.execute_sql, params)
+    except psycopg2.errors.InvalidSqlStatementName:
+        prepared.discard(stmt.name)
+        if not fresh:
+            raise
+        if not conn.autocommit:
+            conn.rollback()
+        cur.statement = stmt.name
+        _prepare(cur, stmt, prepared)
+        cur.execute(stmt.execute_sql, params)
@@ -0,0 +1,238 @@
+"""
+Поиск почти-дубликатов вакансий (ручных и с Avito) по SimHash
+64-битная подпись по словам заголовка и описания; LSH-индекс из 3 полос по 21-22 бита
+в vacancy_simhash_bands. У подписей на расстоянии Хэмминга <= 8 хотя бы в одной полосе
+различаются не больше 2 бит, поэтому кандидаты ищутся по полосам и их вариантам с 1-2
+измененными битами (multi-probe): на вакансию - 718 точечных обращений к индексу, а
+кандидатов в среднем 718 * N / 2^21, около N / 3000 при равномерных подписях.
+Кластер - vacancies.duplicate_of, указывающий на самую раннюю вакансию кластера.
+Модуль одинаковый в admin и avito-sync.
+"""
+import hashlib
+import re
+from collections import Counter
+from functools import lru_cache
+from itertools import combinations
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from psycopg2.extras import execute_values
+
+import metrics
+
+
+# Тексты вакансий короткие: правки дают 4-8 бит разницы, разные вакансии - от 13
+MAX_DISTANCE = 8
+BAND_WIDTHS = (22, 21, 21)
+BANDS = len(BAND_WIDTHS)
+BAND_OFFSETS = tuple(sum(BAND_WIDTHS[:band]) for band in range(BANDS))
+# По принципу Дирихле MAX_DISTANCE различий дают в какой-то полосе не больше стольких
+PROBE_RADIUS = MAX_DISTANCE // BANDS
+# XOR-маски вариантов значения полосы: все сочетания не больше PROBE_RADIUS бит
+PROBE_MASKS = sorted(
+    sum(1 << bit for bit in bits)
+    for radius in range(PROBE_RADIUS + 1)
+    for bits in combinations(range(max(BAND_WIDTHS)), radius)
+)
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Счетчики всех 64 бит подписи считаются разом в одном большом целом: по LANE_BITS на бит,
+# байт хэша раскладывается по своим 8 полосам табличным сложением
+LANE_BITS = 24
+LANE_MASK = (1 << LANE_BITS) - 1
+_SPREAD = [
+    [sum((byte >> i & 1) << (LANE_BITS * (8 * position + i)) for i in range(8)) for byte in range(256)]
+    for position in range(8)
+]
+
+
+@lru_cache(maxsize=65536)
+def _feature_lanes(feature: str) -> int:
+    """Хэш слова, разложенный по полосам; словарь вакансий невелик, поэтому кэшируется"""
+    digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+    spread = 0
+    for position, byte in enumerate(reversed(digest)):
+        spread += _SPREAD[position][byte]
+    return spread
+
+
+CACHE_REQUESTS = metrics.counter('cache_requests_total', 'Обращения к кэшам', ('cache', 'result'))
+
+
+@metrics.on_scrape
+def _cache_metrics() -> None:
+    info = _feature_lanes.cache_info()
+    CACHE_REQUESTS.set(info.hits, 'simhash_features', 'hit')
+    CACHE_REQUESTS.set(info.misses, 'simhash_features', 'miss')
+
+
+def features(text: str) -> Counter:
+    return Counter(WORD_RE.findall(text.lower().replace('ё', 'е')))
+
+
+def simhash(title: str, description: str) -> Optional[int]:
+    """Подпись как знаковое 64-битное число (BIGINT) или None для пустого текста"""
+    counts = features(f'{title or ""} {description or ""}')
+    if not counts:
+        return None
+    lanes = 0
+    for feature, weight in counts.items():
+        lanes += _feature_lanes(feature) * weight
+    half = sum(counts.values())
+    value = 0
+    for bit in range(64):
+        if (lanes >> (LANE_BITS * bit) & LANE_MASK) * 2 > half:
+            value |= 1 << bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def bands(signature: int) -> List[Tuple[int, int]]:
+    unsigned = signature & ((1 << 64) - 1)
+    return [
+        (band, unsigned >> BAND_OFFSETS[band] & ((1 << BAND_WIDTHS[band]) - 1))
+        for band in range(BANDS)
+    ]
+
+
+def hamming(a: int, b: int) -> int:
+    return bin((a ^ b) & ((1 << 64) - 1)).count('1')
+
+
+def index_vacancies(conn, vacancies: Sequence[Tuple[Any, str, str]]) -> Dict[str, Optional[str]]:
+    """
+    Считает подписи для [(id, title, description)], обновляет LSH-индекс и кластеры.
+    Возвращает id -> id корня кластера (None, если дубликатов нет). Коммит - на вызывающем.
+    """
+    signatures = {str(vacancy_id): simhash(title, description) for vacancy_id, title, description in vacancies}
+    if not signatures:
+        return {}
+    with conn.cursor() as cur:
+        return _index(cur, signatures)
+
+
+def _candidates(cur, band_rows: List[Tuple[str, int, int]]) -> List[Tuple[str, str, Optional[int], str]]:
+    """
+    (id, кандидат, его подпись, корень его кластера) по полосам [(id, полоса, значение)]:
+    совпадение полосы или ее варианта в пределах PROBE_RADIUS бит
+    """
+    if not band_rows:
+        return []
+    cur.execute("""
+        SELECT DISTINCT q.vacancy_id, c.id::text AS candidate_id, c.simhash,
+               COALESCE(c.duplicate_of, c.id)::text AS root_id
+        FROM unnest(%s::text[], %s::smallint[], %s::integer[]) AS q(vacancy_id, band, value)
+        JOIN unnest(%s::smallint[]) WITH ORDINALITY AS w(bits, band) ON w.band - 1 = q.band
+        JOIN unnest(%s::integer[]) AS m(mask) ON m.mask < 1 << w.bits
+        JOIN vacancy_simhash_bands b ON b.band = q.band AND b.value = q.value # m.mask
+        JOIN vacancies c ON c.id = b.vacancy_id
+        WHERE b.vacancy_id <> q.vacancy_id::uuid
+    """, (*map(list, zip(*band_rows)), list(BAND_WIDTHS), PROBE_MASKS))
+    return cur.fetchall()
+
+
+def _index(cur, signatures: Dict[str, Optional[int]]) -> Dict[str, Optional[str]]:
+    ids = list(signatures)
+
+    execute_values(cur, """
+        UPDATE vacancies SET simhash = v.simhash
+        FROM (VALUES %s) AS v(id, simhash)
+        WHERE vacancies.id = v.id::uuid
+    """, [(vacancy_id, signature) for vacancy_id, signature in signatures.items()], template='(%s, %s::bigint)')
+    cur.execute('DELETE FROM vacancy_simhash_bands WHERE vacancy_id = ANY(%s::uuid[])', (ids,))
+    band_rows = [
+        (vacancy_id, band, value)
+        for vacancy_id, signature in signatures.items() if signature is not None
+        for band, value in bands(signature)
+    ]
+    if band_rows:
+        execute_values(cur, """
+            INSERT INTO vacancy_simhash_bands (vacancy_id, band, value) VALUES %s
+        """, band_rows, page_size=1000)
+
+    candidates = _candidates(cur, band_rows)
+    parent: Dict[str, str] = {}
+
+    def find(node: str) -> str:
+        parent.setdefault(node, node)
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for vacancy_id in ids:
+        find(vacancy_id)
+    # Каждая вакансия присоединяется к кластеру ближайшего кандидата - без цепочек через всех соседей
+    nearest: Dict[str, Tuple[int, str, str]] = {}
+    for vacancy_id, candidate_id, candidate_signature, root_id in candidates:
+        if candidate_signature is None:
+            continue
+        distance = hamming(signatures[vacancy_id], candidate_signature)
+        if distance <= MAX_DISTANCE and (vacancy_id not in nearest or distance < nearest[vacancy_id][0]):
+            nearest[vacancy_id] = (distance, candidate_id, root_id)
+    for vacancy_id, (_, candidate_id, root_id) in nearest.items():
+        for node in (candidate_id, root_id):
+            parent[find(node)] = find(vacancy_id)
+
+    # Корень кластера - самая ранняя вакансия
+    cur.execute("""
+        SELECT id::text, created_at FROM vacancies WHERE id = ANY(%s::uuid[])
+    """, (list(parent),))
+    created = {row[0]: (row[1], row[0]) for row in cur.fetchall()}
+    components: Dict[str, List[str]] = {}
+    for node in parent:
+        if node in created:
+            components.setdefault(find(node), []).append(node)
+
+    links: List[Tuple[str, str]] = []
+    roots: List[str] = []
+    result: Dict[str, Optional[str]] = {}
+    for members in components.values():
+        root = min(members, key=lambda node: created[node])
+        roots.append(root)
+        for node in members:
+            if node != root:
+                links.append((node, root))
+            if node in signatures:
+                result[node] = root if node != root and len(members) > 1 else None
+
+    cur.execute('UPDATE vacancies SET duplicate_of = NULL WHERE id = ANY(%s::uuid[]) AND duplicate_of IS NOT NULL', (roots,))
+    if links:
+        # Прежние корни переезжают в новый кластер вместе со своими дубликатами
+        for column in ('id', 'duplicate_of'):
+            execute_values(cur, f"""
+                UPDATE vacancies SET duplicate_of = v.root::uuid
+                FROM (VALUES %s) AS v(node, root)
+                WHERE vacancies.{column} = v.node::uuid
+                AND vacancies.duplicate_of IS DISTINCT FROM v.root::uuid
+            """, links, page_size=1000)
+    return result
+
+
+def backfill_batch(conn, batch_size: int, after: Optional[Tuple[Any, Any]] = None) -> Tuple[int, Optional[Tuple[Any, Any]]]:
+    """
+    Индексирует следующую пачку вакансий без подписи (по возрастанию created_at).
+    Возвращает число обработанных и ключ продолжения для следующей пачки.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, title, description, created_at FROM vacancies
+            WHERE simhash IS NULL
+            AND (%s::timestamp IS NULL OR (created_at, id) > (%s::timestamp, %s::uuid))
+            ORDER BY created_at, id
+            LIMIT %s
+        """, (after[0] if after else None, after[0] if after else None, after[1] if after else None, batch_size))
+        rows = cur.fetchall()
+    if not rows:
+        return 0, None
+    index_vacancies(conn, [(row[0], row[1], row[2]) for row in rows])
+    return len(rows), (rows[-1][3], rows[-1][0])
+
+
+def cluster_members(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Группирует строки (cluster_id, ...) по кластерам, корень - первым"""
+    clusters: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        cluster_id = str(row['cluster_id'])
+        cluster = clusters.setdefault(cluster_id, {'cluster_id': cluster_id, 'vacancies': []})
+        cluster['vacancies'].append({k: v for k, v in row.items() if k != 'cluster_id'})
+    return list(clusters.values())
@@ -0,0 +1,142 @@
+"""
+Истечение брошенных заказов Robokassa и пополнений
+Заказы и транзакции, оставшиеся в pending дольше окна, переводятся в expired пачками
+с коммитом после каждой. Оплата, пришедшая после истечения, все равно проводится:
+webhook-и принимают и pending, и expired. По желанию давно истекшие строки переносятся
+в *_archive и удаляются из рабочих таблиц. В архиве webhook-и строку уже не находят и
+оплату не зачисляют: пополнение отвечает 404 (исход not_found), уведомление Robokassa
+закрывается в robokassa_inbox с исходом not_found. Такие оплаты разбираются вручную,
+поэтому срок архивации берется заведомо больше окна, в котором провайдер может прислать оплату.
+"""
+import time
+from typing import Any, Dict, Optional
+
+# Строки, которые в этот момент проводит webhook, пропускаются (SKIP LOCKED)
+# и истекают следующим проходом, если оплата так и не прошла.
+# Пачка выбирается один раз (MATERIALIZED): подзапрос в IN планировщик может
+# пересчитывать на каждую строку, и LIMIT тогда не ограничивает пачку
+EXPIRE_SQL = {
+    'orders': """
+        WITH batch AS MATERIALIZED (
+            SELECT id FROM orders
+            WHERE status = 'pending' AND created_at < CURRENT_TIMESTAMP - %(window)s * INTERVAL '1 minute'
+            ORDER BY created_at
+            LIMIT %(limit)s
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE orders SET status = 'expired', updated_at = CURRENT_TIMESTAMP
+        FROM batch
+        WHERE orders.id = batch.id AND orders.status = 'pending'
+    """,
+    'transactions': """
+        WITH batch AS MATERIALIZED (
+            SELECT id FROM transactions
+            WHERE status = 'pending' AND created_at < CURRENT_TIMESTAMP - %(window)s * INTERVAL '1 minute'
+            ORDER BY created_at
+            LIMIT %(limit)s
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE transactions SET status = 'expired', updated_at = CURRENT_TIMESTAMP
+        FROM batch
+        WHERE transactions.id = batch.id AND transactions.status = 'pending'
+    """,
+}
+
+# Перенос в архив одним оператором: позиции заказа уходят вместе с заказом,
+# внешний ключ order_items проверяется в конце оператора
+ARCHIVE_SQL = {
+    'orders': """
+        WITH batch AS (
+            SELECT id FROM orders
+            WHERE status = 'expired' AND updated_at < CURRENT_TIMESTAMP - %(window)s * INTERVAL '1 minute'
+            ORDER BY updated_at
+            LIMIT %(limit)s
+            FOR UPDATE SKIP LOCKED
+        ), items AS (
+            DELETE FROM order_items WHERE order_id IN (SELECT id FROM batch)
+            RETURNING *
+        ), items_archived AS (
+            INSERT INTO order_items_archive SELECT items.*, CURRENT_TIMESTAMP FROM items
+        ), moved AS (
+            DELETE FROM orders WHERE id IN (SELECT id FROM batch) AND status = 'expired'
+            RETURNING *
+        ), archived AS (
+            INSERT INTO orders_archive SELECT moved.*, CURRENT_TIMESTAMP FROM moved
+        )
+        SELECT (SELECT COUNT(*) FROM moved), (SELECT COUNT(*) FROM items)
+    """,
+    'transactions': """
+        WITH batch AS (
+            SELECT id FROM transactions
+            WHERE status = 'expired' AND updated_at < CURRENT_TIMESTAMP - %(window)s * INTERVAL '1 minute'
+            ORDER BY updated_at
+            LIMIT %(limit)s
+            FOR UPDATE SKIP LOCKED
+        ), moved AS (
+            DELETE FROM transactions WHERE id IN (SELECT id FROM batch) AND status = 'expired'
+            RETURNING *
+        ), archived AS (
+            INSERT INTO transactions_archive SELECT moved.*, CURRENT_TIMESTAMP FROM moved
+        )
+        SELECT (SELECT COUNT(*) FROM moved), 0
+    """,
+}
+
+REMAINING_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM orders
+         WHERE status = 'pending' AND created_at < CURRENT_TIMESTAMP - %(window)s * INTERVAL '1 minute') AS orders,
+        (SELECT COUNT(*) FROM transactions
+         WHERE status = 'pending' AND created_at < CURRENT_TIMESTAMP - %(window)s * INTERVAL '1 minute') AS transactions
+"""
+
+
+def sweep(conn, expire_after_minutes: int, batch_size: int, time_budget: float,
+          archive_after_minutes: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Истекает pending старше expire_after_minutes, затем (если задано) архивирует expired
+    старше archive_after_minutes. Пачки по batch_size, пока не выйдет time_budget секунд.
+    """
+    started = time.monotonic()
+    stats: Dict[str, Any] = {
+        'orders_expired': 0,
+        'transactions_expired': 0,
+        'orders_archived': 0,
+        'order_items_archived': 0,
+        'transactions_archived': 0,
+        'batches': 0,
+    }
+
+    def within_budget() -> bool:
+        return time.monotonic() - started < time_budget
+
+    with conn.cursor() as cur:
+        for table, sql in EXPIRE_SQL.items():
+            while within_budget():
+                cur.execute(sql, {'window': expire_after_minutes, 'limit': batch_size})
+                conn.commit()
+                stats['batches'] += 1
+                stats[f'{table}_expired'] += cur.rowcount
+                if cur.rowcount < batch_size:
+                    break
+
+        if archive_after_minutes is not None:
+            for table, sql in ARCHIVE_SQL.items():
+                while within_budget():
+                    cur.execute(sql, {'window': archive_after_minutes, 'limit': batch_size})
+                    moved, items = cur.fetchone()
+                    conn.commit()
+                    stats['batches'] += 1
+                    stats[f'{table}_archived'] += moved
+                    if table == 'orders':
+                        stats['order_items_archived'] += items
+                    if moved < batch_size:
+                        break
+
+        cur.execute(REMAINING_SQL, {'window': expire_after_minutes})
+        orders, transactions = cur.fetchone()
+    conn.commit()
+
+    stats['remaining'] = {'orders': orders, 'transactions': transactions}
+    stats['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+    return stats
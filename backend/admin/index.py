@@ -1,15 +1,30 @@
 """
 Единый API для управления: пользователи, вакансии, модерация, статистика, промо-коды
-Роуты: ?path=users, vacancies, moderate, stats, update-balance, promo-codes, activate-promo
+Роуты: ?path=users, vacancies, moderate, duplicates, stats, update-balance, compact-ledger, expire-pending, promo-codes, activate-promo,
+reset-promo-activations; GET ?path=metrics - метрики в формате Prometheus
 """
 import json
 import os
+import time
 from typing import Dict, Any
-import psycopg2
 from psycopg2.extras import RealDictCursor
-
-DATABASE_URL = os.environ['DATABASE_URL']
-
+import db
+import dedup
+import expiry
+import ledger
+import metrics
+
+# Через сколько pending-заказ или пополнение считается брошенным; архив по умолчанию выключен
+PENDING_EXPIRE_MINUTES = int(os.environ.get('PENDING_EXPIRE_MINUTES', '1440'))
+PENDING_ARCHIVE_DAYS = os.environ.get('PENDING_ARCHIVE_DAYS')
+
+# Роуты, которые на GET только читают (stats - на любом методе)
+READ_ROUTES = {'users', 'vacancies', 'duplicates', 'stats', 'promo-codes'}
+ROUTES = READ_ROUTES | {
+    'moderate', 'update-balance', 'compact-ledger', 'expire-pending', 'activate-promo', 'reset-promo-activations'
+}
+
+@metrics.instrument(metrics.param_route('path', ROUTES, default='stats'))
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     params = event.get('queryStringParameters', {}) or {}
@@ -21,55 +36,75 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Token, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Token, X-User-Id, X-Read-After',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(DATABASE_URL)
+    # Чтения без записи уходят на реплику, если она настроена и не отстает; после записи
+    # клиент получает X-Read-After и со следующим чтением не увидит старые данные
+    read_only = method == 'GET' and path in READ_ROUTES
+    conn = db.connect_read(db.read_after(event)) if read_only else db.connect()
     
     try:
-        if path == 'users':
-            if method == 'GET':
-                return get_user(params, conn)
-            elif method == 'PUT':
-                return update_user(event, conn, context)
-            elif method == 'DELETE':
-                return delete_user(event, conn)
-        elif path == 'vacancies':
-            if method == 'GET':
-                return get_vacancies(params, conn)
-            elif method == 'POST':
-                return create_vacancy(event, conn, context)
-            elif method == 'PUT':
-                return update_vacancy(event, conn)
-            elif method == 'DELETE':
-                return delete_vacancy(event, conn)
-        elif path == 'moderate':
-            return moderate_vacancy(event, conn)
-        elif path == 'stats':
-            return get_stats(conn)
-        elif path == 'update-balance':
-            return update_user_balance(event, conn, context)
-        elif path == 'promo-codes':
-            if method == 'GET':
-                return get_promo_codes(conn)
-            elif method == 'POST':
-                return create_promo_code(event, conn)
-            elif method == 'DELETE':
-                return delete_promo_code(event, conn)
-        elif path == 'activate-promo':
-            return activate_promo_code(event, conn)
-        elif path == 'reset-promo-activations':
-            return reset_promo_activations(event, conn)
-        else:
-            return error_response(404, 'Path not found')
+        response = route(event, context, method, path, params, conn)
+        if not read_only:
+            response = db.with_write_position(response, db.write_position(conn))
+        return response
     finally:
         conn.close()
 
 
+def route(event: Dict[str, Any], context: Any, method: str, path: str, params: Dict, conn) -> Dict[str, Any]:
+    if path == 'users':
+        if method == 'GET':
+            return get_user(params, conn)
+        elif method == 'PUT':
+            return update_user(event, conn, context)
+        elif method == 'DELETE':
+            return delete_user(event, conn)
+    elif path == 'vacancies':
+        if method == 'GET':
+            return get_vacancies(params, conn)
+        elif method == 'POST':
+            return create_vacancy(event, conn, context)
+        elif method == 'PUT':
+            return update_vacancy(event, conn)
+        elif method == 'DELETE':
+            return delete_vacancy(event, conn)
+    elif path == 'moderate':
+        return moderate_vacancy(event, conn)
+    elif path == 'duplicates':
+        if method == 'GET':
+            return get_duplicates(params, conn)
+        elif method == 'POST':
+            return backfill_duplicates(event, conn)
+    elif path == 'stats':
+        return get_stats(conn)
+    elif path == 'update-balance':
+        return update_user_balance(event, conn, context)
+    elif path == 'compact-ledger':
+        return compact_ledger(conn)
+    elif path == 'expire-pending':
+        return expire_pending(event, conn)
+    elif path == 'promo-codes':
+        if method == 'GET':
+            return get_promo_codes(conn)
+        elif method == 'POST':
+            return create_promo_code(event, conn)
+        elif method == 'DELETE':
+            return delete_promo_code(event, conn)
+    elif path == 'activate-promo':
+        return activate_promo_code(event, conn)
+    elif path == 'reset-promo-activations':
+        return reset_promo_activations(event, conn)
+    else:
+        return error_response(404, 'Path not found')
+    return error_response(405, 'Method not allowed')
+
+
 def get_user(params: Dict, conn) -> Dict[str, Any]:
     user_id = params.get('user_id')
     limit = int(params.get('limit', 100))
@@ -77,8 +112,8 @@ def get_user(params: Dict, conn) -> Dict[str, Any]:
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
         # Если указан user_id - возвращаем конкретного пользователя
         if user_id:
-            cur.execute("""
-                SELECT id, name, email, phone, role, balance, tier, 
+            cur.execute(f"""
+                SELECT id, name, email, phone, role, {ledger.balance_sql('users.id')} AS balance, tier, 
                        vacancies_this_month, email_verified, phone_verified,
                        created_at, updated_at
                 FROM users 
@@ -101,12 +136,15 @@ def get_user(params: Dict, conn) -> Dict[str, Any]:
             }
         
         # Иначе возвращаем список всех пользователей
-        cur.execute("""
-            SELECT id, name, email, phone, role, balance, tier, 
+        cur.execute(f"""
+            SELECT id, name, email, phone, role, {ledger.balance_sql('u.id')} AS balance, tier, 
                    vacancies_this_month, created_at
-            FROM users 
+            FROM (
+                SELECT * FROM users
+                ORDER BY created_at DESC
+                LIMIT %s
+            ) u
             ORDER BY created_at DESC
-            LIMIT %s
         """, (limit,))
         
         users = cur.fetchall()
@@ -133,10 +171,6 @@ def update_user(event: Dict[str, Any], conn, context: Any) -> Dict[str, Any]:
     update_fields = []
     params_list = []
     
-    if 'balance' in body:
-        update_fields.append('balance = %s')
-        params_list.append(body['balance'])
-    
     if 'tier' in body:
         if body['tier'] not in ['FREE', 'ECONOM', 'VIP', 'PREMIUM']:
             return error_response(400, 'Invalid tier')
@@ -147,21 +181,33 @@ def update_user(event: Dict[str, Any], conn, context: Any) -> Dict[str, Any]:
         update_fields.append('vacancies_this_month = %s')
         params_list.append(body['vacancies_this_month'])
     
-    if not update_fields:
+    if not update_fields and 'balance' not in body:
         return error_response(400, 'No fields to update')
     
     params_list.append(user_id)
     
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = %s RETURNING *"
-        cur.execute(query, params_list)
+        if update_fields:
+            query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = %s RETURNING id"
+            cur.execute(query, params_list)
+            if not cur.fetchone():
+                return error_response(404, 'User not found')
+        
+        if 'balance' in body:
+            # Новый баланс задается корректирующей записью журнала на разницу
+            cur.execute(f"""
+                INSERT INTO balance_ledger (user_id, amount, source, reference)
+                SELECT id, %s - {ledger.balance_sql('users.id')}, 'admin', 'set-balance'
+                FROM users WHERE id = %s
+                RETURNING id
+            """, (body['balance'], user_id))
+            if not cur.fetchone():
+                return error_response(404, 'User not found')
         conn.commit()
         
+        cur.execute(f"SELECT *, {ledger.balance_sql('users.id')} AS balance FROM users WHERE id = %s", (user_id,))
         user = cur.fetchone()
         
-        if not user:
-            return error_response(404, 'User not found')
-        
         if body.get('add_transaction'):
             cur.execute("""
                 INSERT INTO transactions (user_id, amount, type, status, description)
@@ -342,6 +388,11 @@ def create_vacancy(event: Dict[str, Any], conn, context: Any) -> Dict[str, Any]:
         
         vacancy = cur.fetchone()
         
+        # Подпись для поиска почти-дубликатов среди ручных и Avito-вакансий
+        vacancy['duplicate_of'] = dedup.index_vacancies(
+            conn, [(vacancy_id, body['title'], body['description'])]
+        ).get(vacancy_id)
+        
         # Увеличиваем счетчик вакансий пользователя (для не-админов)
         if user['role'] != 'admin':
             cur.execute("""
@@ -468,11 +519,12 @@ def get_stats(conn) -> Dict[str, Any]:
             SELECT 
                 COUNT(*) FILTER (WHERE role = 'seeker') as total_seekers,
                 COUNT(*) FILTER (WHERE role = 'employer') as total_employers,
-                COUNT(*) FILTER (WHERE role = 'admin') as total_admins,
-                COALESCE(SUM(balance), 0) as total_balance
+                COUNT(*) FILTER (WHERE role = 'admin') as total_admins
             FROM users
         """)
         user_stats = cur.fetchone()
+        cur.execute(ledger.TOTAL_BALANCE_SQL)
+        user_stats['total_balance'] = cur.fetchone()['total_balance']
         
         cur.execute("""
             SELECT 
@@ -567,6 +619,113 @@ def moderate_vacancy(event: Dict[str, Any], conn) -> Dict[str, Any]:
         }
 
 
+def get_duplicates(params: Dict, conn) -> Dict[str, Any]:
+    """Кластеры почти-дубликатов для модерации (корень кластера - первым)"""
+    vacancy_id = params.get('vacancy_id')
+    limit = min(200, int(params.get('limit', '50')))
+    
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            WITH clusters AS (
+                SELECT COALESCE(duplicate_of, id) AS cluster_id, MAX(created_at) AS last_seen
+                FROM vacancies
+                WHERE duplicate_of IS NOT NULL
+                AND (%s::uuid IS NULL OR %s::uuid IN (id, duplicate_of))
+                GROUP BY 1
+                ORDER BY last_seen DESC
+                LIMIT %s
+            )
+            SELECT c.cluster_id, v.id, v.title, v.source, v.status, v.employer_name,
+                   v.city, v.salary, v.created_at
+            FROM clusters c
+            JOIN vacancies v ON v.id = c.cluster_id OR v.duplicate_of = c.cluster_id
+            ORDER BY c.last_seen DESC, c.cluster_id, v.duplicate_of NULLS FIRST, v.created_at
+        """, (vacancy_id, vacancy_id, limit))
+        clusters = dedup.cluster_members(cur.fetchall())
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'success': True,
+            'clusters': clusters,
+            'total': len(clusters)
+        }, default=str),
+        'isBase64Encoded': False
+    }
+
+
+def backfill_duplicates(event: Dict[str, Any], conn) -> Dict[str, Any]:
+    """Считает подписи для вакансий без них пачками, коммит после каждой"""
+    body = json.loads(event.get('body', '{}') or '{}')
+    batch_size = min(5000, max(1, int(body.get('batch_size', 500))))
+    time_budget = float(body.get('time_budget_seconds', 20))
+    
+    started = time.monotonic()
+    processed = 0
+    batches = 0
+    after = None
+    while time.monotonic() - started < time_budget:
+        count, after = dedup.backfill_batch(conn, batch_size, after)
+        conn.commit()
+        if not count:
+            break
+        processed += count
+        batches += 1
+    with conn.cursor() as cur:
+        cur.execute('SELECT COUNT(*) FROM vacancies WHERE simhash IS NULL')
+        remaining = cur.fetchone()[0]
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'success': True,
+            'processed': processed,
+            'batches': batches,
+            'remaining': remaining,
+            'duration_ms': round((time.monotonic() - started) * 1000, 1)
+        }),
+        'isBase64Encoded': False
+    }
+
+
+def compact_ledger(conn) -> Dict[str, Any]:
+    """Сворачивает зафиксированные записи журнала баланса в снимки (вызывается по расписанию)"""
+    result = ledger.compact(conn)
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'success': True, **result}),
+        'isBase64Encoded': False
+    }
+
+
+def expire_pending(event: Dict[str, Any], conn) -> Dict[str, Any]:
+    """Истекает брошенные pending-заказы и пополнения, по желанию архивирует (вызывается по расписанию)"""
+    if event.get('httpMethod') != 'POST':
+        return error_response(405, 'Method not allowed')
+    body = json.loads(event.get('body', '{}') or '{}')
+    archive_days = body.get('archive_after_days', PENDING_ARCHIVE_DAYS)
+    try:
+        expire_minutes = max(1, int(body.get('older_than_minutes', PENDING_EXPIRE_MINUTES)))
+        batch_size = min(5000, max(1, int(body.get('batch_size', 1000))))
+        time_budget = float(body.get('time_budget_seconds', 20))
+        archive_minutes = None if archive_days in (None, '') else max(1, int(float(archive_days) * 1440))
+    except (TypeError, ValueError):
+        return error_response(400, 'Invalid sweep parameters')
+    
+    stats = expiry.sweep(conn, expire_minutes, batch_size, time_budget, archive_minutes)
+    print(f"[expire-pending] orders={stats['orders_expired']} transactions={stats['transactions_expired']} "
+          f"archived={stats['orders_archived']}/{stats['transactions_archived']} duration_ms={stats['duration_ms']}")
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'success': True, **stats}),
+        'isBase64Encoded': False
+    }
+
+
 def update_user_balance(event: Dict[str, Any], conn, context: Any) -> Dict[str, Any]:
     if event.get('httpMethod') != 'POST':
         return error_response(405, 'Method not allowed')
@@ -581,16 +740,7 @@ def update_user_balance(event: Dict[str, Any], conn, context: Any) -> Dict[str,
         return error_response(400, 'user_id and amount required')
     
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("""
-            UPDATE users 
-            SET balance = balance + %s
-            WHERE id = %s
-            RETURNING *
-        """, (amount, user_id))
-        
-        user = cur.fetchone()
-        
-        if not user:
+        if not ledger.append(cur, user_id, amount, 'admin', description):
             return error_response(404, 'User not found')
         
         cur.execute("""
@@ -600,6 +750,9 @@ def update_user_balance(event: Dict[str, Any], conn, context: Any) -> Dict[str,
         
         conn.commit()
         
+        cur.execute(f"SELECT *, {ledger.balance_sql('users.id')} AS balance FROM users WHERE id = %s", (user_id,))
+        user = cur.fetchone()
+        
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -734,10 +887,7 @@ def activate_promo_code(event: Dict[str, Any], conn) -> Dict[str, Any]:
         current_user = cur.fetchone()
 
         if bonus_balance > 0:
-            cur.execute(
-                "UPDATE users SET balance = balance + %s WHERE id = %s",
-                (bonus_balance, user_id)
-            )
+            ledger.append(cur, user_id, bonus_balance, 'promo', code)
 
         if bonus_vacancies > 0 or bonus_balance > 0:
             if current_user and current_user['tier'] == 'FREE':
@@ -768,7 +918,10 @@ def activate_promo_code(event: Dict[str, Any], conn) -> Dict[str, Any]:
 
         conn.commit()
 
-        cur.execute("SELECT balance, vacancies_this_month, tier FROM users WHERE id = %s", (user_id,))
+        cur.execute(f"""
+            SELECT {ledger.balance_sql('users.id')} AS balance, vacancies_this_month, tier
+            FROM users WHERE id = %s
+        """, (user_id,))
         user = cur.fetchone()
 
         bonuses = []
@@ -0,0 +1,91 @@
+"""
+Баланс пользователя по журналу balance_ledger
+Текущий баланс - снимок из balance_snapshots плюс короткий хвост записей после него.
+Компактор сворачивает зафиксированные записи в снимки, чтобы хвост оставался коротким.
+"""
+import time
+from typing import Any, Dict, Optional
+
+from psycopg2.extras import RealDictCursor
+
+
+# Компактор один: параллельный проход посчитал бы один диапазон дважды
+COMPACT_LOCK_ID = 4207001
+
+
+def balance_sql(user_column: str) -> str:
+    """Выражение баланса для пользователя из колонки user_column"""
+    return f"""(
+        SELECT COALESCE(s.balance, 0) + COALESCE((
+            SELECT SUM(l.amount) FROM balance_ledger l
+            WHERE l.user_id = q.user_id AND l.xid >= COALESCE(s.folded_below, '0'::xid8)
+        ), 0)
+        FROM (SELECT {user_column} AS user_id) q
+        LEFT JOIN balance_snapshots s ON s.user_id = q.user_id
+    )"""
+
+
+# Сумма балансов всех пользователей
+TOTAL_BALANCE_SQL = """
+    SELECT
+        (SELECT COALESCE(SUM(balance), 0) FROM balance_snapshots)
+        + (SELECT COALESCE(SUM(l.amount), 0)
+           FROM balance_ledger l
+           LEFT JOIN balance_snapshots s ON s.user_id = l.user_id
+           WHERE l.xid >= COALESCE(s.folded_below, '0'::xid8)) AS total_balance
+"""
+
+# Проход компактора: записи с xid от прошлой границы до xmin текущего снимка. Все транзакции
+# с xid ниже xmin завершены, поэтому позже в этот диапазон ничего не добавится. Пользователи
+# без записей в диапазоне хвоста не имеют, их снимки не трогаются.
+COMPACT_SQL = """
+    WITH bounds AS (
+        SELECT COALESCE((SELECT MAX(folded_below) FROM balance_snapshots), '0'::xid8) AS lower,
+               pg_snapshot_xmin(pg_current_snapshot()) AS upper
+    ), folded AS (
+        SELECT l.user_id, SUM(l.amount) AS delta, COUNT(*) AS entries
+        FROM balance_ledger l, bounds b
+        WHERE l.xid >= b.lower AND l.xid < b.upper
+        GROUP BY l.user_id
+    ), snapshots AS (
+        INSERT INTO balance_snapshots AS s (user_id, balance, folded_below, updated_at)
+        SELECT f.user_id, f.delta, b.upper, NOW() FROM folded f, bounds b
+        ON CONFLICT (user_id) DO UPDATE
+        SET balance = s.balance + EXCLUDED.balance,
+            folded_below = EXCLUDED.folded_below,
+            updated_at = NOW()
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM snapshots) AS users,
+           (SELECT COALESCE(SUM(entries), 0) FROM folded) AS entries
+"""
+
+
+def append(cur, user_id: Any, amount: Any, source: str, reference: Optional[str] = None) -> bool:
+    """Добавляет запись в журнал; False, если пользователя нет"""
+    cur.execute("""
+        INSERT INTO balance_ledger (user_id, amount, source, reference)
+        SELECT id, %s, %s, %s FROM users WHERE id = %s
+        RETURNING id
+    """, (amount, source, reference, user_id))
+    return cur.fetchone() is not None
+
+
+def compact(conn) -> Dict[str, Any]:
+    """Один проход компактора в своей транзакции; пропускается, если уже идет другой"""
+    started = time.monotonic()
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute('SELECT pg_try_advisory_xact_lock(%s) AS locked', (COMPACT_LOCK_ID,))
+        if not cur.fetchone()['locked']:
+            conn.rollback()
+            return {'skipped': True, 'users': 0, 'entries': 0}
+        # Снимок для диапазона берется следующим оператором - уже после блокировки
+        cur.execute(COMPACT_SQL)
+        row = cur.fetchone()
+    conn.commit()
+    return {
+        'skipped': False,
+        'users': row['users'],
+        'entries': int(row['entries']),
+        'duration_ms': round((time.monotonic() - started) * 1000, 1),
+    }
@@ -0,0 +1,339 @@
+"""
+Circuit breaker-ы внешних провайдеров и бюджет времени вызова функции
+Breaker провайдера живет на уровне модуля и общий для теплых вызовов инстанса. Он
+открывается после серии неудач подряд или по доле неудачных либо медленных вызовов
+в скользящем окне и, пока открыт, отказывает сразу, не дожидаясь таймаута. После
+паузы пропускается один пробный вызов (half-open): успех закрывает breaker, неудача
+открывает снова. Deadline не дает исходящему вызову пережить время самой функции.
+
+Функции деплоятся отдельными папками, поэтому модуль лежит копией рядом с каждым
+index.py, которому нужен. Копии должны оставаться одинаковыми.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+import metrics
+
+WINDOW_SECONDS = float(os.environ.get('CIRCUIT_WINDOW_SECONDS', '60'))
+MIN_CALLS = int(os.environ.get('CIRCUIT_MIN_CALLS', '5'))
+FAILURE_RATE = float(os.environ.get('CIRCUIT_FAILURE_RATE', '0.5'))
+SLOW_RATE = float(os.environ.get('CIRCUIT_SLOW_RATE', '0.5'))
+CONSECUTIVE_FAILURES = int(os.environ.get('CIRCUIT_CONSECUTIVE_FAILURES', '5'))
+COOLDOWN = float(os.environ.get('CIRCUIT_COOLDOWN', '30'))
+
+# Время функции, если контекст его не сообщает, и запас на ответ после последнего вызова
+FUNCTION_TIMEOUT = float(os.environ.get('FUNCTION_TIMEOUT_SECONDS', '30'))
+DEADLINE_RESERVE = float(os.environ.get('DEADLINE_RESERVE_SECONDS', '1'))
+# Меньше этого начинать вызов бессмысленно
+MIN_CALL_SECONDS = 0.1
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class Unavailable(Exception):
+    """Внешний вызов не выполнялся: breaker открыт или не осталось времени"""
+
+    def __init__(self, message: str, retry_after: int = 0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Unavailable):
+    """Breaker провайдера открыт"""
+
+
+class DeadlineExceeded(Unavailable):
+    """Времени вызова функции не хватает на внешний вызов"""
+
+
+class CircuitBreaker:
+    """
+    Breaker одного провайдера
+    Неудача - ошибка сети, таймаут или ответ 5xx/429; медленный вызов - дольше slow_call секунд.
+    Окно - исходы за последние window секунд по секундным корзинам (память не зависит
+    от числа вызовов); доли считаются, когда в окне не меньше min_calls вызовов.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        slow_call: Optional[float] = None,
+        failure_rate: float = FAILURE_RATE,
+        slow_rate: float = SLOW_RATE,
+        consecutive_failures: int = CONSECUTIVE_FAILURES,
+        min_calls: int = MIN_CALLS,
+        window: float = WINDOW_SECONDS,
+        cooldown: float = COOLDOWN,
+    ):
+        self.name = name
+        self.slow_call = slow_call
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.consecutive_failures = max(1, consecutive_failures)
+        self.min_calls = max(1, min_calls)
+        self.window = window
+        self.cooldown = cooldown
+        # [секунда, вызовы, неудачи, медленные]
+        self._buckets: Deque[List[int]] = deque()
+        self._window_calls = 0
+        self._window_failures = 0
+        self._window_slow = 0
+        self._consecutive = 0
+        self._opened_at: Optional[float] = None
+        self._trial_at: Optional[float] = None
+        self._reason: Optional[str] = None
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.slow = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def allow(self) -> bool:
+        """Можно ли вызывать провайдера; в half-open выдает единственный пробный вызов"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            # Пробный вызов без исхода (упал мимо record_*) через cooldown заменяется новым
+            if (now - self._opened_at < self.cooldown
+                    or (self._trial_at is not None and now - self._trial_at < self.cooldown)):
+                self.rejected += 1
+                return False
+            self._trial_at = now
+            return True
+
+    def release(self) -> None:
+        """Возвращает пробный вызов, выданный allow(), если провайдера так и не вызвали"""
+        with self._lock:
+            self._trial_at = None
+
+    def available(self) -> bool:
+        """Как allow(), но без пробного вызова - проверка перед подготовкой к вызову"""
+        with self._lock:
+            return self._opened_at is None or time.monotonic() - self._opened_at >= self.cooldown
+
+    def record_success(self, elapsed: Optional[float] = None) -> None:
+        self._record(False, elapsed)
+
+    def record_failure(self, elapsed: Optional[float] = None) -> None:
+        self._record(True, elapsed)
+
+    def _record(self, failed: bool, elapsed: Optional[float]) -> None:
+        slow = self.slow_call is not None and elapsed is not None and elapsed > self.slow_call
+        now = time.monotonic()
+        with self._lock:
+            self.calls += 1
+            self.failures += failed
+            self.slow += slow
+            if self._opened_at is not None:
+                # Исход вызова, начатого до открытия, ничего не меняет
+                if self._trial_at is None:
+                    return
+                if failed or slow:
+                    self._open(now, 'trial call failed' if failed else 'trial call was slow')
+                else:
+                    self._close()
+                return
+
+            self._consecutive = self._consecutive + 1 if failed else 0
+            second = int(now)
+            if not self._buckets or self._buckets[-1][0] != second:
+                self._buckets.append([second, 0, 0, 0])
+            bucket = self._buckets[-1]
+            bucket[1] += 1
+            bucket[2] += failed
+            bucket[3] += slow
+            self._window_calls += 1
+            self._window_failures += failed
+            self._window_slow += slow
+            while self._buckets[0][0] <= second - self.window:
+                _, old_calls, old_failed, old_slow = self._buckets.popleft()
+                self._window_calls -= old_calls
+                self._window_failures -= old_failed
+                self._window_slow -= old_slow
+
+            calls = self._window_calls
+            if self._consecutive >= self.consecutive_failures:
+                self._open(now, f'{self._consecutive} failures in a row')
+            elif calls >= self.min_calls and self._window_failures / calls >= self.failure_rate:
+                self._open(now, f'{self._window_failures} of {calls} calls failed')
+            elif (self.slow_call is not None and calls >= self.min_calls
+                    and self._window_slow / calls >= self.slow_rate):
+                self._open(now, f'{self._window_slow} of {calls} calls slower than {self.slow_call:g} s')
+
+    def _open(self, now: float, reason: str) -> None:
+        self._opened_at = now
+        self._trial_at = None
+        self._reason = reason
+        self._reset_window()
+        self.opened += 1
+        print(f'[circuit] {self.name}: open for {self.cooldown:g} s ({reason})')
+
+    def _close(self) -> None:
+        self._opened_at = None
+        self._trial_at = None
+        self._reason = None
+        self._reset_window()
+        print(f'[circuit] {self.name}: closed')
+
+    def _reset_window(self) -> None:
+        self._buckets.clear()
+        self._window_calls = 0
+        self._window_failures = 0
+        self._window_slow = 0
+        self._consecutive = 0
+
+    def retry_after(self) -> int:
+        """Через сколько секунд провайдера снова попробуют (0 - можно сейчас)"""
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            return max(0, int(self.cooldown - (time.monotonic() - self._opened_at)) + 1)
+
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return CLOSED
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return OPEN
+            return HALF_OPEN
+
+    @contextmanager
+    def guard(self, allowed: bool = False) -> Iterator[None]:
+        """
+        with breaker.guard(): вызов провайдера
+        Открытый breaker - CircuitOpenError без вызова; исключение из блока - неудача.
+        allowed=True - вызывающий уже получил разрешение через allow().
+        DeadlineExceeded не вина провайдера: исход не учитывается, пробный вызов возвращается
+        """
+        if not allowed and not self.allow():
+            raise CircuitOpenError(f'{self.name}: circuit open', self.retry_after())
+        started = time.monotonic()
+        try:
+            yield
+        except DeadlineExceeded:
+            self.release()
+            raise
+        except BaseException:
+            self.record_failure(time.monotonic() - started)
+            raise
+        self.record_success(time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            window_calls = self._window_calls
+            window_failures = self._window_failures
+            window_slow = self._window_slow
+            reason = self._reason
+        return {
+            'state': self.state(),
+            'retry_after': self.retry_after(),
+            'reason': reason,
+            'calls': self.calls,
+            'failures': self.failures,
+            'slow': self.slow,
+            'rejected': self.rejected,
+            'opened': self.opened,
+            'window_calls': window_calls,
+            'window_failures': window_failures,
+            'window_slow': window_slow,
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name: str, **options: Any) -> CircuitBreaker:
+    """Breaker провайдера по имени, один на процесс; настройки задает первый вызов"""
+    with _breakers_lock:
+        existing = _breakers.get(name)
+        if existing is None:
+            existing = _breakers[name] = CircuitBreaker(name, **options)
+        return existing
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """Состояние и счетчики всех breaker-ов процесса"""
+    return {name: b.stats() for name, b in list(_breakers.items())}
+
+
+BREAKER_STATE = metrics.gauge('circuit_breaker_state', 'Текущее состояние breaker-а (1 у текущего)', ('breaker', 'state'))
+BREAKER_COUNTERS = {
+    key: metrics.counter(f'circuit_breaker_{key}_total', help, ('breaker',))
+    for key, help in (
+        ('calls', 'Вызовы, исход которых учтен breaker-ом'),
+        ('failures', 'Неудачные вызовы'),
+        ('slow', 'Медленные вызовы'),
+        ('rejected', 'Вызовы, отклоненные открытым breaker-ом'),
+        ('opened', 'Открытия breaker-а'),
+    )
+}
+
+
+@metrics.on_scrape
+def _breaker_metrics() -> None:
+    for name, breaker_stats in stats().items():
+        for state in (CLOSED, OPEN, HALF_OPEN):
+            BREAKER_STATE.set(int(breaker_stats['state'] == state), name, state)
+        for key, counter in BREAKER_COUNTERS.items():
+            counter.set(breaker_stats[key], name)
+
+
+class Deadline:
+    """Момент, после которого внешние вызовы уже не начинаются и не ждут ответа"""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_context(cls, context: Any, reserve: float = DEADLINE_RESERVE) -> 'Deadline':
+        """Остаток времени вызова из контекста функции за вычетом reserve"""
+        seconds = FUNCTION_TIMEOUT
+        get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+        if callable(get_remaining):
+            try:
+                seconds = get_remaining() / 1000
+            except Exception:
+                pass
+        return cls(seconds - reserve)
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def timeout(self, limit: float, what: str = 'call') -> float:
+        """limit, урезанный до оставшегося времени; DeadlineExceeded, если его не осталось"""
+        remaining = self.remaining()
+        if remaining < MIN_CALL_SECONDS:
+            raise DeadlineExceeded(f'{what}: no time left in the invocation')
+        return min(limit, remaining)
+
+
+_local = threading.local()
+
+
+def start(context: Any, reserve: float = DEADLINE_RESERVE) -> Deadline:
+    """
+    Запускает бюджет времени вызова для текущего потока; вызывается в начале handler.
+    reserve - время, которое нужно функции после последнего внешнего вызова.
+    """
+    _local.deadline = Deadline.from_context(context, reserve)
+    return _local.deadline
+
+
+def current() -> Optional[Deadline]:
+    """Бюджет текущего вызова; в фоновых потоках его нет"""
+    return getattr(_local, 'deadline', None)
+
+
+def timeout(limit: float, what: str = 'call') -> float:
+    """Таймаут внешнего вызова: limit, урезанный до бюджета текущего вызова, если он есть"""
+    deadline = current()
+    return limit if deadline is None else deadline.timeout(limit, what)
@@ -6,24 +6,184 @@ import json
 import os
 import secrets
 import re
+import time
 import traceback
-from typing import Dict, Any, Tuple
+import uuid
+from typing import Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import urllib.request
-import urllib.parse
+import circuit
+import db
+import http_client
+import metrics
 
 
 def get_db_connection():
-    """Создает подключение к базе данных"""
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    """Соединение из пула (conn.close() возвращает его в пул)"""
+    return db.connect()
 
 
-SCHEMA = '"t_p41246523_jobsapp_mobile_proje"'
+SCHEMA = db.SCHEMA
+
+# Провайдеры кодов: после серии сбоев или медленных ответов отказ сразу, без ожидания таймаута
+SMSC_BREAKER = circuit.breaker('smsc', slow_call=5)
+SMTP_BREAKER = circuit.breaker('smtp', slow_call=10)
+SMTP_TIMEOUT = 30
+
+ROUTES = ('send-code', 'verify-code', 'check-session', 'update-role', 'login', 'sessions', 'revoke-sessions')
+CODES_SENT = metrics.counter(
+    'auth_codes_sent_total', 'Запросы кода входа (sent, failed, unavailable, rate_limited)', ('channel', 'result'))
+CODE_CHECKS = metrics.counter('auth_code_checks_total', 'Проверки кода входа (success, invalid)', ('channel', 'result'))
+
+# Максимум активных сессий на пользователя, самые старые вытесняются при входе
+MAX_ACTIVE_SESSIONS = max(1, int(os.environ.get('MAX_ACTIVE_SESSIONS', '10')))
+
+# Деактивирует активные сессии пользователя сверх лимита, оставляя место для новой.
+# Новая сессия вставляется в том же запросе и в снимок CTE не попадает.
+EVICT_SESSIONS_CTE = f"""
+    evicted AS (
+        UPDATE {SCHEMA}.sessions SET is_active = FALSE
+        WHERE id IN (
+            SELECT id FROM {SCHEMA}.sessions
+            WHERE user_id = (SELECT id FROM u)
+            AND is_active = TRUE
+            ORDER BY created_at DESC
+            OFFSET {MAX_ACTIVE_SESSIONS - 1}
+        )
+    )
+"""
+
+
+def _verify_code_sql(column: str) -> str:
+    """
+    Один запрос на вход по коду: гасит код, создает/обновляет пользователя
+    по email или телефону и создает сессию. Если код не подошел - строк нет.
+    """
+    return f"""
+        WITH otp AS (
+            UPDATE {SCHEMA}.otp_codes SET is_used = TRUE
+            WHERE id = (
+                SELECT id FROM {SCHEMA}.otp_codes
+                WHERE contact = %s
+                AND code = %s
+                AND is_used = FALSE
+                AND expires_at > NOW()
+                ORDER BY created_at DESC
+                LIMIT 1
+                FOR UPDATE
+            )
+            AND is_used = FALSE
+            RETURNING id
+        ),
+        u AS (
+            INSERT INTO {SCHEMA}.users ({column}, {column}_verified, updated_at, role, password_hash, name)
+            SELECT %s, TRUE, NOW(), %s, '', %s FROM otp
+            ON CONFLICT ({column}) DO UPDATE
+                SET updated_at = NOW(), {column}_verified = TRUE
+            RETURNING id, phone, email, name, {column}_verified AS is_verified, role
+        ),
+        {EVICT_SESSIONS_CTE},
+        s AS (
+            INSERT INTO {SCHEMA}.sessions (user_id, token, expires_at)
+            SELECT id, %s, %s FROM u
+        )
+        SELECT * FROM u
+    """
+
+
+# Текст запроса собирается один раз на инстанс, а не на каждый вызов
+VERIFY_CODE = {
+    'email': db.statement('auth_verify_code_email', _verify_code_sql('email')),
+    'phone': db.statement('auth_verify_code_phone', _verify_code_sql('phone')),
+}
+
+# Вход администратора: сессия создается вместе с вытеснением лишних
+LOGIN_SESSION = db.statement('auth_login_session', f"""
+    WITH u AS (SELECT %s::uuid AS id),
+    {EVICT_SESSIONS_CTE}
+    INSERT INTO {SCHEMA}.sessions (user_id, token, expires_at)
+    SELECT id, %s, %s FROM u
+""")
+
+# Колонки перечислены явно: у подготовленного запроса с * после миграции,
+# добавившей колонку, поменялся бы набор колонок результата, и он бы перестал выполняться
+CHECK_SESSION = db.statement('auth_check_session', """
+    SELECT u.id, u.phone, u.email, u.name, u.role
+    FROM {schema}.sessions s
+    JOIN {schema}.users u ON s.user_id = u.id
+    WHERE s.token = %s
+    AND s.is_active = TRUE
+    AND s.expires_at > NOW()
+""")
+
+SESSION_USER = db.statement('auth_session_user', """
+    SELECT s.user_id FROM {schema}.sessions s
+    WHERE s.token = %s
+    AND s.is_active = TRUE
+    AND s.expires_at > NOW()
+""")
+
+ADMIN_SESSION = db.statement('auth_admin_session', """
+    SELECT 1 FROM {schema}.sessions s
+    JOIN {schema}.users u ON s.user_id = u.id
+    WHERE s.token = %s
+    AND s.is_active = TRUE
+    AND s.expires_at > NOW()
+    AND u.role = 'admin'
+""")
+
+UPDATE_ROLE = db.statement('auth_update_role', """
+    UPDATE {schema}.users
+    SET role = %s
+    WHERE id = %s
+    RETURNING id, phone, email, name, email_verified, phone_verified, role
+""")
+
+RECENT_CODES = db.statement('auth_recent_codes', """
+    SELECT COUNT(*) as count FROM {schema}.otp_codes
+    WHERE contact = %s
+    AND created_at > NOW() - INTERVAL '10 minutes'
+""")
+
+INSERT_CODE = db.statement('auth_insert_code', """
+    INSERT INTO {schema}.otp_codes (contact, contact_type, code, purpose, expires_at)
+    VALUES (%s, %s, %s, 'login', %s)
+""")
+
+FAILED_CODE_ATTEMPT = db.statement('auth_failed_code_attempt', """
+    UPDATE {schema}.otp_codes
+    SET attempts = attempts + 1
+    WHERE contact = %s AND code = %s
+""")
+
+# Идет по частичному индексу idx_sessions_user_active
+USER_SESSIONS = db.statement('auth_user_sessions', """
+    SELECT id, created_at, expires_at FROM {schema}.sessions
+    WHERE user_id = %s
+    AND is_active = TRUE
+    AND expires_at > NOW()
+    ORDER BY created_at DESC
+""")
+
+# Без session_id отзываются все активные сессии пользователя
+REVOKE_SESSIONS = db.statement('auth_revoke_sessions', """
+    UPDATE {schema}.sessions SET is_active = FALSE
+    WHERE user_id = %s
+    AND is_active = TRUE
+    AND (%s::int IS NULL OR id = %s::int)
+""")
+
+ADMIN_BY_CONTACT = {
+    'email': db.statement('auth_admin_by_email', """
+        SELECT id, phone, email, name, email_verified, role FROM {schema}.users WHERE email = %s AND role = 'admin'
+    """),
+    'phone': db.statement('auth_admin_by_phone', """
+        SELECT id, phone, email, name, phone_verified, role FROM {schema}.users WHERE phone = %s AND role = 'admin'
+    """),
+}
 
 
 def generate_code() -> str:
@@ -58,8 +218,33 @@ def normalize_phone(phone: str) -> str:
     return '+' + digits
 
 
-def send_email(email: str, code: str) -> Tuple[bool, str]:
-    """Отправляет код на email"""
+def parse_session_id(value: Any) -> Optional[int]:
+    """id сессии из JSON (число или строка цифр); иначе None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        value = str(value)
+    if not isinstance(value, str) or not re.fullmatch(r'\d{1,9}', value.strip()):
+        return None
+    return int(value)
+
+
+def parse_user_id(value: Any) -> Optional[str]:
+    """UUID пользователя в каноническом виде; иначе None"""
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return None
+
+
+def is_admin_session(cur, token: str) -> bool:
+    """Проверяет, что токен принадлежит активной сессии администратора"""
+    db.execute(cur, ADMIN_SESSION, (token,))
+    return cur.fetchone() is not None
+
+
+def send_email(email: str, code: str, allowed: bool = False) -> Tuple[bool, str]:
+    """Отправляет код на email; allowed - разрешение SMTP_BREAKER уже получено"""
     try:
         smtp_host = os.environ.get('SMTP_HOST')
         smtp_port = int(os.environ.get('SMTP_PORT', '465'))
@@ -67,6 +252,8 @@ def send_email(email: str, code: str) -> Tuple[bool, str]:
         smtp_password = os.environ.get('SMTP_PASSWORD')
         
         if not all([smtp_host, smtp_email, smtp_password]):
+            if allowed:
+                SMTP_BREAKER.release()
             return False, 'Email сервис не настроен'
         
         msg = MIMEMultipart('alternative')
@@ -98,29 +285,42 @@ def send_email(email: str, code: str) -> Tuple[bool, str]:
         msg.attach(MIMEText(text, 'plain', 'utf-8'))
         msg.attach(MIMEText(html, 'html', 'utf-8'))
         
-        if smtp_port == 465:
-            with smtplib.SMTP_SSL(smtp_host, smtp_port, timeout=30) as server:
-                server.login(smtp_email, smtp_password)
-                server.send_message(msg)
-        else:
-            with smtplib.SMTP(smtp_host, smtp_port, timeout=30) as server:
-                server.starttls()
-                server.login(smtp_email, smtp_password)
-                server.send_message(msg)
+        # Таймаут сокета действует на каждый шаг разговора, поэтому перед шагами
+        # он урезается до оставшегося времени вызова
+        with SMTP_BREAKER.guard(allowed):
+            started = time.monotonic()
+            try:
+                if smtp_port == 465:
+                    server = smtplib.SMTP_SSL(smtp_host, smtp_port, timeout=circuit.timeout(SMTP_TIMEOUT, 'smtp'))
+                else:
+                    server = smtplib.SMTP(smtp_host, smtp_port, timeout=circuit.timeout(SMTP_TIMEOUT, 'smtp'))
+                with server:
+                    if smtp_port != 465:
+                        server.starttls()
+                    server.sock.settimeout(circuit.timeout(SMTP_TIMEOUT, 'smtp'))
+                    server.login(smtp_email, smtp_password)
+                    server.sock.settimeout(circuit.timeout(SMTP_TIMEOUT, 'smtp'))
+                    server.send_message(msg)
+            finally:
+                metrics.outbound(smtp_host, time.monotonic() - started)
         
         return True, 'Email отправлен'
         
+    except circuit.Unavailable:
+        raise
     except Exception as e:
         return False, f'Ошибка отправки email: {str(e)}'
 
 
-def send_sms(phone: str, code: str) -> Tuple[bool, str]:
-    """Отправляет SMS код"""
+def send_sms(phone: str, code: str, allowed: bool = False) -> Tuple[bool, str]:
+    """Отправляет SMS код; allowed - разрешение SMSC_BREAKER уже получено"""
     try:
         login = os.environ.get('SMSC_LOGIN')
         password = os.environ.get('SMSC_PASSWORD')
         
         if not login or not password:
+            if allowed:
+                SMSC_BREAKER.release()
             return False, 'SMS сервис не настроен'
         
         phone_clean = ''.join(filter(str.isdigit, phone))
@@ -140,24 +340,49 @@ def send_sms(phone: str, code: str) -> Tuple[bool, str]:
             'fmt': 3
         }
         
-        url = 'https://smsc.ru/sys/send.php?' + urllib.parse.urlencode(params)
-        response = urllib.request.urlopen(url, timeout=10)
-        result = json.loads(response.read().decode('utf-8'))
+        # Повтор после отправки запроса мог бы продублировать SMS
+        with SMSC_BREAKER.guard(allowed):
+            response = http_client.client.get(
+                'https://smsc.ru/sys/send.php', params=params, read_timeout=10, idempotent=False
+            )
+            if http_client.unhealthy_status(response.status):
+                response.raise_for_status()
+        result = response.json()
         
         if 'error' in result or 'error_code' in result:
             return False, result.get('error', 'Ошибка отправки SMS')
         
         return True, 'SMS отправлена'
         
+    except circuit.Unavailable:
+        raise
     except Exception as e:
         return False, f'Ошибка отправки SMS: {str(e)}'
 
 
+def code_provider_unavailable(retry_after: int) -> Dict[str, Any]:
+    """503 с Retry-After: провайдер кодов отключен breaker-ом или не хватило времени"""
+    retry_after = max(1, retry_after)
+    return {
+        'statusCode': 503,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Retry-After': str(retry_after)
+        },
+        'body': json.dumps({'error': 'Сервис отправки кодов временно недоступен, попробуйте позже', 'retryAfter': retry_after}),
+        'isBase64Encoded': False
+    }
+
+
+@metrics.instrument(metrics.param_route('path', ROUTES, default='send-code'))
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     API аутентификации через одноразовые коды
-    Endpoints: /send-code, /verify-code, /check-session, /update-role
+    Endpoints: /send-code, /verify-code, /check-session, /update-role, /login,
+    /sessions, /revoke-sessions (admin); GET ?path=metrics - метрики Prometheus
     """
+    circuit.start(context)
     method = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -203,12 +428,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             # Проверяем сессию
-            cur.execute(f"""
-                SELECT s.user_id FROM {SCHEMA}.sessions s
-                WHERE s.token = %s 
-                AND s.is_active = TRUE 
-                AND s.expires_at > NOW()
-            """, (token,))
+            db.execute(cur, SESSION_USER, (token,))
             
             session = cur.fetchone()
             if not session:
@@ -221,12 +441,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             # Обновляем роль
-            cur.execute(f"""
-                UPDATE {SCHEMA}.users 
-                SET role = %s 
-                WHERE id = %s
-                RETURNING id, phone, email, name, email_verified, phone_verified, role
-            """, (role, session['user_id']))
+            db.execute(cur, UPDATE_ROLE, (role, session['user_id']))
             
             user = cur.fetchone()
             conn.commit()
@@ -285,44 +500,57 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 contact_type = 'phone'
                 normalized_contact = normalize_phone(contact)
             
-            # Проверяем лимит запросов (не более 3 кодов за 10 минут)
-            cur.execute(f"""
-                SELECT COUNT(*) as count FROM {SCHEMA}.otp_codes 
-                WHERE contact = %s 
-                AND created_at > NOW() - INTERVAL '10 minutes'
-            """, (normalized_contact,))
-            
-            result = cur.fetchone()
-            if result and result['count'] >= 3:
+            # Разрешение провайдера (в half-open - единственный пробный вызов) берется до
+            # создания кода: пока провайдер недоступен, код не создается и не расходует
+            # лимит запросов. Если код так и не создан, разрешение возвращается
+            provider = SMTP_BREAKER if contact_type == 'email' else SMSC_BREAKER
+            if not provider.allow():
                 conn.close()
-                return {
-                    'statusCode': 429,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Слишком много запросов. Попробуйте через 10 минут'}),
-                    'isBase64Encoded': False
-                }
+                CODES_SENT.inc(contact_type, 'unavailable')
+                return code_provider_unavailable(provider.retry_after())
             
-            # Генерируем код
-            code = generate_code()
-            expires_at = datetime.now() + timedelta(minutes=10)
-            
-            # Сохраняем код с purpose='login' (constraint требует только эти значения)
-            # Роль сохраняем в код самом (последний символ: 0-5=seeker, 6-9=employer)
-            # Но лучше просто использовать role из параметра при создании пользователя
-            cur.execute(f"""
-                INSERT INTO {SCHEMA}.otp_codes (contact, contact_type, code, purpose, expires_at)
-                VALUES (%s, %s, %s, 'login', %s)
-            """, (normalized_contact, contact_type, code, expires_at))
-            conn.commit()
+            try:
+                # Проверяем лимит запросов (не более 3 кодов за 10 минут)
+                db.execute(cur, RECENT_CODES, (normalized_contact,))
+                
+                result = cur.fetchone()
+                if result and result['count'] >= 3:
+                    provider.release()
+                    conn.close()
+                    CODES_SENT.inc(contact_type, 'rate_limited')
+                    return {
+                        'statusCode': 429,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Слишком много запросов. Попробуйте через 10 минут'}),
+                        'isBase64Encoded': False
+                    }
+                
+                # Генерируем код
+                code = generate_code()
+                expires_at = datetime.now() + timedelta(minutes=10)
+                
+                # Сохраняем код с purpose='login' (constraint требует только эти значения)
+                # Роль сохраняем в код самом (последний символ: 0-5=seeker, 6-9=employer)
+                # Но лучше просто использовать role из параметра при создании пользователя
+                db.execute(cur, INSERT_CODE, (normalized_contact, contact_type, code, expires_at))
+                conn.commit()
+            except BaseException:
+                provider.release()
+                raise
+            # Соединение не держится, пока ждем провайдера
+            conn.close()
             
             # Отправляем код
-            if contact_type == 'email':
-                success, message = send_email(normalized_contact, code)
-            else:
-                success, message = send_sms(normalized_contact, code)
-            
-            conn.close()
+            try:
+                if contact_type == 'email':
+                    success, message = send_email(normalized_contact, code, allowed=True)
+                else:
+                    success, message = send_sms(normalized_contact, code, allowed=True)
+            except circuit.Unavailable as e:
+                CODES_SENT.inc(contact_type, 'unavailable')
+                return code_provider_unavailable(e.retry_after)
             
+            CODES_SENT.inc(contact_type, 'sent' if success else 'failed')
             if not success:
                 return {
                     'statusCode': 500,
@@ -347,8 +575,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             contact = body.get('contact', '').strip()
             code = body.get('code', '').strip()
             
-            print(f'[DEBUG] verify-code: contact={contact}, code={code}')
-            
             if not contact or not code:
                 return {
                     'statusCode': 400,
@@ -360,32 +586,29 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             # Нормализуем контакт
             is_email = '@' in contact
             normalized_contact = contact.lower() if is_email else normalize_phone(contact)
+            contact_type = 'email' if is_email else 'phone'
             
-            print(f'[DEBUG] normalized_contact={normalized_contact}, is_email={is_email}')
-            
-            # Проверяем код
-            cur.execute(f"""
-                SELECT * FROM {SCHEMA}.otp_codes 
-                WHERE contact = %s 
-                AND code = %s 
-                AND is_used = FALSE 
-                AND expires_at > NOW()
-                ORDER BY created_at DESC
-                LIMIT 1
-            """, (normalized_contact, code))
+            # Роль берем из body (она была передана вместе с кодом)
+            role = body.get('role', 'seeker')
+            if role not in ['seeker', 'employer']:
+                role = 'seeker'
             
-            otp = cur.fetchone()
-            print(f'[DEBUG] otp found: {otp is not None}')
+            # Погашение кода, upsert пользователя и создание сессии - одним запросом
+            token = generate_token()
+            expires_at = datetime.now() + timedelta(days=30)
+            db.execute(cur, VERIFY_CODE[contact_type], (
+                normalized_contact, code,
+                normalized_contact, role, normalized_contact,
+                token, expires_at
+            ))
+            user = cur.fetchone()
             
-            if not otp:
+            if not user:
                 # Увеличиваем счетчик попыток
-                cur.execute(f"""
-                    UPDATE {SCHEMA}.otp_codes 
-                    SET attempts = attempts + 1 
-                    WHERE contact = %s AND code = %s
-                """, (normalized_contact, code))
+                db.execute(cur, FAILED_CODE_ATTEMPT, (normalized_contact, code))
                 conn.commit()
                 conn.close()
+                CODE_CHECKS.inc(contact_type, 'invalid')
                 
                 return {
                     'statusCode': 401,
@@ -394,67 +617,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            # Отмечаем код как использованный
-            print(f'[DEBUG] Marking OTP as used, otp_id={otp["id"]}')
-            cur.execute(f"UPDATE {SCHEMA}.otp_codes SET is_used = TRUE WHERE id = %s", (otp['id'],))
-            conn.commit()
-            
-            # Роль берем из body (она была передана вместе с кодом)
-            role = body.get('role', 'seeker')
-            if role not in ['seeker', 'employer']:
-                role = 'seeker'
-            
-            # Ищем или создаем пользователя (используем name вместо full_name, email_verified/phone_verified)
-            if is_email:
-                cur.execute(f"SELECT id, phone, email, name, email_verified, role FROM {SCHEMA}.users WHERE email = %s", (normalized_contact,))
-            else:
-                cur.execute(f"SELECT id, phone, email, name, phone_verified, role FROM {SCHEMA}.users WHERE phone = %s", (normalized_contact,))
-            
-            user = cur.fetchone()
-            print(f'[DEBUG] user found: {user is not None}')
-            
-            if not user:
-                # Создаем нового пользователя с ролью (password_hash = '', name = email/phone)
-                print(f'[DEBUG] Creating new user with role={role}')
-                if is_email:
-                    cur.execute(f"""
-                        INSERT INTO {SCHEMA}.users (email, email_verified, updated_at, role, password_hash, name)
-                        VALUES (%s, TRUE, NOW(), %s, '', %s)
-                        RETURNING id, phone, email, name, email_verified, role
-                    """, (normalized_contact, role, normalized_contact))
-                else:
-                    cur.execute(f"""
-                        INSERT INTO {SCHEMA}.users (phone, phone_verified, updated_at, role, password_hash, name)
-                        VALUES (%s, TRUE, NOW(), %s, '', %s)
-                        RETURNING id, phone, email, name, phone_verified, role
-                    """, (normalized_contact, role, normalized_contact))
-                user = cur.fetchone()
-                print(f'[DEBUG] New user created: user_id={user["id"] if user else None}')
-                conn.commit()
-            else:
-                # Обновляем updated_at и verified (роль не меняем для существующих)
-                print(f'[DEBUG] Updating existing user, user_id={user["id"]}')
-                if is_email:
-                    cur.execute(f"UPDATE {SCHEMA}.users SET updated_at = NOW(), email_verified = TRUE WHERE id = %s", (user['id'],))
-                else:
-                    cur.execute(f"UPDATE {SCHEMA}.users SET updated_at = NOW(), phone_verified = TRUE WHERE id = %s", (user['id'],))
-                conn.commit()
-            
-            # Создаем сессию
-            token = generate_token()
-            expires_at = datetime.now() + timedelta(days=30)
-            
-            print(f'[DEBUG] Creating session for user_id={user["id"]}')
-            cur.execute(f"""
-                INSERT INTO {SCHEMA}.sessions (user_id, token, expires_at)
-                VALUES (%s, %s, %s)
-            """, (user['id'], token, expires_at))
             conn.commit()
-            print(f'[DEBUG] Session created successfully')
             conn.close()
-            
-            # Поле is_verified зависит от типа контакта
-            is_verified = user.get('email_verified', False) if is_email else user.get('phone_verified', False)
+            CODE_CHECKS.inc(contact_type, 'success')
             
             return {
                 'statusCode': 200,
@@ -467,7 +632,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'phone': user.get('phone'),
                         'email': user.get('email'),
                         'full_name': user.get('name'),
-                        'is_verified': is_verified,
+                        'is_verified': user.get('is_verified', False),
                         'role': user.get('role', 'seeker')
                     }
                 }),
@@ -486,14 +651,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            cur.execute(f"""
-                SELECT s.*, u.* 
-                FROM {SCHEMA}.sessions s
-                JOIN {SCHEMA}.users u ON s.user_id = u.id
-                WHERE s.token = %s 
-                AND s.is_active = TRUE 
-                AND s.expires_at > NOW()
-            """, (token,))
+            db.execute(cur, CHECK_SESSION, (token,))
             
             result = cur.fetchone()
             conn.close()
@@ -523,6 +681,78 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
+        # Сессии пользователя: просмотр и отзыв (только для администратора)
+        elif path in ('sessions', 'revoke-sessions'):
+            token = event.get('headers', {}).get('X-Session-Token') or params.get('token')
+            
+            if not token or not is_admin_session(cur, token):
+                conn.close()
+                return {
+                    'statusCode': 403,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Доступ только для администратора'}),
+                    'isBase64Encoded': False
+                }
+            
+            user_id = params.get('user_id') or body.get('user_id')
+            if not user_id:
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Укажите user_id'}),
+                    'isBase64Encoded': False
+                }
+            
+            # Запросы приводят id к типам колонок: некорректное значение дало бы ошибку базы и 500
+            user_id = parse_user_id(user_id)
+            raw_session_id = body.get('session_id')
+            session_id = parse_session_id(raw_session_id) if raw_session_id is not None else None
+            if user_id is None or (raw_session_id is not None and session_id is None):
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Некорректный user_id или session_id'}),
+                    'isBase64Encoded': False
+                }
+            
+            if path == 'sessions' and method == 'GET':
+                db.execute(cur, USER_SESSIONS, (user_id,))
+                sessions = cur.fetchall()
+                conn.close()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'success': True,
+                        'sessions': [dict(s) for s in sessions]
+                    }, default=str),
+                    'isBase64Encoded': False
+                }
+            
+            if path == 'revoke-sessions' and method == 'POST':
+                db.execute(cur, REVOKE_SESSIONS, (user_id, session_id, session_id))
+                revoked = cur.rowcount
+                conn.commit()
+                conn.close()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'success': True, 'revoked': revoked}),
+                    'isBase64Encoded': False
+                }
+            
+            conn.close()
+            return {
+                'statusCode': 405,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Method not allowed'}),
+                'isBase64Encoded': False
+            }
+        
         elif path == 'login' and method == 'POST':
             login_value = body.get('login', '').strip()
             password = body.get('password', '')
@@ -539,10 +769,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             is_email = '@' in login_value
             if is_email:
-                cur.execute(f"SELECT id, phone, email, name, email_verified, role FROM {SCHEMA}.users WHERE email = %s AND role = 'admin'", (login_value.lower(),))
+                db.execute(cur, ADMIN_BY_CONTACT['email'], (login_value.lower(),))
             else:
-                normalized = normalize_phone(login_value)
-                cur.execute(f"SELECT id, phone, email, name, phone_verified, role FROM {SCHEMA}.users WHERE phone = %s AND role = 'admin'", (normalized,))
+                db.execute(cur, ADMIN_BY_CONTACT['phone'], (normalize_phone(login_value),))
             
             user = cur.fetchone()
             
@@ -557,7 +786,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             token = generate_token()
             expires_at = datetime.now() + timedelta(days=30)
-            cur.execute(f"INSERT INTO {SCHEMA}.sessions (user_id, token, expires_at) VALUES (%s, %s, %s)", (user['id'], token, expires_at))
+            db.execute(cur, LOGIN_SESSION, (user['id'], token, expires_at))
             conn.commit()
             conn.close()
             
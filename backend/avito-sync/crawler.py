@@ -0,0 +1,210 @@
+"""
+Параллельный обход страниц выдачи Avito по регионам
+Пул потоков с общим лимитом параллельности и ограничением частоты запросов на хост
+"""
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import circuit
+import http_client
+from page_cache import PageCache
+
+
+class RateLimiter:
+    """Не чаще rate запросов в секунду на хост (равномерно, без всплесков)"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host: str, deadline: Optional[circuit.Deadline] = None) -> bool:
+        """
+        Ждет своего слота. С deadline слот, который наступит слишком поздно для запроса,
+        не занимается: сразу возвращается False
+        """
+        if not self.interval:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            if deadline is not None and slot - now > deadline.remaining() - circuit.MIN_CALL_SECONDS:
+                return False
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+        return True
+
+    def capacity(self, host: str, seconds: float) -> Optional[int]:
+        """Сколько запросов к host успеет начаться за seconds (None - без ограничения)"""
+        if not self.interval:
+            return None
+        with self._lock:
+            wait = max(0.0, self._next_slot.get(host, 0.0) - time.monotonic())
+        if seconds < wait:
+            return 0
+        return int((seconds - wait) / self.interval) + 1
+
+
+class Crawler:
+    """
+    Обходит страницы 1..max_pages каждого региона
+
+    Страницы региона запрашиваются окнами, параллельно с другими регионами.
+    Регион останавливается на первой странице без новых объявлений (Avito
+    отдает последнюю страницу повторно, если номер больше реального), на пустой
+    странице, на ошибке или на max_pages. Выдача полная (complete в отчете), только
+    если каждый регион дошел до настоящего конца - страницы с объявлениями, но без
+    новых: пустая страница бывает капчей или поломкой верстки, а на max_pages
+    выдача просто обрезана.
+    С кэшем свежие страницы берутся без сети, остальные - условным запросом,
+    и на 304 повторный разбор не выполняется. С breaker-ом страницы при открытом
+    breaker-е не запрашиваются, а обход укладывается в бюджет вызова функции.
+    """
+
+    def __init__(
+        self,
+        page_url: Callable[[str, int], str],
+        parse: Callable[[Iterable[bytes]], List[Dict[str, Any]]],
+        key: Callable[[Dict[str, Any]], str],
+        headers: Optional[Dict[str, str]] = None,
+        max_pages: int = 5,
+        concurrency: int = 4,
+        rate_limiter: Optional[RateLimiter] = None,
+        cache: Optional[PageCache] = None,
+        breaker: Optional[circuit.CircuitBreaker] = None,
+    ):
+        self.page_url = page_url
+        self.parse = parse
+        self.key = key
+        self.headers = headers or {}
+        self.max_pages = max_pages
+        self.concurrency = max(1, concurrency)
+        self.rate_limiter = rate_limiter or RateLimiter(0)
+        self.cache = cache
+        self.breaker = breaker
+
+    def fetch_page(
+        self, region: str, page: int, deadline: Optional[circuit.Deadline] = None
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Загружает и потоково парсит одну страницу, возвращает объявления и замер
+        deadline по умолчанию - бюджет вызова в текущем потоке
+        """
+        url = self.page_url(region, page)
+        report: Dict[str, Any] = {'region': region, 'page': page}
+        cached = self.cache.lookup(url) if self.cache else None
+        if cached and self.cache.is_fresh(cached[0]):
+            self.cache.record_fresh_hit(cached[0])
+            report.update({'status': 200, 'cache': 'fresh', 'listings': len(cached[1]), 'bytes': 0, 'total_ms': 0.0})
+            return cached[1], report
+
+        headers = dict(self.headers)
+        if cached:
+            headers.update(PageCache.conditional_headers(cached[0]))
+        started = time.monotonic()
+        if not self.rate_limiter.acquire(urlsplit(url).hostname or '', deadline or circuit.current()):
+            report.update({'status': None, 'error': 'no time left for a rate limit slot', 'listings': 0, 'total_ms': 0.0})
+            return [], report
+        try:
+            # Тело разбирается по мере загрузки, без буферизации всей страницы
+            with http_client.client.stream('GET', url, headers=headers,
+                                           breaker=self.breaker, deadline=deadline) as response:
+                report['ttfb_ms'] = round((time.monotonic() - started) * 1000, 1)
+                if response.status == 304 and cached:
+                    for _ in response.iter_chunks():
+                        pass
+                    self.cache.revalidated(url, response.headers)
+                    report.update({'status': 304, 'cache': 'revalidated', 'listings': len(cached[1]), 'bytes': 0})
+                    return cached[1], report
+                digest = hashlib.sha1()
+                listings = self.parse(self._hashed(response.raise_for_status().iter_chunks(), digest))
+            report.update({
+                'status': response.status,
+                'listings': len(listings),
+                'bytes': response.bytes_read,
+            })
+            if self.cache:
+                report['cache'] = 'miss'
+                self.cache.record_miss(response.bytes_read)
+                if listings:
+                    # Пустую выдачу (капча, поломка верстки) не кэшируем
+                    self.cache.store(url, response.headers, digest.hexdigest(), response.bytes_read, listings)
+            return listings, report
+        except Exception as e:
+            report.update({'status': getattr(e, 'status', None), 'error': str(e), 'listings': 0})
+            return [], report
+        finally:
+            report['total_ms'] = round((time.monotonic() - started) * 1000, 1)
+
+    @staticmethod
+    def _hashed(chunks: Iterable[bytes], digest) -> Iterator[bytes]:
+        for chunk in chunks:
+            digest.update(chunk)
+            yield chunk
+
+    def crawl(self, regions: List[str]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Обходит регионы, возвращает уникальные объявления и отчет по страницам"""
+        started = time.monotonic()
+        seen = set()
+        listings: List[Dict[str, Any]] = []
+        pages: List[Dict[str, Any]] = []
+        next_page = {region: 1 for region in regions}
+        # Почему регион остановлен: end, empty, error или max_pages
+        ended: Dict[str, str] = {}
+        errors = 0
+        # Потоки пула не видят бюджет вызова - он передается им явно
+        deadline = circuit.current()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while next_page:
+                window = max(1, self.concurrency // len(next_page))
+                batch = [
+                    (region, page)
+                    for region, first in next_page.items()
+                    for page in range(first, min(first + window, self.max_pages + 1))
+                ]
+                results = pool.map(lambda rp: self.fetch_page(*rp, deadline=deadline), batch)
+
+                for (region, page), (page_listings, report) in zip(batch, results):
+                    if region in ended:
+                        # Страница уже за точкой остановки региона
+                        continue
+                    new = 0
+                    for item in page_listings:
+                        item_key = self.key(item)
+                        if item_key not in seen:
+                            seen.add(item_key)
+                            listings.append(item)
+                            new += 1
+                    report['new'] = new
+                    pages.append(report)
+                    if 'error' in report:
+                        errors += 1
+                        ended[region] = 'error'
+                    elif not page_listings:
+                        ended[region] = 'empty'
+                    elif not new:
+                        ended[region] = 'end'
+                    next_page[region] = page + 1
+
+                for region, page in next_page.items():
+                    if region not in ended and page > self.max_pages:
+                        ended[region] = 'max_pages'
+                next_page = {region: page for region, page in next_page.items() if region not in ended}
+
+        return listings, {
+            'regions': len(regions),
+            'pages': len(pages),
+            'errors': errors,
+            'ended': ended,
+            'complete': all(ended.get(region) == 'end' for region in regions),
+            'listings': len(listings),
+            'duration_ms': round((time.monotonic() - started) * 1000, 1),
+            'cache': self.cache.stats() if self.cache else None,
+            'per_page': pages,
+        }
@@ -0,0 +1,309 @@
+"""
+Дозагрузка карточек объявлений Avito: описание, работодатель, график
+Страницы объявлений загружаются ограниченным пулом потоков, результат кэшируется
+по id объявления и повторно не запрашивается, пока карточка в выдаче не изменилась.
+Загрузка укладывается в бюджет вызова: сколько страниц запросить, считается по
+лимиту частоты и оставшемуся времени, кэш сохраняется по ходу, поэтому следующий
+вызов продолжает с того места, где остановился предыдущий.
+"""
+import codecs
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from html.parser import HTMLParser
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import circuit
+import http_client
+from crawler import RateLimiter
+
+
+# data-marker блока страницы объявления -> поле
+DETAIL_MARKERS = (
+    ('item-view/item-description', 'description'),
+    ('seller-info/name', 'employer'),
+    ('item-view/item-params', 'params'),
+)
+
+# Теги, после которых текст переносится на новую строку
+BLOCK_TAGS = frozenset(('p', 'br', 'li', 'div', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4'))
+
+VOID_TAGS = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr'
+))
+
+# Подписи параметров объявления с графиком работы
+SCHEDULE_LABELS = ('график работы', 'график')
+
+
+class DetailParser(HTMLParser):
+    """Собирает текст блоков страницы объявления по data-marker"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: Dict[str, List[str]] = {}
+        self.field: Optional[str] = None
+        self.depth = 0
+
+    def handle_starttag(self, tag: str, attrs: List[tuple]):
+        if self.field is not None:
+            if tag in BLOCK_TAGS:
+                self.parts[self.field].append('\n')
+            if tag not in VOID_TAGS:
+                self.depth += 1
+            return
+        marker = dict(attrs).get('data-marker')
+        if not marker:
+            return
+        for detail_marker, field in DETAIL_MARKERS:
+            if marker == detail_marker and field not in self.parts:
+                self.field = field
+                self.parts[field] = []
+                self.depth = 0 if tag in VOID_TAGS else 1
+                if not self.depth:
+                    self.field = None
+                break
+
+    def handle_data(self, data: str):
+        if self.field is not None:
+            self.parts[self.field].append(data)
+
+    def handle_endtag(self, tag: str):
+        if self.field is None or tag in VOID_TAGS:
+            return
+        self.depth -= 1
+        if tag in BLOCK_TAGS:
+            self.parts[self.field].append('\n')
+        if not self.depth:
+            self.field = None
+
+    def details(self) -> Dict[str, str]:
+        result = {}
+        for field, parts in self.parts.items():
+            lines = [' '.join(line.split()) for line in ''.join(parts).split('\n')]
+            lines = [line for line in lines if line]
+            if field == 'params':
+                schedule = schedule_from_params(lines)
+                if schedule:
+                    result['schedule'] = schedule
+            elif lines:
+                result[field] = '\n'.join(lines) if field == 'description' else lines[0]
+        return result
+
+
+def schedule_from_params(lines: List[str]) -> Optional[str]:
+    """'График работы: сменный' -> 'сменный'"""
+    for line in lines:
+        label, sep, value = line.partition(':')
+        if sep and label.strip().lower() in SCHEDULE_LABELS and value.strip():
+            return value.strip()
+    return None
+
+
+def parse_details(chunks: Iterable[bytes]) -> Dict[str, str]:
+    parser = DetailParser()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk))
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    return parser.details()
+
+
+def card_fingerprint(listing: Dict[str, Any]) -> str:
+    """Отпечаток карточки из выдачи: при его смене объявление загружается заново"""
+    key = '|'.join(listing.get(f, '') for f in ('title', 'salary', 'city', 'url'))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class DetailCache:
+    """id объявления -> отпечаток карточки и извлеченные поля; JSON-файл в /tmp"""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self.hits = 0
+        self.misses = 0
+        self.unsaved = 0
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, listing_id: str, fingerprint: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            entry = self._load().get(listing_id)
+            if entry is None or entry['fp'] != fingerprint:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry['used_at'] = time.time()
+            return entry['details']
+
+    def put(self, listing_id: str, fingerprint: str, details: Dict[str, str]) -> None:
+        with self._lock:
+            self._load()[listing_id] = {'fp': fingerprint, 'details': details, 'used_at': time.time()}
+            self.unsaved += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries or {})}
+
+    def save(self) -> None:
+        """Вытесняет давно не использованные записи и пишет файл"""
+        with self._lock:
+            entries = self._load()
+            if len(entries) > self.max_entries:
+                keep = sorted(entries, key=lambda k: entries[k]['used_at'], reverse=True)[:self.max_entries]
+                self._entries = entries = {k: entries[k] for k in keep}
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+                self.unsaved = 0
+            except OSError:
+                pass
+
+
+# Кэш дозагрузки пишется на диск после стольких новых записей
+CACHE_SAVE_EVERY = 10
+
+
+class Enricher:
+    """
+    Дополняет объявления полями со страниц объявлений
+
+    Из кэша берется все, что возможно; новые и изменившиеся объявления
+    (не больше max_fetches за вызов и не больше, чем лимит частоты пропустит до
+    deadline; остальные - в следующий) загружаются пулом из workers потоков с
+    общим ограничением частоты на хост. Новая загрузка не начинается, если ее слот
+    лимита частоты наступит после deadline: такие объявления считаются deferred.
+    """
+
+    def __init__(
+        self,
+        detail_url: Callable[[Dict[str, Any]], Optional[str]],
+        key: Callable[[Dict[str, Any]], str],
+        cache: DetailCache,
+        headers: Optional[Dict[str, str]] = None,
+        workers: int = 4,
+        max_fetches: int = 100,
+        rate_limiter: Optional[RateLimiter] = None,
+        breaker: Optional[circuit.CircuitBreaker] = None,
+    ):
+        self.detail_url = detail_url
+        self.key = key
+        self.cache = cache
+        self.headers = headers or {}
+        self.workers = max(1, workers)
+        self.max_fetches = max_fetches
+        self.rate_limiter = rate_limiter or RateLimiter(0)
+        self.breaker = breaker
+
+    def fetch_details(self, url: str, deadline: Optional[circuit.Deadline] = None) -> Optional[Dict[str, str]]:
+        """Поля страницы объявления; None - до deadline слот лимита частоты не наступит"""
+        if not self.rate_limiter.acquire(urlsplit(url).hostname or '', deadline):
+            return None
+        with http_client.client.stream('GET', url, headers=self.headers,
+                                       breaker=self.breaker, deadline=deadline) as response:
+            return parse_details(response.raise_for_status().iter_chunks())
+
+    def enrich(self, listings: List[Dict[str, Any]],
+               deadline: Optional[circuit.Deadline] = None) -> Dict[str, Any]:
+        """Дополняет listings на месте, возвращает отчет; deadline по умолчанию - бюджет вызова"""
+        started = time.monotonic()
+        # Потоки пула не видят бюджет вызова - он передается им явно
+        deadline = deadline or circuit.current()
+        candidates: List[Tuple[Dict[str, Any], str, str, str]] = []
+        cached = skipped = 0
+        for listing in listings:
+            listing_id = self.key(listing)
+            fingerprint = card_fingerprint(listing)
+            details = self.cache.get(listing_id, fingerprint)
+            if details is not None:
+                listing.update(details)
+                cached += 1
+                continue
+            url = self.detail_url(listing)
+            if not url:
+                skipped += 1
+                continue
+            candidates.append((listing, listing_id, fingerprint, url))
+
+        limit = self.max_fetches
+        if candidates and deadline is not None:
+            host = urlsplit(candidates[0][3]).hostname or ''
+            capacity = self.rate_limiter.capacity(host, deadline.remaining() - circuit.MIN_CALL_SECONDS)
+            if capacity is not None:
+                limit = min(limit, capacity)
+        pending = candidates[:max(0, limit)]
+        skipped += len(candidates) - len(pending)
+
+        fetched = errors = deferred = 0
+        fetch_started = time.monotonic()
+        if pending:
+            queue = iter(pending)
+            in_flight: Dict[Any, Tuple[Dict[str, Any], str, str, str]] = {}
+            out_of_time = False
+            try:
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    while True:
+                        # Новые загрузки не отправляются, когда бюджет вызова исчерпан
+                        while len(in_flight) < self.workers and not out_of_time:
+                            if deadline is not None and deadline.remaining() < circuit.MIN_CALL_SECONDS:
+                                out_of_time = True
+                                break
+                            item = next(queue, None)
+                            if item is None:
+                                break
+                            in_flight[pool.submit(self.fetch_details, item[3], deadline)] = item
+                        if not in_flight:
+                            break
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            listing, listing_id, fingerprint, _ = in_flight.pop(future)
+                            try:
+                                details = future.result()
+                            except circuit.Unavailable:
+                                details = None
+                            except Exception:
+                                errors += 1
+                                continue
+                            if details is None:
+                                deferred += 1
+                                out_of_time = True
+                                continue
+                            fetched += 1
+                            listing.update(details)
+                            self.cache.put(listing_id, fingerprint, details)
+                            if self.cache.unsaved >= CACHE_SAVE_EVERY:
+                                self.cache.save()
+            finally:
+                self.cache.save()
+            # И те, что не дождались слота, и те, что не были отправлены
+            deferred = len(pending) - fetched - errors
+        fetch_seconds = time.monotonic() - fetch_started
+
+        return {
+            'listings': len(listings),
+            'cached': cached,
+            'fetched': fetched,
+            'errors': errors,
+            'deferred': deferred,
+            'skipped': skipped,
+            'fetched_per_sec': round(fetched / fetch_seconds, 1) if fetched and fetch_seconds else None,
+            'duration_ms': round((time.monotonic() - started) * 1000, 1),
+        }
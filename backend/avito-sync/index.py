@@ -1,67 +1,456 @@
 import json
-import re
-from typing import Dict, Any, List
-from urllib.parse import urlencode
-import urllib.request
+import os
+import uuid
+import hashlib
+import codecs
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 from html.parser import HTMLParser
+from psycopg2.extras import RealDictCursor, execute_values
+import circuit
+import db
+import http_client
+import metrics
+from crawler import Crawler, RateLimiter
+from page_cache import PageCache
+from snapshot import SnapshotStore
+from enrichment import DetailCache, Enricher
+import dedup
+
+
+AVITO_BASE_URL = 'https://www.avito.ru'
+
+# Регионы обхода (сегменты URL Avito), по умолчанию - Кировская область
+AVITO_REGIONS = [r.strip() for r in os.environ.get('AVITO_REGIONS', 'kirovskaya_oblast').split(',') if r.strip()]
+AVITO_MAX_PAGES = int(os.environ.get('AVITO_MAX_PAGES', '5'))
+AVITO_CONCURRENCY = int(os.environ.get('AVITO_CONCURRENCY', '4'))
+AVITO_RATE_PER_HOST = float(os.environ.get('AVITO_RATE_PER_HOST', '2'))
+
+# Лимит частоты общий для всех обходов в теплом инстансе
+RATE_LIMITER = RateLimiter(AVITO_RATE_PER_HOST)
+
+# Кэш страниц выдачи в /tmp: свежие отдаются без сети, устаревшие проверяются условным запросом
+PAGE_CACHE = PageCache(
+    root=os.environ.get('AVITO_CACHE_DIR', '/tmp/avito-page-cache'),
+    ttl=float(os.environ.get('AVITO_CACHE_TTL', '300')),
+    max_bytes=int(os.environ.get('AVITO_CACHE_MAX_MB', '64')) * 1024 * 1024,
+)
+
+# Лента старше AVITO_REFRESH_AFTER помечается устаревшей, снимок такой давности
+# перезагружается в пределах бюджета вызова
+AVITO_REFRESH_AFTER = float(os.environ.get('AVITO_REFRESH_AFTER', '900'))
+SNAPSHOTS = SnapshotStore(os.environ.get('AVITO_SNAPSHOT_PATH', '/tmp/avito-snapshot.json'))
+
+# После нескольких неудачных обходов подряд Avito не запрашивается, пока не пройдет пауза
+BREAKER = circuit.breaker(
+    'avito-sync',
+    consecutive_failures=int(os.environ.get('AVITO_BREAKER_FAILURES', '3')),
+    cooldown=float(os.environ.get('AVITO_BREAKER_COOLDOWN', '120')),
+)
+# Отдельные запросы страниц: медленный или падающий Avito отключается посреди обхода,
+# остальные страницы не ждут таймаута
+PAGE_BREAKER = circuit.breaker('avito', slow_call=8)
+# После обхода еще нужно записать выдачу в базу - на это оставляется запас
+AVITO_DEADLINE_RESERVE = float(os.environ.get('AVITO_DEADLINE_RESERVE', '5'))
+
+# Дозагрузка страниц объявлений: описание, работодатель, график
+AVITO_ENRICH_WORKERS = int(os.environ.get('AVITO_ENRICH_WORKERS', '4'))
+AVITO_ENRICH_MAX_PER_RUN = int(os.environ.get('AVITO_ENRICH_MAX_PER_RUN', '100'))
+DETAIL_CACHE = DetailCache(
+    os.environ.get('AVITO_DETAIL_CACHE_PATH', '/tmp/avito-details.json'),
+    max_entries=int(os.environ.get('AVITO_DETAIL_CACHE_MAX', '20000')),
+)
+
+CACHE_REQUESTS = metrics.counter('cache_requests_total', 'Обращения к кэшам', ('cache', 'result'))
+
+
+@metrics.on_scrape
+def _cache_metrics() -> None:
+    pages = PAGE_CACHE.stats()
+    CACHE_REQUESTS.set(pages['fresh_hits'], 'avito_page', 'hit')
+    CACHE_REQUESTS.set(pages['revalidated'], 'avito_page', 'revalidated')
+    CACHE_REQUESTS.set(pages['misses'], 'avito_page', 'miss')
+    details = DETAIL_CACHE.stats()
+    CACHE_REQUESTS.set(details['hits'], 'avito_details', 'hit')
+    CACHE_REQUESTS.set(details['misses'], 'avito_details', 'miss')
+
+# Заголовки, чтобы выглядеть как браузер
+REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8',
+}
+
+# Пространство имен для стабильных UUID вакансий Avito
+AVITO_NAMESPACE = uuid.UUID('6f1c1d52-5d7e-4a8e-9a39-1f0a8c2b7e41')
+
+
+def get_db_connection():
+    """Соединение из пула (conn.close() возвращает его в пул)"""
+    return db.connect()
+
+
+# Теги без закрывающего тега - не меняют глубину вложенности
+VOID_TAGS = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr'
+))
+
+# data-marker полей карточки -> ключ записи
+FIELD_MARKERS = (
+    ('item-title', 'title'),
+    ('item-price', 'salary'),
+    ('item-address', 'city'),
+)
 
 
 class AvitoParser(HTMLParser):
     """
-    Простой парсер HTML для извлечения данных вакансий с Avito
+    Потоковый парсер HTML для извлечения данных вакансий с Avito
+
+    Запись собирается по контейнеру карточки (data-marker="item") и фиксируется
+    при его закрытии; дубли отсекаются по множеству стабильных ключей, так что
+    разбор линеен по размеру страницы. Страницу можно подавать кусками через feed().
     """
     def __init__(self):
-        super().__init__()
+        super().__init__(convert_charrefs=True)
         self.vacancies: List[Dict[str, Any]] = []
+        self.seen_keys = set()
         self.current_vacancy: Dict[str, Any] = {}
-        self.in_title = False
-        self.in_price = False
-        self.in_location = False
-        
+        self.item_depth = 0
+        self.current_field = None
+
+    def _finish_vacancy(self):
+        if 'title' in self.current_vacancy:
+            key = external_id_for(self.current_vacancy)
+            if key not in self.seen_keys:
+                self.seen_keys.add(key)
+                self.vacancies.append(self.current_vacancy)
+        self.current_vacancy = {}
+        self.current_field = None
+
     def handle_starttag(self, tag: str, attrs: List[tuple]):
-        attrs_dict = dict(attrs)
-        
-        # Поиск заголовка вакансии
-        if 'data-marker' in attrs_dict and 'item-title' in attrs_dict.get('data-marker', ''):
-            self.in_title = True
-            
-        # Поиск зарплаты
-        if 'data-marker' in attrs_dict and 'item-price' in attrs_dict.get('data-marker', ''):
-            self.in_price = True
-            
-        # Поиск города
-        if 'data-marker' in attrs_dict and 'item-address' in attrs_dict.get('data-marker', ''):
-            self.in_location = True
-    
+        if self.item_depth and tag not in VOID_TAGS:
+            self.item_depth += 1
+
+        marker = None
+        item_id = None
+        href = None
+        for name, value in attrs:
+            if name == 'data-marker':
+                marker = value
+            elif name == 'data-item-id':
+                item_id = value
+            elif name == 'href':
+                href = value
+        if not marker:
+            return
+
+        # Начало карточки
+        if marker == 'item':
+            if self.item_depth:
+                self._finish_vacancy()
+            self.current_vacancy = {'external_id': item_id} if item_id else {}
+            self.item_depth = 1
+            return
+
+        for field_marker, field in FIELD_MARKERS:
+            if field_marker in marker:
+                # Разметка без контейнеров: новый заголовок начинает новую запись
+                if field == 'title' and not self.item_depth and 'title' in self.current_vacancy:
+                    self._finish_vacancy()
+                if field not in self.current_vacancy:
+                    self.current_field = field
+                # Ссылка заголовка ведет на страницу объявления
+                if field == 'title' and href and 'url' not in self.current_vacancy:
+                    self.current_vacancy['url'] = href
+                break
+
     def handle_data(self, data: str):
-        data = data.strip()
-        if not data:
+        if self.current_field is None:
             return
-            
-        if self.in_title:
-            self.current_vacancy['title'] = data
-            self.in_title = False
-            
-        if self.in_price:
-            self.current_vacancy['salary'] = data
-            self.in_price = False
-            
-        if self.in_location:
-            self.current_vacancy['city'] = data
-            self.in_location = False
-            
+        data = data.strip()
+        if data:
+            self.current_vacancy[self.current_field] = data
+            self.current_field = None
+
     def handle_endtag(self, tag: str):
-        if self.current_vacancy and 'title' in self.current_vacancy:
-            if self.current_vacancy not in self.vacancies:
-                self.vacancies.append(self.current_vacancy.copy())
-                self.current_vacancy = {}
+        if self.item_depth and tag not in VOID_TAGS:
+            self.item_depth -= 1
+            if not self.item_depth:
+                self._finish_vacancy()
 
+    def close(self):
+        super().close()
+        self._finish_vacancy()
+
+
+def external_id_for(raw: Dict[str, Any]) -> str:
+    """Стабильный id объявления: id Avito или хеш заголовка/зарплаты/города"""
+    if raw.get('external_id'):
+        return str(raw['external_id'])
+    key = '|'.join([raw.get('title', ''), raw.get('salary', ''), raw.get('city', '')])
+    return 'h' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+
+def to_jobsapp(raw: Dict[str, Any], vacancy_id: str) -> Dict[str, Any]:
+    """Преобразует распарсенную карточку в формат Jobs-App"""
+    return {
+        'id': vacancy_id,
+        'title': raw.get('title', 'Вакансия без названия'),
+        'description': raw.get('description') or "Вакансия с портала Avito. Подробности по телефону.",
+        'salary': raw.get('salary', 'Не указана'),
+        'city': raw.get('city', 'Киров'),
+        'phone': '+7 (833) 000-00-00',  # Номер телефона нужно парсить отдельно
+        'employerName': raw.get('employer') or 'Работодатель с Avito',
+        'employerTier': 'FREE',
+        'schedule': raw.get('schedule', ''),
+        'tags': ['Подработка'],
+        'status': 'published',
+        'source': 'avito'
+    }
+
+
+def content_hash(vacancy: Dict[str, Any]) -> str:
+    """Хеш содержимого вакансии - строка в БД обновляется только при его смене"""
+    fields = ('title', 'description', 'salary', 'city', 'phone', 'employerName', 'employerTier', 'schedule', 'tags')
+    payload = json.dumps([vacancy.get(f) for f in fields], ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def sync_vacancies(conn, raw_vacancies: List[Dict[str, Any]], close_missing: bool = True) -> Dict[str, int]:
+    """
+    Сохраняет объявления в vacancies (source = 'avito') одним пакетным upsert.
+    Строки с неизменившимся хешем не трогаются, пропавшие объявления закрываются
+    (если close_missing - каждый регион обойден до конца выдачи). Закрытое объявление,
+    вернувшееся в выдачу, публикуется снова; статус модерации не меняется.
+    """
+    rows = {}
+    for raw in raw_vacancies:
+        external_id = external_id_for(raw)
+        vacancy = to_jobsapp(raw, str(uuid.uuid5(AVITO_NAMESPACE, external_id)))
+        rows[external_id] = (
+            vacancy['id'], None, vacancy['title'], vacancy['description'], vacancy['salary'],
+            vacancy['city'], vacancy['phone'], vacancy['employerName'], vacancy['employerTier'],
+            vacancy['schedule'], vacancy['tags'], 'published', 'avito', external_id, content_hash(vacancy)
+        )
+
+    with conn.cursor() as cur:
+        changed = execute_values(cur, """
+            INSERT INTO vacancies (
+                id, user_id, title, description, salary, city, phone,
+                employer_name, employer_tier, schedule, tags, status, source, external_id, content_hash
+            ) VALUES %s
+            ON CONFLICT (source, external_id) DO UPDATE SET
+                title = EXCLUDED.title,
+                description = EXCLUDED.description,
+                salary = EXCLUDED.salary,
+                city = EXCLUDED.city,
+                phone = EXCLUDED.phone,
+                employer_name = EXCLUDED.employer_name,
+                employer_tier = EXCLUDED.employer_tier,
+                schedule = EXCLUDED.schedule,
+                tags = EXCLUDED.tags,
+                -- Вернувшееся объявление снова публикуется; решение модерации
+                -- (rejected, pending) синхронизация не отменяет
+                status = CASE WHEN vacancies.status = 'closed' THEN 'published' ELSE vacancies.status END,
+                content_hash = EXCLUDED.content_hash,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE vacancies.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+               OR vacancies.status = 'closed'
+            RETURNING (xmax = 0) AS inserted, id, title, description
+        """, list(rows.values()), page_size=500, fetch=True)
+        inserted = sum(1 for r in changed if r[0])
+        
+        # Новые и изменившиеся объявления - в индекс почти-дубликатов
+        duplicates = dedup.index_vacancies(conn, [r[1:] for r in changed])
 
+        closed = 0
+        if rows and close_missing:
+            cur.execute("""
+                UPDATE vacancies SET status = 'closed', updated_at = CURRENT_TIMESTAMP
+                WHERE source = 'avito'
+                AND status = 'published'
+                AND external_id <> ALL(%s)
+            """, (list(rows.keys()),))
+            closed = cur.rowcount
+
+        stats = {
+            'seen': len(rows),
+            'inserted': inserted,
+            'updated': len(changed) - inserted,
+            'unchanged': len(rows) - len(changed),
+            'closed': closed,
+            'duplicates': sum(1 for root in duplicates.values() if root)
+        }
+        # Время удачной синхронизации - возраст данных в ленте
+        cur.execute("""
+            INSERT INTO avito_sync_runs (seen, inserted, updated, closed)
+            VALUES (%s, %s, %s, %s)
+        """, (stats['seen'], stats['inserted'], stats['updated'], stats['closed']))
+
+    conn.commit()
+    return stats
+
+
+def crawl_and_sync(conn) -> Tuple[int, Dict[str, Any]]:
+    """Обходит Avito и сохраняет выдачу; исход учитывается в circuit breaker"""
+    raw_vacancies, crawl = make_crawler().crawl(AVITO_REGIONS)
+    if not raw_vacancies:
+        # Пустая выдача скорее поломка парсинга, чем пустой рынок - ничего не закрываем
+        BREAKER.record_failure()
+        return 502, {'error': 'Avito недоступен или вернул пустую выдачу', 'crawl': crawl}
+    BREAKER.record_success()
+    enrichment = make_enricher().enrich(raw_vacancies)
+    # Пропавшие объявления закрываются, только если каждый регион дошел до конца выдачи
+    stats = sync_vacancies(conn, raw_vacancies, close_missing=crawl['complete'])
+    return 200, {'success': True, 'source': 'avito', 'sync': stats, 'crawl': crawl, 'enrichment': enrichment}
+
+
+def get_data_age(conn) -> Optional[float]:
+    """Секунды с последней удачной синхронизации или None, если ее не было"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - MAX(finished_at)))
+            FROM avito_sync_runs
+        """)
+        age = cur.fetchone()[0]
+    return max(0.0, float(age)) if age is not None else None
+
+
+def get_feed(conn, page: int, limit: int) -> List[Dict[str, Any]]:
+    """Лента вакансий Avito из базы"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT id, title, description, salary, city, phone, employer_name,
+                   employer_tier, schedule, tags, status, source
+            FROM vacancies v
+            WHERE source = 'avito' AND status = 'published'
+            AND NOT EXISTS (
+                -- Дубликат опубликованной вакансии (ручной или другого объявления)
+                SELECT 1 FROM vacancies r
+                WHERE r.id = v.duplicate_of AND r.status = 'published'
+            )
+            ORDER BY updated_at DESC, id
+            LIMIT %s OFFSET %s
+        """, (limit, (page - 1) * limit))
+        return [{
+            'id': str(v['id']),
+            'title': v['title'],
+            'description': v['description'],
+            'salary': v['salary'],
+            'city': v['city'],
+            'phone': v['phone'],
+            'employerName': v['employer_name'],
+            'employerTier': v['employer_tier'],
+            'schedule': v['schedule'] or '',
+            'tags': v['tags'] or [],
+            'status': v['status'],
+            'source': v['source']
+        } for v in cur.fetchall()]
+
+
+def avito_page_url(region: str, page: int) -> str:
+    """URL страницы выдачи вакансий региона"""
+    url = f'{AVITO_BASE_URL}/{region}/vakansii'
+    return f'{url}?p={page}' if page > 1 else url
+
+
+def parse_vacancies(chunks: Iterable[bytes]) -> List[Dict[str, Any]]:
+    """Парсит страницу по мере поступления кусков тела"""
+    parser = AvitoParser()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk))
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    return parser.vacancies
+
+
+def fetch_avito_vacancies(region: str, page: int = 1) -> List[Dict[str, Any]]:
+    """Загружает и парсит одну страницу вакансий Avito (через кэш страниц)"""
+    listings, report = make_crawler().fetch_page(region, page)
+    if 'error' in report:
+        raise http_client.HttpError(report['error'], status=report['status'])
+    return listings
+
+
+def refresh_snapshot(region: str, page: int) -> List[Dict[str, Any]]:
+    """Загружает страницу в снимок; исход учитывается в circuit breaker"""
+    try:
+        raw_vacancies = fetch_avito_vacancies(region, page)
+        if not raw_vacancies:
+            raise http_client.HttpError('Avito вернул пустую выдачу')
+    except Exception:
+        BREAKER.record_failure()
+        raise
+    BREAKER.record_success()
+    make_enricher().enrich(raw_vacancies)
+    SNAPSHOTS.put(f'{region}:{page}', raw_vacancies)
+    return raw_vacancies
+
+
+def detail_url(raw: Dict[str, Any]) -> Optional[str]:
+    """Абсолютный URL страницы объявления из ссылки в карточке"""
+    href = raw.get('url')
+    if not href:
+        return None
+    return href if href.startswith('http') else f'{AVITO_BASE_URL}{href}'
+
+
+def make_enricher() -> Enricher:
+    return Enricher(
+        detail_url=detail_url,
+        key=external_id_for,
+        cache=DETAIL_CACHE,
+        headers=REQUEST_HEADERS,
+        workers=AVITO_ENRICH_WORKERS,
+        max_fetches=AVITO_ENRICH_MAX_PER_RUN,
+        rate_limiter=RATE_LIMITER,
+        breaker=PAGE_BREAKER,
+    )
+
+
+def make_crawler() -> Crawler:
+    return Crawler(
+        page_url=avito_page_url,
+        parse=parse_vacancies,
+        key=external_id_for,
+        headers=REQUEST_HEADERS,
+        max_pages=AVITO_MAX_PAGES,
+        concurrency=AVITO_CONCURRENCY,
+        rate_limiter=RATE_LIMITER,
+        cache=PAGE_CACHE,
+        breaker=PAGE_BREAKER,
+    )
+
+
+def json_response(status_code: int, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(payload),
+        'isBase64Encoded': False
+    }
+
+
+@metrics.instrument(metrics.param_route('mode', ('feed', 'sync'), default='feed'))
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Синхронизирует вакансии с Avito (Кировская область)
     Возвращает список вакансий в формате Jobs-App
     
+    Режимы (?mode=):
+        feed (по умолчанию) - лента из таблицы vacancies
+        sync - загрузить Avito и сохранить изменения в vacancies
+    GET ?path=metrics - метрики в формате Prometheus
+    Лента из базы отдается сразу, даже устаревшая (stale; dataAge - возраст в секундах):
+    обновляет ее только mode=sync по расписанию.
+    Без DATABASE_URL отдается снимок последней удачной загрузки страницы. Устаревший
+    снимок перезагружается в пределах бюджета вызова, при ошибке отдается прежний.
+    
     Args:
         event: HTTP событие с параметрами запроса
         context: контекст выполнения функции
@@ -69,6 +458,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     Returns:
         JSON с массивом вакансий или ошибкой
     """
+    circuit.start(context, reserve=AVITO_DEADLINE_RESERVE)
     method: str = event.get('httpMethod', 'GET')
     
     # CORS preflight
@@ -97,348 +487,84 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        # Параметры для запроса к Avito
-        params = event.get('queryStringParameters', {})
-        page = int(params.get('page', '1'))
-        limit = int(params.get('limit', '20'))
-        
-        # URL Avito для вакансий Кировской области
-        avito_url = 'https://www.avito.ru/kirovskaya_oblast/vakansii'
-        
-        # Добавляем заголовки, чтобы выглядеть как браузер
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8',
-            'Accept-Encoding': 'gzip, deflate',
-            'Connection': 'keep-alive',
-        }
+        params = event.get('queryStringParameters') or {}
+        page = max(1, int(params.get('page', '1')))
+        limit = min(100, max(1, int(params.get('limit', '20'))))
+        mode = params.get('mode', 'feed')
         
-        # Выполняем запрос
-        req = urllib.request.Request(avito_url, headers=headers)
-        
-        try:
-            with urllib.request.urlopen(req, timeout=10) as response:
-                html_content = response.read().decode('utf-8')
-        except Exception as fetch_error:
-            # Если не удалось получить реальные данные, вернем моковые вакансии
-            mock_vacancies = [
-                {
-                    'id': 'avito_mock_1',
-                    'title': 'Продавец-консультант',
-                    'description': 'Требуется активный продавец в магазин электроники. График 2/2, полный день. Обучение на месте.',
-                    'salary': '35 000 - 50 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 123-45-67',
-                    'employerName': 'Магазин "Электроника"',
-                    'employerTier': 'FREE',
-                    'tags': ['С опытом', 'Для студентов'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_2',
-                    'title': 'Водитель категории B',
-                    'description': 'Требуется водитель для доставки товаров по городу. Автомобиль предоставляется. Топливо за счет компании.',
-                    'salary': 'от 40 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 987-65-43',
-                    'employerName': 'Служба доставки "Быстро"',
-                    'employerTier': 'ECONOM',
-                    'tags': ['С опытом', 'Ежедневная оплата'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_3',
-                    'title': 'Уборщик производственных помещений',
-                    'description': 'Уборка производственных и складских помещений. График сменный 2/2.',
-                    'salary': '30 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 555-44-33',
-                    'employerName': 'Завод "Кировский"',
-                    'employerTier': 'FREE',
-                    'tags': ['Без опыта', 'Вахтовый метод'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_4',
-                    'title': 'Кассир',
-                    'description': 'В продуктовый магазин требуется кассир. График сменный. Дружный коллектив.',
-                    'salary': '28 000 - 35 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 234-56-78',
-                    'employerName': 'Супермаркет "Продукты"',
-                    'employerTier': 'FREE',
-                    'tags': ['Без опыта', 'Для студентов'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_5',
-                    'title': 'Официант',
-                    'description': 'В ресторан требуется официант. Гибкий график, чаевые. Питание за счет заведения.',
-                    'salary': 'от 32 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 345-67-89',
-                    'employerName': 'Ресторан "Вкусно"',
-                    'employerTier': 'FREE',
-                    'tags': ['Подработка', 'Для студентов'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_6',
-                    'title': 'Комплектовщик на склад',
-                    'description': 'Требуется комплектовщик на крупный склад. Вахта 15/15. Проживание предоставляется.',
-                    'salary': '45 000 - 60 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 456-78-90',
-                    'employerName': 'Логистический центр "Склад+"',
-                    'employerTier': 'ECONOM',
-                    'tags': ['Вахтовый метод', 'Без опыта'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_7',
-                    'title': 'Охранник',
-                    'description': 'Требуется охранник на торговый объект. Сутки через трое. Лицензия обязательна.',
-                    'salary': '38 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 567-89-01',
-                    'employerName': 'ЧОП "Защита"',
-                    'employerTier': 'FREE',
-                    'tags': ['С опытом'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_8',
-                    'title': 'Грузчик',
-                    'description': 'Требуются грузчики на погрузочно-разгрузочные работы. График сменный. Выплаты еженедельно.',
-                    'salary': '35 000 - 45 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 678-90-12',
-                    'employerName': 'Склад "Логистика"',
-                    'employerTier': 'FREE',
-                    'tags': ['Без опыта', 'Ежедневная оплата'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_9',
-                    'title': 'Менеджер по продажам',
-                    'description': 'В динамично развивающуюся компанию требуется менеджер. Активные продажи, работа с клиентами.',
-                    'salary': '40 000 - 80 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 789-01-23',
-                    'employerName': 'ООО "Бизнес Решения"',
-                    'employerTier': 'VIP',
-                    'tags': ['С опытом'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_10',
-                    'title': 'Оператор call-центра',
-                    'description': 'Требуется оператор для входящих звонков. Удаленная работа возможна. Обучение предоставляется.',
-                    'salary': '30 000 - 40 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 890-12-34',
-                    'employerName': 'Call-центр "Связь"',
-                    'employerTier': 'FREE',
-                    'tags': ['Без опыта', 'Для студентов'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_11',
-                    'title': 'Курьер',
-                    'description': 'Требуется курьер для доставки еды. Гибкий график, ежедневные выплаты.',
-                    'salary': 'от 45 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 901-23-45',
-                    'employerName': 'Доставка еды "Быстро"',
-                    'employerTier': 'ECONOM',
-                    'tags': ['Подработка', 'Ежедневная оплата'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_12',
-                    'title': 'Слесарь-сантехник',
-                    'description': 'В управляющую компанию требуется слесарь-сантехник. Полный рабочий день.',
-                    'salary': '40 000 - 50 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 012-34-56',
-                    'employerName': 'УК "Наш дом"',
-                    'employerTier': 'FREE',
-                    'tags': ['С опытом'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_13',
-                    'title': 'Повар',
-                    'description': 'В кафе требуется повар. График 2/2. Питание за счет заведения.',
-                    'salary': '35 000 - 45 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 123-45-78',
-                    'employerName': 'Кафе "Уют"',
-                    'employerTier': 'FREE',
-                    'tags': ['С опытом'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_14',
-                    'title': 'Администратор',
-                    'description': 'В фитнес-клуб требуется администратор. График сменный. Бесплатный абонемент.',
-                    'salary': '32 000 - 38 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 234-56-89',
-                    'employerName': 'Фитнес-клуб "Спорт"',
-                    'employerTier': 'FREE',
-                    'tags': ['Без опыта', 'Для студентов'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_15',
-                    'title': 'Электромонтер',
-                    'description': 'Требуется электромонтер на производство. Полный рабочий день. Соцпакет.',
-                    'salary': '45 000 - 55 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 345-67-90',
-                    'employerName': 'Завод "Промышленник"',
-                    'employerTier': 'ECONOM',
-                    'tags': ['С опытом'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_16',
-                    'title': 'Бармен',
-                    'description': 'В бар требуется бармен. Гибкий график, чаевые. Обучение предоставляется.',
-                    'salary': 'от 35 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 456-78-01',
-                    'employerName': 'Бар "Cocktail"',
-                    'employerTier': 'FREE',
-                    'tags': ['Без опыта', 'Подработка'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_17',
-                    'title': 'Мерчендайзер',
-                    'description': 'Требуется мерчендайзер для работы в торговых точках. Разъездной характер работы.',
-                    'salary': '30 000 - 40 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 567-89-12',
-                    'employerName': 'Компания "Дистрибуция"',
-                    'employerTier': 'FREE',
-                    'tags': ['Без опыта'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_18',
-                    'title': 'Кладовщик',
-                    'description': 'На склад требуется кладовщик. Работа с документами, приемка товара.',
-                    'salary': '35 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 678-90-23',
-                    'employerName': 'Склад "Товары"',
-                    'employerTier': 'FREE',
-                    'tags': ['С опытом'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_19',
-                    'title': 'Промоутер',
-                    'description': 'Требуются промоутеры для раздачи листовок. Гибкий график, подработка.',
-                    'salary': '1 500 ₽ за смену',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 789-01-34',
-                    'employerName': 'Рекламное агентство "Промо"',
-                    'employerTier': 'FREE',
-                    'tags': ['Без опыта', 'Подработка', 'Для студентов'],
-                    'status': 'published',
-                    'source': 'avito'
-                },
-                {
-                    'id': 'avito_mock_20',
-                    'title': 'Токарь',
-                    'description': 'Требуется токарь на производство. Полный рабочий день. Соцпакет, премии.',
-                    'salary': '50 000 - 65 000 ₽',
-                    'city': 'Киров',
-                    'phone': '+7 (833) 890-12-45',
-                    'employerName': 'Машиностроительный завод',
-                    'employerTier': 'VIP',
-                    'tags': ['С опытом'],
-                    'status': 'published',
-                    'source': 'avito'
-                }
-            ]
+        if os.environ.get('DATABASE_URL'):
+            if mode == 'sync':
+                if not BREAKER.allow():
+                    return json_response(503, {
+                        'error': 'Avito временно не запрашивается после серии ошибок',
+                        'retryAfter': BREAKER.retry_after()
+                    })
+                conn = get_db_connection()
+                try:
+                    status, result = crawl_and_sync(conn)
+                finally:
+                    conn.close()
+                return json_response(status, result)
+            
+            conn = get_db_connection()
+            try:
+                vacancies = get_feed(conn, page, limit)
+                data_age = get_data_age(conn)
+            finally:
+                conn.close()
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'success': True,
-                    'source': 'mock',
-                    'message': 'Avito недоступен, используются тестовые данные',
-                    'vacancies': mock_vacancies,
-                    'total': len(mock_vacancies),
-                    'page': page
-                }),
-                'isBase64Encoded': False
-            }
+            # Обновление в фоне не годится: после ответа платформа замораживает инстанс,
+            # а поток без бюджета вызова пересекается со следующими вызовами
+            return json_response(200, {
+                'success': True,
+                'source': 'database',
+                'vacancies': vacancies,
+                'total': len(vacancies),
+                'page': page,
+                'dataAge': round(data_age) if data_age is not None else None,
+                'stale': data_age is None or data_age > AVITO_REFRESH_AFTER,
+                'upstream': BREAKER.state()
+            })
         
-        # Парсим HTML
-        parser = AvitoParser()
-        parser.feed(html_content)
+        # Без базы - снимок последней удачной выдачи страницы
+        region = AVITO_REGIONS[0]
+        key = f'{region}:{page}'
+        snapshot = SNAPSHOTS.get(key)
+        error = None
+        if (snapshot is None or snapshot[0] > AVITO_REFRESH_AFTER) and BREAKER.allow():
+            try:
+                snapshot = 0.0, refresh_snapshot(region, page)
+            except Exception as e:
+                error = str(e)
+        if snapshot is None:
+            if error is None:
+                return json_response(503, {
+                    'error': 'Avito временно недоступен',
+                    'retryAfter': BREAKER.retry_after()
+                })
+            return json_response(503, {
+                'error': 'Avito недоступен',
+                'message': error,
+                'retryAfter': BREAKER.retry_after()
+            })
+        data_age, raw_vacancies = snapshot
         
         # Преобразуем в формат JobsApp
-        vacancies = []
-        for idx, raw_vacancy in enumerate(parser.vacancies[:limit], start=1):
-            vacancy = {
-                'id': f'avito_{page}_{idx}',
-                'title': raw_vacancy.get('title', 'Вакансия без названия'),
-                'description': f"Вакансия с портала Avito. Подробности по телефону.",
-                'salary': raw_vacancy.get('salary', 'Не указана'),
-                'city': raw_vacancy.get('city', 'Киров'),
-                'phone': '+7 (833) 000-00-00',  # Номер телефона нужно парсить отдельно
-                'employerName': 'Работодатель с Avito',
-                'employerTier': 'FREE',
-                'tags': ['Подработка'],
-                'status': 'published',
-                'source': 'avito'
-            }
-            vacancies.append(vacancy)
+        vacancies = [
+            to_jobsapp(raw, f'avito_{external_id_for(raw)}')
+            for raw in raw_vacancies[:limit]
+        ]
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'success': True,
-                'source': 'avito',
-                'vacancies': vacancies,
-                'total': len(vacancies),
-                'page': page
-            }),
-            'isBase64Encoded': False
-        }
+        return json_response(200, {
+            'success': True,
+            'source': 'avito',
+            'vacancies': vacancies,
+            'total': len(vacancies),
+            'page': page,
+            'dataAge': round(data_age),
+            'stale': data_age > AVITO_REFRESH_AFTER,
+            'upstream': BREAKER.state()
+        })
         
     except Exception as e:
         return {
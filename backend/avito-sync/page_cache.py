@@ -0,0 +1,180 @@
+"""
+Дисковый кэш страниц выдачи Avito для условных запросов
+Результат разбора хранится по sha1 тела страницы, индекс url -> валидаторы, TTL и время
+последнего использования; при превышении лимита размера вытесняются давно не использованные
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class PageCache:
+    """
+    Кэш url -> разобранные объявления с ETag/Last-Modified для повторной проверки
+
+    Пока запись моложе ttl, страница отдается без сети; после - запрашивается
+    с If-None-Match/If-Modified-Since, и на 304 берется готовый разбор.
+    Файлы лежат в /tmp и переживают теплые вызовы инстанса.
+    """
+
+    def __init__(self, root: str, ttl: float, max_bytes: int):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._blobs = os.path.join(root, 'blobs')
+        self._index_path = os.path.join(root, 'index.json')
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._counters = {
+            'fresh_hits': 0,
+            'revalidated': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'errors': 0,
+            'bytes_downloaded': 0,
+            'bytes_saved': 0,
+        }
+        self._load_index()
+
+    def _load_index(self) -> None:
+        try:
+            os.makedirs(self._blobs, exist_ok=True)
+            with open(self._index_path, encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            # Битый индекс - начинаем с пустого кэша, старые файлы уйдут при вытеснении
+            self._counters['errors'] += 1
+            self._entries = {}
+
+    def _blob_path(self, sha: str) -> str:
+        return os.path.join(self._blobs, f'{sha}.json')
+
+    def _save_index(self) -> None:
+        tmp_path = f'{self._index_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self._index_path)
+
+    def lookup(self, url: str) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """Запись и разобранные объявления страницы или None"""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            try:
+                with open(self._blob_path(entry['sha']), encoding='utf-8') as f:
+                    listings = json.load(f)
+            except (OSError, ValueError):
+                self._entries.pop(url, None)
+                return None
+            entry['used_at'] = time.time()
+            return dict(entry), listings
+
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry['fetched_at'] < self.ttl
+
+    @staticmethod
+    def conditional_headers(entry: Dict[str, Any]) -> Dict[str, str]:
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def record_fresh_hit(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._counters['fresh_hits'] += 1
+            self._counters['bytes_saved'] += entry['wire_bytes']
+
+    def record_miss(self, wire_bytes: int) -> None:
+        with self._lock:
+            self._counters['misses'] += 1
+            self._counters['bytes_downloaded'] += wire_bytes
+
+    def revalidated(self, url: str, headers: Dict[str, str]) -> None:
+        """Сервер ответил 304: продлеваем свежесть записи"""
+        with self._lock:
+            self._counters['revalidated'] += 1
+            entry = self._entries.get(url)
+            if entry is None:
+                return
+            self._counters['bytes_saved'] += entry['wire_bytes']
+            now = time.time()
+            entry['fetched_at'] = now
+            entry['used_at'] = now
+            entry['etag'] = headers.get('etag') or entry.get('etag')
+            entry['last_modified'] = headers.get('last-modified') or entry.get('last_modified')
+            self._persist()
+
+    def store(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        sha: str,
+        wire_bytes: int,
+        listings: List[Dict[str, Any]],
+    ) -> None:
+        """Сохраняет разбор страницы по хэшу тела; одинаковые тела делят один файл"""
+        with self._lock:
+            try:
+                blob_path = self._blob_path(sha)
+                if not os.path.exists(blob_path):
+                    tmp_path = f'{blob_path}.{os.getpid()}.tmp'
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        json.dump(listings, f, ensure_ascii=False)
+                    os.replace(tmp_path, blob_path)
+                now = time.time()
+                self._entries[url] = {
+                    'sha': sha,
+                    'size': os.path.getsize(blob_path),
+                    'wire_bytes': wire_bytes,
+                    'etag': headers.get('etag'),
+                    'last_modified': headers.get('last-modified'),
+                    'fetched_at': now,
+                    'used_at': now,
+                }
+                self._counters['stores'] += 1
+                self._evict()
+            except OSError:
+                self._counters['errors'] += 1
+                return
+            self._persist()
+
+    def _evict(self) -> None:
+        """LRU-вытеснение до max_bytes (размер считается по уникальным файлам)"""
+        sizes = {entry['sha']: entry['size'] for entry in self._entries.values()}
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+        for url, entry in sorted(self._entries.items(), key=lambda item: item[1]['used_at']):
+            if total <= self.max_bytes:
+                break
+            del self._entries[url]
+            self._counters['evictions'] += 1
+            sha = entry['sha']
+            if any(other['sha'] == sha for other in self._entries.values()):
+                continue
+            total -= sizes[sha]
+            try:
+                os.remove(self._blob_path(sha))
+            except FileNotFoundError:
+                pass
+
+    def _persist(self) -> None:
+        try:
+            self._save_index()
+        except OSError:
+            self._counters['errors'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            stats['bytes_stored'] = sum({e['sha']: e['size'] for e in self._entries.values()}.values())
+            return stats
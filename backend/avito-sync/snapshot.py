@@ -0,0 +1,49 @@
+"""
+Последняя удачная выдача Avito для режима без базы
+Снимки в JSON-файле; breaker апстрима - circuit.py
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class SnapshotStore:
+    """Последняя удачная выдача по ключу; файл в /tmp переживает теплые вызовы"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._snapshots: Optional[Dict[str, Dict[str, Any]]] = None
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._snapshots is None:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self._snapshots = json.load(f)
+            except (OSError, ValueError):
+                self._snapshots = {}
+        return self._snapshots
+
+    def get(self, key: str) -> Optional[Tuple[float, List[Dict[str, Any]]]]:
+        """(возраст в секундах, объявления) или None"""
+        with self._lock:
+            snapshot = self._load().get(key)
+            if snapshot is None:
+                return None
+            return max(0.0, time.time() - snapshot['fetched_at']), snapshot['vacancies']
+
+    def put(self, key: str, vacancies: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            snapshots = self._load()
+            snapshots[key] = {'fetched_at': time.time(), 'vacancies': vacancies}
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(snapshots, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                # Снимок остается в памяти инстанса
+                pass
+
@@ -0,0 +1,201 @@
+"""
+Входящие уведомления Robokassa: запись сразу, проведение - пачками
+Уведомление с верной подписью записывается в robokassa_inbox (повтор того же InvId
+ничего не добавляет). drain забирает пачку SKIP LOCKED, переводит заказы в paid и
+зачисляет суммы в журнал баланса одним запросом. Заказ, сумма которого не совпадает
+с OutSum уведомления, не оплачивается: запись закрывается с исходом amount_mismatch.
+При ошибке пачка откладывается с экспоненциальной задержкой, а ее записи проводятся
+по одной, чтобы одна сбойная не держала остальные. Если заказы заблокированы дольше
+lock_timeout, пачка остается в очереди без попытки и ждет следующего прохода.
+"""
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import psycopg2.errors
+
+import db
+import metrics
+
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 3600
+
+OUTCOMES = ('paid', 'duplicate', 'not_found', 'amount_mismatch')
+
+PROCESSED = metrics.counter(
+    'robokassa_inbox_processed_total',
+    'Проведенные уведомления (paid, duplicate, not_found, amount_mismatch, failed)', ('outcome',))
+
+RECORD = db.statement('inbox_record', """
+    INSERT INTO robokassa_inbox (inv_id, out_sum)
+    VALUES (%s, %s)
+    ON CONFLICT (inv_id) DO NOTHING
+""")
+
+CLAIM = db.statement('inbox_claim', """
+    SELECT inv_id FROM robokassa_inbox
+    WHERE processed_at IS NULL AND next_attempt_at <= NOW()
+    ORDER BY next_attempt_at
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+""")
+
+# Заказы pending -> paid, зачисление владельцам и отметка об обработке - одним запросом.
+# Истекший заказ (expired) оплачивается так же; уже оплаченный не проходит условие на статус
+# и второй раз не зачисляется. Заказ оплачивается, только если его сумма равна OutSum
+# из уведомления; иначе запись закрывается как amount_mismatch с обеими суммами в last_error.
+APPLY = db.statement('inbox_apply', """
+    WITH batch AS (
+        SELECT inv_id, out_sum FROM robokassa_inbox
+        WHERE inv_id = ANY(%(ids)s) AND processed_at IS NULL
+    ), paid AS (
+        UPDATE orders o
+        SET status = 'paid', paid_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        FROM batch b
+        WHERE o.robokassa_inv_id = b.inv_id AND o.status IN ('pending', 'expired') AND o.amount = b.out_sum
+        RETURNING o.robokassa_inv_id, o.order_number, o.user_id, o.amount
+    ), credited AS (
+        INSERT INTO balance_ledger (user_id, amount, source, reference)
+        SELECT u.id, p.amount, 'robokassa', p.order_number
+        FROM paid p
+        JOIN users u ON u.id = CASE
+            WHEN p.user_id ~* '^[0-9a-f]{8}-([0-9a-f]{4}-){3}[0-9a-f]{12}$' THEN p.user_id::uuid
+        END
+        RETURNING 1
+    ), done AS (
+        UPDATE robokassa_inbox i
+        SET processed_at = NOW(),
+            attempts = i.attempts + 1,
+            outcome = CASE
+                WHEN p.robokassa_inv_id IS NOT NULL THEN 'paid'
+                WHEN o.id IS NULL THEN 'not_found'
+                WHEN o.status IN ('pending', 'expired') AND o.amount <> b.out_sum THEN 'amount_mismatch'
+                ELSE 'duplicate'
+            END,
+            last_error = CASE
+                WHEN p.robokassa_inv_id IS NULL AND o.status IN ('pending', 'expired') AND o.amount <> b.out_sum
+                THEN 'OutSum ' || b.out_sum || ' != order amount ' || o.amount
+            END
+        FROM batch b
+        LEFT JOIN paid p ON p.robokassa_inv_id = b.inv_id
+        LEFT JOIN orders o ON o.robokassa_inv_id = b.inv_id
+        WHERE i.inv_id = b.inv_id
+        RETURNING i.inv_id, i.outcome, i.last_error
+    )
+    SELECT
+        (SELECT COUNT(*) FROM done WHERE outcome = 'paid') AS paid,
+        (SELECT COUNT(*) FROM done WHERE outcome = 'duplicate') AS duplicate,
+        (SELECT COUNT(*) FROM done WHERE outcome = 'not_found') AS not_found,
+        (SELECT COUNT(*) FROM done WHERE outcome = 'amount_mismatch') AS amount_mismatch,
+        (SELECT COUNT(*) FROM credited) AS credited,
+        (SELECT array_agg(inv_id::text || ': ' || last_error) FROM done WHERE outcome = 'amount_mismatch') AS mismatches
+""")
+
+FAIL = db.statement('inbox_fail', """
+    UPDATE robokassa_inbox
+    SET attempts = attempts + 1,
+        last_error = %s,
+        next_attempt_at = NOW() + LEAST(%s * power(2, attempts), %s) * INTERVAL '1 second'
+    WHERE inv_id = ANY(%s) AND processed_at IS NULL
+""")
+
+
+def record(conn, inv_id: int, out_sum: str) -> None:
+    """Записывает уведомление; соединение в autocommit"""
+    with conn.cursor() as cur:
+        db.execute(cur, RECORD, (inv_id, out_sum))
+
+
+def _apply(conn, ids: List[int], lock_timeout: Optional[float] = None) -> Dict[str, int]:
+    with conn.cursor() as cur:
+        if lock_timeout is not None:
+            # Только на эту транзакцию: соединение вернется в пул без настройки
+            cur.execute("SELECT set_config('lock_timeout', %s, true)", (f'{max(int(lock_timeout * 1000), 1)}ms',))
+        db.execute(cur, APPLY, {'ids': ids})
+        paid, duplicate, not_found, amount_mismatch, credited, mismatches = cur.fetchone()
+    conn.commit()
+    for mismatch in mismatches or ():
+        print(f'[inbox] InvId {mismatch}, not credited')
+    return {'paid': paid, 'duplicate': duplicate, 'not_found': not_found,
+            'amount_mismatch': amount_mismatch, 'credited': credited}
+
+
+def _fail(conn, ids: List[int], error: Exception) -> None:
+    with conn.cursor() as cur:
+        db.execute(cur, FAIL, (str(error)[:500], RETRY_BASE_SECONDS, RETRY_MAX_SECONDS, ids))
+    conn.commit()
+
+
+def drain_batch(conn, batch_size: int, lock_timeout: Optional[float] = None) -> Dict[str, int]:
+    """
+    Обрабатывает одну пачку; возвращает счетчики (claimed = 0 - очередь пуста).
+    deferred - пачка не дождалась блокировки заказов и осталась в очереди как была.
+    """
+    stats = {'claimed': 0, **{outcome: 0 for outcome in OUTCOMES}, 'credited': 0, 'failed': 0, 'deferred': 0}
+    with conn.cursor() as cur:
+        db.execute(cur, CLAIM, (batch_size,))
+        ids = [row[0] for row in cur.fetchall()]
+    stats['claimed'] = len(ids)
+    if not ids:
+        conn.rollback()
+        return stats
+    try:
+        result = _apply(conn, ids, lock_timeout)
+    except psycopg2.errors.LockNotAvailable:
+        conn.rollback()
+        stats['deferred'] = len(ids)
+        return stats
+    except Exception as e:
+        conn.rollback()
+        if len(ids) == 1:
+            print(f'[inbox] InvId {ids[0]} failed: {e}')
+            _fail(conn, ids, e)
+            stats['failed'] = 1
+            return stats
+        # Пачка целиком не прошла: записи по одной, сбойные откладываются
+        result = {**{outcome: 0 for outcome in OUTCOMES}, 'credited': 0}
+        for position, inv_id in enumerate(ids):
+            try:
+                for key, value in _apply(conn, [inv_id], lock_timeout).items():
+                    result[key] += value
+            except psycopg2.errors.LockNotAvailable:
+                conn.rollback()
+                stats['deferred'] = len(ids) - position
+                break
+            except Exception as item_error:
+                conn.rollback()
+                print(f'[inbox] InvId {inv_id} failed: {item_error}')
+                _fail(conn, [inv_id], item_error)
+                stats['failed'] += 1
+    for key, value in result.items():
+        stats[key] += value
+    return stats
+
+
+def drain(connect: Callable[[], Any], batch_size: int, time_budget: float,
+          lock_timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Обрабатывает пачки, пока очередь не опустеет или не выйдет время.
+    lock_timeout (секунды) ограничивает ожидание блокировок заказов в одной пачке;
+    без него пачка ждет, сколько потребуется.
+    """
+    started = time.monotonic()
+    totals = {'batches': 0, 'claimed': 0, **{outcome: 0 for outcome in OUTCOMES},
+              'credited': 0, 'failed': 0, 'deferred': 0}
+    conn = connect()
+    try:
+        while time.monotonic() - started < time_budget:
+            stats = drain_batch(conn, batch_size, lock_timeout)
+            if not stats['claimed']:
+                break
+            totals['batches'] += 1
+            for key, value in stats.items():
+                totals[key] += value
+            if stats['failed'] + stats['deferred'] == stats['claimed']:
+                break
+    finally:
+        conn.close()
+        for outcome in OUTCOMES + ('failed',):
+            if totals[outcome]:
+                PROCESSED.inc(outcome, amount=totals[outcome])
+    totals['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+    return totals
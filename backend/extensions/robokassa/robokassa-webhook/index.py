@@ -1,8 +1,11 @@
 import json
 import os
 import hashlib
-import psycopg2
+import hmac
+import db
 from urllib.parse import parse_qs
+import inbox
+import metrics
 
 
 def calculate_signature(*args) -> str:
@@ -11,10 +14,40 @@ def calculate_signature(*args) -> str:
 
 
 def get_db_connection():
-    dsn = os.environ.get('DATABASE_URL')
-    if not dsn:
-        raise ValueError('DATABASE_URL not configured')
-    return psycopg2.connect(dsn)
+    return db.connect()
+
+
+INBOX_BATCH_SIZE = int(os.environ.get('ROBOKASSA_INBOX_BATCH_SIZE', '100'))
+# Проход ?drain=1 по расписанию
+INBOX_TIME_BUDGET = float(os.environ.get('ROBOKASSA_INBOX_TIME_BUDGET', '20'))
+# Проведение в том же вызове, что и запись уведомления, до ответа Robokassa
+INBOX_INLINE_BUDGET = float(os.environ.get('ROBOKASSA_INBOX_INLINE_BUDGET', '2'))
+# Сколько проведение в вызове ждет заказы, заблокированные другой транзакцией
+INBOX_LOCK_TIMEOUT = float(os.environ.get('ROBOKASSA_INBOX_LOCK_TIMEOUT', '0.2'))
+# Время, которое нужно вызову после прохода, чтобы ответить
+INVOCATION_RESERVE = 1.0
+
+
+def drain_budget(context, limit: float) -> float:
+    """limit, урезанный до оставшегося времени вызова за вычетом INVOCATION_RESERVE"""
+    get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+    if callable(get_remaining):
+        try:
+            return min(limit, get_remaining() / 1000 - INVOCATION_RESERVE)
+        except Exception:
+            pass
+    return limit
+
+
+def is_drain_authorized(event: dict) -> bool:
+    """Заголовок X-Drain-Token против ROBOKASSA_DRAIN_TOKEN; без токена ?drain=1 выключен"""
+    expected = os.environ.get('ROBOKASSA_DRAIN_TOKEN', '')
+    if not expected:
+        return False
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == 'x-drain-token':
+            return hmac.compare_digest(str(value).encode(), expected.encode())
+    return False
 
 
 HEADERS = {
@@ -25,13 +58,38 @@ HEADERS = {
 }
 
 
+def route_name(event: dict) -> str:
+    return 'drain' if (event.get('queryStringParameters') or {}).get('drain') else 'result'
+
+
+@metrics.instrument(route_name)
 def handler(event: dict, context) -> dict:
-    '''Webhook от Robokassa — подтверждение оплаты и начисление баланса'''
+    '''
+    Webhook от Robokassa — подтверждение оплаты и начисление баланса
+    Уведомление записывается в очередь, затем очередь проводится в этом же вызове
+    (не дольше ROBOKASSA_INBOX_INLINE_BUDGET секунд и не дольше оставшегося времени
+    вызова), и только после этого Robokassa получает OK. Записи, которые не успели
+    или не дождались блокировки заказов за ROBOKASSA_INBOX_LOCK_TIMEOUT, остаются
+    в очереди: их проводит следующее уведомление или ?drain=1.
+    ?drain=1 - проход очереди для триггера по расписанию (раз в минуту); триггер
+    передает секрет из ROBOKASSA_DRAIN_TOKEN в заголовке X-Drain-Token, без
+    настроенного токена ?drain=1 отвечает 403.
+    GET ?path=metrics - метрики в формате Prometheus.
+    '''
     method = event.get('httpMethod', 'GET').upper()
 
     if method == 'OPTIONS':
         return {'statusCode': 200, 'headers': HEADERS, 'body': '', 'isBase64Encoded': False}
 
+    if (event.get('queryStringParameters') or {}).get('drain'):
+        if not is_drain_authorized(event):
+            return {'statusCode': 403, 'headers': HEADERS, 'body': 'Forbidden', 'isBase64Encoded': False}
+        budget = drain_budget(context, INBOX_TIME_BUDGET)
+        stats = inbox.drain(get_db_connection, INBOX_BATCH_SIZE, budget, lock_timeout=budget)
+        print(f"[inbox] drain claimed={stats['claimed']} paid={stats['paid']} "
+              f"amount_mismatch={stats['amount_mismatch']} deferred={stats['deferred']} duration_ms={stats['duration_ms']}")
+        return {'statusCode': 200, 'headers': HEADERS, 'body': json.dumps(stats), 'isBase64Encoded': False}
+
     password_2 = os.environ.get('ROBOKASSA_PASSWORD_2')
     if not password_2:
         return {'statusCode': 500, 'headers': HEADERS, 'body': 'Configuration error', 'isBase64Encoded': False}
@@ -61,37 +119,18 @@ def handler(event: dict, context) -> dict:
         return {'statusCode': 400, 'headers': HEADERS, 'body': 'Invalid signature', 'isBase64Encoded': False}
 
     conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        UPDATE orders
-        SET status = 'paid', paid_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
-        WHERE robokassa_inv_id = %s AND status = 'pending'
-        RETURNING id, order_number, user_id, amount
-    """, (int(inv_id),))
-
-    result = cur.fetchone()
-
-    if not result:
-        cur.execute("SELECT status FROM orders WHERE robokassa_inv_id = %s", (int(inv_id),))
-        existing = cur.fetchone()
+    conn.autocommit = True
+    try:
+        inbox.record(conn, int(inv_id), out_sum)
+    finally:
         conn.close()
 
-        if existing and existing[0] == 'paid':
-            return {'statusCode': 200, 'headers': HEADERS, 'body': f'OK{inv_id}', 'isBase64Encoded': False}
-        return {'statusCode': 404, 'headers': HEADERS, 'body': 'Order not found', 'isBase64Encoded': False}
-
-    order_id, order_number, user_id, amount = result
-
-    if user_id:
-        cur.execute(
-            "UPDATE users SET balance = balance + %s WHERE id = %s",
-            (float(amount), user_id)
-        )
-        print(f"Balance credited: user={user_id}, amount={amount}, order={order_number}")
-
-    conn.commit()
-    cur.close()
-    conn.close()
+    # Уведомление уже записано: сбой или нехватка времени здесь только откладывают проведение
+    budget = drain_budget(context, INBOX_INLINE_BUDGET)
+    if budget > 0:
+        try:
+            inbox.drain(get_db_connection, INBOX_BATCH_SIZE, budget, lock_timeout=min(INBOX_LOCK_TIMEOUT, budget))
+        except Exception as e:
+            print(f'[inbox] inline drain failed: {e}')
 
     return {'statusCode': 200, 'headers': HEADERS, 'body': f'OK{inv_id}', 'isBase64Encoded': False}
@@ -1,8 +1,9 @@
 import json
 import os
 import hashlib
-import psycopg2
-import random
+import threading
+import db
+import metrics
 from urllib.parse import urlencode
 from datetime import datetime
 
@@ -13,10 +14,7 @@ def calculate_signature(*args) -> str:
 
 
 def get_db_connection():
-    dsn = os.environ.get('DATABASE_URL')
-    if not dsn:
-        raise ValueError('DATABASE_URL not configured')
-    return psycopg2.connect(dsn)
+    return db.connect()
 
 
 HEADERS = {
@@ -29,9 +27,101 @@ HEADERS = {
 
 ROBOKASSA_URL = 'https://auth.robokassa.ru/Merchant/Index.aspx'
 
+# Номера счетов резервируются блоками: nextval отдает начало блока, дальше теплый
+# инстанс выдает номера блока без запросов. Размер блока - INCREMENT BY последовательности
+# (V0031); он читается вместе с nextval, поэтому не может разойтись с миграциями.
+# Зная номер заранее, подпись и ссылку на оплату можно посчитать до записи заказа.
+INVOICE_SEQUENCE = 'orders_robokassa_inv_id_seq'
+
+CACHE_REQUESTS = metrics.counter('cache_requests_total', 'Обращения к кэшам', ('cache', 'result'))
+
+
+class InvoiceIds:
+    """Номера счетов из зарезервированного блока; новый блок - один запрос"""
+
+    def __init__(self, sequence: str):
+        self.sequence = sequence
+        self.block = 0
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def take(self, cur) -> int:
+        with self._lock:
+            if self._next >= self._end:
+                CACHE_REQUESTS.inc('invoice_block', 'miss')
+                cur.execute(
+                    'SELECT nextval(%(seq)s::regclass), seqincrement FROM pg_sequence WHERE seqrelid = %(seq)s::regclass',
+                    {'seq': self.sequence}
+                )
+                self._next, self.block = cur.fetchone()
+                self._end = self._next + self.block
+            else:
+                CACHE_REQUESTS.inc('invoice_block', 'hit')
+            inv_id = self._next
+            self._next += 1
+            return inv_id
+
+
+INVOICE_IDS = InvoiceIds(INVOICE_SEQUENCE)
+
+# Заказ, его позиции и ссылка на оплату - одним запросом. Старые заказы получали
+# случайные номера: при редком совпадении с ними заказ не вставится (и позиции тоже),
+# и попытка повторится со следующим номером.
+CREATE_ORDER = db.statement('robokassa_create_order', """
+    WITH o AS (
+        INSERT INTO orders (order_number, user_id, user_name, user_email, user_phone, amount, robokassa_inv_id, status, payment_url, delivery_address, order_comment)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, 'pending', %s, %s, %s)
+        ON CONFLICT DO NOTHING
+        RETURNING id
+    ), items AS (
+        INSERT INTO order_items (order_id, product_id, product_name, product_price, quantity)
+        SELECT o.id, i.product_id, i.product_name, i.product_price, i.quantity
+        FROM o, unnest(%s::varchar[], %s::varchar[], %s::numeric[], %s::integer[])
+            WITH ORDINALITY AS i(product_id, product_name, product_price, quantity, position)
+        ORDER BY i.position
+    )
+    SELECT id FROM o
+""")
+CREATE_ORDER_ATTEMPTS = 5
+
+
+def build_payment_url(merchant_login: str, password_1: str, amount_str: str, inv_id: int, order_number: str,
+                      user_email: str, success_url: str, fail_url: str) -> str:
+    if success_url or fail_url:
+        signature = calculate_signature(
+            merchant_login, amount_str, inv_id,
+            success_url, 'GET', fail_url, 'GET', password_1
+        )
+    else:
+        signature = calculate_signature(merchant_login, amount_str, inv_id, password_1)
 
+    query_params = {
+        'MerchantLogin': merchant_login,
+        'OutSum': amount_str,
+        'InvoiceID': inv_id,
+        'SignatureValue': signature,
+        'Email': user_email,
+        'Culture': 'ru',
+        'Description': f'Пополнение баланса {order_number}'
+    }
+
+    if success_url:
+        query_params['SuccessUrl2'] = success_url
+        query_params['SuccessUrl2Method'] = 'GET'
+    if fail_url:
+        query_params['FailUrl2'] = fail_url
+        query_params['FailUrl2Method'] = 'GET'
+
+    return f"{ROBOKASSA_URL}?{urlencode(query_params)}"
+
+
+@metrics.instrument(lambda event: 'create-order')
 def handler(event: dict, context) -> dict:
-    '''Создание платежа через Robokassa для пополнения баланса работодателя'''
+    '''
+    Создание платежа через Robokassa для пополнения баланса работодателя
+    GET ?path=metrics - метрики в формате Prometheus
+    '''
     method = event.get('httpMethod', 'GET').upper()
 
     if method == 'OPTIONS':
@@ -66,61 +156,38 @@ def handler(event: dict, context) -> dict:
         return {'statusCode': 400, 'headers': HEADERS, 'body': json.dumps({'error': 'user_name and user_email required'}), 'isBase64Encoded': False}
 
     conn = get_db_connection()
+    # Заказ с позициями - один оператор, он атомарен и без отдельного COMMIT
+    conn.autocommit = True
     cur = conn.cursor()
 
-    for _ in range(10):
-        robokassa_inv_id = random.randint(100000, 2147483647)
-        cur.execute("SELECT COUNT(*) FROM orders WHERE robokassa_inv_id = %s", (robokassa_inv_id,))
-        if cur.fetchone()[0] == 0:
-            break
-
-    order_number = f"ORD-{datetime.now().strftime('%Y%m%d')}-{robokassa_inv_id}"
-
-    cur.execute("""
-        INSERT INTO orders (order_number, user_id, user_name, user_email, user_phone, amount, robokassa_inv_id, status, delivery_address, order_comment)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        RETURNING id
-    """, (order_number, user_id or None, user_name, user_email, user_phone, round(amount, 2), robokassa_inv_id, 'pending', user_address, order_comment))
-
-    order_id = cur.fetchone()[0]
-
-    for item in cart_items:
-        cur.execute("""
-            INSERT INTO order_items (order_id, product_id, product_name, product_price, quantity)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (order_id, item.get('id'), item.get('name'), item.get('price'), item.get('quantity')))
-
     amount_str = f"{amount:.2f}"
-
-    if success_url or fail_url:
-        signature = calculate_signature(
-            merchant_login, amount_str, robokassa_inv_id,
-            success_url, 'GET', fail_url, 'GET', password_1
+    items = (
+        [str(item['id']) if item.get('id') is not None else None for item in cart_items],
+        [item.get('name') for item in cart_items],
+        [item.get('price') for item in cart_items],
+        [item.get('quantity') for item in cart_items],
+    )
+
+    order_id = None
+    for _ in range(CREATE_ORDER_ATTEMPTS):
+        robokassa_inv_id = INVOICE_IDS.take(cur)
+        order_number = f"ORD-{datetime.now().strftime('%Y%m%d')}-{robokassa_inv_id}"
+        payment_url = build_payment_url(
+            merchant_login, password_1, amount_str, robokassa_inv_id, order_number,
+            user_email, success_url, fail_url
         )
-    else:
-        signature = calculate_signature(merchant_login, amount_str, robokassa_inv_id, password_1)
-
-    query_params = {
-        'MerchantLogin': merchant_login,
-        'OutSum': amount_str,
-        'InvoiceID': robokassa_inv_id,
-        'SignatureValue': signature,
-        'Email': user_email,
-        'Culture': 'ru',
-        'Description': f'Пополнение баланса {order_number}'
-    }
-
-    if success_url:
-        query_params['SuccessUrl2'] = success_url
-        query_params['SuccessUrl2Method'] = 'GET'
-    if fail_url:
-        query_params['FailUrl2'] = fail_url
-        query_params['FailUrl2Method'] = 'GET'
-
-    payment_url = f"{ROBOKASSA_URL}?{urlencode(query_params)}"
+        db.execute(cur, CREATE_ORDER, (
+            order_number, user_id or None, user_name, user_email, user_phone, round(amount, 2),
+            robokassa_inv_id, payment_url, user_address, order_comment, *items
+        ))
+        row = cur.fetchone()
+        if row:
+            order_id = row[0]
+            break
+    if order_id is None:
+        conn.close()
+        return {'statusCode': 503, 'headers': HEADERS, 'body': json.dumps({'error': 'Could not allocate invoice id'}), 'isBase64Encoded': False}
 
-    cur.execute("UPDATE orders SET payment_url = %s WHERE id = %s", (payment_url, order_id))
-    conn.commit()
     cur.close()
     conn.close()
 
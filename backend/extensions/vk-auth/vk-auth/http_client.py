@@ -0,0 +1,578 @@
+"""
+HTTP-клиент для исходящих запросов к внешним сервисам
+Пулы keep-alive соединений по хостам, раздельные таймауты на соединение и чтение,
+ограниченные повторы с jitter, распаковка gzip/deflate и метрики задержек
+(metrics.py: длительность по хостам и время внешних вызовов текущего вызова функции).
+С breaker-ом провайдера и бюджетом вызова функции (circuit.py) запрос к упавшему
+провайдеру отклоняется сразу, а таймауты урезаются до оставшегося времени.
+
+Функции деплоятся отдельными папками, поэтому модуль лежит копией рядом с каждым
+index.py, которому нужен. Копии должны оставаться одинаковыми.
+"""
+import gzip
+import http.client
+import json
+import random
+import select
+import ssl
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+import circuit
+import metrics
+
+CONNECT_TIMEOUT = 3.0
+READ_TIMEOUT = 10.0
+MAX_RETRIES = 2
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 2.0
+MAX_IDLE_PER_HOST = 8
+RETRY_STATUSES = (502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Ошибки переиспользованного соединения, которое сервер уже закрыл.
+# При отправке запроса они значат, что сервер его не получил; при чтении ответа -
+# что запрос мог быть уже обработан
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+
+class HttpError(Exception):
+    """Ошибка исходящего запроса: сеть, таймаут или статус ответа"""
+
+    def __init__(self, message: str, status: Optional[int] = None, body: bytes = b''):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+
+
+class ConnectError(HttpError):
+    """Соединение не установлено - запрос точно не был отправлен"""
+
+
+class HttpResponse:
+    """Полностью прочитанный и распакованный ответ"""
+
+    def __init__(self, status: int, headers: Dict[str, str], body: bytes, elapsed_ms: float):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.elapsed_ms = elapsed_ms
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    def text(self, encoding: str = 'utf-8') -> str:
+        return self.body.decode(encoding, errors='replace')
+
+    def json(self) -> Any:
+        return json.loads(self.body.decode('utf-8'))
+
+    def raise_for_status(self) -> 'HttpResponse':
+        if self.status >= 400:
+            raise HttpError(f'HTTP {self.status}', status=self.status, body=self.body)
+        return self
+
+
+class StreamingResponse:
+    """Ответ, тело которого читается кусками с распаковкой на лету"""
+
+    def __init__(
+        self,
+        resp: http.client.HTTPResponse,
+        chunk_size: int,
+        conn: Optional[http.client.HTTPConnection] = None,
+        read_timeout: float = READ_TIMEOUT,
+        deadline: Optional[circuit.Deadline] = None,
+    ):
+        self.status = resp.status
+        self.headers = {k.lower(): v for k, v in resp.getheaders()}
+        self.bytes_read = 0
+        self._resp = resp
+        self._chunk_size = chunk_size
+        self._conn = conn
+        self._read_timeout = read_timeout
+        self._deadline = deadline
+        self.complete = False
+
+    def _read_chunk(self) -> bytes:
+        if self._deadline is not None and self._conn is not None and self._conn.sock is not None:
+            self._conn.sock.settimeout(self._deadline.timeout(self._read_timeout, 'read'))
+        return self._resp.read1(self._chunk_size)
+
+    def raise_for_status(self) -> 'StreamingResponse':
+        if self.status >= 400:
+            raise HttpError(f'HTTP {self.status}', status=self.status, body=self._resp.read())
+        return self
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        encoding = self.headers.get('content-encoding', '').strip().lower()
+        if encoding in ('gzip', 'x-gzip'):
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            decoder = zlib.decompressobj()
+        else:
+            decoder = None
+        while True:
+            chunk = self._read_chunk()
+            if not chunk:
+                # read1 не помечает ответ дочитанным при Content-Length - read() закрывает его
+                chunk = self._resp.read()
+                if not chunk:
+                    break
+            self.bytes_read += len(chunk)
+            if decoder is not None:
+                try:
+                    chunk = decoder.decompress(chunk)
+                except zlib.error:
+                    if encoding != 'deflate' or self.bytes_read != len(chunk):
+                        raise
+                    # Raw deflate без zlib-заголовка, как и в decode_body
+                    decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+                    chunk = decoder.decompress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+        if decoder is not None:
+            tail = decoder.flush()
+            if tail:
+                yield tail
+        self.complete = True
+
+
+def decode_body(body: bytes, encoding: str) -> bytes:
+    """Распаковывает тело по Content-Encoding"""
+    encoding = (encoding or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return gzip.decompress(body)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # Некоторые серверы шлют raw deflate без zlib-заголовка
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+def unhealthy_status(status: int) -> bool:
+    """Ответ, который breaker считает неудачей провайдера: 5xx и 429"""
+    return status >= 500 or status == 429
+
+
+def record_outcome(breaker: circuit.CircuitBreaker, failed: bool, started: float) -> None:
+    elapsed = time.monotonic() - started
+    if failed:
+        breaker.record_failure(elapsed)
+    else:
+        breaker.record_success(elapsed)
+
+
+class _HostStats:
+    """Счетчики хоста; обновляются из потоков пула, поэтому под своей блокировкой"""
+    __slots__ = ('host', 'calls', 'errors', 'retries', 'reused', 'total_ms', 'max_ms', 'last_ms', '_lock')
+
+    def __init__(self, host: str):
+        self.host = host
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.reused = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms = 0.0
+
+    def add(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record(self, elapsed_ms: float) -> None:
+        with self._lock:
+            self.calls += 1
+            self.total_ms += elapsed_ms
+            self.last_ms = elapsed_ms
+            if elapsed_ms > self.max_ms:
+                self.max_ms = elapsed_ms
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'errors': self.errors,
+                'retries': self.retries,
+                'reused_connections': self.reused,
+                'avg_ms': round(self.total_ms / self.calls, 2) if self.calls else 0.0,
+                'max_ms': round(self.max_ms, 2),
+                'last_ms': round(self.last_ms, 2),
+            }
+
+
+class HttpClient:
+    """
+    Потокобезопасный клиент с пулом соединений на (схема, хост, порт)
+    Живет на уровне модуля и переиспользуется между теплыми вызовами функции
+    """
+
+    def __init__(self, max_idle_per_host: int = MAX_IDLE_PER_HOST):
+        self.max_idle_per_host = max_idle_per_host
+        self._idle: Dict[Tuple[str, str, int], List[http.client.HTTPConnection]] = {}
+        self._stats: Dict[str, _HostStats] = {}
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context()
+
+    # --- пул соединений ---
+
+    def _acquire(self, key: Tuple[str, str, int], connect_timeout: float, fresh: bool = False) -> Tuple[http.client.HTTPConnection, bool]:
+        while not fresh:
+            with self._lock:
+                idle = self._idle.get(key)
+                conn = idle.pop() if idle else None
+            if conn is None:
+                break
+            if not self._closed_by_peer(conn):
+                return conn, True
+            conn.close()
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=connect_timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=connect_timeout)
+        return conn, False
+
+    @staticmethod
+    def _closed_by_peer(conn: http.client.HTTPConnection) -> bool:
+        """
+        Простаивающее соединение не должно быть читаемым: данные или EOF в нем значат,
+        что сервер его закрыл. Проверка сужает, но не закрывает гонку с таймаутом
+        keep-alive сервера
+        """
+        if conn.sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def _release(self, key: Tuple[str, str, int], conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        """Закрывает все простаивающие соединения"""
+        with self._lock:
+            pools = list(self._idle.values())
+            self._idle.clear()
+        for idle in pools:
+            for conn in idle:
+                conn.close()
+
+    # --- метрики ---
+
+    def _host_stats(self, host: str) -> _HostStats:
+        stats = self._stats.get(host)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(host, _HostStats(host))
+        return stats
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Метрики по хостам: число вызовов, ошибки, повторы, задержки"""
+        return {host: s.as_dict() for host, s in list(self._stats.items())}
+
+    # --- запросы ---
+
+    def _open(
+        self,
+        method: str,
+        url: str,
+        body: Optional[bytes],
+        headers: Dict[str, str],
+        connect_timeout: float,
+        read_timeout: float,
+        idempotent: bool,
+    ) -> Tuple[Tuple[str, str, int], http.client.HTTPConnection, http.client.HTTPResponse, bool]:
+        """Отправляет запрос и возвращает ответ с непрочитанным телом"""
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'https'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname or '', port)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+
+        send_headers = {'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'}
+        send_headers.update(headers)
+
+        # Переиспользованное соединение могло быть закрыто сервером - тогда одна
+        # бесплатная попытка на свежем соединении. Неидемпотентный запрос повторяется,
+        # только если сбой случился при отправке: если сервер оборвал соединение уже
+        # после получения запроса, повтор мог бы, например, провести платеж дважды
+        for attempt in range(2):
+            conn, reused = self._acquire(key, connect_timeout, fresh=attempt > 0)
+            if conn.sock is None:
+                try:
+                    conn.timeout = connect_timeout
+                    conn.connect()
+                except OSError as e:
+                    conn.close()
+                    raise ConnectError(f'connect to {key[1]}:{port} failed: {e}') from e
+            try:
+                conn.sock.settimeout(read_timeout)
+                conn.request(method, target, body=body, headers=send_headers)
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+                continue
+            except BaseException:
+                conn.close()
+                raise
+            try:
+                return key, conn, conn.getresponse(), reused
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if not (reused and idempotent):
+                    raise
+            except BaseException:
+                conn.close()
+                raise
+        raise HttpError('unreachable')
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        data: Optional[Dict[str, Any]] = None,
+        json_body: Any = None,
+        body: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        retries: int = MAX_RETRIES,
+        idempotent: Optional[bool] = None,
+        breaker: Optional[circuit.CircuitBreaker] = None,
+        deadline: Optional[circuit.Deadline] = None,
+    ) -> HttpResponse:
+        """
+        Выполняет запрос и возвращает распакованный ответ
+
+        Повторы с экспоненциальной задержкой и jitter: ошибки установки соединения
+        повторяются всегда, таймауты чтения и статусы 502/503/504 - только для
+        идемпотентных запросов (GET/HEAD или idempotent=True).
+        Статусы 4xx/5xx не бросают исключение - см. HttpResponse.raise_for_status
+
+        Каждая попытка учитывается в breaker; пока он открыт, попытка не делается
+        (circuit.CircuitOpenError). Таймауты и паузы между попытками не выходят за
+        deadline (по умолчанию - бюджет текущего вызова функции, circuit.start).
+        """
+        method = method.upper()
+        headers = dict(headers or {})
+        if params:
+            url += ('&' if '?' in url else '?') + urlencode(params)
+        if data is not None:
+            body = urlencode(data).encode('utf-8')
+            headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+        elif json_body is not None:
+            body = json.dumps(json_body).encode('utf-8')
+            headers.setdefault('Content-Type', 'application/json')
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        if deadline is None:
+            deadline = circuit.current()
+
+        host = urlsplit(url).hostname or ''
+        stats = self._host_stats(host)
+        attempt = 0
+        started = time.monotonic()
+
+        while True:
+            attempt_connect, attempt_read = self._budget(host, connect_timeout, read_timeout, deadline)
+            if breaker is not None and not breaker.allow():
+                raise circuit.CircuitOpenError(f'{breaker.name}: circuit open', breaker.retry_after())
+            attempt_started = time.monotonic()
+            recorded = False
+            try:
+                key, conn, resp, reused = self._open(method, url, body, headers, attempt_connect, attempt_read, idempotent)
+                try:
+                    raw = self._read_body(conn, resp, attempt_read, deadline)
+                except BaseException:
+                    conn.close()
+                    raise
+                result = HttpResponse(
+                    resp.status,
+                    {k.lower(): v for k, v in resp.getheaders()},
+                    decode_body(raw, resp.getheader('Content-Encoding', '')),
+                    (time.monotonic() - attempt_started) * 1000,
+                )
+                if resp.will_close:
+                    conn.close()
+                else:
+                    self._release(key, conn)
+                if reused:
+                    stats.add('reused')
+                if breaker is not None:
+                    record_outcome(breaker, unhealthy_status(result.status), attempt_started)
+                    recorded = True
+                if idempotent and result.status in RETRY_STATUSES and attempt < retries:
+                    raise HttpError(f'HTTP {result.status}', status=result.status, body=result.body)
+                self._record(stats, started)
+                return result
+            except (OSError, http.client.HTTPException, HttpError, zlib.error) as e:
+                if breaker is not None and not recorded:
+                    record_outcome(breaker, True, attempt_started)
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** (attempt + 1))))
+                can_retry = (
+                    attempt < retries
+                    and (isinstance(e, ConnectError) or idempotent)
+                    and (deadline is None or deadline.remaining() - delay >= circuit.MIN_CALL_SECONDS)
+                )
+                if not can_retry:
+                    stats.add('errors')
+                    self._record(stats, started)
+                    if isinstance(e, HttpError):
+                        raise
+                    raise HttpError(f'{method} {host} failed: {e}') from e
+                attempt += 1
+                stats.add('retries')
+                time.sleep(delay)
+
+    @staticmethod
+    def _budget(
+        host: str, connect_timeout: float, read_timeout: float, deadline: Optional[circuit.Deadline]
+    ) -> Tuple[float, float]:
+        """Таймауты попытки, урезанные до deadline; DeadlineExceeded, если времени нет"""
+        if deadline is None:
+            return connect_timeout, read_timeout
+        return deadline.timeout(connect_timeout, host), deadline.timeout(read_timeout, host)
+
+    @staticmethod
+    def _read_body(
+        conn: http.client.HTTPConnection,
+        resp: http.client.HTTPResponse,
+        read_timeout: float,
+        deadline: Optional[circuit.Deadline],
+    ) -> bytes:
+        # Таймаут сокета действует на каждое чтение, поэтому с deadline тело читается
+        # кусками и таймаут пересчитывается: медленная отдача не переживет вызов функции
+        if deadline is None:
+            return resp.read()
+        chunks = []
+        while True:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                raise TimeoutError('deadline exceeded while reading response')
+            if conn.sock is not None:
+                conn.sock.settimeout(min(read_timeout, remaining))
+            chunk = resp.read1(65536)
+            if not chunk:
+                # read1 не помечает ответ дочитанным при Content-Length - read() закрывает его
+                chunks.append(resp.read())
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    @contextmanager
+    def stream(
+        self,
+        method: str,
+        url: str,
+        *,
+        headers: Optional[Dict[str, str]] = None,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        chunk_size: int = 65536,
+        breaker: Optional[circuit.CircuitBreaker] = None,
+        deadline: Optional[circuit.Deadline] = None,
+    ) -> Iterator[StreamingResponse]:
+        """
+        Запрос с потоковым чтением тела: with client.stream('GET', url) as resp
+        Без повторов; соединение возвращается в пул, только если тело дочитано.
+        breaker и deadline - как в request; исход учитывается по выходу из блока.
+        """
+        host = urlsplit(url).hostname or ''
+        stats = self._host_stats(host)
+        if deadline is None:
+            deadline = circuit.current()
+        connect_timeout, read_timeout = self._budget(host, connect_timeout, read_timeout, deadline)
+        if breaker is not None and not breaker.allow():
+            raise circuit.CircuitOpenError(f'{breaker.name}: circuit open', breaker.retry_after())
+        started = time.monotonic()
+        try:
+            method = method.upper()
+            key, conn, resp, reused = self._open(
+                method, url, None, dict(headers or {}), connect_timeout, read_timeout, method in IDEMPOTENT_METHODS)
+        except (OSError, http.client.HTTPException, HttpError) as e:
+            stats.add('errors')
+            self._record(stats, started)
+            if breaker is not None:
+                record_outcome(breaker, True, started)
+            if isinstance(e, HttpError):
+                raise
+            raise HttpError(f'{method} {host} failed: {e}') from e
+        if reused:
+            stats.add('reused')
+        streaming = StreamingResponse(resp, chunk_size, conn, read_timeout, deadline)
+        failed = True
+        try:
+            yield streaming
+            failed = unhealthy_status(streaming.status)
+        except BaseException:
+            stats.add('errors')
+            conn.close()
+            raise
+        else:
+            if streaming.complete and not resp.will_close:
+                self._release(key, conn)
+            else:
+                conn.close()
+        finally:
+            self._record(stats, started)
+            if breaker is not None:
+                record_outcome(breaker, failed, started)
+
+    def _record(self, stats: _HostStats, started: float) -> None:
+        seconds = time.monotonic() - started
+        metrics.outbound(stats.host, seconds)
+        stats.record(seconds * 1000)
+
+    def get(self, url: str, **kwargs) -> HttpResponse:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> HttpResponse:
+        return self.request('POST', url, **kwargs)
+
+
+# Общий клиент на процесс: соединения переживают теплые вызовы
+client = HttpClient()
+
+HOST_COUNTERS = {
+    key: metrics.counter(f'outbound_{key}_total', help, ('host',))
+    for key, help in (
+        ('errors', 'Внешние вызовы, завершившиеся ошибкой'),
+        ('retries', 'Повторы внешних вызовов'),
+        ('reused_connections', 'Внешние вызовы по соединению из пула'),
+    )
+}
+
+
+@metrics.on_scrape
+def _client_metrics() -> None:
+    for host, host_stats in client.stats().items():
+        for key, counter in HOST_COUNTERS.items():
+            counter.set(host_stats[key], host)
@@ -4,13 +4,18 @@ import os
 import secrets
 import base64
 import hashlib
+import hmac
+import time
 from datetime import datetime, timedelta, timezone
-from urllib.request import Request, urlopen
 from urllib.parse import urlencode
-from urllib.error import HTTPError
 
 import jwt
-import psycopg2
+
+import circuit
+import db
+import http_client
+import metrics
+from http_client import HttpError
 
 # =============================================================================
 # CONSTANTS
@@ -20,9 +25,18 @@ VK_AUTHORIZE_URL = "https://id.vk.com/authorize"
 VK_TOKEN_URL = "https://id.vk.com/oauth2/auth"
 VK_USER_INFO_URL = "https://id.vk.com/oauth2/user_info"
 
+# Shared by both VK ID calls: while open, sign-in fails fast instead of waiting on timeouts
+VK_ID_BREAKER = circuit.breaker('vk-id', slow_call=3)
+
 ACCESS_TOKEN_EXPIRE_MINUTES = 15
 REFRESH_TOKEN_EXPIRE_DAYS = 30
 
+DEFAULT_KID = 'default'
+
+SWEEP_BATCH_SIZE = 1000
+SWEEP_MAX_BATCHES = 50
+SWEEP_TIME_BUDGET_SECONDS = 20
+
 HEADERS = {
     'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
     'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Authorization, X-Session-Token',
@@ -35,21 +49,92 @@ HEADERS = {
 # =============================================================================
 
 def get_connection():
-    """Get database connection."""
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-
-SCHEMA = '"t_p41246523_jobsapp_mobile_proje"'
+    """Get a pooled database connection; conn.close() returns it to the pool."""
+    return db.connect()
+
+
+# Statements are rendered once per instance and prepared once per connection
+USER_BY_VK_ID = db.statement('vk_user_by_vk_id', """
+    SELECT id, email, name, avatar_url FROM {schema}.users WHERE vk_id = %s
+""")
+
+TOUCH_LOGIN = db.statement('vk_touch_login', """
+    UPDATE {schema}.users SET last_login_at = %s, updated_at = %s WHERE id = %s
+""")
+
+USER_BY_EMAIL = db.statement('vk_user_by_email', """
+    SELECT id, name, avatar_url FROM {schema}.users WHERE email = %s
+""")
+
+LINK_VK_ACCOUNT = db.statement('vk_link_account', """
+    UPDATE {schema}.users
+    SET vk_id = %s, avatar_url = COALESCE(avatar_url, %s),
+        last_login_at = %s, updated_at = %s
+    WHERE id = %s
+""")
+
+CREATE_USER = db.statement('vk_create_user', """
+    INSERT INTO {schema}.users
+    (vk_id, email, name, avatar_url, email_verified, password_hash, role, created_at, updated_at, last_login_at)
+    VALUES (%s, %s, %s, %s, TRUE, '', 'seeker', %s, %s, %s)
+    RETURNING id
+""")
+
+STORE_REFRESH_TOKEN = db.statement('vk_store_refresh_token', """
+    INSERT INTO {schema}.refresh_tokens (user_id, token_hash, expires_at, created_at)
+    VALUES (%s, %s, %s, %s)
+""")
+
+REFRESH_TOKEN_USER = db.statement('vk_refresh_token_user', """
+    SELECT rt.user_id, u.email, u.name, u.avatar_url, u.vk_id
+    FROM {schema}.refresh_tokens rt
+    JOIN {schema}.users u ON u.id = rt.user_id
+    WHERE rt.token_hash = %s AND rt.expires_at > %s
+""")
+
+DELETE_REFRESH_TOKEN = db.statement('vk_delete_refresh_token', """
+    DELETE FROM {schema}.refresh_tokens WHERE token_hash = %s
+""")
+
+UPDATE_ROLE = db.statement('vk_update_role', """
+    UPDATE {schema}.users SET role = %s, updated_at = %s WHERE id = %s RETURNING id
+""")
+
+SWEEP_REFRESH_TOKENS = db.statement('vk_sweep_refresh_tokens', """
+    DELETE FROM {schema}.refresh_tokens
+    WHERE id IN (
+        SELECT id FROM {schema}.refresh_tokens
+        WHERE expires_at < %s
+        ORDER BY expires_at
+        LIMIT %s
+    )
+""")
 
 
-def get_schema() -> str:
-    return f"{SCHEMA}."
+def sweep_expired_tokens(conn) -> dict:
+    """Delete expired refresh tokens in bounded batches, committing each one."""
+    started = time.monotonic()
+    now = datetime.now(timezone.utc).isoformat()
+    deleted = 0
+    batches = 0
 
+    with conn.cursor() as cur:
+        while batches < SWEEP_MAX_BATCHES:
+            db.execute(cur, SWEEP_REFRESH_TOKENS, (now, SWEEP_BATCH_SIZE))
+            conn.commit()
+            batches += 1
+            deleted += cur.rowcount
+            if cur.rowcount < SWEEP_BATCH_SIZE:
+                break
+            if time.monotonic() - started > SWEEP_TIME_BUDGET_SECONDS:
+                break
 
-def cleanup_expired_tokens(cur, schema: str) -> None:
-    """Delete expired refresh tokens."""
-    now = datetime.now(timezone.utc).isoformat()
-    cur.execute(f"DELETE FROM {schema}refresh_tokens WHERE expires_at < %s", (now,))
+    return {
+        'deleted': deleted,
+        'batches': batches,
+        'batch_size': SWEEP_BATCH_SIZE,
+        'duration_ms': int((time.monotonic() - started) * 1000)
+    }
 
 
 # =============================================================================
@@ -61,12 +146,63 @@ def hash_token(token: str) -> str:
     return hashlib.sha256(token.encode('utf-8')).hexdigest()
 
 
-def get_jwt_secret() -> str:
-    """Get JWT secret with validation."""
-    secret = os.environ.get('JWT_SECRET', '')
-    if not secret or len(secret) < 32:
-        raise ValueError('JWT_SECRET must be at least 32 characters')
-    return secret
+class JwtKeyring:
+    """HS256 signer/verifier over one or more keys, selected by the `kid` header.
+
+    Keys come from JWT_SECRET (kid "default") plus optional JWT_EXTRA_KEYS in
+    the form "kid1:secret1,kid2:secret2". JWT_ACTIVE_KID picks the signing key;
+    every configured key is accepted for verification, so a new key can be
+    rolled out before the old one is retired.
+    """
+
+    def __init__(self, keys: dict[str, str], active_kid: str):
+        for kid, secret in keys.items():
+            if len(secret) < 32:
+                raise ValueError(f'JWT key "{kid}" must be at least 32 characters')
+        if active_kid not in keys:
+            raise ValueError(f'JWT_ACTIVE_KID "{active_kid}" is not configured')
+        self.keys = keys
+        self.active_kid = active_kid
+
+    @classmethod
+    def from_env(cls) -> 'JwtKeyring':
+        keys = {}
+        secret = os.environ.get('JWT_SECRET', '')
+        if secret:
+            keys[DEFAULT_KID] = secret
+        for item in os.environ.get('JWT_EXTRA_KEYS', '').split(','):
+            kid, sep, key = item.strip().partition(':')
+            if sep and kid and key:
+                keys[kid] = key
+        if not keys:
+            raise ValueError('JWT_SECRET must be at least 32 characters')
+        active_kid = os.environ.get('JWT_ACTIVE_KID', '') or (DEFAULT_KID if DEFAULT_KID in keys else next(iter(keys)))
+        return cls(keys, active_kid)
+
+    def sign(self, payload: dict) -> str:
+        return jwt.encode(
+            payload, self.keys[self.active_kid], algorithm='HS256',
+            headers={'kid': self.active_kid}
+        )
+
+    def verify(self, token: str) -> dict:
+        """Decode and verify token; raises jwt.InvalidTokenError subclasses."""
+        kid = jwt.get_unverified_header(token).get('kid', DEFAULT_KID)
+        secret = self.keys.get(kid)
+        if secret is None:
+            raise jwt.InvalidTokenError(f'Unknown key id: {kid}')
+        return jwt.decode(token, secret, algorithms=['HS256'])
+
+
+_keyring: JwtKeyring | None = None
+
+
+def get_keyring() -> JwtKeyring:
+    """Return the keyring, built from the environment once per warm instance."""
+    global _keyring
+    if _keyring is None:
+        _keyring = JwtKeyring.from_env()
+    return _keyring
 
 
 # =============================================================================
@@ -75,7 +211,7 @@ def get_jwt_secret() -> str:
 
 def create_access_token(user_id: str, email: str | None = None) -> tuple[str, int]:
     """Create JWT access token."""
-    secret = get_jwt_secret()
+    keyring = get_keyring()
     expires_delta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     now = datetime.now(timezone.utc)
     expire = now + expires_delta
@@ -89,7 +225,7 @@ def create_access_token(user_id: str, email: str | None = None) -> tuple[str, in
     if email:
         payload['email'] = email
 
-    token = jwt.encode(payload, secret, algorithm='HS256')
+    token = keyring.sign(payload)
     return token, int(expires_delta.total_seconds())
 
 
@@ -137,22 +273,12 @@ def exchange_code_for_token(
     if device_id:
         data['device_id'] = device_id
 
-    request = Request(
-        VK_TOKEN_URL,
-        data=urlencode(data).encode('utf-8'),
-        headers={'Content-Type': 'application/x-www-form-urlencoded'},
-        method='POST'
-    )
-
+    # The authorization code is single-use, so no retries once the request is sent
+    result = http_client.client.post(VK_TOKEN_URL, data=data, breaker=VK_ID_BREAKER)
     try:
-        with urlopen(request, timeout=10) as response:
-            return json.loads(response.read().decode())
-    except HTTPError as e:
-        error_body = e.read().decode()
-        try:
-            return json.loads(error_body)
-        except json.JSONDecodeError:
-            return {'error': 'http_error', 'error_description': 'VK API request failed'}
+        return result.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return {'error': 'http_error', 'error_description': 'VK API request failed'}
 
 
 def get_vk_user_info(access_token: str, client_id: str) -> dict:
@@ -162,16 +288,8 @@ def get_vk_user_info(access_token: str, client_id: str) -> dict:
         'client_id': client_id
     }
 
-    request = Request(
-        VK_USER_INFO_URL,
-        data=urlencode(data).encode('utf-8'),
-        headers={'Content-Type': 'application/x-www-form-urlencoded'},
-        method='POST'
-    )
-
-    with urlopen(request, timeout=10) as response:
-        result = json.loads(response.read().decode())
-        return result.get('user', {})
+    result = http_client.client.post(VK_USER_INFO_URL, data=data, idempotent=True, breaker=VK_ID_BREAKER)
+    return result.raise_for_status().json().get('user', {})
 
 
 # =============================================================================
@@ -290,8 +408,8 @@ def handle_callback(event: dict, origin: str) -> dict:
         return error(500, 'Server configuration error', origin)
 
     try:
-        # Validate JWT_SECRET early
-        get_jwt_secret()
+        # Validate JWT keys early
+        get_keyring()
     except ValueError:
         return error(500, 'Server configuration error', origin)
 
@@ -317,63 +435,40 @@ def handle_callback(event: dict, origin: str) -> dict:
         full_name = f"{first_name} {last_name}".strip()
 
         # Find or create user
-        S = get_schema()
         conn = get_connection()
 
         try:
             cur = conn.cursor()
             now = datetime.now(timezone.utc).isoformat()
 
-            # Cleanup expired tokens periodically
-            cleanup_expired_tokens(cur, S)
-
             # 1. Check if user exists by vk_id
-            cur.execute(
-                f"SELECT id, email, name, avatar_url FROM {S}users WHERE vk_id = %s",
-                (str(vk_user_id),)
-            )
+            db.execute(cur, USER_BY_VK_ID, (str(vk_user_id),))
             row = cur.fetchone()
 
             if row:
                 user_id, email, name, db_avatar = row
                 user_id = str(user_id)
-                cur.execute(
-                    f"UPDATE {S}users SET last_login_at = %s, updated_at = %s WHERE id = %s",
-                    (now, now, user_id)
-                )
+                db.execute(cur, TOUCH_LOGIN, (now, now, user_id))
                 email = email or vk_email
                 name = name or full_name
                 photo_url = db_avatar or photo_url
             else:
                 # 2. Check if user exists by email - link VK account
                 if vk_email:
-                    cur.execute(
-                        f"SELECT id, name, avatar_url FROM {S}users WHERE email = %s",
-                        (vk_email,)
-                    )
+                    db.execute(cur, USER_BY_EMAIL, (vk_email,))
                     row = cur.fetchone()
 
                 if vk_email and row:
                     user_id, db_name, db_avatar = row
                     user_id = str(user_id)
-                    cur.execute(
-                        f"""UPDATE {S}users
-                            SET vk_id = %s, avatar_url = COALESCE(avatar_url, %s),
-                                last_login_at = %s, updated_at = %s
-                            WHERE id = %s""",
-                        (str(vk_user_id), photo_url, now, now, user_id)
-                    )
+                    db.execute(cur, LINK_VK_ACCOUNT, (str(vk_user_id), photo_url, now, now, user_id))
                     email = vk_email
                     name = db_name or full_name
                     photo_url = db_avatar or photo_url
                 else:
-                    cur.execute(
-                        f"""INSERT INTO {S}users
-                            (vk_id, email, name, avatar_url, email_verified, password_hash, role, created_at, updated_at, last_login_at)
-                            VALUES (%s, %s, %s, %s, TRUE, '', 'seeker', %s, %s, %s)
-                            RETURNING id""",
-                        (str(vk_user_id), vk_email, full_name or 'Пользователь VK', photo_url, now, now, now)
-                    )
+                    db.execute(cur, CREATE_USER, (
+                        str(vk_user_id), vk_email, full_name or 'Пользователь VK', photo_url, now, now, now
+                    ))
                     user_id = str(cur.fetchone()[0])
                     email = vk_email
                     name = full_name
@@ -385,11 +480,7 @@ def handle_callback(event: dict, origin: str) -> dict:
             refresh_expires = (datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)).isoformat()
 
             # Store hashed refresh token
-            cur.execute(
-                f"""INSERT INTO {S}refresh_tokens (user_id, token_hash, expires_at, created_at)
-                    VALUES (%s, %s, %s, %s)""",
-                (user_id, refresh_token_hash, refresh_expires, now)
-            )
+            db.execute(cur, STORE_REFRESH_TOKEN, (user_id, refresh_token_hash, refresh_expires, now))
 
             conn.commit()
 
@@ -414,7 +505,11 @@ def handle_callback(event: dict, origin: str) -> dict:
         finally:
             conn.close()
 
-    except HTTPError as e:
+    except circuit.Unavailable as e:
+        result = error(503, f'VK ID temporarily unavailable: {str(e)}', origin)
+        result['headers']['Retry-After'] = str(max(1, e.retry_after))
+        return result
+    except HttpError as e:
         return error(500, f'VK API error: {str(e)}', origin)
     except Exception as e:
         import traceback
@@ -438,34 +533,23 @@ def handle_refresh(event: dict, origin: str) -> dict:
         return error(400, 'refresh_token is required', origin)
 
     try:
-        get_jwt_secret()
+        get_keyring()
     except ValueError:
         return error(500, 'Server configuration error', origin)
 
-    S = get_schema()
     conn = get_connection()
 
     try:
         cur = conn.cursor()
         now = datetime.now(timezone.utc)
 
-        # Cleanup expired tokens
-        cleanup_expired_tokens(cur, S)
-
         # Hash the provided token to compare with stored hash
         token_hash = hash_token(refresh_token)
 
-        cur.execute(
-            f"""SELECT rt.user_id, u.email, u.name, u.avatar_url, u.vk_id
-                FROM {S}refresh_tokens rt
-                JOIN {S}users u ON u.id = rt.user_id
-                WHERE rt.token_hash = %s AND rt.expires_at > %s""",
-            (token_hash, now.isoformat())
-        )
+        db.execute(cur, REFRESH_TOKEN_USER, (token_hash, now.isoformat()))
 
         row = cur.fetchone()
         if not row:
-            conn.commit()  # Commit cleanup
             return error(401, 'Invalid or expired refresh token', origin)
 
         user_id, email, name, avatar_url, vk_id = row
@@ -473,8 +557,6 @@ def handle_refresh(event: dict, origin: str) -> dict:
 
         access_token, expires_in = create_access_token(user_id, email)
 
-        conn.commit()
-
         return response(200, {
             'access_token': access_token,
             'expires_in': expires_in,
@@ -506,17 +588,11 @@ def handle_logout(event: dict, origin: str) -> dict:
 
     refresh_token = payload.get('refresh_token', '')
     if refresh_token:
-        S = get_schema()
         conn = get_connection()
         try:
             cur = conn.cursor()
             token_hash = hash_token(refresh_token)
-            cur.execute(
-                f"DELETE FROM {S}refresh_tokens WHERE token_hash = %s",
-                (token_hash,)
-            )
-            # Also cleanup expired tokens
-            cleanup_expired_tokens(cur, S)
+            db.execute(cur, DELETE_REFRESH_TOKEN, (token_hash,))
             conn.commit()
         except Exception:
             pass
@@ -552,8 +628,12 @@ def handle_update_role(event: dict, origin: str) -> dict:
         return error(401, 'Токен не указан', origin)
 
     try:
-        secret = get_jwt_secret()
-        decoded = jwt.decode(token, secret, algorithms=['HS256'])
+        keyring = get_keyring()
+    except ValueError:
+        return error(500, 'Server configuration error', origin)
+
+    try:
+        decoded = keyring.verify(token)
         user_id = decoded.get('sub')
     except jwt.ExpiredSignatureError:
         return error(401, 'Токен истёк', origin)
@@ -563,14 +643,10 @@ def handle_update_role(event: dict, origin: str) -> dict:
     if not user_id:
         return error(401, 'Недействительный токен', origin)
 
-    S = get_schema()
     conn = get_connection()
     try:
         cur = conn.cursor()
-        cur.execute(
-            f"UPDATE {S}users SET role = %s, updated_at = %s WHERE id = %s RETURNING id",
-            (new_role, datetime.now(timezone.utc).isoformat(), user_id)
-        )
+        db.execute(cur, UPDATE_ROLE, (new_role, datetime.now(timezone.utc).isoformat(), user_id))
         row = cur.fetchone()
         if not row:
             return error(404, 'Пользователь не найден', origin)
@@ -583,12 +659,60 @@ def handle_update_role(event: dict, origin: str) -> dict:
         conn.close()
 
 
+def is_sweep_authorized(event: dict) -> bool:
+    """Check the X-Sweep-Token header against SWEEP_TOKEN; unset SWEEP_TOKEN allows nothing."""
+    expected = os.environ.get('SWEEP_TOKEN', '')
+    if not expected:
+        return False
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == 'x-sweep-token':
+            return hmac.compare_digest(str(value).encode(), expected.encode())
+    return False
+
+
+def handle_sweep(event: dict, origin: str) -> dict:
+    """Remove expired refresh tokens.
+
+    Meant for a scheduled trigger that sends the shared secret from SWEEP_TOKEN in the
+    X-Sweep-Token header. Without SWEEP_TOKEN configured the action is disabled.
+    """
+    if not is_sweep_authorized(event):
+        return error(403, 'Forbidden', origin)
+
+    conn = get_connection()
+    try:
+        stats = sweep_expired_tokens(conn)
+    except Exception as e:
+        conn.rollback()
+        return error(500, f'Database error: {str(e)}', origin)
+    finally:
+        conn.close()
+
+    print(f"[sweep] refresh_tokens deleted={stats['deleted']} batches={stats['batches']} duration_ms={stats['duration_ms']}")
+    return response(200, stats, origin)
+
+
 # =============================================================================
 # MAIN HANDLER
 # =============================================================================
 
+ACTION_HANDLERS = {
+    'auth-url': handle_auth_url,
+    'callback': handle_callback,
+    'refresh': handle_refresh,
+    'logout': handle_logout,
+    'update-role': handle_update_role,
+    'sweep': handle_sweep,
+}
+
+
+@metrics.instrument(metrics.param_route('action', ACTION_HANDLERS))
 def handler(event: dict, context) -> dict:
-    """Main handler - routes to specific handlers based on action."""
+    """
+    Main handler - routes to specific handlers based on action.
+    GET ?path=metrics serves Prometheus metrics for this instance.
+    """
+    circuit.start(context)
     origin = get_origin(event)
 
     if event.get('httpMethod') == 'OPTIONS':
@@ -599,15 +723,7 @@ def handler(event: dict, context) -> dict:
     query = event.get('queryStringParameters', {}) or {}
     action = query.get('action', '')
 
-    handlers = {
-        'auth-url': handle_auth_url,
-        'callback': handle_callback,
-        'refresh': handle_refresh,
-        'logout': handle_logout,
-        'update-role': handle_update_role,
-    }
-
-    if action not in handlers:
+    if action not in ACTION_HANDLERS:
         return error(400, f'Unknown action: {action}', origin)
 
-    return handlers[action](event, origin)
\ No newline at end of file
+    return ACTION_HANDLERS[action](event, origin)
\ No newline at end of file
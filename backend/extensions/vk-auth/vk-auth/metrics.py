@@ -0,0 +1,335 @@
+"""
+Метрики функции в текстовом формате Prometheus
+Счетчики, gauge и гистограммы с фиксированными корзинами живут на уровне модуля и
+копятся, пока жив инстанс. Handler, обернутый instrument(), учитывает каждый вызов:
+роут, метод, статус, длительность и сколько из нее ушло на базу и внешние вызовы.
+На GET ?path=metrics с токеном METRICS_TOKEN он отдает все метрики процесса. Запись -
+поиск в словаре и сложение под блокировкой, без ввода-вывода: единицы микросекунд.
+
+Теплые инстансы считают каждый свое, а запрос метрик попадает в один из них, поэтому
+у всех рядов есть метка instance_id: счетчики разных инстансов - разные ряды, и
+rate()/sum() по ним работают как обычно.
+
+Функции деплоятся отдельными папками, поэтому модуль лежит копией рядом с каждым
+index.py. Копии должны оставаться одинаковыми.
+"""
+import functools
+import hmac
+import math
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Метрики отдаются только с заголовком Authorization: Bearer <METRICS_TOKEN>;
+# без заданного токена запрос метрик получает 403
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+INSTANCE_ID = uuid.uuid4().hex[:12]
+STARTED_AT = time.time()
+
+# Секунды: от запроса к базе по индексу до таймаута функции
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Куда уходит время вызова (см. spend)
+DB = 'db'
+OUTBOUND = 'outbound'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _help(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _number(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+class Metric:
+    """
+    Метрика с метками; значения меток передаются позиционно в порядке labels.
+    Ряд создается при первой записи с новым набором значений.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _check(self, labels: Tuple[str, ...]) -> None:
+        if len(labels) != len(self.labels):
+            raise ValueError(f'{self.name}: expected labels {self.labels}, got {labels}')
+
+    def _label_text(self, labels: Tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'instance_id="{INSTANCE_ID}"']
+        pairs.extend(f'{k}="{_escape(str(v))}"' for k, v in zip(self.labels, labels))
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}'
+
+    def _series(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return [(labels, list(v) if isinstance(v, list) else v) for labels, v in self._values.items()]
+
+    def expose(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {_help(self.help)}'
+        yield f'# TYPE {self.name} {self.kind}'
+        for labels, value in sorted(self._series()):
+            yield f'{self.name}{self._label_text(labels)} {_number(value)}'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            value = self._values.get(labels)
+            if value is None:
+                self._check(labels)
+                value = 0
+            self._values[labels] = value + amount
+
+    def set(self, value: float, *labels: str) -> None:
+        """Итог, который считает сам источник (пул, кэш) - из функции on_scrape"""
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = value
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, *labels: str) -> None:
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            value = self._values.get(labels)
+            if value is None:
+                self._check(labels)
+                value = 0
+            self._values[labels] = value + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+
+class Histogram(Metric):
+    """Гистограмма: счетчик на корзину (граница включительно), сумма и число наблюдений"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                self._check(labels)
+                # Счетчики корзин без накопления, последняя - +Inf; затем сумма
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._values.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def expose(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {_help(self.help)}'
+        yield f'# TYPE {self.name} {self.kind}'
+        for labels, series in sorted(self._series()):
+            total = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                total += count
+                le = 'le="' + _number(bound) + '"'
+                yield f'{self.name}_bucket{self._label_text(labels, le)} {total}'
+            yield f'{self.name}_sum{self._label_text(labels)} {_number(series[-1])}'
+            yield f'{self.name}_count{self._label_text(labels)} {total}'
+
+
+_metrics: Dict[str, Metric] = {}
+_collectors: List[Callable[[], None]] = []
+_registry_lock = threading.Lock()
+
+
+def _register(metric: Metric) -> Any:
+    """Метрика по имени, одна на процесс: повторное объявление возвращает существующую"""
+    with _registry_lock:
+        existing = _metrics.get(metric.name)
+        if existing is None:
+            _metrics[metric.name] = metric
+            return metric
+    if type(existing) is not type(metric) or existing.labels != metric.labels:
+        raise ValueError(f'metric {metric.name} already registered as {existing.kind} {existing.labels}')
+    return existing
+
+
+def counter(name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+    return _register(Counter(name, help, labels))
+
+
+def gauge(name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+    return _register(Gauge(name, help, labels))
+
+
+def histogram(name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, labels, buckets))
+
+
+def on_scrape(collect: Callable[[], None]) -> Callable[[], None]:
+    """
+    Регистрирует функцию, которая перед выдачей метрик переносит в них статистику,
+    которую источник уже считает сам (пулы соединений, кэши, breaker-ы)
+    """
+    with _registry_lock:
+        _collectors.append(collect)
+    return collect
+
+
+REQUESTS = counter('function_requests_total', 'Вызовы функции', ('route', 'method', 'status'))
+REQUEST_SECONDS = histogram('function_request_duration_seconds', 'Длительность вызова функции', ('route',))
+REQUEST_DB_SECONDS = histogram('function_request_db_seconds', 'Время вызова в запросах к базе', ('route',))
+REQUEST_OUTBOUND_SECONDS = histogram(
+    'function_request_outbound_seconds', 'Время вызова во внешних HTTP/SMTP-вызовах', ('route',))
+OUTBOUND_SECONDS = histogram('outbound_request_duration_seconds', 'Длительность внешнего вызова', ('host',))
+START_TIME = gauge('process_start_time_seconds', 'Время запуска инстанса (unix)')
+START_TIME.set(STARTED_AT)
+
+_local = threading.local()
+
+
+def spend(kind: str, seconds: float) -> None:
+    """
+    Добавляет время к текущему вызову функции (DB или OUTBOUND). Вне вызова и в
+    фоновых потоках ничего не делает: там время видно только в метриках самих вызовов.
+    """
+    spent = getattr(_local, 'spent', None)
+    if spent is not None:
+        spent[kind] = spent.get(kind, 0.0) + seconds
+
+
+def outbound(host: str, seconds: float) -> None:
+    """Учитывает внешний вызов к host: гистограмма по хостам и время текущего вызова"""
+    OUTBOUND_SECONDS.observe(seconds, host)
+    spend(OUTBOUND, seconds)
+
+
+def exposition() -> str:
+    """Все метрики процесса в текстовом формате Prometheus"""
+    for collect in list(_collectors):
+        try:
+            collect()
+        except Exception as e:
+            print(f'[metrics] collector {getattr(collect, "__name__", collect)} failed: {e}')
+    lines: List[str] = []
+    for metric in list(_metrics.values()):
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+
+def _authorized(event: Dict[str, Any]) -> bool:
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == 'authorization':
+            return hmac.compare_digest(str(value).encode(), f'Bearer {METRICS_TOKEN}'.encode())
+    return False
+
+
+def scrape(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Ответ на запрос метрик"""
+    if not METRICS_TOKEN:
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'text/plain; charset=utf-8'},
+            'body': 'Forbidden\n',
+            'isBase64Encoded': False
+        }
+    if not _authorized(event):
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'text/plain; charset=utf-8', 'WWW-Authenticate': 'Bearer'},
+            'body': 'Unauthorized\n',
+            'isBase64Encoded': False
+        }
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': CONTENT_TYPE, 'Cache-Control': 'no-store'},
+        'body': exposition(),
+        'isBase64Encoded': False
+    }
+
+
+def param_route(name: str, known: Iterable[str], default: Optional[str] = None) -> Callable[[Dict[str, Any]], str]:
+    """
+    route для instrument: значение параметра запроса name (или default, если его нет).
+    Незнакомые значения - 'other', чтобы число рядов не зависело от запросов.
+    """
+    known = frozenset(known)
+
+    def route(event: Dict[str, Any]) -> str:
+        value = (event.get('queryStringParameters') or {}).get(name, default)
+        return value if value in known else 'other'
+
+    return route
+
+
+def instrument(route: Callable[[Dict[str, Any]], str]) -> Callable:
+    """
+    Декоратор handler: GET ?path=metrics отдает метрики, остальные вызовы учитываются.
+    route(event) - имя роута для меток; значения должны быть из конечного набора.
+    Необработанное исключение учитывается со статусом exception и пробрасывается дальше.
+    """
+
+    def decorate(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable:
+        @functools.wraps(handler)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            method = str(event.get('httpMethod') or 'GET').upper()
+            if method == 'GET' and (event.get('queryStringParameters') or {}).get('path') == 'metrics':
+                return scrape(event)
+            try:
+                name = route(event)
+            except Exception:
+                name = 'other'
+            spent = _local.spent = {}
+            status = 'exception'
+            started = time.perf_counter()
+            try:
+                response = handler(event, context)
+                if isinstance(response, dict):
+                    status = str(response.get('statusCode', 200))
+                return response
+            finally:
+                elapsed = time.perf_counter() - started
+                _local.spent = None
+                REQUESTS.inc(name, method, status)
+                REQUEST_SECONDS.observe(elapsed, name)
+                REQUEST_DB_SECONDS.observe(spent.get(DB, 0.0), name)
+                REQUEST_OUTBOUND_SECONDS.observe(spent.get(OUTBOUND, 0.0), name)
+
+        return wrapper
+
+    return decorate
@@ -1,20 +1,79 @@
+import base64
+import binascii
 import json
 import os
 import uuid
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 from datetime import datetime
-import psycopg2
 from psycopg2.extras import RealDictCursor
-import urllib.request
 import urllib.parse
 import hashlib
+import threading
+import circuit
+import db
+import http_client
+import metrics
+
+
+PALLY_API_URL = os.environ.get('PALLY_API_URL', 'https://pally.info/api/v1')
+
+# Не больше PALLY_MAX_IN_FLIGHT одновременных запросов к Pally на инстанс;
+# остальные ждут слот не дольше PALLY_SLOT_TIMEOUT секунд
+PALLY_MAX_IN_FLIGHT = int(os.environ.get('PALLY_MAX_IN_FLIGHT', '8'))
+PALLY_SLOT_TIMEOUT = float(os.environ.get('PALLY_SLOT_TIMEOUT', '5'))
+PALLY_SLOTS = threading.BoundedSemaphore(PALLY_MAX_IN_FLIGHT)
+# Медленный или падающий Pally отключается на паузу: платежи не ждут его таймаута
+PALLY_BREAKER = circuit.breaker('pally', slow_call=5)
+
+# Счет Pally не создан - клиент получает демо-ссылку, поэтому исходы считаются отдельно
+PALLY_BILLS = metrics.counter(
+    'payments_pally_bills_total', 'Создание счетов Pally (created, rejected, unavailable, error, not_configured)',
+    ('result',))
+WEBHOOK_OUTCOMES = metrics.counter(
+    'payments_webhook_outcomes_total', 'Уведомления об оплате (credited, duplicate, not_found)', ('outcome',))
 
 
 def get_db_connection():
-    """Создает подключение к базе данных"""
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    """Соединение из пула (conn.close() возвращает его в пул)"""
+    return db.connect()
+
+
+# Транзакция создается, только если пользователь существует
+CREATE_TRANSACTION = db.statement('payments_create_transaction', """
+    INSERT INTO transactions (id, user_id, amount, type, payment_system, status, description, payment_url)
+    SELECT %s, id, %s, 'deposit', %s, 'pending', %s, %s
+    FROM users WHERE id = %s
+    RETURNING id
+""")
+
+SET_PAYMENT_URL = db.statement('payments_set_payment_url', """
+    UPDATE transactions SET payment_url = %s, updated_at = NOW()
+    WHERE id = %s
+""")
+
+PAYMENT_STATUS = db.statement('payments_status', """
+    SELECT id, user_id, amount, type, payment_system, status, payment_url, created_at, updated_at
+    FROM transactions
+    WHERE id = %s
+""")
+
+
+def route_name(event: Dict[str, Any]) -> str:
+    """Роут для метрик: в path бывают id, поэтому - по виду запроса, как в handler"""
+    method = event.get('httpMethod', 'GET')
+    path = (event.get('queryStringParameters') or {}).get('path', '')
+    if method == 'POST' and 'create-payment' in path:
+        return 'create-payment'
+    if method == 'POST' and 'webhook' in path:
+        return 'webhook'
+    if method == 'GET' and 'transactions' in path:
+        return 'transactions'
+    if method == 'GET' and path:
+        return 'payment-status'
+    return 'other'
 
 
+@metrics.instrument(route_name)
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     API для работы с платежами через Pally и ЮMoney
@@ -23,7 +82,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     - POST /create-payment - Создание платежа
     - POST /webhook - Обработка уведомлений от платежных систем
     - GET /payment/:id - Получение статуса платежа
+    - GET /transactions/:user_id - История транзакций (cursor, limit, type, status, from, to)
+    - GET ?path=metrics - Метрики в формате Prometheus
     """
+    circuit.start(context)
     method = event.get('httpMethod', 'GET')
     
     # CORS
@@ -33,7 +95,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Read-After',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -51,9 +113,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return handle_webhook(body, event.get('headers', {}))
         elif method == 'GET' and 'transactions' in path:
             user_id = path.split('/')[-1]
-            return get_user_transactions(user_id)
+            return get_user_transactions(user_id, event.get('queryStringParameters') or {}, db.read_after(event))
         elif method == 'GET' and path:
-            return get_payment_status(path.split('/')[-1])
+            return get_payment_status(path.split('/')[-1], db.read_after(event))
         else:
             return {
                 'statusCode': 404,
@@ -89,54 +151,55 @@ def create_payment(data: Dict[str, Any]) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    transaction_id = str(uuid.uuid4())
+    # ЮMoney - ссылка собирается локально и пишется сразу, Pally - после ответа провайдера
+    payment_url = None if payment_system == 'pally' else create_yoomoney_payment(transaction_id, amount, return_url)
     
+    # Короткая запись: транзакция создается, только если пользователь существует
+    conn = get_db_connection()
+    conn.autocommit = True
     try:
-        # Проверяем существование пользователя
-        cur.execute('SELECT id FROM users WHERE id = %s', (user_id,))
-        if not cur.fetchone():
-            return {
-                'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Пользователь не найден'}),
-                'isBase64Encoded': False
-            }
-        
-        # Создаем транзакцию
-        transaction_id = str(uuid.uuid4())
-        cur.execute("""
-            INSERT INTO transactions (id, user_id, amount, type, payment_system, status, description)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """, (transaction_id, user_id, amount, 'deposit', payment_system, 'pending', f'Пополнение баланса через {payment_system}'))
-        
-        conn.commit()
-        
-        # Формируем ссылку на оплату
-        if payment_system == 'pally':
-            payment_url = create_pally_payment(transaction_id, amount, return_url)
-        else:  # yoomoney
-            payment_url = create_yoomoney_payment(transaction_id, amount, return_url)
-        
+        with conn.cursor() as cur:
+            db.execute(cur, CREATE_TRANSACTION, (
+                transaction_id, amount, payment_system, f'Пополнение баланса через {payment_system}', payment_url, user_id
+            ))
+            created = cur.fetchone()
+        position = db.write_position(conn)
+    finally:
+        conn.close()
+    
+    if not created:
         return {
-            'statusCode': 200,
+            'statusCode': 404,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'success': True,
-                'transaction_id': transaction_id,
-                'payment_url': payment_url,
-                'amount': amount
-            }),
+            'body': json.dumps({'error': 'Пользователь не найден'}),
             'isBase64Encoded': False
         }
-        
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cur.close()
-        conn.close()
+    
+    if payment_system == 'pally':
+        # Соединение с БД уже возвращено - ожидание провайдера не держит коннект Postgres
+        payment_url = create_pally_payment(transaction_id, amount, return_url)
+        conn = get_db_connection()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                db.execute(cur, SET_PAYMENT_URL, (payment_url, transaction_id))
+            position = db.write_position(conn)
+        finally:
+            conn.close()
+    
+    # Следующее чтение клиента (статус платежа, история) увидит транзакцию и на реплике
+    return db.with_write_position({
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'success': True,
+            'transaction_id': transaction_id,
+            'payment_url': payment_url,
+            'amount': amount
+        }),
+        'isBase64Encoded': False
+    }, position)
 
 
 def create_pally_payment(transaction_id: str, amount: float, return_url: str) -> str:
@@ -148,6 +211,7 @@ def create_pally_payment(transaction_id: str, amount: float, return_url: str) ->
     
     if not api_key:
         print('⚠️ PALLY_API_KEY не настроен')
+        PALLY_BILLS.inc('not_configured')
         return f'https://demo-payment.pally.info?amount={amount}&order={transaction_id}'
     
     try:
@@ -163,29 +227,42 @@ def create_pally_payment(transaction_id: str, amount: float, return_url: str) ->
         print(f'📤 Создание платежа Pally: {payload}')
         
         headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
+            'Authorization': f'Bearer {api_key}'
         }
         
-        req = urllib.request.Request(
-            'https://pally.info/api/v1/bill/create',
-            data=json.dumps(payload).encode('utf-8'),
-            headers=headers,
-            method='POST'
-        )
-        
-        with urllib.request.urlopen(req, timeout=30) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            print(f'✅ Ответ Pally: {result}')
-            
-            if result.get('success') and result.get('data'):
-                return result['data'].get('url', '#')
-            else:
-                print(f'❌ Ошибка Pally: {result}')
-                return f'https://demo-payment.pally.info?amount={amount}&order={transaction_id}'
+        # Открытый breaker - отказ до ожидания слота
+        if not PALLY_BREAKER.available():
+            raise circuit.CircuitOpenError('pally: circuit open', PALLY_BREAKER.retry_after())
+        if not PALLY_SLOTS.acquire(timeout=circuit.timeout(PALLY_SLOT_TIMEOUT, 'pally')):
+            raise http_client.HttpError(f'Pally: нет свободного слота за {PALLY_SLOT_TIMEOUT} с')
+        try:
+            response = http_client.client.post(
+                f'{PALLY_API_URL}/bill/create',
+                json_body=payload,
+                headers=headers,
+                read_timeout=15,
+                breaker=PALLY_BREAKER
+            )
+        finally:
+            PALLY_SLOTS.release()
+        result = response.json()
+        print(f'✅ Ответ Pally: {result}')
+        
+        if result.get('success') and result.get('data'):
+            PALLY_BILLS.inc('created')
+            return result['data'].get('url', '#')
+        else:
+            print(f'❌ Ошибка Pally: {result}')
+            PALLY_BILLS.inc('rejected')
+            return f'https://demo-payment.pally.info?amount={amount}&order={transaction_id}'
             
+    except circuit.Unavailable as e:
+        print(f'⚠️ Pally не запрашивается: {e}')
+        PALLY_BILLS.inc('unavailable')
+        return f'https://demo-payment.pally.info?amount={amount}&order={transaction_id}'
     except Exception as e:
         print(f'❌ Ошибка создания платежа Pally: {e}')
+        PALLY_BILLS.inc('error')
         import traceback
         traceback.print_exc()
         return f'https://demo-payment.pally.info?amount={amount}&order={transaction_id}'
@@ -234,10 +311,80 @@ def handle_webhook(data: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, A
         }
 
 
+# Проведение платежа одним запросом: переход pending -> completed и запись в журнал баланса.
+# Истекшее пополнение (expired, admin ?path=expire-pending) проводится так же - деньги пришли.
+# Повторная или параллельная доставка webhook не проходит условие на статус
+# (вторая ждет блокировку строки и перепроверяет его), поэтому баланс зачисляется ровно раз.
+# Зачисление - вставка в balance_ledger, строка пользователя не блокируется.
+# status в подзапросе читается из снимка до UPDATE: NULL - транзакции нет.
+COMPLETE_TRANSACTION = db.statement('payments_complete_transaction', """
+    WITH t AS (
+        UPDATE transactions
+        SET status = 'completed', payment_id = %(payment_id)s, updated_at = NOW()
+        WHERE id = %(transaction_id)s AND status IN ('pending', 'expired')
+        RETURNING id, user_id, payment_system, COALESCE(%(amount)s::numeric, amount) AS credit
+    ), credited AS (
+        INSERT INTO balance_ledger (user_id, amount, source, reference)
+        SELECT user_id, credit, COALESCE(payment_system, 'payment'), id::text
+        FROM t
+        RETURNING amount AS credit
+    )
+    SELECT
+        (SELECT credit FROM credited) AS credit,
+        (SELECT status FROM transactions WHERE id = %(transaction_id)s) AS status
+""")
+
+
+def complete_transaction(transaction_id: str, payment_id: Any, amount: Any = None) -> Dict[str, Any]:
+    """
+    Проводит pending- или expired-транзакцию и зачисляет сумму (amount или сумму транзакции)
+    Возвращает {'outcome': 'credited' | 'duplicate' | 'not_found', 'credit': ...}
+    """
+    conn = get_db_connection()
+    # Один оператор атомарен сам по себе - без отдельного COMMIT (лишний round trip)
+    conn.autocommit = True
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            db.execute(cur, COMPLETE_TRANSACTION, {
+                'transaction_id': transaction_id,
+                'payment_id': payment_id,
+                'amount': amount
+            })
+            row = cur.fetchone()
+    finally:
+        conn.close()
+    
+    if row['credit'] is not None:
+        return {'outcome': 'credited', 'credit': float(row['credit'])}
+    if row['status'] is None:
+        return {'outcome': 'not_found', 'credit': None}
+    return {'outcome': 'duplicate', 'credit': None}
+
+
+def webhook_response(result: Dict[str, Any]) -> Dict[str, Any]:
+    WEBHOOK_OUTCOMES.inc(result['outcome'])
+    if result['outcome'] == 'not_found':
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Transaction not found'}),
+            'isBase64Encoded': False
+        }
+    body = {'success': True}
+    if result['outcome'] == 'duplicate':
+        body['message'] = 'Already processed'
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(body),
+        'isBase64Encoded': False
+    }
+
+
 def handle_yoomoney_webhook(data: Dict[str, Any]) -> Dict[str, Any]:
     """Обработка webhook от ЮMoney"""
     transaction_id = data.get('label')
-    amount = float(data.get('withdraw_amount', 0))
+    withdraw_amount = data.get('withdraw_amount')
     operation_id = data.get('operation_id')
     
     if not transaction_id:
@@ -248,60 +395,13 @@ def handle_yoomoney_webhook(data: Dict[str, Any]) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    try:
-        # Находим транзакцию
-        cur.execute('SELECT * FROM transactions WHERE id = %s', (transaction_id,))
-        transaction = cur.fetchone()
-        
-        if not transaction:
-            return {
-                'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Transaction not found'}),
-                'isBase64Encoded': False
-            }
-        
-        # Проверяем что транзакция еще не обработана
-        if transaction['status'] == 'completed':
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'message': 'Already processed'}),
-                'isBase64Encoded': False
-            }
-        
-        # Обновляем статус транзакции
-        cur.execute("""
-            UPDATE transactions
-            SET status = 'completed', payment_id = %s, updated_at = NOW()
-            WHERE id = %s
-        """, (operation_id, transaction_id))
-        
-        # Пополняем баланс пользователя
-        cur.execute("""
-            UPDATE users
-            SET balance = balance + %s
-            WHERE id = %s
-        """, (amount, transaction['user_id']))
-        
-        conn.commit()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'success': True}),
-            'isBase64Encoded': False
-        }
-        
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cur.close()
-        conn.close()
+    # Зачисляется фактически списанная сумма, без нее - сумма транзакции
+    result = complete_transaction(
+        transaction_id,
+        operation_id,
+        float(withdraw_amount) if withdraw_amount not in (None, '') else None
+    )
+    return webhook_response(result)
 
 
 def handle_pally_webhook(data: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
@@ -309,11 +409,10 @@ def handle_pally_webhook(data: Dict[str, Any], headers: Dict[str, str]) -> Dict[
     print(f'🔔 Webhook от Pally: {data}')
     
     transaction_id = data.get('order_id')
-    amount = float(data.get('amount', 0)) / 100  # Из копеек в рубли
     status = data.get('status')
     payment_id = data.get('payment_id')
     
-    print(f'📊 Данные: transaction_id={transaction_id}, amount={amount}, status={status}')
+    print(f'📊 Данные: transaction_id={transaction_id}, status={status}')
     
     if status != 'success':
         print(f'⚠️ Статус не success: {status}')
@@ -324,75 +423,28 @@ def handle_pally_webhook(data: Dict[str, Any], headers: Dict[str, str]) -> Dict[
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
     try:
-        cur.execute('SELECT * FROM transactions WHERE id = %s', (transaction_id,))
-        transaction = cur.fetchone()
-        
-        if not transaction:
-            print(f'❌ Транзакция не найдена: {transaction_id}')
-            return {
-                'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Transaction not found'}),
-                'isBase64Encoded': False
-            }
-        
-        if transaction['status'] == 'completed':
-            print(f'⚠️ Транзакция уже обработана: {transaction_id}')
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
-        
-        print(f'💰 Пополнение баланса: user_id={transaction["user_id"]}, amount={transaction["amount"]}')
-        
-        cur.execute("""
-            UPDATE transactions
-            SET status = 'completed', payment_id = %s, updated_at = NOW()
-            WHERE id = %s
-        """, (payment_id, transaction_id))
-        
-        cur.execute("""
-            UPDATE users
-            SET balance = balance + %s
-            WHERE id = %s
-        """, (transaction['amount'], transaction['user_id']))
-        
-        conn.commit()
-        print(f'✅ Баланс пополнен успешно: {transaction["user_id"]}')
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'success': True}),
-            'isBase64Encoded': False
-        }
-        
+        result = complete_transaction(transaction_id, payment_id)
     except Exception as e:
-        conn.rollback()
         print(f'❌ Ошибка обработки Pally webhook: {e}')
-        raise e
-    finally:
-        cur.close()
-        conn.close()
+        raise
+    
+    if result['outcome'] == 'credited':
+        print(f'✅ Баланс пополнен успешно: transaction_id={transaction_id}, amount={result["credit"]}')
+    elif result['outcome'] == 'duplicate':
+        print(f'⚠️ Транзакция уже обработана: {transaction_id}')
+    else:
+        print(f'❌ Транзакция не найдена: {transaction_id}')
+    return webhook_response(result)
 
 
-def get_payment_status(transaction_id: str) -> Dict[str, Any]:
-    """Получение статуса платежа"""
-    conn = get_db_connection()
+def get_payment_status(transaction_id: str, read_after: Optional[str] = None) -> Dict[str, Any]:
+    """Получение статуса платежа (с реплики, если она проиграла read_after)"""
+    conn = db.connect_read(read_after)
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        cur.execute("""
-            SELECT id, user_id, amount, type, payment_system, status, created_at, updated_at
-            FROM transactions
-            WHERE id = %s
-        """, (transaction_id,))
+        db.execute(cur, PAYMENT_STATUS, (transaction_id,))
         
         transaction = cur.fetchone()
         
@@ -416,6 +468,7 @@ def get_payment_status(transaction_id: str) -> Dict[str, Any]:
                     'type': transaction['type'],
                     'payment_system': transaction['payment_system'],
                     'status': transaction['status'],
+                    'payment_url': transaction['payment_url'],
                     'created_at': transaction['created_at'].isoformat(),
                     'updated_at': transaction['updated_at'].isoformat()
                 }
@@ -428,40 +481,131 @@ def get_payment_status(transaction_id: str) -> Dict[str, Any]:
         conn.close()
 
 
-def get_user_transactions(user_id: str) -> Dict[str, Any]:
-    """Получение истории транзакций пользователя"""
-    conn = get_db_connection()
+TRANSACTIONS_PAGE_SIZE = 50
+TRANSACTIONS_MAX_PAGE_SIZE = 100
+
+# Фильтры истории: страница и сводка строятся по одному и тому же набору условий
+TRANSACTION_FILTERS = """
+    user_id = %(user_id)s::uuid
+    AND (%(type)s::text IS NULL OR type = %(type)s)
+    AND (%(status)s::text IS NULL OR status = %(status)s)
+    AND (%(date_from)s::timestamp IS NULL OR created_at >= %(date_from)s::timestamp)
+    AND (%(date_to)s::timestamp IS NULL OR created_at < %(date_to)s::timestamp)
+"""
+
+# Страница по ключу (created_at, id) идет по индексу idx_transactions_user_created
+# и стоит одинаково на любой глубине; сводка по типам считается только для первой страницы
+# Не в каталоге: условия "параметр IS NULL OR ..." сворачиваются только в плане под значения
+TRANSACTIONS_PAGE_SQL = f"""
+    SELECT
+        (SELECT COALESCE(json_agg(p ORDER BY p.created_at DESC, p.id DESC), '[]'::json)
+         FROM (
+            SELECT id, user_id, amount, type, payment_system, status, description,
+                   created_at, updated_at
+            FROM transactions
+            WHERE {TRANSACTION_FILTERS}
+            AND (%(after_created)s::timestamp IS NULL
+                 OR (created_at, id) < (%(after_created)s::timestamp, %(after_id)s::uuid))
+            ORDER BY created_at DESC, id DESC
+            LIMIT %(limit)s + 1
+         ) p) AS items,
+        (SELECT json_object_agg(s.type, json_build_object('count', s.count, 'total', s.total))
+         FROM (
+            SELECT type, count(*) AS count, COALESCE(sum(amount), 0) AS total
+            FROM transactions
+            WHERE {TRANSACTION_FILTERS}
+            GROUP BY type
+         ) s
+         WHERE %(after_created)s::timestamp IS NULL) AS summary
+"""
+
+
+def encode_cursor(created_at: str, transaction_id: str) -> str:
+    return base64.urlsafe_b64encode(f'{created_at}|{transaction_id}'.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Курсор -> (created_at, id); ValueError, если курсор испорчен"""
+    try:
+        created_at, transaction_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(created_at).isoformat(), str(uuid.UUID(transaction_id))
+    except (UnicodeError, binascii.Error) as e:
+        raise ValueError(str(e))
+
+
+def transaction_filters(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Фильтры из query-параметров: type, status, from, to (ISO-даты); ValueError на неверных"""
+    filters = {
+        'type': params.get('type') or None,
+        'status': params.get('status') or None,
+        'date_from': None,
+        'date_to': None,
+    }
+    for param, key in (('from', 'date_from'), ('to', 'date_to')):
+        if params.get(param):
+            filters[key] = datetime.fromisoformat(params[param]).isoformat()
+    return filters
+
+
+def get_user_transactions(user_id: str, params: Dict[str, Any], read_after: Optional[str] = None) -> Dict[str, Any]:
+    """
+    История транзакций пользователя постранично
+    Параметры: limit, cursor (nextCursor предыдущей страницы), type, status, from, to.
+    Сводка по типам (count, total) приходит с первой страницей - без cursor.
+    Читается с реплики, если она проиграла read_after (X-Read-After).
+    """
+    try:
+        user_id = str(uuid.UUID(user_id))
+        limit = min(max(int(params.get('limit') or TRANSACTIONS_PAGE_SIZE), 1), TRANSACTIONS_MAX_PAGE_SIZE)
+        query = transaction_filters(params)
+        query['after_created'], query['after_id'] = decode_cursor(params['cursor']) if params.get('cursor') else (None, None)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'Invalid parameters: {e}'}),
+            'isBase64Encoded': False
+        }
+    query.update(user_id=user_id, limit=limit)
+
+    conn = db.connect_read(read_after)
+    conn.autocommit = True
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        cur.execute("""
-            SELECT id, user_id, amount, type, payment_system, status, description, 
-                   created_at, updated_at
-            FROM transactions
-            WHERE user_id = %s
-            ORDER BY created_at DESC
-            LIMIT 50
-        """, (user_id,))
-        
-        transactions = cur.fetchall()
+        cur.execute(TRANSACTIONS_PAGE_SQL, query)
+        row = cur.fetchone()
+        transactions = row['items']
+        next_cursor = None
+        if len(transactions) > limit:
+            transactions = transactions[:limit]
+            next_cursor = encode_cursor(transactions[-1]['created_at'], transactions[-1]['id'])
+        
+        body = {
+            'success': True,
+            'transactions': [{
+                'id': t['id'],
+                'user_id': t['user_id'],
+                'amount': float(t['amount']),
+                'type': t['type'],
+                'payment_system': t['payment_system'],
+                'status': t['status'],
+                'description': t['description'],
+                'created_at': t['created_at'],
+                'updated_at': t['updated_at']
+            } for t in transactions],
+            'nextCursor': next_cursor
+        }
+        if row['summary'] is not None or not params.get('cursor'):
+            body['summary'] = {
+                tx_type: {'count': totals['count'], 'total': float(totals['total'])}
+                for tx_type, totals in (row['summary'] or {}).items()
+            }
         
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'success': True,
-                'transactions': [{
-                    'id': str(t['id']),
-                    'user_id': str(t['user_id']),
-                    'amount': float(t['amount']),
-                    'type': t['type'],
-                    'payment_system': t['payment_system'],
-                    'status': t['status'],
-                    'description': t['description'],
-                    'created_at': t['created_at'].isoformat(),
-                    'updated_at': t['updated_at'].isoformat()
-                } for t in transactions]
-            }),
+            'body': json.dumps(body),
             'isBase64Encoded': False
         }
         
@@ -0,0 +1,292 @@
+"""
+Сверка платежей с выпиской провайдера
+
+Выписка (CSV, JSON Lines или JSON-массив) читается потоком, записи провайдера из базы -
+серверным курсором. Обе стороны раскладываются по файлам-разделам по хэшу ключа,
+затем каждый раздел сверяется хэш-соединением в памяти: память ограничена одним
+разделом, а не всей выпиской.
+
+Запуск:
+    DATABASE_URL=... python reconcile.py --provider pally statement.csv \\
+        [--since 2024-01-01 --until 2024-02-01] [--output mismatches.jsonl]
+
+Расхождения пишутся JSON-строками, итог - в stderr:
+- missing_in_db: платеж есть в выписке, в базе его нет
+- missing_in_statement: в базе зачислен, в выписке его нет
+- duplicate_in_statement: ключ встречается в выписке несколько раз
+- amount_mismatch: суммы в выписке и в базе различаются
+- not_settled: провайдер деньги получил, а в базе запись не зачислена
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+import psycopg2
+
+
+# Поля выписки по умолчанию - те же, что провайдеры присылают в уведомлениях
+PROVIDERS = {
+    'pally': {'id_field': 'order_id', 'amount_field': 'amount'},
+    'yoomoney': {'id_field': 'label', 'amount_field': 'withdraw_amount'},
+    'robokassa': {'id_field': 'InvId', 'amount_field': 'OutSum'},
+}
+
+# Записи провайдера в базе: ключ, сумма, статус, зачислена ли
+PROVIDER_SQL = {
+    'transactions': """
+        SELECT id::text, amount, status, status = 'completed'
+        FROM transactions
+        WHERE payment_system = %(provider)s
+        AND (%(since)s::timestamp IS NULL OR created_at >= %(since)s::timestamp)
+        AND (%(until)s::timestamp IS NULL OR created_at < %(until)s::timestamp)
+    """,
+    'orders': """
+        SELECT robokassa_inv_id::text, amount, status, status = 'paid'
+        FROM orders
+        WHERE robokassa_inv_id IS NOT NULL
+        AND (%(since)s::timestamp IS NULL OR created_at >= %(since)s::timestamp)
+        AND (%(until)s::timestamp IS NULL OR created_at < %(until)s::timestamp)
+    """,
+}
+
+DEFAULT_PARTITIONS = 64
+CURSOR_ITERSIZE = 20000
+READ_CHUNK = 1 << 16
+NUMBER_CHARS = frozenset('0123456789+-.eE')
+
+
+def iter_statement(stream: TextIO) -> Iterator[Dict[str, Any]]:
+    """Записи выписки по одной: JSON-массив, JSON Lines или CSV (по первому символу)"""
+    head = stream.read(1)
+    while head and head.isspace():
+        head = stream.read(1)
+    if head == '[':
+        yield from iter_json_array(stream)
+    elif head == '{':
+        for line in _prepend(head, stream):
+            if line.strip():
+                yield json.loads(line)
+    elif head:
+        yield from csv.DictReader(_prepend(head, stream))
+
+
+def _prepend(head: str, stream: TextIO) -> Iterator[str]:
+    first = True
+    for line in stream:
+        yield head + line if first else line
+        first = False
+    if first:
+        yield head
+
+
+def iter_json_array(stream: TextIO) -> Iterator[Any]:
+    """Элементы JSON-массива (открывающая скобка уже прочитана) без загрузки файла целиком"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = stream.read(READ_CHUNK)
+            buffer = buffer[position:] + chunk
+            position = 0
+            eof = not chunk
+            continue
+        # Число на границе куска могло прочитаться не до конца: "1" из "1.5e3" или "12" из "125".
+        # Если до конца буфера идут только символы числа, кусок дочитывается
+        tail = end
+        while tail < len(buffer) and buffer[tail] in NUMBER_CHARS:
+            tail += 1
+        if tail == len(buffer) and not eof:
+            chunk = stream.read(READ_CHUNK)
+            buffer = buffer[position:] + chunk
+            position = 0
+            eof = not chunk
+            continue
+        yield item
+        position = end
+
+
+def parse_amount(value: Any) -> Optional[Decimal]:
+    if value in (None, ''):
+        return None
+    try:
+        return Decimal(str(value).replace(',', '.').replace(' ', ''))
+    except InvalidOperation:
+        return None
+
+
+class Partitions:
+    """Файлы-разделы одной стороны сверки: строки 'ключ\\tсумма\\tстатус'"""
+
+    def __init__(self, root: str, side: str, count: int):
+        self.count = count
+        self.paths = [os.path.join(root, f'{side}-{n}.tsv') for n in range(count)]
+        self._files = [open(path, 'w', encoding='utf-8', newline='\n') for path in self.paths]
+        self.rows = 0
+
+    def add(self, key: str, amount: Optional[Decimal], status: str) -> None:
+        part = zlib.crc32(key.encode('utf-8')) % self.count
+        self._files[part].write(f'{key}\t{"" if amount is None else amount}\t{status}\n')
+        self.rows += 1
+
+    def close(self) -> None:
+        for f in self._files:
+            f.close()
+
+    def read(self, part: int) -> Iterator[Tuple[str, Optional[Decimal], str]]:
+        with open(self.paths[part], encoding='utf-8') as f:
+            for line in f:
+                key, amount, status = line.rstrip('\n').split('\t')
+                yield key, Decimal(amount) if amount else None, status
+
+
+def partition_statement(rows: Iterable[Dict[str, Any]], parts: Partitions, id_field: str, amount_field: str,
+                        minor_units: bool) -> int:
+    """Раскладывает выписку по разделам; возвращает число строк без ключа"""
+    skipped = 0
+    for row in rows:
+        key = str(row.get(id_field) or '').strip().lower()
+        if not key:
+            skipped += 1
+            continue
+        amount = parse_amount(row.get(amount_field))
+        if amount is not None and minor_units:
+            amount = amount / 100
+        parts.add(key, amount, '')
+    return skipped
+
+
+def partition_database(conn, provider: str, since: Optional[str], until: Optional[str], parts: Partitions) -> None:
+    """Выгружает записи провайдера серверным курсором, не держа их в памяти"""
+    table = 'orders' if provider == 'robokassa' else 'transactions'
+    with conn.cursor(name='reconcile') as cur:
+        cur.itersize = CURSOR_ITERSIZE
+        cur.execute(PROVIDER_SQL[table], {'provider': provider, 'since': since, 'until': until})
+        for key, amount, status, settled in cur:
+            parts.add(key, amount, f'{status}:{int(settled)}')
+
+
+def match_partition(statement: Iterable[Tuple[str, Optional[Decimal], str]],
+                    database: Iterable[Tuple[str, Optional[Decimal], str]]) -> Iterator[Dict[str, Any]]:
+    """Хэш-соединение одного раздела: таблица строится по выписке, база ее зондирует"""
+    built: Dict[str, List[Optional[Decimal]]] = {}
+    for key, amount, _ in statement:
+        built.setdefault(key, []).append(amount)
+
+    for key, amount, state in database:
+        status, settled = state.rsplit(':', 1)
+        amounts = built.pop(key, None)
+        if amounts is None:
+            if settled == '1':
+                yield {'type': 'missing_in_statement', 'key': key, 'db_amount': amount, 'db_status': status}
+            continue
+        if len(amounts) > 1:
+            yield {'type': 'duplicate_in_statement', 'key': key, 'count': len(amounts),
+                   'statement_amounts': amounts, 'db_amount': amount, 'db_status': status}
+        if settled != '1':
+            yield {'type': 'not_settled', 'key': key, 'statement_amount': amounts[0],
+                   'db_amount': amount, 'db_status': status}
+        elif amounts[0] is not None and amounts[0] != amount:
+            yield {'type': 'amount_mismatch', 'key': key, 'statement_amount': amounts[0], 'db_amount': amount}
+
+    for key, amounts in built.items():
+        yield {'type': 'missing_in_db', 'key': key, 'statement_amounts': amounts}
+        if len(amounts) > 1:
+            yield {'type': 'duplicate_in_statement', 'key': key, 'count': len(amounts),
+                   'statement_amounts': amounts}
+
+
+def reconcile(conn, statement: TextIO, output: TextIO, provider: str, id_field: str, amount_field: str,
+              since: Optional[str] = None, until: Optional[str] = None, minor_units: bool = False,
+              partitions: int = DEFAULT_PARTITIONS, workdir: Optional[str] = None) -> Dict[str, Any]:
+    """Сверяет выписку с базой, пишет расхождения в output, возвращает итог"""
+    started = time.monotonic()
+    root = tempfile.mkdtemp(prefix='reconcile-', dir=workdir)
+    try:
+        statement_parts = Partitions(root, 'statement', partitions)
+        try:
+            skipped = partition_statement(iter_statement(statement), statement_parts, id_field, amount_field, minor_units)
+        finally:
+            statement_parts.close()
+        database_parts = Partitions(root, 'database', partitions)
+        try:
+            partition_database(conn, provider, since, until, database_parts)
+        finally:
+            database_parts.close()
+        partitioned = time.monotonic()
+
+        counts: Dict[str, int] = {}
+        for part in range(partitions):
+            for mismatch in match_partition(statement_parts.read(part), database_parts.read(part)):
+                counts[mismatch['type']] = counts.get(mismatch['type'], 0) + 1
+                output.write(json.dumps(mismatch, default=str, ensure_ascii=False) + '\n')
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        'provider': provider,
+        'statement_rows': statement_parts.rows,
+        'statement_rows_without_key': skipped,
+        'database_rows': database_parts.rows,
+        'mismatches': counts,
+        'partition_seconds': round(partitioned - started, 1),
+        'duration_seconds': round(time.monotonic() - started, 1),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Сверка платежей с выпиской провайдера')
+    parser.add_argument('statement', help='файл выписки (CSV, JSON Lines или JSON-массив), - для stdin')
+    parser.add_argument('--provider', required=True, choices=sorted(PROVIDERS))
+    parser.add_argument('--id-field', help='поле с номером платежа в выписке')
+    parser.add_argument('--amount-field', help='поле с суммой в выписке')
+    parser.add_argument('--minor-units', action='store_true', help='суммы в выписке в копейках')
+    parser.add_argument('--since', help='начало периода выписки (created_at >=)')
+    parser.add_argument('--until', help='конец периода выписки (created_at <)')
+    parser.add_argument('--output', help='файл для расхождений, по умолчанию stdout')
+    parser.add_argument('--partitions', type=int, default=DEFAULT_PARTITIONS)
+    parser.add_argument('--workdir', help='каталог для временных разделов')
+    args = parser.parse_args(argv)
+
+    defaults = PROVIDERS[args.provider]
+    statement = sys.stdin if args.statement == '-' else open(args.statement, encoding='utf-8-sig', newline='')
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.set_session(readonly=True)
+    try:
+        summary = reconcile(
+            conn, statement, output, args.provider,
+            args.id_field or defaults['id_field'],
+            args.amount_field or defaults['amount_field'],
+            since=args.since, until=args.until, minor_units=args.minor_units,
+            partitions=max(1, args.partitions), workdir=args.workdir,
+        )
+    finally:
+        conn.close()
+        if output is not sys.stdout:
+            output.close()
+        if statement is not sys.stdin:
+            statement.close()
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+    return 1 if summary['mismatches'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
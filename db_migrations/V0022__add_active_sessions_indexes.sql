@@ -0,0 +1,6 @@
+-- Частичные индексы только по активным сессиям: неактивные строки в них не попадают
+CREATE INDEX IF NOT EXISTS idx_sessions_user_active ON "t_p41246523_jobsapp_mobile_proje".sessions(user_id, created_at DESC) WHERE is_active = TRUE;
+CREATE INDEX IF NOT EXISTS idx_sessions_token_active ON "t_p41246523_jobsapp_mobile_proje".sessions(token) WHERE is_active = TRUE;
+
+-- token уже уникален, составной индекс (token, is_active) больше не нужен
+DROP INDEX IF EXISTS "t_p41246523_jobsapp_mobile_proje".idx_sessions_token;
@@ -0,0 +1,6 @@
+-- Уникальный индекс для поиска refresh-токена по хешу
+CREATE UNIQUE INDEX IF NOT EXISTS uq_refresh_tokens_token_hash ON "t_p41246523_jobsapp_mobile_proje".refresh_tokens(token_hash);
+DROP INDEX IF EXISTS "t_p41246523_jobsapp_mobile_proje".idx_refresh_tokens_token_hash;
+
+-- Индекс для пакетной очистки истекших токенов (action=sweep)
+CREATE INDEX IF NOT EXISTS idx_refresh_tokens_expires_at ON "t_p41246523_jobsapp_mobile_proje".refresh_tokens(expires_at);
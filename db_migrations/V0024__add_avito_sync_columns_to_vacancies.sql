@@ -0,0 +1,14 @@
+-- Вакансии Avito хранятся в vacancies: стабильный внешний id и хеш содержимого
+ALTER TABLE vacancies
+ADD COLUMN IF NOT EXISTS external_id TEXT,
+ADD COLUMN IF NOT EXISTS content_hash VARCHAR(40);
+
+-- У вакансий Avito нет владельца в users
+ALTER TABLE vacancies ALTER COLUMN user_id DROP NOT NULL;
+
+-- Статус closed для объявлений, пропавших с Avito
+ALTER TABLE vacancies DROP CONSTRAINT IF EXISTS vacancies_status_check;
+ALTER TABLE vacancies ADD CONSTRAINT vacancies_status_check CHECK (status IN ('pending', 'published', 'rejected', 'closed'));
+
+-- Ключ upsert при синхронизации (у ручных вакансий external_id = NULL)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_vacancies_source_external_id ON vacancies(source, external_id);
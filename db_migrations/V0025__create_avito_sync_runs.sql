@@ -0,0 +1,11 @@
+-- Удачные синхронизации Avito: по последней считается возраст данных в ленте
+CREATE TABLE IF NOT EXISTS avito_sync_runs (
+    id SERIAL PRIMARY KEY,
+    seen INTEGER NOT NULL DEFAULT 0,
+    inserted INTEGER NOT NULL DEFAULT 0,
+    updated INTEGER NOT NULL DEFAULT 0,
+    closed INTEGER NOT NULL DEFAULT 0,
+    finished_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_avito_sync_runs_finished_at ON avito_sync_runs(finished_at DESC);
@@ -0,0 +1,19 @@
+-- Поиск почти-дубликатов: SimHash-подпись и ссылка на корень кластера
+ALTER TABLE vacancies
+ADD COLUMN IF NOT EXISTS simhash BIGINT,
+ADD COLUMN IF NOT EXISTS duplicate_of UUID REFERENCES vacancies(id) ON DELETE SET NULL;
+
+CREATE INDEX IF NOT EXISTS idx_vacancies_duplicate_of ON vacancies(duplicate_of) WHERE duplicate_of IS NOT NULL;
+
+-- Очередь бэкфилла подписей
+CREATE INDEX IF NOT EXISTS idx_vacancies_simhash_missing ON vacancies(created_at, id) WHERE simhash IS NULL;
+
+-- LSH-индекс: 64-битная подпись, разбитая на 8 полос по 8 бит
+CREATE TABLE IF NOT EXISTS vacancy_simhash_bands (
+    vacancy_id UUID NOT NULL REFERENCES vacancies(id) ON DELETE CASCADE,
+    band SMALLINT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (band, value, vacancy_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_vacancy_simhash_bands_vacancy_id ON vacancy_simhash_bands(vacancy_id);
@@ -0,0 +1,2 @@
+-- Ссылка на оплату у провайдера: пишется отдельной короткой записью после его ответа
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS payment_url TEXT;
@@ -0,0 +1,8 @@
+-- История транзакций листается по ключу (created_at, id) внутри пользователя:
+-- индекс отдает любую страницу без сортировки, а INCLUDE позволяет считать сводку
+-- по типам без чтения таблицы
+CREATE INDEX IF NOT EXISTS idx_transactions_user_created
+    ON transactions (user_id, created_at DESC, id DESC) INCLUDE (type, status, amount);
+
+-- Поиск по user_id обслуживает новый индекс
+DROP INDEX IF EXISTS idx_transactions_user_id;
@@ -0,0 +1,31 @@
+-- Журнал движений баланса: только вставки, источник истины вместо users.balance
+-- xid - транзакция, вставившая запись; по нему компактор понимает, какие записи уже
+-- точно зафиксированы (xid ниже xmin снимка) и их можно свернуть в снимок
+CREATE TABLE IF NOT EXISTS balance_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    amount NUMERIC(12, 2) NOT NULL,
+    source VARCHAR(30) NOT NULL,
+    reference TEXT,
+    xid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Хвост пользователя после снимка и диапазон очередного прохода компактора
+CREATE INDEX IF NOT EXISTS idx_balance_ledger_user_xid ON balance_ledger(user_id, xid);
+CREATE INDEX IF NOT EXISTS idx_balance_ledger_xid ON balance_ledger(xid);
+
+-- Снимок: сумма всех записей пользователя с xid < folded_below
+CREATE TABLE IF NOT EXISTS balance_snapshots (
+    user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    balance NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    folded_below XID8 NOT NULL DEFAULT '0',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_balance_snapshots_folded_below ON balance_snapshots(folded_below);
+
+-- Начальные снимки из текущих балансов; дальше users.balance не обновляется
+INSERT INTO balance_snapshots (user_id, balance)
+SELECT id, balance FROM users
+ON CONFLICT (user_id) DO NOTHING;
@@ -0,0 +1,7 @@
+-- Номера счетов Robokassa выдаются последовательностью прямо в INSERT заказа,
+-- без случайного подбора и проверочных запросов
+CREATE SEQUENCE IF NOT EXISTS orders_robokassa_inv_id_seq
+    AS INTEGER
+    START WITH 100000
+    MINVALUE 100000
+    OWNED BY orders.robokassa_inv_id;
@@ -0,0 +1,3 @@
+-- Номера счетов резервируются блоками по 20: nextval отдает начало блока,
+-- остальные номера инстанс выдает сам (robokassa/index.py читает размер блока из последовательности)
+ALTER SEQUENCE orders_robokassa_inv_id_seq INCREMENT BY 20;
@@ -0,0 +1,15 @@
+-- Очередь уведомлений Robokassa: запись по InvId сразу после проверки подписи,
+-- проведение заказа и зачисление - обработчиком с повторами
+CREATE TABLE IF NOT EXISTS robokassa_inbox (
+    inv_id INTEGER PRIMARY KEY,
+    out_sum NUMERIC(12, 2) NOT NULL,
+    received_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    processed_at TIMESTAMP,
+    outcome VARCHAR(20)
+);
+
+-- Необработанные в порядке очереди
+CREATE INDEX IF NOT EXISTS idx_robokassa_inbox_pending ON robokassa_inbox(next_attempt_at) WHERE processed_at IS NULL;
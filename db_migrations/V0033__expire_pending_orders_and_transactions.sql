@@ -0,0 +1,34 @@
+-- Брошенные заказы и пополнения переводятся из pending в expired (admin ?path=expire-pending)
+ALTER TABLE transactions DROP CONSTRAINT IF EXISTS transactions_status_check;
+ALTER TABLE transactions ADD CONSTRAINT transactions_status_check
+    CHECK (status IN ('pending', 'completed', 'failed', 'refunded', 'expired'));
+
+-- Очистке нужны только pending по возрасту и expired по времени перехода; индекс по всем
+-- статусам разрастался за счет оплаченных заказов, а по статусу заказы больше не ищутся
+CREATE INDEX IF NOT EXISTS idx_orders_pending_created ON orders(created_at) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_orders_expired_updated ON orders(updated_at) WHERE status = 'expired';
+CREATE INDEX IF NOT EXISTS idx_transactions_pending_created ON transactions(created_at) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_transactions_expired_updated ON transactions(updated_at) WHERE status = 'expired';
+DROP INDEX IF EXISTS idx_orders_status;
+
+-- Архив давно истекших строк: те же колонки плюс archived_at последней колонкой.
+-- Новая колонка в orders, order_items или transactions добавляется и в архив.
+CREATE TABLE IF NOT EXISTS orders_archive (
+    LIKE orders,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id)
+);
+
+CREATE TABLE IF NOT EXISTS order_items_archive (
+    LIKE order_items,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id)
+);
+CREATE INDEX IF NOT EXISTS idx_order_items_archive_order_id ON order_items_archive(order_id);
+
+CREATE TABLE IF NOT EXISTS transactions_archive (
+    LIKE transactions,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id)
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_archive_user_id ON transactions_archive(user_id);
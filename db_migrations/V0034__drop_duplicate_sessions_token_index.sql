@@ -0,0 +1,3 @@
+-- Уникальный индекс sessions(token) уже покрывает поиск по токену; частичный дубль
+-- только замедлял запись сессий
+DROP INDEX IF EXISTS "t_p41246523_jobsapp_mobile_proje".idx_sessions_token_active;
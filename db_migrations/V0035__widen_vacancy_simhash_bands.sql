@@ -0,0 +1,5 @@
+-- LSH-индекс почти-дубликатов: 3 полосы по 22, 21 и 21 бит вместо 8 по 8
+-- (в полосе из 8 бит всего 256 значений - поиск по ней перебирает N/32 строк).
+-- Полосы пересчитываются бэкфиллом подписей: admin POST ?path=duplicates
+DELETE FROM vacancy_simhash_bands;
+UPDATE vacancies SET simhash = NULL WHERE simhash IS NOT NULL;
@@ -6,6 +6,7 @@ import { Label } from '@/components/ui/label';
 import { toast } from '@/hooks/use-toast';
 import Icon from '@/components/ui/icon';
 import func2url from '@/../backend/func2url.json';
+import { apiFetch } from '@/lib/read-after';
 
 const ADMIN_API = 'https://functions.poehali.dev/0d65638b-a8d6-40af-971b-31d0f9e356d0';
 const ROBOKASSA_API = func2url['robokassa-robokassa'];
@@ -94,7 +95,7 @@ export function BalanceTopUp({ open, onClose, userId, userName, userEmail, curre
     setPromoLoading(true);
     setPromoResult(null);
     try {
-      const response = await fetch(`${ADMIN_API}?path=activate-promo`, {
+      const response = await apiFetch(`${ADMIN_API}?path=activate-promo`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ code: promoCode.trim(), user_id: userId })
@@ -4,6 +4,7 @@ import { Input } from '@/components/ui/input';
 import { Label } from '@/components/ui/label';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogDescription } from '@/components/ui/dialog';
 import { toast } from '@/hooks/use-toast';
+import { apiFetch } from '@/lib/read-after';
 import Icon from '@/components/ui/icon';
 
 const PAYMENTS_API_URL = 'https://functions.poehali.dev/fc60f54b-d835-4f8b-9424-5d6c14a11945';
@@ -37,7 +38,7 @@ export function PaymentDialog({ open, onClose, userId }: PaymentDialogProps) {
     setSelectedSystem(paymentSystem);
 
     try {
-      const response = await fetch(`${PAYMENTS_API_URL}?path=create-payment`, {
+      const response = await apiFetch(`${PAYMENTS_API_URL}?path=create-payment`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -2,42 +2,60 @@ import { useState, useEffect } from 'react';
 import { Card, CardContent } from '@/components/ui/card';
 import { Badge } from '@/components/ui/badge';
 import { Button } from '@/components/ui/button';
+import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select';
 import Icon from '@/components/ui/icon';
+import { apiFetch } from '@/lib/read-after';
 
 const PAYMENTS_API_URL = 'https://functions.poehali.dev/fc60f54b-d835-4f8b-9424-5d6c14a11945';
+const PAGE_SIZE = 20;
 
 interface Transaction {
   id: string;
   user_id: string;
   amount: number;
-  type: 'deposit' | 'withdrawal' | 'purchase';
+  type: 'deposit' | 'withdrawal' | 'purchase' | 'vacancy_purchase' | 'tier_upgrade';
   payment_system: string;
-  status: 'pending' | 'completed' | 'failed';
+  status: 'pending' | 'completed' | 'failed' | 'expired';
   description: string;
   created_at: string;
   updated_at: string;
 }
 
+type TransactionSummary = Record<string, { count: number; total: number }>;
+
 interface TransactionHistoryProps {
   userId: string;
 }
 
 export function TransactionHistory({ userId }: TransactionHistoryProps) {
   const [transactions, setTransactions] = useState<Transaction[]>([]);
+  const [summary, setSummary] = useState<TransactionSummary>({});
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [typeFilter, setTypeFilter] = useState('all');
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     loadTransactions();
-  }, [userId]);
+  }, [userId, typeFilter]);
+
+  const fetchPage = async (cursor: string | null) => {
+    const params = new URLSearchParams({ path: `transactions/${userId}`, limit: String(PAGE_SIZE) });
+    if (cursor) params.set('cursor', cursor);
+    if (typeFilter !== 'all') params.set('type', typeFilter);
+    const response = await apiFetch(`${PAYMENTS_API_URL}?${params}`);
+    const data = await response.json();
+    return response.ok && data.success ? data : null;
+  };
 
   const loadTransactions = async () => {
     setLoading(true);
     try {
-      const response = await fetch(`${PAYMENTS_API_URL}?path=transactions/${userId}`);
-      const data = await response.json();
-
-      if (response.ok && data.success) {
+      const data = await fetchPage(null);
+      if (data) {
         setTransactions(data.transactions);
+        setSummary(data.summary || {});
+        setNextCursor(data.nextCursor);
       }
     } catch (error) {
       console.error('Ошибка загрузки транзакций:', error);
@@ -46,6 +64,22 @@ export function TransactionHistory({ userId }: TransactionHistoryProps) {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const data = await fetchPage(nextCursor);
+      if (data) {
+        setTransactions((prev) => [...prev, ...data.transactions]);
+        setNextCursor(data.nextCursor);
+      }
+    } catch (error) {
+      console.error('Ошибка загрузки транзакций:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const formatDate = (dateString: string) => {
     const date = new Date(dateString);
     return new Intl.DateTimeFormat('ru-RU', {
@@ -65,6 +99,8 @@ export function TransactionHistory({ userId }: TransactionHistoryProps) {
         return <Badge variant="secondary">В обработке</Badge>;
       case 'failed':
         return <Badge variant="destructive">Отменена</Badge>;
+      case 'expired':
+        return <Badge variant="outline">Не оплачена</Badge>;
       default:
         return <Badge variant="outline">{status}</Badge>;
     }
@@ -77,6 +113,8 @@ export function TransactionHistory({ userId }: TransactionHistoryProps) {
       case 'withdrawal':
         return <Icon name="ArrowUpFromLine" className="text-red-600" size={20} />;
       case 'purchase':
+      case 'vacancy_purchase':
+      case 'tier_upgrade':
         return <Icon name="ShoppingCart" className="text-primary" size={20} />;
       default:
         return <Icon name="Wallet" className="text-muted-foreground" size={20} />;
@@ -90,7 +128,10 @@ export function TransactionHistory({ userId }: TransactionHistoryProps) {
       case 'withdrawal':
         return 'Вывод';
       case 'purchase':
+      case 'vacancy_purchase':
         return 'Покупка';
+      case 'tier_upgrade':
+        return 'Смена тарифа';
       default:
         return type;
     }
@@ -104,7 +145,7 @@ export function TransactionHistory({ userId }: TransactionHistoryProps) {
     );
   }
 
-  if (transactions.length === 0) {
+  if (transactions.length === 0 && typeFilter === 'all') {
     return (
       <div className="text-center py-12">
         <Icon name="Receipt" size={48} className="mx-auto mb-4 text-muted-foreground" />
@@ -120,12 +161,40 @@ export function TransactionHistory({ userId }: TransactionHistoryProps) {
     <div className="space-y-3">
       <div className="flex items-center justify-between mb-4">
         <h3 className="font-semibold">История транзакций</h3>
-        <Button size="sm" variant="ghost" onClick={loadTransactions}>
-          <Icon name="RefreshCw" size={14} className="mr-1" />
-          Обновить
-        </Button>
+        <div className="flex items-center gap-2">
+          <Select value={typeFilter} onValueChange={setTypeFilter}>
+            <SelectTrigger className="h-8 w-[150px]">
+              <SelectValue />
+            </SelectTrigger>
+            <SelectContent>
+              <SelectItem value="all">Все операции</SelectItem>
+              <SelectItem value="deposit">Пополнения</SelectItem>
+              <SelectItem value="withdrawal">Выводы</SelectItem>
+              <SelectItem value="vacancy_purchase">Покупки</SelectItem>
+              <SelectItem value="tier_upgrade">Тарифы</SelectItem>
+            </SelectContent>
+          </Select>
+          <Button size="sm" variant="ghost" onClick={loadTransactions}>
+            <Icon name="RefreshCw" size={14} className="mr-1" />
+            Обновить
+          </Button>
+        </div>
       </div>
 
+      {Object.keys(summary).length > 0 && (
+        <div className="flex flex-wrap gap-2">
+          {Object.entries(summary).map(([type, totals]) => (
+            <Badge key={type} variant="outline">
+              {getTypeLabel(type as Transaction['type'])}: {totals.count} · {totals.total} ₽
+            </Badge>
+          ))}
+        </div>
+      )}
+
+      {transactions.length === 0 && (
+        <p className="text-center text-sm text-muted-foreground py-8">Нет операций этого типа</p>
+      )}
+
       {transactions.map((transaction) => (
         <Card key={transaction.id} className="overflow-hidden">
           <CardContent className="p-4">
@@ -171,6 +240,17 @@ export function TransactionHistory({ userId }: TransactionHistoryProps) {
           </CardContent>
         </Card>
       ))}
+
+      {nextCursor && (
+        <Button variant="outline" className="w-full" onClick={loadMore} disabled={loadingMore}>
+          {loadingMore ? (
+            <Icon name="Loader2" size={16} className="mr-2 animate-spin" />
+          ) : (
+            <Icon name="ChevronDown" size={16} className="mr-2" />
+          )}
+          Показать еще
+        </Button>
+      )}
     </div>
   );
 }
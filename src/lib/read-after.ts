@@ -0,0 +1,39 @@
+import { safeSessionStorage } from './safe-storage';
+
+const STORAGE_KEY = 'readAfter';
+// Реплика отстает на секунды; через минуту позиция записи уже ничего не меняет
+const TTL_MS = 60_000;
+
+interface StoredPosition {
+  lsn: string;
+  at: number;
+}
+
+function storedPosition(): string | null {
+  const raw = safeSessionStorage.getItem(STORAGE_KEY);
+  if (!raw) return null;
+  try {
+    const position: StoredPosition = JSON.parse(raw);
+    if (Date.now() - position.at < TTL_MS) return position.lsn;
+  } catch (_) { /* malformed value */ }
+  safeSessionStorage.removeItem(STORAGE_KEY);
+  return null;
+}
+
+// fetch к функциям, читающим с реплики: позиция записи из ответа (X-Read-After)
+// уходит с последующими GET, и они не возвращают данные старее этой записи
+export async function apiFetch(input: string, init: RequestInit = {}): Promise<Response> {
+  const headers = new Headers(init.headers);
+  if ((init.method ?? 'GET').toUpperCase() === 'GET') {
+    const lsn = storedPosition();
+    if (lsn) headers.set('X-Read-After', lsn);
+  }
+
+  const response = await fetch(input, { ...init, headers });
+
+  const written = response.headers.get('X-Read-After');
+  if (written) {
+    safeSessionStorage.setItem(STORAGE_KEY, JSON.stringify({ lsn: written, at: Date.now() }));
+  }
+  return response;
+}
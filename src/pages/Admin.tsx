@@ -14,6 +14,7 @@ import Icon from '@/components/ui/icon';
 import { toast } from '@/hooks/use-toast';
 import { useNavigate } from 'react-router-dom';
 import { getMockVacancies, deleteMockVacancy } from '@/data/mock-vacancies';
+import { apiFetch } from '@/lib/read-after';
 
 const ADMIN_API = 'https://functions.poehali.dev/0d65638b-a8d6-40af-971b-31d0f9e356d0';
 const AUTH_API = 'https://functions.poehali.dev/b3919417-c4e8-496a-982f-500d5754d530';
@@ -218,7 +219,7 @@ export default function Admin() {
 
   const loadStats = async () => {
     try {
-      const response = await fetch(`${ADMIN_API}?path=stats`);
+      const response = await apiFetch(`${ADMIN_API}?path=stats`);
       const data = await response.json();
       if (data.success) {
         setStats(data.stats);
@@ -235,7 +236,7 @@ export default function Admin() {
   const loadVacancies = async (status: string) => {
     setLoading(true);
     try {
-      const response = await fetch(`${ADMIN_API}?path=vacancies&status=${status}&limit=50`);
+      const response = await apiFetch(`${ADMIN_API}?path=vacancies&status=${status}&limit=50`);
       const data = await response.json();
       if (data.success) {
         setVacancies(data.vacancies);
@@ -253,7 +254,7 @@ export default function Admin() {
 
   const loadUser = async (userId: string) => {
     try {
-      const response = await fetch(`${ADMIN_API}?path=users&user_id=${userId}`);
+      const response = await apiFetch(`${ADMIN_API}?path=users&user_id=${userId}`);
       const data = await response.json();
       if (data.success) {
         setSelectedUser(data.user);
@@ -270,7 +271,7 @@ export default function Admin() {
 
   const updateUserBalance = async (userId: string, amount: number, description: string) => {
     try {
-      const response = await fetch(`${ADMIN_API}?path=update-balance`, {
+      const response = await apiFetch(`${ADMIN_API}?path=update-balance`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ user_id: userId, amount, description })
@@ -297,7 +298,7 @@ export default function Admin() {
 
   const updateUserTier = async (userId: string, tier: string) => {
     try {
-      const response = await fetch(`${ADMIN_API}?path=users`, {
+      const response = await apiFetch(`${ADMIN_API}?path=users`, {
         method: 'PUT',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ user_id: userId, tier })
@@ -324,7 +325,7 @@ export default function Admin() {
 
   const deleteUser = async (userId: string) => {
     try {
-      const response = await fetch(`${ADMIN_API}?path=users`, {
+      const response = await apiFetch(`${ADMIN_API}?path=users`, {
         method: 'DELETE',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ user_id: userId })
@@ -354,7 +355,7 @@ export default function Admin() {
 
   const moderateVacancy = async (vacancyId: string, action: 'approve' | 'reject', reason?: string) => {
     try {
-      const response = await fetch(`${ADMIN_API}?path=moderate`, {
+      const response = await apiFetch(`${ADMIN_API}?path=moderate`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ 
@@ -403,7 +404,7 @@ export default function Admin() {
   const loadUsers = async () => {
     setUsersLoading(true);
     try {
-      const response = await fetch(`${ADMIN_API}?path=users&limit=100`);
+      const response = await apiFetch(`${ADMIN_API}?path=users&limit=100`);
       const data = await response.json();
       if (data.success) {
         setUsers(data.users);
@@ -422,7 +423,7 @@ export default function Admin() {
   const loadPromoCodes = async () => {
     setPromoLoading(true);
     try {
-      const response = await fetch(`${ADMIN_API}?path=promo-codes`);
+      const response = await apiFetch(`${ADMIN_API}?path=promo-codes`);
       const data = await response.json();
       if (data.success) {
         setPromoCodes(data.promo_codes);
@@ -440,7 +441,7 @@ export default function Admin() {
 
   const createPromoCode = async () => {
     try {
-      const response = await fetch(`${ADMIN_API}?path=promo-codes`, {
+      const response = await apiFetch(`${ADMIN_API}?path=promo-codes`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -473,7 +474,7 @@ export default function Admin() {
 
   const deactivatePromoCode = async (id: string) => {
     try {
-      const response = await fetch(`${ADMIN_API}?path=promo-codes`, {
+      const response = await apiFetch(`${ADMIN_API}?path=promo-codes`, {
         method: 'DELETE',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ id })
@@ -845,7 +846,7 @@ export default function Admin() {
                                 onClick={async () => {
                                   if (confirm('Удалить эту вакансию?')) {
                                     try {
-                                      const response = await fetch(`${ADMIN_API}?path=vacancies`, {
+                                      const response = await apiFetch(`${ADMIN_API}?path=vacancies`, {
                                         method: 'DELETE',
                                         headers: { 'Content-Type': 'application/json' },
                                         body: JSON.stringify({ vacancy_id: vacancy.id })
@@ -69,6 +69,7 @@ function CitySearchInput({ value, onChange }: CitySearchInputProps) {
   );
 }
 import { getMockVacancies } from '@/data/mock-vacancies';
+import { apiFetch } from '@/lib/read-after';
 
 type UserRole = 'guest' | 'seeker' | 'employer' | 'admin';
 
@@ -187,7 +188,7 @@ export default function Index() {
 
   const loadPublishedVacancies = async () => {
     try {
-      const response = await fetch(`${ADMIN_API}?path=vacancies&status=published&limit=100`);
+      const response = await apiFetch(`${ADMIN_API}?path=vacancies&status=published&limit=100`);
       const data = await response.json();
       
       if (data.success && data.vacancies) {
@@ -251,7 +252,7 @@ export default function Index() {
   const loadEmployerVacancies = async () => {
     if (!currentUser || currentUser.role !== 'employer') return;
     try {
-      const response = await fetch(`${ADMIN_API}?path=vacancies&user_id=${currentUser.id}&limit=50`);
+      const response = await apiFetch(`${ADMIN_API}?path=vacancies&user_id=${currentUser.id}&limit=50`);
       const data = await response.json();
       if (data.success) {
         const mappedVacancies = data.vacancies.map((v: any) => ({
@@ -462,7 +463,7 @@ export default function Index() {
       
       console.log('Creating vacancy with payload:', payload);
       
-      const response = await fetch(`${ADMIN_API}?path=vacancies`, {
+      const response = await apiFetch(`${ADMIN_API}?path=vacancies`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(payload)
@@ -510,7 +511,7 @@ export default function Index() {
     if (!currentUser) return;
     
     try {
-      const response = await fetch(`${ADMIN_API}?path=vacancies`, {
+      const response = await apiFetch(`${ADMIN_API}?path=vacancies`, {
         method: 'DELETE',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ vacancy_id: vacancyId })
@@ -1118,7 +1119,7 @@ function ProfileDialog({ open, onClose, user, onAddBalance, onSelectTier, onCrea
     if (!user) return;
     setIsLoadingVacancies(true);
     try {
-      const response = await fetch(`${ADMIN_API}?path=vacancies&user_id=${user.id}&limit=50`);
+      const response = await apiFetch(`${ADMIN_API}?path=vacancies&user_id=${user.id}&limit=50`);
       const data = await response.json();
       if (data.success) {
         const mappedVacancies = data.vacancies.map((v: any) => ({
@@ -1150,7 +1151,7 @@ function ProfileDialog({ open, onClose, user, onAddBalance, onSelectTier, onCrea
 
   const handleDeleteVacancy = async (vacancyId: string) => {
     try {
-      const response = await fetch(`${ADMIN_API}?path=vacancies`, {
+      const response = await apiFetch(`${ADMIN_API}?path=vacancies`, {
         method: 'DELETE',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ vacancy_id: vacancyId })
@@ -1721,7 +1722,7 @@ function AdminDialog({
   const loadPendingVacancies = async () => {
     setIsLoading(true);
     try {
-      const response = await fetch(`${ADMIN_API}?path=vacancies&status=pending&limit=100`);
+      const response = await apiFetch(`${ADMIN_API}?path=vacancies&status=pending&limit=100`);
       const data = await response.json();
       
       if (data.success && data.vacancies) {
@@ -1764,7 +1765,7 @@ function AdminDialog({
 
   const handleApprove = async (id: string) => {
     try {
-      const response = await fetch(`${ADMIN_API}?path=moderate`, {
+      const response = await apiFetch(`${ADMIN_API}?path=moderate`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ vacancy_id: id, action: 'approve' })
@@ -1797,7 +1798,7 @@ function AdminDialog({
     }
 
     try {
-      const response = await fetch(`${ADMIN_API}?path=moderate`, {
+      const response = await apiFetch(`${ADMIN_API}?path=moderate`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ 
@@ -0,0 +1,70 @@
+"""
+Дозагрузка страниц объявлений Avito (Enricher) с настоящим лимитом частоты
+
+Страницы объявлений отдает локальный сервер с задержкой --delay-ms на ответ, лимит
+частоты - RateLimiter(--rate), как AVITO_RATE_PER_HOST в функции. С пустым кэшем
+выполняются вызовы с бюджетом --budget секунд каждый, пока все объявления не
+окажутся в кэше: видно, сколько страниц успевает один вызов и что следующий
+продолжает с места остановки. Для сравнения - прогон без бюджета, как до проверки
+deadline: столько длился бы один вызов.
+
+    python -m tests.benchmarks.bench_avito_enrichment --listings 60 --rate 2 --budget 10
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from tests.support import StubServer, avito_detail, load_function
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--listings', type=int, default=60)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=2.0, help='запросов в секунду на хост')
+    parser.add_argument('--budget', type=float, default=10.0, help='бюджет вызова на дозагрузку, секунд')
+    parser.add_argument('--delay-ms', type=float, default=150.0, help='время ответа страницы объявления')
+    args = parser.parse_args()
+
+    avito = load_function('avito-sync')
+    listings = [{'title': f'Вакансия {i}', 'salary': f'{30000 + i * 100} ₽', 'city': 'Киров',
+                 'url': f'/kirov/vakansii/job_{i}'} for i in range(args.listings)]
+
+    def respond(path):
+        return 200, avito_detail(int(path.rsplit('_', 1)[-1])).encode()
+
+    def make_enricher(server, cache):
+        return avito.Enricher(
+            detail_url=lambda raw: server.url + raw['url'],
+            key=avito.external_id_for,
+            cache=cache,
+            workers=args.workers,
+            max_fetches=args.listings,
+            rate_limiter=avito.RateLimiter(args.rate),
+        )
+
+    with StubServer(respond, delay=args.delay_ms / 1000) as server, tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'details.json')
+        print(f'{"call":>4} {"fetched":>8} {"deferred":>9} {"skipped":>8} {"errors":>7} {"wall":>7}')
+        call = 0
+        while True:
+            call += 1
+            # Каждый вызов - новый инстанс: кэш читается с диска
+            enricher = make_enricher(server, avito.DetailCache(path, max_entries=args.listings))
+            started = time.monotonic()
+            report = enricher.enrich([dict(item) for item in listings], avito.circuit.Deadline(args.budget))
+            wall = time.monotonic() - started
+            print(f'{call:>4} {report["fetched"]:>8} {report["deferred"]:>9} {report["skipped"]:>8}'
+                  f' {report["errors"]:>7} {wall:>6.1f}s')
+            if report['cached'] == args.listings:
+                break
+
+        started = time.monotonic()
+        report = make_enricher(server, avito.DetailCache(os.path.join(tmp, 'unbounded.json'), args.listings)).enrich(
+            [dict(item) for item in listings], avito.circuit.Deadline(3600))
+        print(f'without a budget: fetched={report["fetched"]} in {time.monotonic() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Разбор страницы выдачи Avito: прежний парсер против потокового
+
+legacy - AvitoParser до перехода на контейнеры карточек: документ целиком одной
+строкой, дубли ищутся сравнением с каждой уже найденной записью (квадратично).
+current - parse_vacancies функции avito-sync: куски по 64 КБ, как из сети.
+
+Страницы генерируются: cards карточек и по 4 блока разметки без объявлений на
+карточку, чтобы размер был близок к настоящей выдаче.
+
+    python -m tests.benchmarks.bench_avito_parser --cards 500 2000 5000
+"""
+import argparse
+import statistics
+import time
+from html.parser import HTMLParser
+from typing import Any, Dict, List
+
+from tests.support import avito_page, load_function
+
+CHUNK = 64 * 1024
+
+
+class LegacyAvitoParser(HTMLParser):
+    """AvitoParser до потокового разбора, без изменений"""
+
+    def __init__(self):
+        super().__init__()
+        self.vacancies: List[Dict[str, Any]] = []
+        self.current_vacancy: Dict[str, Any] = {}
+        self.in_title = False
+        self.in_price = False
+        self.in_location = False
+
+    def handle_starttag(self, tag: str, attrs: List[tuple]):
+        attrs_dict = dict(attrs)
+        if attrs_dict.get('data-item-id'):
+            self.current_vacancy['external_id'] = attrs_dict['data-item-id']
+        if 'data-marker' in attrs_dict and 'item-title' in attrs_dict.get('data-marker', ''):
+            self.in_title = True
+        if 'data-marker' in attrs_dict and 'item-price' in attrs_dict.get('data-marker', ''):
+            self.in_price = True
+        if 'data-marker' in attrs_dict and 'item-address' in attrs_dict.get('data-marker', ''):
+            self.in_location = True
+
+    def handle_data(self, data: str):
+        data = data.strip()
+        if not data:
+            return
+        if self.in_title:
+            self.current_vacancy['title'] = data
+            self.in_title = False
+        if self.in_price:
+            self.current_vacancy['salary'] = data
+            self.in_price = False
+        if self.in_location:
+            self.current_vacancy['city'] = data
+            self.in_location = False
+
+    def handle_endtag(self, tag: str):
+        if self.current_vacancy and 'title' in self.current_vacancy:
+            if self.current_vacancy not in self.vacancies:
+                self.vacancies.append(self.current_vacancy.copy())
+                self.current_vacancy = {}
+
+
+def legacy_parse(data: bytes) -> int:
+    parser = LegacyAvitoParser()
+    parser.feed(data.decode('utf-8'))
+    return len(parser.vacancies)
+
+
+def current_parse(avito, data: bytes) -> int:
+    return len(avito.parse_vacancies(data[i:i + CHUNK] for i in range(0, len(data), CHUNK)))
+
+
+def median_of(repeat: int, parse, data: bytes):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        found = parse(data)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000, found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--cards', type=int, nargs='+', default=[500, 2000, 5000])
+    parser.add_argument('--repeat', type=int, default=3, help='прогонов на размер, берется медиана')
+    args = parser.parse_args()
+
+    avito = load_function('avito-sync')
+    print(f'{"cards":>6} {"size":>8} {"legacy":>10} {"current":>10} {"found":>12}')
+    for cards in args.cards:
+        data = avito_page(range(cards), pad=cards * 4).encode()
+        legacy_ms, legacy_found = median_of(args.repeat, legacy_parse, data)
+        current_ms, current_found = median_of(args.repeat, lambda d: current_parse(avito, d), data)
+        print(f'{cards:>6} {len(data) / 1e6:>6.1f}MB {legacy_ms:>8.0f}ms {current_ms:>8.0f}ms'
+              f' {legacy_found:>5}/{current_found:<5}')
+
+
+if __name__ == '__main__':
+    main()
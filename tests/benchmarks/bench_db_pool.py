@@ -0,0 +1,151 @@
+"""
+Пул соединений и каталог подготовленных запросов (db.py): время вызова функции auth
+
+connect - соединение на каждый вызов (DB_POOL_MAX_IDLE=0, DB_PREPARE=0), как до пула.
+pooled - соединение из пула, текст запроса разбирается и планируется каждый раз (DB_PREPARE=0).
+prepared - соединение из пула и EXECUTE подготовленного запроса (по умолчанию).
+
+Замеряются check-session с действующим токеном и verify-code с неверным кодом (промах,
+без записи). Затем threads потоков вызывают check-session одновременно: видно, что
+открытых соединений не больше DB_POOL_MAX_SIZE, а лишние вызовы ждут свободного.
+Ждущему пул отдает вернувшееся соединение, поэтому там и connect почти не подключается заново.
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost:5432/postgres \\
+        python -m tests.benchmarks.bench_db_pool --calls 3000
+"""
+import argparse
+import json
+import os
+import secrets
+import statistics
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from tests.support import TestDatabase, database_server, load_function
+
+MODES = {
+    'connect': {'DB_POOL_MAX_IDLE': '0', 'DB_PREPARE': '0'},
+    'pooled': {'DB_PREPARE': '0'},
+    'prepared': {},
+}
+ENV = ('DB_POOL_MAX_IDLE', 'DB_PREPARE', 'DB_POOL_MAX_SIZE')
+
+
+def seed_session(database: TestDatabase) -> str:
+    token = secrets.token_urlsafe(32)
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO users (email, password_hash, name) VALUES ('pool@example.com', '', 'p') RETURNING id")
+        cur.execute("INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, NOW() + INTERVAL '1 day')",
+                    (cur.fetchone()[0], token))
+    conn.close()
+    return token
+
+
+def load(mode: str, max_size: int):
+    """Функция auth, импортированная заново с настройками пула режима"""
+    for name in ENV:
+        os.environ.pop(name, None)
+    os.environ.update(MODES[mode], DB_POOL_MAX_SIZE=str(max_size))
+    return load_function('auth')
+
+
+def calls(auth, token: str) -> Dict[str, Callable[[], int]]:
+    def check_session() -> int:
+        return auth.handler({'httpMethod': 'GET', 'queryStringParameters': {'path': 'check-session'},
+                             'headers': {'X-Session-Token': token}}, None)['statusCode']
+
+    def verify_code_miss() -> int:
+        return auth.handler({'httpMethod': 'POST', 'queryStringParameters': {'path': 'verify-code'}, 'headers': {},
+                             'body': json.dumps({'contact': 'pool@example.com', 'code': '000000'})},
+                            None)['statusCode']
+
+    return {'check-session': check_session, 'verify-code miss': verify_code_miss}
+
+
+def timed(call: Callable[[], int], count: int) -> Dict[str, Any]:
+    statuses = {call()}
+    timings = []
+    for _ in range(count):
+        started = time.perf_counter()
+        statuses.add(call())
+        timings.append(time.perf_counter() - started)
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'mean_ms': round(statistics.mean(timings) * 1000, 3),
+        'statuses': sorted(statuses),
+    }
+
+
+def concurrent(auth, call: Callable[[], int], threads: int, count: int) -> Dict[str, Any]:
+    done = threading.Event()
+    peak = [0]
+
+    def sample() -> None:
+        while not done.is_set():
+            peak[0] = max(peak[0], auth.db.POOL.size)
+            time.sleep(0.0005)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(threads) as pool:
+            statuses = Counter(pool.map(lambda _: call(), range(count)))
+    finally:
+        elapsed = time.perf_counter() - started
+        done.set()
+        sampler.join()
+    stats = auth.db.POOL.stats()
+    return {
+        'threads': threads,
+        'calls_per_sec': round(count / elapsed),
+        'statuses': dict(statuses),
+        'max_size': auth.db.POOL.max_size,
+        'peak_size': peak[0],
+        'opened': stats['opened'],
+        'exhausted': stats['exhausted'],
+    }
+
+
+def run(database: TestDatabase, mode: str, count: int, threads: int, max_size: int) -> Dict[str, Any]:
+    token = seed_session(database)
+    auth = load(mode, max_size)
+    try:
+        result: Dict[str, Any] = {'mode': mode}
+        for name, call in calls(auth, token).items():
+            result[name] = timed(call, count)
+        if threads:
+            result['concurrent check-session'] = concurrent(auth, calls(auth, token)['check-session'],
+                                                            threads, count)
+        return result
+    finally:
+        auth.db.POOL.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--calls', type=int, default=3000)
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--threads', type=int, default=32, help='0 - без одновременных вызовов')
+    parser.add_argument('--max-size', type=int, default=10, help='DB_POOL_MAX_SIZE')
+    args = parser.parse_args()
+
+    server = database_server()
+    if not server:
+        parser.error('TEST_DATABASE_URL is not set')
+    database = TestDatabase(server).create()
+    try:
+        os.environ['DATABASE_URL'] = database.dsn
+        for mode in args.modes:
+            database.truncate()
+            print(json.dumps(run(database, mode, args.calls, args.threads, args.max_size), ensure_ascii=False))
+    finally:
+        database.drop()
+
+
+if __name__ == '__main__':
+    main()
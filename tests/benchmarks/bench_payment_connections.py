@@ -0,0 +1,129 @@
+"""
+Соединения с базой во время create-payment через Pally (payments ?path=create-payment)
+
+legacy - прежний create_payment: новое соединение на вызов, запрос к Pally при
+открытом соединении. current - handler функции payments: короткие запросы через
+пул, к Pally - без соединения и не больше PALLY_MAX_IN_FLIGHT одновременно.
+
+Pally отвечает с локального сервера через --delay-ms. Пока идут вызовы, раз в
+50 мс считаются клиентские соединения с тестовой базой (pg_stat_activity).
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost:5432/postgres \\
+        python -m tests.benchmarks.bench_payment_connections --calls 80 --threads 40
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from tests.support import StubServer, TestDatabase, database_server, load_function
+
+
+def pally_response(path):
+    return 200, json.dumps({'success': True, 'data': {'url': 'https://pally.example/pay'}}).encode()
+
+
+def legacy_create_payment(payments, dsn: str, user_id: str, amount: float) -> None:
+    """create_payment до пула: транзакция записана, соединение держится на время запроса к Pally"""
+    conn = psycopg2.connect(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT id FROM users WHERE id = %s', (user_id,))
+        assert cur.fetchone()
+        transaction_id = str(uuid.uuid4())
+        cur.execute("""
+            INSERT INTO transactions (id, user_id, amount, type, payment_system, status, description)
+            VALUES (%s, %s, %s, 'deposit', 'pally', 'pending', 'stress')
+        """, (transaction_id, user_id, amount))
+        conn.commit()
+        payments.http_client.client.post(
+            f'{payments.PALLY_API_URL}/bill/create',
+            json_body={'amount': int(amount * 100), 'order_id': transaction_id},
+            headers={'Authorization': 'Bearer test'},
+            read_timeout=15,
+        ).json()
+    finally:
+        conn.close()
+
+
+def current_create_payment(payments, dsn: str, user_id: str, amount: float) -> None:
+    response = payments.handler({
+        'httpMethod': 'POST',
+        'queryStringParameters': {'path': 'create-payment'},
+        'headers': {},
+        'body': json.dumps({'user_id': user_id, 'amount': amount, 'payment_system': 'pally'}),
+    }, None)
+    assert response['statusCode'] == 200, response
+
+
+def run(database: TestDatabase, payments, create, user_id: str, calls: int, threads: int):
+    samples = []
+    stop = threading.Event()
+    monitor = database.connect()
+    monitor.autocommit = True
+
+    def sample():
+        with monitor.cursor() as cur:
+            while not stop.is_set():
+                cur.execute("SELECT COUNT(*) FROM pg_stat_activity"
+                            " WHERE datname = current_database() AND pid <> pg_backend_pid()")
+                samples.append(cur.fetchone()[0])
+                time.sleep(0.05)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        # handler печатает каждый вызов, а отказы по слоту - с трассировкой
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()), \
+                ThreadPoolExecutor(threads) as pool:
+            list(pool.map(lambda _: create(payments, database.dsn, user_id, 100.0), range(calls)))
+    finally:
+        elapsed = time.perf_counter() - started
+        stop.set()
+        sampler.join()
+        monitor.close()
+    return {'seconds': elapsed, 'peak': max(samples), 'median': statistics.median(samples)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--calls', type=int, default=80)
+    parser.add_argument('--threads', type=int, default=40)
+    parser.add_argument('--delay-ms', type=float, default=1000.0, help='время ответа Pally')
+    args = parser.parse_args()
+
+    server = database_server()
+    if not server:
+        parser.error('TEST_DATABASE_URL is not set')
+    database = TestDatabase(server).create()
+    try:
+        with StubServer(pally_response, delay=args.delay_ms / 1000) as pally:
+            os.environ.update(DATABASE_URL=database.dsn, PALLY_API_KEY='test', PALLY_API_URL=pally.url)
+            payments = load_function('payments')
+            conn = database.connect()
+            with conn, conn.cursor() as cur:
+                cur.execute("INSERT INTO users (email, password_hash, name) VALUES ('bench@example.com', '', 'b')"
+                            " RETURNING id")
+                user_id = str(cur.fetchone()[0])
+            conn.close()
+
+            print(f'{"mode":>8} {"wall":>8} {"peak conns":>11} {"median":>7}')
+            for mode, create in (('legacy', legacy_create_payment), ('current', current_create_payment)):
+                result = run(database, payments, create, user_id, args.calls, args.threads)
+                print(f'{mode:>8} {result["seconds"]:>7.1f}s {result["peak"]:>11} {result["median"]:>7}')
+            payments.db.POOL.close()
+    finally:
+        database.drop()
+
+
+if __name__ == '__main__':
+    main()
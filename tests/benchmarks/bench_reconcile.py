@@ -0,0 +1,186 @@
+"""
+Сверка выписки провайдера с базой (backend/payments/reconcile.py): время и пиковая память
+
+В базе создаются rows записей провайдера (transactions для pally, orders для
+robokassa), каждая тысячная - pending. Выписка строится из них потоком, с
+подмешанными расхождениями: injected записей выброшено, injected лишних,
+injected задвоено и у injected изменена сумма. reconcile.py запускается
+отдельным процессом, как из консоли; пиковая память - ru_maxrss этого процесса.
+Затем найденные расхождения сравниваются с подмешанными.
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost:5432/postgres \\
+        python -m tests.benchmarks.bench_reconcile --rows 2000000 --format csv
+"""
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from decimal import Decimal
+from typing import Any, Dict, TextIO
+
+from tests.support import BACKEND, TestDatabase, database_server
+
+RECONCILE = BACKEND / 'payments' / 'reconcile.py'
+FIELDS = {'pally': ('order_id', 'amount'), 'robokassa': ('InvId', 'OutSum')}
+
+
+def seed(database: TestDatabase, provider: str, rows: int) -> None:
+    """rows записей провайдера одним запросом; каждая тысячная не зачислена"""
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO users (email, password_hash, name) VALUES ('bench@example.com', '', 'b') RETURNING id")
+        user_id = cur.fetchone()[0]
+        if provider == 'robokassa':
+            cur.execute("""
+                INSERT INTO orders (order_number, user_name, user_email, amount, robokassa_inv_id, status, user_id)
+                SELECT 'B-' || n, 'b', 'bench@example.com', (n %% 500 + 1) * 10, n,
+                       CASE WHEN n %% 1000 = 0 THEN 'pending' ELSE 'paid' END, %s
+                FROM generate_series(1, %s) AS n
+            """, (user_id, rows))
+        else:
+            cur.execute("""
+                INSERT INTO transactions (user_id, amount, type, payment_system, status)
+                SELECT %s, (n %% 500 + 1) * 10, 'deposit', 'pally',
+                       CASE WHEN n %% 1000 = 0 THEN 'pending' ELSE 'completed' END
+                FROM generate_series(1, %s) AS n
+            """, (user_id, rows))
+    conn.close()
+
+
+def write_statement(database: TestDatabase, provider: str, injected: int, fmt: str, out: TextIO) -> Dict[str, int]:
+    """Выписка из базы с подмешанными расхождениями; возвращает ожидаемые расхождения"""
+    id_field, amount_field = FIELDS[provider]
+    table, key, settled = (('orders', 'robokassa_inv_id', 'paid') if provider == 'robokassa'
+                           else ('transactions', 'id', 'completed'))
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute(f'SELECT {key}::text FROM {table} WHERE status = %s ORDER BY random() LIMIT %s',
+                    (settled, injected * 3))
+        picked = [row[0] for row in cur.fetchall()]
+        cur.execute(f"SELECT COUNT(*) FROM {table} WHERE status <> %s", (settled,))
+        pending = cur.fetchone()[0]
+    dropped = set(picked[:injected])
+    duplicated = set(picked[injected:injected * 2])
+    changed = set(picked[injected * 2:])
+
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow([id_field, amount_field])
+
+        def emit(record: Dict[str, Any]) -> None:
+            writer.writerow([record[id_field], record[amount_field]])
+    else:
+        first = [True]
+        if fmt == 'json':
+            out.write('[')
+
+        def emit(record: Dict[str, Any]) -> None:
+            line = json.dumps(record)
+            if fmt == 'json':
+                line = ('' if first[0] else ',\n') + line
+                first[0] = False
+            else:
+                line += '\n'
+            out.write(line)
+
+    with conn.cursor(name='statement') as cur:
+        cur.itersize = 20000
+        cur.execute(f'SELECT {key}::text, amount FROM {table}')
+        for row_key, amount in cur:
+            if row_key in dropped:
+                continue
+            if row_key in changed:
+                amount += Decimal('0.01')
+            record = {id_field: row_key, amount_field: str(amount)}
+            emit(record)
+            if row_key in duplicated:
+                emit(record)
+    conn.close()
+    base = 10 ** 9 if provider == 'robokassa' else 0
+    for n in range(injected):
+        extra = str(base + n) if provider == 'robokassa' else str(uuid.uuid4())
+        emit({id_field: extra, amount_field: '10.00'})
+    if fmt == 'json':
+        out.write(']\n')
+
+    return {
+        'missing_in_statement': injected,
+        'missing_in_db': injected,
+        'duplicate_in_statement': injected,
+        'amount_mismatch': injected,
+        'not_settled': pending,
+    }
+
+
+def run(database: TestDatabase, provider: str = 'pally', rows: int = 200000, injected: int = 100,
+        fmt: str = 'csv', partitions: int = 64, seed_rows: bool = True) -> Dict[str, Any]:
+    if seed_rows:
+        seed(database, provider, rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        statement_path = os.path.join(tmp, f'statement.{fmt}')
+        output_path = os.path.join(tmp, 'mismatches.jsonl')
+        with open(statement_path, 'w', encoding='utf-8', newline='') as out:
+            expected = write_statement(database, provider, injected, fmt, out)
+
+        started = time.monotonic()
+        with open(os.path.join(tmp, 'stderr.txt'), 'w+', encoding='utf-8') as stderr:
+            process = subprocess.Popen(
+                [sys.executable, str(RECONCILE), '--provider', provider, statement_path,
+                 '--output', output_path, '--partitions', str(partitions), '--workdir', tmp],
+                env={**os.environ, 'DATABASE_URL': database.dsn}, stdout=subprocess.DEVNULL, stderr=stderr,
+            )
+            # wait4 отдает ресурсы именно этого процесса, в том числе пиковую память
+            _, status, usage = os.wait4(process.pid, 0)
+            code = os.waitstatus_to_exitcode(status)
+            elapsed = time.monotonic() - started
+            stderr.seek(0)
+            log = stderr.read()
+        if code not in (0, 1):
+            raise RuntimeError(log)
+        summary = json.loads(log.strip().splitlines()[-1])
+        with open(output_path, encoding='utf-8') as f:
+            found = Counter(json.loads(line)['type'] for line in f)
+
+    return {
+        'provider': provider,
+        'format': fmt,
+        'statement_rows': summary['statement_rows'],
+        'database_rows': summary['database_rows'],
+        'seconds': round(elapsed, 1),
+        'peak_rss_mb': round(usage.ru_maxrss / 1024),
+        'mismatches': dict(found),
+        'expected': expected,
+        'exact': dict(found) == expected,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--injected', type=int, default=100)
+    parser.add_argument('--provider', default='pally', choices=sorted(FIELDS))
+    parser.add_argument('--format', nargs='+', default=['csv'], choices=['csv', 'jsonl', 'json'])
+    parser.add_argument('--partitions', type=int, default=64)
+    args = parser.parse_args()
+
+    server = database_server()
+    if not server:
+        parser.error('TEST_DATABASE_URL is not set')
+    database = TestDatabase(server).create()
+    try:
+        for position, fmt in enumerate(args.format):
+            result = run(database, args.provider, args.rows, args.injected, fmt, args.partitions,
+                         seed_rows=position == 0)
+            print(json.dumps(result))
+    finally:
+        database.drop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Создание заказа Robokassa по размеру корзины: запросы и время на заказ
+
+legacy - прежняя последовательность: INSERT заказа с nextval, INSERT на каждую
+позицию корзины, UPDATE ссылки на оплату и COMMIT. current - handler функции
+robokassa: один запрос с CTE в autocommit, номер счета - из блока инстанса.
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost:5432/postgres \\
+        python -m tests.benchmarks.bench_robokassa_order --carts 1 10 50 200 --latency-ms 0 0.5
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+from tests.support import TestDatabase, database_server, load_function, round_trips
+
+LEGACY_CREATE_ORDER = """
+    WITH inv AS (
+        SELECT nextval('orders_robokassa_inv_id_seq')::integer AS id
+    )
+    INSERT INTO orders (order_number, user_id, user_name, user_email, user_phone, amount, robokassa_inv_id, status, delivery_address, order_comment)
+    SELECT 'ORD-' || to_char(CURRENT_DATE, 'YYYYMMDD') || '-' || inv.id, %s, %s, %s, %s, %s, inv.id, 'pending', %s, %s
+    FROM inv
+    ON CONFLICT DO NOTHING
+    RETURNING id, robokassa_inv_id, order_number
+"""
+
+
+def legacy_create_order(robokassa, order: dict) -> None:
+    """Заказ, позиции по одной и ссылка на оплату отдельным UPDATE"""
+    conn = robokassa.db.connect()
+    cur = conn.cursor()
+    cur.execute(LEGACY_CREATE_ORDER, (None, order['user_name'], order['user_email'], None,
+                                      order['amount'], None, None))
+    order_id, inv_id, order_number = cur.fetchone()
+    for item in order['cart_items']:
+        cur.execute("""
+            INSERT INTO order_items (order_id, product_id, product_name, product_price, quantity)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (order_id, item['id'], item['name'], item['price'], item['quantity']))
+    payment_url = robokassa.build_payment_url(
+        os.environ['ROBOKASSA_MERCHANT_LOGIN'], os.environ['ROBOKASSA_PASSWORD_1'], f"{order['amount']:.2f}",
+        inv_id, order_number, order['user_email'], order['success_url'], order['fail_url'])
+    cur.execute('UPDATE orders SET payment_url = %s WHERE id = %s', (payment_url, order_id))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def current_create_order(robokassa, order: dict) -> None:
+    response = robokassa.handler({'httpMethod': 'POST', 'headers': {}, 'body': json.dumps(order)}, None)
+    assert response['statusCode'] == 200, response
+
+
+def make_order(cart_size: int) -> dict:
+    cart = [{'id': str(i), 'name': f'item {i}', 'price': 10.5, 'quantity': 1 + i % 3} for i in range(cart_size)]
+    return {
+        'amount': round(sum(item['price'] * item['quantity'] for item in cart), 2),
+        'user_name': 'bench', 'user_email': 'bench@example.com', 'cart_items': cart,
+        'success_url': 'https://example.com/success', 'fail_url': 'https://example.com/fail',
+    }
+
+
+def run(robokassa, create, cart_size: int, orders: int, latency: float):
+    order = make_order(cart_size)
+    create(robokassa, order)
+    timings = []
+    with round_trips(robokassa.db, latency) as counts:
+        for _ in range(orders):
+            started = time.perf_counter()
+            create(robokassa, order)
+            timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000, (counts['queries'] + counts['commits']) / orders
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--carts', type=int, nargs='+', default=[1, 10, 50, 200])
+    parser.add_argument('--orders', type=int, default=30, help='заказов на размер корзины, берется медиана')
+    parser.add_argument('--latency-ms', type=float, nargs='+', default=[0.0, 0.5],
+                        help='задержка на каждый запрос и коммит')
+    args = parser.parse_args()
+
+    server = database_server()
+    if not server:
+        parser.error('TEST_DATABASE_URL is not set')
+    database = TestDatabase(server).create()
+    try:
+        os.environ.update(DATABASE_URL=database.dsn, ROBOKASSA_MERCHANT_LOGIN='merchant',
+                          ROBOKASSA_PASSWORD_1='password1')
+        robokassa = load_function('robokassa')
+        print(f'{"latency":>8} {"cart":>5} {"legacy":>22} {"current":>22}')
+        for latency_ms in args.latency_ms:
+            for cart_size in args.carts:
+                row = [f'{latency_ms:>6.1f}ms {cart_size:>5}']
+                for create in (legacy_create_order, current_create_order):
+                    median_ms, round_trip_count = run(robokassa, create, cart_size, args.orders, latency_ms / 1000)
+                    row.append(f'{median_ms:>8.2f}ms ({round_trip_count:>5.1f} rt)')
+                print(' '.join(row))
+        robokassa.db.POOL.close()
+    finally:
+        database.drop()
+
+
+if __name__ == '__main__':
+    main()
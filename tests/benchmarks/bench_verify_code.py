@@ -0,0 +1,136 @@
+"""
+Вход по коду (auth ?path=verify-code): запросы, коммиты и время на один вход
+
+legacy - прежняя последовательность: поиск кода, погашение с коммитом, поиск
+пользователя, создание или обновление с коммитом, сессия с коммитом.
+current - handler функции auth: один запрос с CTE и один коммит.
+
+Половина входов - новые пользователи, половина - повторный вход существующих.
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost:5432/postgres \\
+        python -m tests.benchmarks.bench_verify_code --logins 200 --latency-ms 0 0.5
+"""
+import argparse
+import json
+import os
+import secrets
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from psycopg2.extras import RealDictCursor
+
+from tests.support import TestDatabase, database_server, load_function, round_trips
+
+SCHEMA = 't_p41246523_jobsapp_mobile_proje'
+
+
+def legacy_verify_code(db, contact: str, code: str, role: str) -> bool:
+    """verify-code до объединения в один запрос (email-ветка)"""
+    conn = db.connect()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(f"""
+        SELECT * FROM {SCHEMA}.otp_codes
+        WHERE contact = %s AND code = %s AND is_used = FALSE AND expires_at > NOW()
+        ORDER BY created_at DESC
+        LIMIT 1
+    """, (contact, code))
+    otp = cur.fetchone()
+    if not otp:
+        conn.close()
+        return False
+    cur.execute(f"UPDATE {SCHEMA}.otp_codes SET is_used = TRUE WHERE id = %s", (otp['id'],))
+    conn.commit()
+    cur.execute(f"SELECT id, phone, email, name, email_verified, role FROM {SCHEMA}.users WHERE email = %s",
+                (contact,))
+    user = cur.fetchone()
+    if not user:
+        cur.execute(f"""
+            INSERT INTO {SCHEMA}.users (email, email_verified, updated_at, role, password_hash, name)
+            VALUES (%s, TRUE, NOW(), %s, '', %s)
+            RETURNING id, phone, email, name, email_verified, role
+        """, (contact, role, contact))
+        user = cur.fetchone()
+        conn.commit()
+    else:
+        cur.execute(f"UPDATE {SCHEMA}.users SET updated_at = NOW(), email_verified = TRUE WHERE id = %s",
+                    (user['id'],))
+        conn.commit()
+    cur.execute(f"INSERT INTO {SCHEMA}.sessions (user_id, token, expires_at) VALUES (%s, %s, %s)",
+                (user['id'], secrets.token_urlsafe(32), datetime.now() + timedelta(days=30)))
+    conn.commit()
+    conn.close()
+    return True
+
+
+def current_verify_code(auth, contact: str, code: str, role: str) -> bool:
+    response = auth.handler({
+        'httpMethod': 'POST',
+        'queryStringParameters': {'path': 'verify-code'},
+        'headers': {},
+        'body': json.dumps({'contact': contact, 'code': code, 'role': role}),
+    }, None)
+    return response['statusCode'] == 200
+
+
+def issue_codes(database: TestDatabase, contacts, code: str) -> None:
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        cur.executemany(
+            "INSERT INTO otp_codes (contact, contact_type, code, purpose, expires_at)"
+            " VALUES (%s, 'email', %s, 'login', NOW() + INTERVAL '5 minutes')",
+            [(contact, code) for contact in contacts])
+    conn.close()
+
+
+def run(database: TestDatabase, auth, mode: str, logins: int, latency: float):
+    verify = (lambda *args: legacy_verify_code(auth.db, *args)) if mode == 'legacy' else \
+        (lambda *args: current_verify_code(auth, *args))
+    prefix = f'{mode}-{secrets.token_hex(3)}'
+    # Прогрев: соединение в пуле и подготовленные запросы
+    issue_codes(database, [f'{prefix}-warmup@example.com'], '000000')
+    assert verify(f'{prefix}-warmup@example.com', '000000', 'seeker')
+
+    contacts = [f'{prefix}-{i % (logins // 2 or 1)}@example.com' for i in range(logins)]
+    timings = []
+    with round_trips(auth.db, latency) as counts:
+        for i, contact in enumerate(contacts):
+            code = f'{i:06d}'
+            issue_codes(database, [contact], code)
+            started = time.perf_counter()
+            assert verify(contact, code, 'seeker'), contact
+            timings.append(time.perf_counter() - started)
+    return {
+        'median_ms': statistics.median(timings) * 1000,
+        'queries': counts['queries'] / logins,
+        'commits': counts['commits'] / logins,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, nargs='+', default=[0.0, 0.5],
+                        help='задержка на каждый запрос и коммит')
+    args = parser.parse_args()
+
+    server = database_server()
+    if not server:
+        parser.error('TEST_DATABASE_URL is not set')
+    database = TestDatabase(server).create()
+    try:
+        os.environ['DATABASE_URL'] = database.dsn
+        auth = load_function('auth')
+        print(f'{"latency":>8} {"mode":>8} {"median":>10} {"queries":>8} {"commits":>8}')
+        for latency_ms in args.latency_ms:
+            for mode in ('legacy', 'current'):
+                result = run(database, auth, mode, args.logins, latency_ms / 1000)
+                print(f'{latency_ms:>6.1f}ms {mode:>8} {result["median_ms"]:>8.2f}ms'
+                      f' {result["queries"]:>8.1f} {result["commits"]:>8.1f}')
+        auth.db.POOL.close()
+    finally:
+        database.drop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Журнал баланса под нагрузкой: точность балансов при работающем компакторе и записи горячему пользователю
+
+mixed - пополнения (payments complete_transaction с повторными доставками) и
+начисления/списания админки (ledger.append) из threads потоков, пока компактор
+(admin ledger.compact) делает проход каждые compact_every_ms. Затем проверяется,
+что баланс каждого пользователя (ledger.balance_sql) равен сумме его операций,
+каждая запись журнала свернута ровно один раз, а последний проход компактора не
+меняет ни одного баланса.
+
+hot - writers потоков зачисляют одному пользователю по записи на транзакцию в
+течение seconds; work_ms - другая работа внутри той же транзакции до COMMIT.
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost:5432/postgres \\
+        python -m tests.benchmarks.stress_balance_ledger --modes mixed hot
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Any, Dict, List
+
+import psycopg2
+
+from tests.support import TestDatabase, database_server, load_function
+
+
+class Connections:
+    """Соединение с базой на поток"""
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self._local = threading.local()
+        self._all: List[Any] = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = psycopg2.connect(self.dsn)
+            with self._lock:
+                self._all.append(conn)
+        return conn
+
+    def close(self) -> None:
+        for conn in self._all:
+            conn.close()
+
+
+def seed_users(database: TestDatabase, users: int) -> List[str]:
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO users (email, password_hash, name)
+            SELECT 'ledger-' || n || '@example.com', '', 'ledger' FROM generate_series(1, %s) AS n
+            RETURNING id::text
+        """, (users,))
+        user_ids = [row[0] for row in cur.fetchall()]
+    conn.close()
+    return user_ids
+
+
+def balances(conn, ledger) -> Dict[str, Decimal]:
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT id::text, {ledger.balance_sql('users.id')} FROM users")
+        result = dict(cur.fetchall())
+    conn.rollback()
+    return result
+
+
+def mixed(database: TestDatabase, payments, ledger, users: int = 50, transactions: int = 1500,
+          adjustments: int = 500, threads: int = 24, compact_every_ms: float = 10, seed_value: int = 42) -> Dict[str, Any]:
+    rng = random.Random(seed_value)
+    user_ids = seed_users(database, users)
+    expected: Counter = Counter()
+
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        deposits = []
+        for _ in range(transactions):
+            user_id, amount = rng.choice(user_ids), Decimal(rng.randint(1, 500) * 10)
+            cur.execute("""
+                INSERT INTO transactions (user_id, amount, type, payment_system, status)
+                VALUES (%s, %s, 'deposit', 'pally', 'pending') RETURNING id::text
+            """, (user_id, amount))
+            deposits.append(cur.fetchone()[0])
+            expected[user_id] += amount
+    conn.close()
+
+    operations: List[Any] = []
+    for transaction_id in deposits:
+        # Повторные доставки webhook-а: зачислить должна ровно одна
+        operations += [('deposit', transaction_id)] * rng.randint(1, 3)
+    for n in range(adjustments):
+        user_id, amount = rng.choice(user_ids), Decimal(rng.randint(-200, 200))
+        operations.append(('adjust', user_id, amount, f'adj-{n}'))
+        expected[user_id] += amount
+    rng.shuffle(operations)
+
+    connections = Connections(database.dsn)
+
+    def apply(operation) -> str:
+        if operation[0] == 'deposit':
+            return payments.complete_transaction(operation[1], 'p-' + operation[1][:8])['outcome']
+        _, user_id, amount, reference = operation
+        conn = connections.get()
+        with conn.cursor() as cur:
+            ledger.append(cur, user_id, amount, 'admin', reference)
+        conn.commit()
+        return 'adjusted'
+
+    stop = threading.Event()
+    passes: List[Dict[str, Any]] = []
+
+    def compactor() -> None:
+        conn = database.connect()
+        try:
+            while not stop.is_set():
+                passes.append(ledger.compact(conn))
+                time.sleep(compact_every_ms / 1000)
+        finally:
+            conn.close()
+
+    compacting = threading.Thread(target=compactor)
+    compacting.start()
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(threads) as pool:
+            outcomes = Counter(pool.map(apply, operations))
+    finally:
+        elapsed = time.perf_counter() - started
+        stop.set()
+        compacting.join()
+        connections.close()
+
+    conn = database.connect()
+    before = balances(conn, ledger)
+    final = ledger.compact(conn)
+    after = balances(conn, ledger)
+    with conn.cursor() as cur:
+        cur.execute('SELECT COUNT(*) FROM balance_ledger')
+        entries = cur.fetchone()[0]
+        cur.execute("""
+            SELECT COUNT(*) FROM balance_ledger l
+            JOIN balance_snapshots s ON s.user_id = l.user_id
+            WHERE l.xid >= s.folded_below
+        """)
+        tail = cur.fetchone()[0]
+    conn.close()
+
+    folded = sum(p['entries'] for p in passes if not p['skipped']) + final['entries']
+    return {
+        'mode': 'mixed',
+        'operations': len(operations),
+        'per_sec': round(len(operations) / elapsed),
+        'outcomes': dict(outcomes),
+        'compactor_passes': sum(1 for p in passes if not p['skipped']),
+        'ledger_entries': entries,
+        'folded_entries': folded,
+        'tail_after_final_pass': tail,
+        'wrong_balances': sum(1 for user_id in user_ids if before[user_id] != expected[user_id]),
+        'changed_by_final_pass': sum(1 for user_id in user_ids if before[user_id] != after[user_id]),
+    }
+
+
+def hot(database: TestDatabase, ledger, writers: int = 32, seconds: float = 5.0, work_ms: float = 0.0) -> Dict[str, Any]:
+    user_id = seed_users(database, 1)[0]
+    connections = Connections(database.dsn)
+    deadline = time.monotonic() + seconds
+
+    def write(_) -> int:
+        conn = connections.get()
+        commits = 0
+        while time.monotonic() < deadline:
+            with conn.cursor() as cur:
+                ledger.append(cur, user_id, 1, 'bench', None)
+            if work_ms:
+                time.sleep(work_ms / 1000)
+            conn.commit()
+            commits += 1
+        return commits
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(writers) as pool:
+            commits = sum(pool.map(write, range(writers)))
+    finally:
+        connections.close()
+    elapsed = time.perf_counter() - started
+
+    conn = database.connect()
+    balance = balances(conn, ledger)[user_id]
+    conn.close()
+    return {
+        'mode': 'hot',
+        'writers': writers,
+        'work_ms': work_ms,
+        'commits': commits,
+        'commits_per_sec': round(commits / elapsed),
+        'balance_exact': balance == commits,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--modes', nargs='+', default=['mixed', 'hot'], choices=['mixed', 'hot'])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--transactions', type=int, default=1500)
+    parser.add_argument('--adjustments', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=24)
+    parser.add_argument('--compact-every-ms', type=float, default=10)
+    parser.add_argument('--writers', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--work-ms', type=float, nargs='+', default=[0, 5])
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    server = database_server()
+    if not server:
+        parser.error('TEST_DATABASE_URL is not set')
+    database = TestDatabase(server).create()
+    try:
+        os.environ['DATABASE_URL'] = database.dsn
+        payments = load_function('payments')
+        ledger = load_function('admin', 'ledger')
+        for run in range(args.runs):
+            if 'mixed' in args.modes:
+                database.truncate()
+                result = mixed(database, payments, ledger, args.users, args.transactions, args.adjustments,
+                               args.threads, args.compact_every_ms, seed_value=run)
+                print(json.dumps(result))
+            if 'hot' in args.modes:
+                for work_ms in args.work_ms:
+                    database.truncate()
+                    print(json.dumps(hot(database, ledger, args.writers, args.seconds, work_ms)))
+        payments.db.POOL.close()
+    finally:
+        database.drop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Нагрузочная проверка webhook-ов платежей (payments ?path=webhook)
+
+Создаются pending-пополнения, часть из них уже истекла (expired: webhook пришел
+после admin ?path=expire-pending). Каждое доставляется 2-6 раз; для Pally среди
+доставок бывают неуспешные статусы, а плюс к ним - уведомление о неизвестной
+транзакции. Все доставки перемешиваются и отправляются в handler из threads
+потоков. Затем проверяется, что каждое пополнение зачислено ровно одной записью
+balance_ledger и баланс каждого пользователя равен сумме его пополнений.
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost:5432/postgres \\
+        python -m tests.benchmarks.stress_payment_webhooks --transactions 1000 --threads 32
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Any, Dict, List
+
+from tests.support import TestDatabase, database_server, load_function
+
+UNKNOWN_TRANSACTION = '00000000-0000-0000-0000-000000000000'
+
+
+def seed(database: TestDatabase, users: int, transactions: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """Пользователи и их pending/expired-пополнения"""
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        user_ids = []
+        for i in range(users):
+            cur.execute("INSERT INTO users (email, password_hash, name) VALUES (%s, '', 'stress') RETURNING id",
+                        (f'stress-{i}-{rng.random()}@example.com',))
+            user_ids.append(str(cur.fetchone()[0]))
+        created = []
+        for _ in range(transactions):
+            txn = {
+                'user_id': rng.choice(user_ids),
+                'amount': Decimal(rng.randint(1, 500) * 10),
+                'system': rng.choice(['pally', 'yoomoney']),
+                'status': 'expired' if rng.random() < 0.1 else 'pending',
+            }
+            cur.execute("""
+                INSERT INTO transactions (user_id, amount, type, payment_system, status)
+                VALUES (%s, %s, 'deposit', %s, %s) RETURNING id
+            """, (txn['user_id'], txn['amount'], txn['system'], txn['status']))
+            txn['id'] = str(cur.fetchone()[0])
+            created.append(txn)
+    conn.close()
+    return created
+
+
+def deliveries(transactions: List[Dict[str, Any]], rng: random.Random) -> List[Dict[str, Any]]:
+    """Повторные и неуспешные уведомления в случайном порядке"""
+    events = []
+    for txn in transactions:
+        for _ in range(rng.randint(2, 6)):
+            if txn['system'] == 'pally':
+                events.append({'order_id': txn['id'], 'status': 'success', 'payment_id': 'p' + txn['id'][:8]})
+                if rng.random() < 0.3:
+                    events.append({'order_id': txn['id'], 'status': 'pending'})
+            else:
+                events.append({'label': txn['id'], 'withdraw_amount': str(txn['amount']),
+                               'operation_id': 'op' + txn['id'][:8]})
+    events.append({'label': UNKNOWN_TRANSACTION, 'withdraw_amount': '1'})
+    rng.shuffle(events)
+    return events
+
+
+def replay(database: TestDatabase, payments, users: int = 50, transactions: int = 1000,
+           threads: int = 32, seed_value: int = 7) -> Dict[str, Any]:
+    """Прогоняет доставки и сверяет журнал баланса с пополнениями"""
+    rng = random.Random(seed_value)
+    created = seed(database, users, transactions, rng)
+    events = deliveries(created, rng)
+
+    def deliver(event: Dict[str, Any]) -> int:
+        response = payments.handler({
+            'httpMethod': 'POST',
+            'queryStringParameters': {'path': 'webhook'},
+            'headers': {},
+            'body': json.dumps(event),
+        }, None)
+        return response['statusCode']
+
+    started = time.perf_counter()
+    # handler печатает каждую доставку
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(threads) as pool:
+        statuses = Counter(pool.map(deliver, events))
+    elapsed = time.perf_counter() - started
+
+    expected: Counter = Counter()
+    for txn in created:
+        expected[txn['user_id']] += txn['amount']
+
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute('SELECT reference, COUNT(*), SUM(amount) FROM balance_ledger GROUP BY reference')
+        ledger = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+        cur.execute('SELECT user_id::text, SUM(amount) FROM balance_ledger GROUP BY user_id')
+        balances = dict(cur.fetchall())
+        cur.execute('SELECT status, COUNT(*) FROM transactions GROUP BY status')
+        transaction_statuses = dict(cur.fetchall())
+    conn.close()
+
+    return {
+        'events': len(events),
+        'per_sec': round(len(events) / elapsed),
+        'statuses': dict(statuses),
+        'transaction_statuses': transaction_statuses,
+        # Пополнения без записи в журнале или с несколькими записями
+        'not_credited': sum(1 for txn in created if txn['id'] not in ledger),
+        'credited_twice': sum(1 for count, _ in ledger.values() if count > 1),
+        'wrong_amount': sum(1 for txn in created if txn['id'] in ledger and ledger[txn['id']][1] != txn['amount']),
+        'wrong_balances': sum(1 for user, amount in expected.items() if balances.get(user) != amount),
+        'overcredit': sum(balances.get(user, 0) - amount for user, amount in expected.items()),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--transactions', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    server = database_server()
+    if not server:
+        parser.error('TEST_DATABASE_URL is not set')
+    database = TestDatabase(server).create()
+    try:
+        os.environ['DATABASE_URL'] = database.dsn
+        payments = load_function('payments')
+        for run in range(args.runs):
+            database.truncate()
+            result = replay(database, payments, args.users, args.transactions, args.threads, seed_value=run)
+            print(json.dumps(result, default=str))
+        payments.db.POOL.close()
+    finally:
+        database.drop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+Нагрузочная проверка webhook-а Robokassa: подтверждений в секунду и задержка ответа
+
+Создаются pending-заказы; уведомление по каждому InvId приходит дважды, все
+уведомления перемешиваются и отправляются из threads потоков. Каждый режим
+прогоняется дважды: без помех и с lock_window - вторая сессия держит
+EXCLUSIVE-блокировку orders LOCK_SECONDS из каждых LOCK_SECONDS + 1 с, как
+долгая транзакция админки.
+
+legacy - webhook до очереди: UPDATE заказа и зачисление до ответа, новое
+соединение на вызов. current - handler функции robokassa-webhook. После
+последнего ответа очередь дочищается проходами ?drain=1, затем проверяется, что
+каждый заказ оплачен и зачислен ровно один раз.
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost:5432/postgres \\
+        python -m tests.benchmarks.stress_robokassa_webhook --orders 3000 --threads 16
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+import psycopg2
+
+from tests.support import TestDatabase, database_server, load_function
+
+PASSWORD_2 = 'password2'
+DRAIN_TOKEN = 'drain-token'
+AMOUNT = '10.00'
+LOCK_SECONDS = 2.0
+
+
+class Context:
+    """Контекст вызова функции с таймаутом 30 с"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int((30 - (time.monotonic() - self.started)) * 1000)
+
+
+def legacy_webhook(dsn: str, inv_id: int) -> int:
+    """Webhook до очереди, без изменений в запросах"""
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE orders
+        SET status = 'paid', paid_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE robokassa_inv_id = %s AND status = 'pending'
+        RETURNING id, order_number, user_id, amount
+    """, (inv_id,))
+    result = cur.fetchone()
+    if not result:
+        cur.execute('SELECT status FROM orders WHERE robokassa_inv_id = %s', (inv_id,))
+        existing = cur.fetchone()
+        conn.close()
+        return 200 if existing and existing[0] == 'paid' else 404
+    _, order_number, user_id, amount = result
+    if user_id:
+        cur.execute("""
+            INSERT INTO balance_ledger (user_id, amount, source, reference)
+            SELECT id, %s, 'robokassa', %s FROM users WHERE id = %s
+        """, (amount, order_number, user_id))
+    conn.commit()
+    cur.close()
+    conn.close()
+    return 200
+
+
+def current_webhook(webhook, inv_id: int) -> int:
+    signature = hashlib.md5(f'{AMOUNT}:{inv_id}:{PASSWORD_2}'.encode()).hexdigest()
+    response = webhook.handler({
+        'httpMethod': 'GET',
+        'queryStringParameters': {'OutSum': AMOUNT, 'InvId': str(inv_id), 'SignatureValue': signature},
+    }, Context())
+    return response['statusCode']
+
+
+def seed(database: TestDatabase, orders: int) -> str:
+    """Пользователь и его pending-заказы с InvId 1..orders"""
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO users (email, password_hash, name) VALUES ('rk@example.com', '', 'rk') RETURNING id")
+        user_id = str(cur.fetchone()[0])
+        cur.execute("""
+            INSERT INTO orders (order_number, user_name, user_email, amount, robokassa_inv_id, status, user_id)
+            SELECT 'RK-' || g, 'rk', 'rk@example.com', %s, g, 'pending', %s FROM generate_series(1, %s) g
+        """, (AMOUNT, user_id, orders))
+    conn.close()
+    return user_id
+
+
+def hold_locks(database: TestDatabase, stop: threading.Event) -> None:
+    conn = database.connect()
+    with conn.cursor() as cur:
+        while not stop.is_set():
+            cur.execute('LOCK TABLE orders IN EXCLUSIVE MODE')
+            stop.wait(LOCK_SECONDS)
+            conn.commit()
+            stop.wait(1.0)
+    conn.close()
+
+
+def run(database: TestDatabase, webhook, mode: str, orders: int = 3000, threads: int = 16,
+        lock_window: bool = False, seed_value: int = 7) -> Dict[str, Any]:
+    """Отправляет по два уведомления на заказ и сверяет заказы с журналом баланса"""
+    user_id = seed(database, orders)
+    callbacks = [inv_id for inv_id in range(1, orders + 1) for _ in range(2)]
+    random.Random(seed_value).shuffle(callbacks)
+
+    def deliver(inv_id: int):
+        started = time.perf_counter()
+        if mode == 'legacy':
+            status = legacy_webhook(database.dsn, inv_id)
+        else:
+            status = current_webhook(webhook, inv_id)
+        return status, (time.perf_counter() - started) * 1000
+
+    stop = threading.Event()
+    locker = threading.Thread(target=hold_locks, args=(database, stop))
+    if lock_window:
+        locker.start()
+    started = time.perf_counter()
+    try:
+        # handler печатает несовпадения сумм и сбои проведения
+        with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(deliver, callbacks))
+    finally:
+        elapsed = time.perf_counter() - started
+        stop.set()
+        if lock_window:
+            locker.join()
+
+    conn = database.connect()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM orders WHERE status = 'paid'")
+        paid_at_last_ack = cur.fetchone()[0]
+    drain_passes = 0
+    while mode == 'current':
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = webhook.handler({'httpMethod': 'GET', 'queryStringParameters': {'drain': '1'},
+                                        'headers': {'X-Drain-Token': DRAIN_TOKEN}}, None)
+        drain_passes += 1
+        if not json.loads(response['body'])['claimed']:
+            break
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM orders WHERE status = 'paid'")
+        paid = cur.fetchone()[0]
+        cur.execute('SELECT reference, COUNT(*) FROM balance_ledger WHERE user_id = %s GROUP BY reference',
+                    (user_id,))
+        ledger = dict(cur.fetchall())
+    conn.close()
+
+    latencies = sorted(latency for _, latency in results)
+    statuses: Dict[int, int] = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    return {
+        'mode': mode,
+        'lock_window': lock_window,
+        'callbacks': len(callbacks),
+        'acks_per_sec': round(len(callbacks) / elapsed),
+        'p50_ms': round(latencies[len(latencies) // 2], 1),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)], 1),
+        'max_ms': round(latencies[-1], 1),
+        'statuses': statuses,
+        'paid_at_last_ack': paid_at_last_ack,
+        'drain_passes': drain_passes,
+        'paid': paid,
+        'not_credited': orders - len(ledger),
+        'credited_twice': sum(1 for count in ledger.values() if count > 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--orders', type=int, default=3000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--modes', nargs='+', default=['legacy', 'current'], choices=['legacy', 'current'])
+    args = parser.parse_args()
+
+    server = database_server()
+    if not server:
+        parser.error('TEST_DATABASE_URL is not set')
+    database = TestDatabase(server).create()
+    try:
+        os.environ.update(DATABASE_URL=database.dsn, ROBOKASSA_PASSWORD_2=PASSWORD_2,
+                          ROBOKASSA_DRAIN_TOKEN=DRAIN_TOKEN)
+        webhook = load_function('robokassa-webhook')
+        for lock_window in (False, True):
+            for mode in args.modes:
+                database.truncate()
+                result = run(database, webhook, mode, args.orders, args.threads, lock_window)
+                print(json.dumps(result))
+        webhook.db.POOL.close()
+    finally:
+        database.drop()
+
+
+if __name__ == '__main__':
+    main()
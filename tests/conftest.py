@@ -0,0 +1,34 @@
+import pytest
+
+from tests.support import TestDatabase, database_server, replica_server
+
+
+@pytest.fixture(scope='session')
+def database():
+    """База с миграциями на сервере TEST_DATABASE_URL, одна на прогон"""
+    server = database_server()
+    if not server:
+        pytest.skip('TEST_DATABASE_URL is not set')
+    db = TestDatabase(server).create()
+    yield db
+    db.drop()
+
+
+@pytest.fixture
+def clean_database(database, monkeypatch):
+    """Пустая база для теста; DATABASE_URL функций указывает на нее"""
+    database.truncate()
+    monkeypatch.setenv('DATABASE_URL', database.dsn)
+    monkeypatch.delenv('DATABASE_READ_URL', raising=False)
+    return database
+
+
+@pytest.fixture
+def replica(clean_database, monkeypatch):
+    """dsn тестовой базы на реплике TEST_REPLICA_URL; DATABASE_READ_URL функций указывает на нее"""
+    server = replica_server()
+    if not server:
+        pytest.skip('TEST_REPLICA_URL is not set')
+    dsn = clean_database.replica(server)
+    monkeypatch.setenv('DATABASE_READ_URL', dsn)
+    return dsn
@@ -0,0 +1,302 @@
+"""
+Общие помощники тестов и бенчмарков функций backend/
+
+Функции лежат отдельными папками с одинаковыми именами модулей (index, db, metrics),
+поэтому load_function перед импортом убирает из sys.modules модули другой функции.
+
+Тесты с базой создают отдельную базу на сервере из TEST_DATABASE_URL
+(например postgresql://postgres@localhost:5432/postgres), накатывают db_migrations
+и удаляют базу в конце. Без TEST_DATABASE_URL такие тесты пропускаются.
+Тесты чтения с реплики берут сервер из TEST_REPLICA_URL - потоковую реплику
+сервера TEST_DATABASE_URL; без нее они пропускаются.
+"""
+import importlib
+import threading
+import os
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from types import ModuleType
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND = ROOT / 'backend'
+MIGRATIONS = ROOT / 'db_migrations'
+SCHEMA = 't_p41246523_jobsapp_mobile_proje'
+
+FUNCTIONS = {
+    'admin': BACKEND / 'admin',
+    'auth': BACKEND / 'auth',
+    'avito-sync': BACKEND / 'avito-sync',
+    'payments': BACKEND / 'payments',
+    'robokassa': BACKEND / 'extensions' / 'robokassa' / 'robokassa',
+    'robokassa-webhook': BACKEND / 'extensions' / 'robokassa' / 'robokassa-webhook',
+    'vk-auth': BACKEND / 'extensions' / 'vk-auth' / 'vk-auth',
+}
+
+
+def load_function(name: str, module: str = 'index') -> ModuleType:
+    """Импортирует модуль функции name заново, вместе с ее копиями db, metrics и т.д."""
+    path = FUNCTIONS[name]
+    for key, loaded in list(sys.modules.items()):
+        file = getattr(loaded, '__file__', None) or ''
+        if file.startswith(str(BACKEND)):
+            del sys.modules[key]
+    for other in FUNCTIONS.values():
+        while str(other) in sys.path:
+            sys.path.remove(str(other))
+    sys.path.insert(0, str(path))
+    return importlib.import_module(module)
+
+
+def database_server() -> Optional[str]:
+    return os.environ.get('TEST_DATABASE_URL') or None
+
+
+def replica_server() -> Optional[str]:
+    return os.environ.get('TEST_REPLICA_URL') or None
+
+
+def _with_database(dsn: str, database: str) -> str:
+    parts = urlsplit(dsn)
+    return urlunsplit((parts.scheme, parts.netloc, '/' + database, parts.query, parts.fragment))
+
+
+def migrations() -> List[Path]:
+    return sorted(MIGRATIONS.glob('V*.sql'), key=lambda p: int(p.name[1:].split('__')[0]))
+
+
+class TestDatabase:
+    """Временная база с примененными миграциями; dsn подходит для DATABASE_URL функций"""
+
+    __test__ = False
+
+    def __init__(self, server: str):
+        self.server = server
+        self.name = 'test_' + uuid.uuid4().hex[:12]
+        self.dsn = _with_database(server, self.name)
+
+    def _admin(self):
+        import psycopg2
+        conn = psycopg2.connect(self.server)
+        conn.autocommit = True
+        return conn
+
+    def create(self) -> 'TestDatabase':
+        import psycopg2
+        admin = self._admin()
+        try:
+            with admin.cursor() as cur:
+                cur.execute(f'CREATE DATABASE {self.name}')
+                cur.execute(f'ALTER DATABASE {self.name} SET search_path = {SCHEMA}, public')
+        finally:
+            admin.close()
+        conn = psycopg2.connect(self.dsn)
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute(f'CREATE SCHEMA {SCHEMA}')
+                cur.execute(f'SET search_path = {SCHEMA}, public')
+                for path in migrations():
+                    cur.execute(path.read_text(encoding='utf-8'))
+        finally:
+            conn.close()
+        return self
+
+    def connect(self):
+        import psycopg2
+        return psycopg2.connect(self.dsn)
+
+    def truncate(self) -> None:
+        """Очищает все таблицы схемы и сбрасывает последовательности"""
+        conn = self.connect()
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute('SELECT tablename FROM pg_tables WHERE schemaname = %s', (SCHEMA,))
+                tables = ', '.join(f'{SCHEMA}.{row[0]}' for row in cur.fetchall())
+                if tables:
+                    cur.execute(f'TRUNCATE {tables} RESTART IDENTITY CASCADE')
+        finally:
+            conn.close()
+
+    def replica(self, server: str, timeout: float = 10.0) -> str:
+        """dsn этой базы на реплике server; ждет, пока реплика проиграет все записанное"""
+        dsn = _with_database(server, self.name)
+        wait_for_replica(self.dsn, dsn, timeout)
+        return dsn
+
+    def drop(self) -> None:
+        admin = self._admin()
+        try:
+            with admin.cursor() as cur:
+                cur.execute(f'DROP DATABASE IF EXISTS {self.name} WITH (FORCE)')
+        finally:
+            admin.close()
+
+
+def wait_for_replica(primary_dsn: str, replica_dsn: str, timeout: float = 10.0) -> None:
+    """Ждет, пока реплика проиграет WAL основной базы до текущей позиции"""
+    import psycopg2
+    conn = psycopg2.connect(primary_dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT pg_current_wal_lsn()')
+            position = cur.fetchone()[0]
+    finally:
+        conn.close()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn = psycopg2.connect(replica_dsn)
+        except psycopg2.OperationalError:
+            # База, только что созданная на основной, еще не дошла до реплики
+            conn = None
+        if conn is not None:
+            try:
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute('SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn', (position,))
+                    if cur.fetchone()[0]:
+                        return
+            finally:
+                conn.close()
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'replica has not replayed {position} in {timeout}s')
+        time.sleep(0.02)
+
+
+@contextmanager
+def replay_paused(replica_dsn: str) -> Iterator[None]:
+    """Реплика принимает WAL, но не проигрывает его; отставание растет, пока блок не выйдет"""
+    import psycopg2
+    conn = psycopg2.connect(replica_dsn)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT pg_wal_replay_pause()')
+        yield
+    finally:
+        with conn.cursor() as cur:
+            cur.execute('SELECT pg_wal_replay_resume()')
+        conn.close()
+
+
+@contextmanager
+def round_trips(db: ModuleType, latency: float = 0.0) -> Iterator[Dict[str, int]]:
+    """
+    Считает запросы и коммиты соединений из пула модуля db (копии db.py функции).
+    latency - задержка перед каждым из них: так локальная база ведет себя как
+    удаленная, и видно, во что обходится каждый лишний round trip.
+    """
+    counts = {'queries': 0, 'commits': 0}
+    execute = db.TimedCursor.execute
+    commit = db.PooledConnection.commit
+
+    def counted_execute(self: Any, query: Any, vars: Any = None) -> Any:
+        counts['queries'] += 1
+        if latency:
+            time.sleep(latency)
+        return execute(self, query, vars)
+
+    def counted_commit(self: Any) -> None:
+        counts['commits'] += 1
+        if latency:
+            time.sleep(latency)
+        return commit(self)
+
+    db.TimedCursor.execute = counted_execute
+    db.PooledConnection.commit = counted_commit
+    try:
+        yield counts
+    finally:
+        db.TimedCursor.execute = execute
+        db.PooledConnection.commit = commit
+
+
+def avito_card(item_id: int, title: Optional[str] = None, city: str = 'Киров') -> str:
+    """Карточка объявления в разметке выдачи Avito"""
+    return f'''<div data-marker="item" data-item-id="{item_id}" class="iva-item">
+  <a data-marker="item-title" href="/kirov/vakansii/job_{item_id}"><h3>{title or "Вакансия %d" % item_id}</h3></a>
+  <p data-marker="item-price"><span>{30000 + item_id * 100} ₽</span></p>
+  <div data-marker="item-address"><span>{city}</span></div>
+  <div class="desc"><p>{"lorem ipsum " * 20}</p><span>x</span><span>y</span></div>
+</div>'''
+
+
+def avito_page(item_ids: Iterable[int], pad: int = 0) -> str:
+    """Страница выдачи: pad блоков разметки без объявлений, затем карточки"""
+    return ('<html><body>' + '<div class="pad"><span>z</span></div>' * pad
+            + ''.join(avito_card(i) for i in item_ids) + '</body></html>')
+
+
+def avito_detail(item_id: int) -> str:
+    """Страница объявления Avito: параметры, описание и продавец"""
+    return f'''<html><body><h1 data-marker="item-view/title-info">Вакансия {item_id}</h1>
+<div data-marker="item-view/item-params"><ul>
+<li><span>Сфера деятельности: </span>Торговля</li>
+<li><span>График работы: </span>сменный 2/2</li>
+<li><span>Опыт работы: </span>без опыта</li></ul></div>
+<div data-marker="item-view/item-description"><p>Требуется сотрудник №{item_id}.</p><p>Оформление по ТК &amp; обучение.<br>Звоните!</p></div>
+<div data-marker="seller-info/name"><span>ООО «Ромашка {item_id % 7}»</span></div>
+<img src="x.png"></body></html>'''
+
+class StubServer:
+    """
+    Локальный HTTP-сервер для тестов: на GET и POST respond(path) возвращает (статус, тело)
+    или (статус, тело, заголовки). Время начала каждого запроса пишется в requests
+    как (monotonic, path).
+    """
+
+    def __init__(self, respond: Callable[[str], Tuple[Any, ...]], delay: float = 0.0):
+        stub = self
+        self.respond = respond
+        self.delay = delay
+        self.requests: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Заголовки и тело уходят отдельными send: с Nagle каждый ответ ждал бы delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                with stub._lock:
+                    stub.requests.append((time.monotonic(), self.path))
+                if stub.delay:
+                    time.sleep(stub.delay)
+                status, body, *extra = stub.respond(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (extra[0] if extra else {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_POST = do_GET
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            # Пул клиента открывает десятки соединений разом
+            request_queue_size = 64
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def __enter__(self) -> 'StubServer':
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
@@ -0,0 +1,209 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from tests.support import load_function, round_trips
+
+
+@pytest.fixture
+def auth(clean_database):
+    module = load_function('auth')
+    yield module
+    module.db.POOL.close()
+
+
+def call(auth, path, body=None, method='POST', headers=None, **params):
+    response = auth.handler({
+        'httpMethod': method,
+        'queryStringParameters': {'path': path, **params},
+        'headers': headers or {},
+        'body': json.dumps(body or {}),
+    }, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def issue_code(database, contact, code):
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO otp_codes (contact, contact_type, code, purpose, expires_at)"
+                    " VALUES (%s, 'email', %s, 'login', NOW() + INTERVAL '5 minutes')", (contact, code))
+    conn.close()
+
+
+def test_verify_code_is_one_statement_and_one_commit(auth, clean_database):
+    issue_code(clean_database, 'warmup@example.com', '111111')
+    assert call(auth, 'verify-code', {'contact': 'warmup@example.com', 'code': '111111'})[0] == 200
+
+    issue_code(clean_database, 'new@example.com', '123456')
+    with round_trips(auth.db) as counts:
+        status, body = call(auth, 'verify-code', {'contact': 'New@Example.com', 'code': '123456', 'role': 'employer'})
+    assert status == 200
+    assert body['user']['email'] == 'new@example.com'
+    assert body['user']['role'] == 'employer'
+    assert counts == {'queries': 1, 'commits': 1}
+
+    # Код погашен: повторный вход тем же кодом не проходит
+    assert call(auth, 'verify-code', {'contact': 'new@example.com', 'code': '123456'})[0] == 401
+    assert call(auth, 'check-session', method='GET', token=body['token'])[0] == 200
+
+
+@pytest.fixture
+def admin_token(auth, clean_database, monkeypatch):
+    monkeypatch.setenv('ADMIN_PASSWORD', 'secret')
+    conn = clean_database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO users (email, password_hash, name, role)"
+                    " VALUES ('admin@example.com', '', 'Admin', 'admin') RETURNING id")
+        admin_id = str(cur.fetchone()[0])
+    conn.close()
+    status, body = call(auth, 'login', {'login': 'admin@example.com', 'password': 'secret'})
+    assert status == 200
+    return admin_id, body['token']
+
+
+@pytest.mark.parametrize('body', [
+    {'user_id': 'not-a-uuid'},
+    {'session_id': 'abc'},
+    {'session_id': '1 OR 1=1'},
+    {'session_id': True},
+    {'session_id': 1.5},
+])
+def test_revoke_sessions_rejects_malformed_ids_with_400(auth, admin_token, body):
+    admin_id, token = admin_token
+    status, response = call(auth, 'revoke-sessions', {'user_id': admin_id, **body},
+                            headers={'X-Session-Token': token})
+    assert status == 400, response
+
+
+def test_revoke_single_session(auth, admin_token):
+    admin_id, token = admin_token
+    _, other = call(auth, 'login', {'login': 'admin@example.com', 'password': 'secret'})
+    _, listed = call(auth, 'sessions', method='GET', headers={'X-Session-Token': token}, user_id=admin_id)
+    assert len(listed['sessions']) == 2
+    oldest = listed['sessions'][-1]['id']
+
+    status, body = call(auth, 'revoke-sessions', {'user_id': admin_id, 'session_id': str(oldest)},
+                        headers={'X-Session-Token': other['token']})
+    assert (status, body['revoked']) == (200, 1)
+    assert call(auth, 'check-session', method='GET', token=token)[0] == 401
+    assert call(auth, 'check-session', method='GET', token=other['token'])[0] == 200
+
+
+def test_sessions_token_has_a_single_index(clean_database):
+    conn = clean_database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'sessions' AND indexdef LIKE '%%(token%%'")
+        indexes = [row[0] for row in cur.fetchall()]
+    conn.close()
+    assert indexes == ['sessions_token_key']
+
+
+class FakeSMTP:
+    """smtplib.SMTP_SSL без сети; fail - исключение при входе"""
+    sent = []
+    fail = None
+
+    def __init__(self, host, port, timeout):
+        self.sock = SimpleNamespace(settimeout=lambda seconds: None)
+        if FakeSMTP.fail is not None:
+            raise FakeSMTP.fail
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def login(self, user, password):
+        pass
+
+    def send_message(self, msg):
+        FakeSMTP.sent.append(msg['To'])
+
+
+@pytest.fixture
+def smtp(auth, monkeypatch):
+    monkeypatch.setenv('SMTP_HOST', 'smtp.example.com')
+    monkeypatch.setenv('SMTP_EMAIL', 'robot@example.com')
+    monkeypatch.setenv('SMTP_PASSWORD', 'secret')
+    monkeypatch.setattr(auth.smtplib, 'SMTP_SSL', FakeSMTP)
+    monkeypatch.setattr(FakeSMTP, 'sent', [])
+    monkeypatch.setattr(FakeSMTP, 'fail', None)
+    breaker = auth.SMTP_BREAKER
+    monkeypatch.setattr(breaker, 'cooldown', 0.2)
+    return breaker
+
+
+def half_open(breaker):
+    for _ in range(breaker.consecutive_failures):
+        breaker.record_failure()
+    time.sleep(breaker.cooldown + 0.05)
+
+
+def codes(database, contact):
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute('SELECT COUNT(*) FROM otp_codes WHERE contact = %s', (contact,))
+        count = cur.fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_send_code_uses_the_half_open_trial(auth, smtp, clean_database):
+    half_open(smtp)
+
+    status, _ = call(auth, 'send-code', {'contact': 'user@example.com'})
+
+    assert status == 200
+    assert FakeSMTP.sent == ['user@example.com']
+    assert smtp.state() == 'closed'
+
+
+def test_send_code_without_a_trial_creates_no_code(auth, smtp, clean_database):
+    half_open(smtp)
+    assert smtp.allow()
+
+    status, body = call(auth, 'send-code', {'contact': 'user@example.com'})
+
+    assert (status, body['retryAfter'] >= 1) == (503, True)
+    assert codes(clean_database, 'user@example.com') == 0
+    assert FakeSMTP.sent == []
+
+
+def test_rate_limited_send_code_returns_the_trial(auth, smtp, clean_database):
+    for code in ('111111', '222222', '333333'):
+        issue_code(clean_database, 'user@example.com', code)
+    half_open(smtp)
+
+    assert call(auth, 'send-code', {'contact': 'user@example.com'})[0] == 429
+    assert smtp.allow()
+
+
+def test_failed_insert_returns_the_trial(auth, smtp, clean_database, monkeypatch):
+    half_open(smtp)
+    execute = auth.db.execute
+
+    def failing_insert(cur, statement, params=None):
+        if statement is auth.INSERT_CODE:
+            raise RuntimeError('insert failed')
+        return execute(cur, statement, params)
+
+    monkeypatch.setattr(auth.db, 'execute', failing_insert)
+    assert call(auth, 'send-code', {'contact': 'user@example.com'})[0] == 500
+    assert smtp.allow()
+
+
+def test_deadline_during_send_is_not_a_provider_failure(auth, smtp, clean_database):
+    FakeSMTP.fail = auth.circuit.DeadlineExceeded('smtp: no time left in the invocation')
+
+    status, _ = call(auth, 'send-code', {'contact': 'user@example.com'})
+
+    assert status == 503
+    assert (smtp.calls, smtp.failures, smtp.state()) == (0, 0, 'closed')
+
+    FakeSMTP.fail = OSError('connection refused')
+    status, _ = call(auth, 'send-code', {'contact': 'other@example.com'})
+    assert status == 500
+    assert smtp.failures == 1
@@ -0,0 +1,132 @@
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from tests.support import StubServer, avito_page, load_function
+
+PER_PAGE = 20
+
+
+@pytest.fixture(scope='module')
+def avito():
+    return load_function('avito-sync')
+
+
+def listing_pages(depths):
+    """
+    Выдача как у Avito: страница p региона - карточки этой страницы, номер больше
+    реального отдает последнюю страницу повторно. Глубина 0 - пустая страница (капча).
+    """
+    regions = sorted(depths)
+
+    def respond(path):
+        url = urlsplit(path)
+        region = url.path.split('/')[1]
+        depth = depths[region]
+        if not depth:
+            return 200, avito_page([]).encode()
+        page = min(int(parse_qs(url.query).get('p', ['1'])[0]), depth)
+        first = (regions.index(region) * 100 + page) * PER_PAGE
+        return 200, avito_page(range(first, first + PER_PAGE)).encode()
+
+    return respond
+
+
+def make_crawler(avito, server, **kwargs):
+    return avito.Crawler(
+        page_url=lambda region, page: f'{server.url}/{region}/vakansii?p={page}',
+        parse=avito.parse_vacancies,
+        key=avito.external_id_for,
+        **kwargs,
+    )
+
+
+def requested_pages(server, region):
+    return sorted(int(parse_qs(urlsplit(path).query)['p'][0])
+                  for _, path in server.requests if path.startswith(f'/{region}/'))
+
+
+def test_region_stops_on_first_page_without_new_listings(avito):
+    with StubServer(listing_pages({'short': 3, 'long': 6})) as server:
+        listings, report = make_crawler(avito, server, max_pages=10, concurrency=1).crawl(['short', 'long'])
+
+    # Четвертая страница повторяет третью - дальше не идем
+    assert requested_pages(server, 'short') == [1, 2, 3, 4]
+    assert requested_pages(server, 'long') == [1, 2, 3, 4, 5, 6, 7]
+    assert len(listings) == (3 + 6) * PER_PAGE
+    assert report['ended'] == {'short': 'end', 'long': 'end'}
+    assert report['complete'] is True
+    assert report['errors'] == 0
+
+
+def test_windowed_crawl_does_not_count_pages_past_the_end(avito):
+    with StubServer(listing_pages({'a': 2, 'b': 3})) as server:
+        listings, report = make_crawler(avito, server, max_pages=10, concurrency=4).crawl(['a', 'b'])
+
+    assert len(listings) == (2 + 3) * PER_PAGE
+    assert report['complete'] is True
+    # Страницы окна за точкой остановки запрошены, но в отчет не попадают
+    counted = [(p['region'], p['page']) for p in report['per_page']]
+    assert max(page for region, page in counted if region == 'a') == 3
+    assert max(page for region, page in counted if region == 'b') == 4
+    assert max(requested_pages(server, 'a')) <= 4
+
+
+def test_empty_page_and_page_cap_leave_crawl_incomplete(avito):
+    with StubServer(listing_pages({'captcha': 0, 'deep': 50})) as server:
+        listings, report = make_crawler(avito, server, max_pages=3, concurrency=2).crawl(['captcha', 'deep'])
+
+    assert requested_pages(server, 'captcha') == [1]
+    assert requested_pages(server, 'deep') == [1, 2, 3]
+    assert len(listings) == 3 * PER_PAGE
+    assert report['ended'] == {'captcha': 'empty', 'deep': 'max_pages'}
+    assert report['errors'] == 0
+    assert report['complete'] is False
+
+
+def test_http_error_ends_region_and_crawl_is_incomplete(avito):
+    pages = listing_pages({'ok': 1, 'broken': 2})
+
+    def respond(path):
+        if path.startswith('/broken/') and 'p=2' in path:
+            return 503, b'unavailable'
+        return pages(path)
+
+    with StubServer(respond) as server:
+        _, report = make_crawler(avito, server, max_pages=5, concurrency=1).crawl(['ok', 'broken'])
+
+    assert report['ended'] == {'ok': 'end', 'broken': 'error'}
+    assert report['errors'] == 1
+    assert report['complete'] is False
+
+
+def test_requests_to_one_host_respect_rate_limit(avito):
+    rate = 20
+    with StubServer(listing_pages({'r1': 4, 'r2': 4})) as server:
+        crawler = make_crawler(avito, server, max_pages=4, concurrency=8,
+                               rate_limiter=avito.RateLimiter(rate))
+        _, report = crawler.crawl(['r1', 'r2'])
+
+    started = sorted(at for at, _ in server.requests)
+    assert len(started) == report['pages'] == 8
+    gaps = [b - a for a, b in zip(started, started[1:])]
+    # Слоты выдаются через 1/rate; запас на планировщик потоков и сеть
+    assert min(gaps) >= 1 / rate * 0.7
+    assert started[-1] - started[0] >= (len(started) - 1) / rate * 0.9
+
+
+def test_per_page_report_has_timings(avito):
+    delay = 0.05
+    with StubServer(listing_pages({'r': 2}), delay=delay) as server:
+        _, report = make_crawler(avito, server, max_pages=5, concurrency=1).crawl(['r'])
+
+    assert [p['page'] for p in report['per_page']] == [1, 2, 3]
+    for page in report['per_page']:
+        assert page['status'] == 200
+        assert page['listings'] == PER_PAGE
+        assert page['bytes'] > 0
+        # Сервер отвечает не раньше delay; полное время включает чтение тела
+        assert page['ttfb_ms'] >= delay * 1000 * 0.9
+        assert page['total_ms'] >= page['ttfb_ms']
+    assert [p['new'] for p in report['per_page']] == [PER_PAGE, PER_PAGE, 0]
+    assert report['duration_ms'] >= 3 * delay * 1000 * 0.9
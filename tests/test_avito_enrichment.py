@@ -0,0 +1,86 @@
+import json
+import time
+
+import pytest
+
+from tests.support import StubServer, avito_detail, load_function
+
+
+@pytest.fixture(scope='module')
+def avito():
+    return load_function('avito-sync')
+
+
+def listings(count):
+    return [{'title': f'Вакансия {i}', 'salary': f'{30000 + i * 100} ₽', 'city': 'Киров',
+             'url': f'/kirov/vakansii/job_{i}'} for i in range(count)]
+
+
+def detail_server():
+    return StubServer(lambda path: (200, avito_detail(int(path.rsplit('_', 1)[-1])).encode()), delay=0.02)
+
+
+def make_enricher(avito, server, cache, rate=2.0):
+    return avito.Enricher(
+        detail_url=lambda raw: server.url + raw['url'],
+        key=avito.external_id_for,
+        cache=cache,
+        workers=4,
+        max_fetches=100,
+        rate_limiter=avito.RateLimiter(rate),
+    )
+
+
+def test_enrichment_stops_within_the_deadline_and_resumes_from_the_cache(avito, tmp_path):
+    path = str(tmp_path / 'details.json')
+    with detail_server() as server:
+        started = time.monotonic()
+        first = make_enricher(avito, server, avito.DetailCache(path, 100)).enrich(
+            listings(20), avito.circuit.Deadline(3))
+        elapsed = time.monotonic() - started
+
+        # 2 запроса в секунду: за 3 с начинается 6 загрузок, остальные ждут следующего вызова
+        assert elapsed < 3
+        assert (first['fetched'], first['errors'], first['skipped']) == (6, 0, 14)
+        assert len(json.load(open(path, encoding='utf-8'))) == 6
+
+        # Новый инстанс читает кэш с диска и загружает только оставшиеся
+        second = make_enricher(avito, server, avito.DetailCache(path, 100)).enrich(
+            listings(20), avito.circuit.Deadline(3))
+        assert (second['cached'], second['fetched']) == (6, 6)
+        requested = [request for _, request in server.requests]
+        assert len(requested) == len(set(requested)) == 12
+
+
+def test_cache_is_saved_while_fetching(avito, tmp_path, monkeypatch):
+    path = str(tmp_path / 'details.json')
+    cache = avito.DetailCache(path, 100)
+    saved = []
+    save = cache.save
+    monkeypatch.setattr(cache, 'save', lambda: (saved.append(cache.unsaved), save()))
+    with detail_server() as server:
+        report = make_enricher(avito, server, cache, rate=0).enrich(listings(25), avito.circuit.Deadline(10))
+
+    assert report['fetched'] == 25
+    assert saved == [10, 10, 5]
+
+
+def test_rate_limit_slot_after_the_deadline_is_not_taken(avito):
+    limiter = avito.RateLimiter(2)
+    deadline = avito.circuit.Deadline(0.3)
+
+    assert limiter.acquire('avito', deadline) is True
+    # Следующий слот через 0.5 с - позже deadline: без ожидания и без занятия слота
+    started = time.monotonic()
+    assert limiter.acquire('avito', deadline) is False
+    assert time.monotonic() - started < 0.05
+    assert limiter.capacity('avito', 1.2) == 2
+
+
+def test_failed_fetches_are_errors_not_cached(avito, tmp_path):
+    with StubServer(lambda path: (500, b'')) as server:
+        report = make_enricher(avito, server, avito.DetailCache(str(tmp_path / 'd.json'), 100), rate=0).enrich(
+            listings(3), avito.circuit.Deadline(10))
+
+    assert (report['fetched'], report['errors']) == (0, 3)
+    assert json.load(open(tmp_path / 'd.json', encoding='utf-8')) == {}
@@ -0,0 +1,135 @@
+import json
+import time
+
+import pytest
+
+from tests.support import StubServer, avito_page, load_function
+
+REGION = 'kirovskaya_oblast'
+FEED = {'httpMethod': 'GET', 'queryStringParameters': {'page': '1'}, 'headers': {}}
+
+
+@pytest.fixture
+def avito(tmp_path, monkeypatch):
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    monkeypatch.setenv('AVITO_REGIONS', REGION)
+    monkeypatch.setenv('AVITO_SNAPSHOT_PATH', str(tmp_path / 'snapshot.json'))
+    monkeypatch.setenv('AVITO_CACHE_DIR', str(tmp_path / 'pages'))
+    monkeypatch.setenv('AVITO_DETAIL_CACHE_PATH', str(tmp_path / 'details.json'))
+    monkeypatch.setenv('AVITO_ENRICH_MAX_PER_RUN', '0')
+    monkeypatch.setenv('AVITO_RATE_PER_HOST', '1000')
+    monkeypatch.setenv('AVITO_BREAKER_FAILURES', '2')
+    return load_function('avito-sync')
+
+
+def upstream(status):
+    """Avito, который отвечает status; 200 - страница с двумя объявлениями"""
+    state = {'status': status}
+
+    def respond(path):
+        if state['status'] != 200:
+            return state['status'], b''
+        return 200, avito_page([101, 102]).encode()
+
+    server = StubServer(respond)
+    server.state = state
+    return server
+
+
+def write_snapshot(avito, age, item_ids):
+    with open(avito.SNAPSHOTS.path, 'w', encoding='utf-8') as f:
+        json.dump({f'{REGION}:1': {
+            'fetched_at': time.time() - age,
+            'vacancies': [{'id': str(item_id), 'title': f'Старая {item_id}', 'url': f'/job_{item_id}'}
+                          for item_id in item_ids],
+        }}, f)
+
+
+def feed(avito, server, monkeypatch):
+    monkeypatch.setattr(avito, 'AVITO_BASE_URL', server.url)
+    response = avito.handler(FEED, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def titles(body):
+    return [vacancy['title'] for vacancy in body['vacancies']]
+
+
+def test_snapshot_store_keeps_age_and_survives_a_new_instance(avito, tmp_path):
+    store = avito.SnapshotStore(str(tmp_path / 'store.json'))
+    assert store.get('a:1') is None
+
+    store.put('a:1', [{'id': '1'}])
+
+    age, vacancies = avito.SnapshotStore(str(tmp_path / 'store.json')).get('a:1')
+    assert 0 <= age < 5
+    assert vacancies == [{'id': '1'}]
+
+    (tmp_path / 'broken.json').write_text('{not json')
+    assert avito.SnapshotStore(str(tmp_path / 'broken.json')).get('a:1') is None
+
+
+def test_fresh_snapshot_is_served_without_calling_avito(avito, monkeypatch):
+    write_snapshot(avito, 60, [1])
+    with upstream(200) as server:
+        status, body = feed(avito, server, monkeypatch)
+
+    assert server.requests == []
+    assert (status, titles(body), body['dataAge'], body['stale']) == (200, ['Старая 1'], 60, False)
+
+
+def test_stale_snapshot_is_refreshed_inline(avito, monkeypatch):
+    write_snapshot(avito, avito.AVITO_REFRESH_AFTER + 60, [1])
+    with upstream(200) as server:
+        status, body = feed(avito, server, monkeypatch)
+
+    assert len(server.requests) == 1
+    assert (status, titles(body), body['dataAge'], body['stale']) == (200, ['Вакансия 101', 'Вакансия 102'], 0, False)
+    assert avito.SNAPSHOTS.get(f'{REGION}:1')[0] < 5
+
+
+def test_stale_snapshot_is_served_while_avito_fails_and_the_breaker_opens(avito, monkeypatch):
+    stale_age = avito.AVITO_REFRESH_AFTER + 60
+    write_snapshot(avito, stale_age, [1])
+    with upstream(500) as server:
+        for _ in range(3):
+            status, body = feed(avito, server, monkeypatch)
+            assert (status, titles(body), body['stale']) == (200, ['Старая 1'], True)
+        # Две неудачи подряд открывают breaker: третий вызов Avito не запрашивает
+        assert len(server.requests) == 2
+        assert body['upstream'] == 'open'
+
+        server.state['status'] = 200
+        monkeypatch.setattr(avito.BREAKER, 'cooldown', 0)
+        status, body = feed(avito, server, monkeypatch)
+    assert (status, titles(body), body['stale']) == (200, ['Вакансия 101', 'Вакансия 102'], False)
+
+
+def test_without_snapshot_failures_are_reported(avito, monkeypatch):
+    with upstream(500) as server:
+        status, body = feed(avito, server, monkeypatch)
+        assert (status, body['error']) == (503, 'Avito недоступен')
+        feed(avito, server, monkeypatch)
+        status, body = feed(avito, server, monkeypatch)
+
+    assert (status, body['error']) == (503, 'Avito временно недоступен')
+    assert body['retryAfter'] > 0
+    assert len(server.requests) == 2
+
+
+def test_stale_database_feed_is_served_without_refreshing(avito, clean_database, monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', clean_database.dsn)
+    with upstream(200) as server:
+        status, body = feed(avito, server, monkeypatch)
+        assert (status, body['dataAge'], body['stale']) == (200, None, True)
+
+        conn = clean_database.connect()
+        with conn, conn.cursor() as cur:
+            cur.execute("INSERT INTO avito_sync_runs (seen) VALUES (0)")
+        conn.close()
+        status, body = feed(avito, server, monkeypatch)
+    avito.db.POOL.close()
+
+    # Обновляет ленту только mode=sync по расписанию
+    assert server.requests == []
+    assert (status, body['stale']) == (200, False)
@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+from tests.support import FUNCTIONS, load_function
+
+COOLDOWN = 0.2
+
+
+def test_copies_are_identical():
+    copies = {(path / 'circuit.py').read_bytes() for path in FUNCTIONS.values() if (path / 'circuit.py').exists()}
+    assert len(copies) == 1
+
+
+@pytest.fixture(scope='module')
+def circuit():
+    return load_function('auth', 'circuit')
+
+
+@pytest.fixture
+def breaker(circuit):
+    return circuit.CircuitBreaker('test', consecutive_failures=2, cooldown=COOLDOWN)
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.consecutive_failures):
+        breaker.record_failure()
+
+
+def test_consecutive_failures_open_the_breaker_until_cooldown(circuit, breaker):
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state() == circuit.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state() == circuit.OPEN
+    assert not breaker.allow()
+    assert not breaker.available()
+    assert breaker.retry_after() >= 1
+
+    time.sleep(COOLDOWN + 0.05)
+    assert breaker.state() == circuit.HALF_OPEN
+    assert breaker.available()
+
+
+def test_half_open_gives_a_single_trial_that_closes_or_reopens(circuit, breaker):
+    open_breaker(breaker)
+    time.sleep(COOLDOWN + 0.05)
+
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state() == circuit.OPEN
+
+    time.sleep(COOLDOWN + 0.05)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state() == circuit.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_released_trial_is_given_to_the_next_caller(breaker):
+    open_breaker(breaker)
+    time.sleep(COOLDOWN + 0.05)
+
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_guard_counts_errors_but_not_the_deadline(circuit, breaker):
+    with pytest.raises(ValueError):
+        with breaker.guard():
+            raise ValueError('provider error')
+    assert breaker.failures == 1
+
+    with pytest.raises(circuit.DeadlineExceeded):
+        with breaker.guard():
+            raise circuit.DeadlineExceeded('no time left')
+    assert (breaker.calls, breaker.failures, breaker.state()) == (1, 1, circuit.CLOSED)
+
+
+def test_deadline_in_guard_returns_the_trial(circuit, breaker):
+    open_breaker(breaker)
+    time.sleep(COOLDOWN + 0.05)
+
+    with pytest.raises(circuit.DeadlineExceeded):
+        with breaker.guard():
+            raise circuit.DeadlineExceeded('no time left')
+    assert breaker.state() == circuit.HALF_OPEN
+
+    assert breaker.allow()
+    with breaker.guard(allowed=True):
+        pass
+    assert breaker.state() == circuit.CLOSED
+
+
+def test_guard_rejects_without_calling_while_open(circuit, breaker):
+    open_breaker(breaker)
+    called = []
+
+    with pytest.raises(circuit.CircuitOpenError) as error:
+        with breaker.guard():
+            called.append(True)
+    assert called == []
+    assert error.value.retry_after >= 1
+
+
+class Context:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def test_deadline_trims_timeouts_and_runs_out(circuit):
+    deadline = circuit.Deadline.from_context(Context(3000), reserve=1)
+    assert 1.9 < deadline.remaining() <= 2
+    assert deadline.timeout(10) <= 2
+    assert deadline.timeout(0.5) == 0.5
+
+    expired = circuit.Deadline(circuit.MIN_CALL_SECONDS / 2)
+    with pytest.raises(circuit.DeadlineExceeded):
+        expired.timeout(10, 'smtp')
+
+
+def test_deadline_without_context_uses_the_function_timeout(circuit):
+    deadline = circuit.Deadline.from_context(None, reserve=1)
+    assert circuit.FUNCTION_TIMEOUT - 1.1 < deadline.remaining() <= circuit.FUNCTION_TIMEOUT - 1
+
+
+def test_current_deadline_belongs_to_the_calling_thread(circuit):
+    started = circuit.start(Context(5000), reserve=1)
+    assert circuit.current() is started
+    assert circuit.timeout(10) <= 4
+
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(circuit.current()))
+    thread.start()
+    thread.join()
+    assert seen == [None]
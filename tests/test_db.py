@@ -0,0 +1,372 @@
+import json
+import threading
+import time
+
+import psycopg2
+import psycopg2.errors
+import pytest
+
+from tests.support import load_function, replay_paused, wait_for_replica
+
+
+@pytest.fixture
+def db(clean_database):
+    module = load_function('admin', 'db')
+    yield module
+    module.POOL.close()
+    module.REPLICA_POOL.close()
+
+
+def served_by(conn):
+    """Сервер, выдавший соединение; соединение возвращается в пул"""
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT pg_is_in_recovery()')
+            return 'replica' if cur.fetchone()[0] else 'primary'
+    finally:
+        conn.close()
+
+
+def add_user(db, email):
+    """Запись на основную базу; возвращает ее позицию для X-Read-After"""
+    conn = db.connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO users (email, password_hash, name) VALUES (%s, '', 'r')", (email,))
+        conn.commit()
+        return db.write_position(conn)
+    finally:
+        conn.close()
+
+
+def sees_user(conn, email):
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT COUNT(*) FROM users WHERE email = %s', (email,))
+            return cur.fetchone()[0] == 1
+    finally:
+        conn.close()
+
+
+def wait_until_received(replica, db):
+    """Реплика приняла WAL, который еще не проиграла"""
+    conn = db.connect()
+    with conn.cursor() as cur:
+        cur.execute('SELECT pg_current_wal_lsn()')
+        position = cur.fetchone()[0]
+    conn.close()
+    deadline = time.monotonic() + 10
+    standby = psycopg2.connect(replica)
+    standby.autocommit = True
+    try:
+        while True:
+            with standby.cursor() as cur:
+                cur.execute('SELECT pg_last_wal_receive_lsn() >= %s::pg_lsn', (position,))
+                if cur.fetchone()[0]:
+                    return
+            assert time.monotonic() < deadline, 'replica did not receive WAL'
+            time.sleep(0.02)
+    finally:
+        standby.close()
+
+
+def test_reads_go_to_the_primary_without_a_replica(db):
+    assert served_by(db.connect_read()) == 'primary'
+    assert served_by(db.connect_read('0/0')) == 'primary'
+
+
+def test_caught_up_replica_serves_reads(db, replica):
+    assert served_by(db.connect_read()) == 'replica'
+    assert db.REPLICA_POOL.stats()['opened'] == 1
+
+
+def test_lagging_replica_sends_reads_to_the_primary_until_it_catches_up(db, replica, clean_database, monkeypatch):
+    monkeypatch.setattr(db, 'REPLICA_CHECK_SECONDS', 0)
+    monkeypatch.setattr(db, 'REPLICA_MAX_LAG_SECONDS', 0.2)
+
+    with replay_paused(replica):
+        add_user(db, 'lag@example.com')
+        wait_until_received(replica, db)
+        time.sleep(0.3)
+
+        assert served_by(db.connect_read()) == 'primary'
+        assert db._replica['healthy'] is False
+        assert db._replica['lag'] > 0.2
+
+    wait_for_replica(clean_database.dsn, replica)
+    assert served_by(db.connect_read()) == 'replica'
+    assert (db._replica['healthy'], db._replica['lag']) == (True, 0)
+
+
+def test_unhealthy_replica_is_not_rechecked_until_the_interval_passes(db, replica, clean_database, monkeypatch):
+    monkeypatch.setattr(db, 'REPLICA_MAX_LAG_SECONDS', 0.2)
+    with replay_paused(replica):
+        add_user(db, 'lag@example.com')
+        wait_until_received(replica, db)
+        time.sleep(0.3)
+        assert served_by(db.connect_read()) == 'primary'
+
+    wait_for_replica(clean_database.dsn, replica)
+    opened = db.REPLICA_POOL.stats()['opened']
+    # Результат проверки живет REPLICA_CHECK_SECONDS: реплику даже не спрашивают
+    assert served_by(db.connect_read()) == 'primary'
+    assert db.REPLICA_POOL.stats()['opened'] == opened
+
+    db._replica['checked_at'] -= db.REPLICA_CHECK_SECONDS
+    assert served_by(db.connect_read()) == 'replica'
+
+
+def test_read_after_a_position_the_replica_has_not_replayed_goes_to_the_primary(db, replica, clean_database):
+    with replay_paused(replica):
+        position = add_user(db, 'mine@example.com')
+        assert position
+
+        # Свою запись клиент читает с основной; без позиции - со (старой) реплики
+        conn = db.connect_read(position)
+        assert conn.pool_name == 'primary'
+        assert sees_user(conn, 'mine@example.com')
+        conn = db.connect_read()
+        assert conn.pool_name == 'replica'
+        assert not sees_user(conn, 'mine@example.com')
+
+    wait_for_replica(clean_database.dsn, replica)
+    conn = db.connect_read(position)
+    assert conn.pool_name == 'replica'
+    assert sees_user(conn, 'mine@example.com')
+
+
+@pytest.mark.parametrize('value', ['', 'garbage', '0/', '/1', '1/2/3', 'G/1', '123456789/0', '0/1; DROP TABLE users'])
+def test_malformed_read_after_header_is_ignored(db, value):
+    assert db.read_after({'headers': {'X-Read-After': value}}) is None
+
+
+def test_read_after_header_is_case_insensitive_and_normalized(db):
+    assert db.read_after({'headers': {'x-read-after': ' 0/1a2b3c '}}) == '0/1A2B3C'
+    assert db.read_after({'headers': None}) is None
+    assert db.read_after({}) is None
+
+
+@pytest.fixture
+def payments(clean_database):
+    module = load_function('payments')
+    yield module
+    module.db.POOL.close()
+    module.db.REPLICA_POOL.close()
+
+
+def payment_status(payments, transaction_id, read_after):
+    return payments.handler({
+        'httpMethod': 'GET',
+        'queryStringParameters': {'path': f'status/{transaction_id}'},
+        'headers': {'X-Read-After': read_after},
+    }, None)
+
+
+def test_payment_status_with_a_malformed_header_reads_the_replica(payments, replica, clean_database):
+    conn = clean_database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO users (email, password_hash, name) VALUES ('s@example.com', '', 's') RETURNING id")
+        cur.execute("INSERT INTO transactions (user_id, amount, type, payment_system, status)"
+                    " VALUES (%s, 100, 'deposit', 'pally', 'pending') RETURNING id::text", (cur.fetchone()[0],))
+        transaction_id = cur.fetchone()[0]
+    conn.close()
+    wait_for_replica(clean_database.dsn, replica)
+
+    response = payment_status(payments, transaction_id, 'not-a-position')
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['transaction']['status'] == 'pending'
+    assert payments.db.REPLICA_POOL.stats()['opened'] == 1
+    assert payments.db.POOL.stats()['opened'] == 0
+
+    # Корректная позиция, которой реплика еще не достигла, - чтение с основной
+    response = payment_status(payments, transaction_id, 'FFFFFFFF/FFFFFFFF')
+    assert response['statusCode'] == 200
+    assert payments.db.POOL.stats()['opened'] == 1
+
+
+def terminate(database, conn):
+    admin = database.connect()
+    with admin, admin.cursor() as cur:
+        cur.execute('SELECT pg_terminate_backend(%s)', (conn.info.backend_pid,))
+    admin.close()
+
+
+def pool(db, **kwargs):
+    return db.Pool(**{'max_size': 2, 'acquire_timeout': 0.2, 'name': 'test', **kwargs})
+
+
+def test_pool_waits_for_a_free_connection_and_gives_up_at_the_timeout(db):
+    small = pool(db)
+    first, second = small.acquire(), small.acquire()
+
+    started = time.monotonic()
+    with pytest.raises(db.PoolExhausted):
+        small.acquire()
+    assert time.monotonic() - started >= 0.2
+    assert small.stats()['exhausted'] == 1
+
+    # Ждущий получает соединение, как только другое вернулось
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(small.acquire()))
+    small.acquire_timeout = 5
+    waiter.start()
+    time.sleep(0.1)
+    assert not got
+    first.close()
+    waiter.join()
+    assert got == [first]
+    assert small.stats() == {'opened': 2, 'reused': 1, 'idle': 0, 'size': 2, 'exhausted': 1}
+
+    for conn in (second, got[0]):
+        conn.close()
+    small.close()
+    assert small.stats()['size'] == 0
+
+
+def test_waiters_are_served_in_order_and_get_the_returned_connection(db):
+    small = pool(db, max_size=1, max_idle=0, acquire_timeout=5)
+    held = small.acquire()
+    order = []
+
+    def wait(name):
+        conn = small.acquire()
+        order.append((name, conn))
+        time.sleep(0.05)
+        conn.close()
+
+    waiters = []
+    for name in ('first', 'second', 'third'):
+        waiters.append(threading.Thread(target=wait, args=(name,)))
+        waiters[-1].start()
+        time.sleep(0.05)
+    held.close()
+    for waiter in waiters:
+        waiter.join()
+
+    assert [name for name, _ in order] == ['first', 'second', 'third']
+    # max_idle = 0, но ждущему соединение отдается, а не закрывается и открывается заново
+    assert all(conn is held for _, conn in order)
+    assert small.stats()['opened'] == 1
+    assert small.stats()['size'] == 0
+
+
+def test_broken_and_surplus_connections_free_their_place(db, clean_database):
+    small = pool(db, max_idle=0)
+    conn = small.acquire()
+    conn.close()
+    # max_idle = 0: вернувшееся соединение закрыто и места не держит
+    assert small.stats()['size'] == 0
+
+    first, second = small.acquire(), small.acquire()
+    terminate(clean_database, first)
+    with pytest.raises(psycopg2.OperationalError):
+        with first.cursor() as cur:
+            cur.execute('SELECT 1')
+    first.close()
+    assert small.stats()['size'] == 1
+
+    third = small.acquire()
+    assert served_by(third) == 'primary'
+    second.close()
+    assert small.stats()['size'] == 0
+
+
+def test_failed_connect_frees_its_place(db, monkeypatch):
+    small = pool(db)
+    monkeypatch.setenv('DATABASE_URL', 'postgresql://postgres@localhost:1/none')
+    for _ in range(3):
+        with pytest.raises(psycopg2.OperationalError):
+            small.acquire()
+    assert small.stats()['size'] == 0
+
+
+def test_exhausted_replica_pool_falls_back_without_marking_the_replica_unhealthy(db, replica, monkeypatch):
+    monkeypatch.setattr(db.REPLICA_POOL, 'max_size', 1)
+    monkeypatch.setattr(db.REPLICA_POOL, 'acquire_timeout', 0)
+    held = db.connect_read()
+    assert held.pool_name == 'replica'
+
+    assert served_by(db.connect_read()) == 'primary'
+    assert db._replica['healthy'] is True
+    held.close()
+    assert served_by(db.connect_read()) == 'replica'
+
+
+def server_prepared(conn):
+    with conn.cursor() as cur:
+        cur.execute('SELECT name FROM pg_prepared_statements')
+        return {row[0] for row in cur.fetchall()}
+
+
+def run_statement(db, conn, stmt, value=1):
+    with conn.cursor() as cur:
+        db.execute(cur, stmt, (value,))
+        return cur.fetchone()[0]
+
+
+@pytest.fixture
+def stmt(db):
+    return db.statement('test_echo', 'SELECT %s::int + 1')
+
+
+def test_statement_is_prepared_again_on_a_new_connection(db, stmt, clean_database):
+    conn = db.connect()
+    assert run_statement(db, conn, stmt) == 2
+    conn.commit()
+    assert server_prepared(conn) == {'test_echo'}
+    terminate(clean_database, conn)
+    with pytest.raises(psycopg2.OperationalError):
+        run_statement(db, conn, stmt)
+    conn.close()
+
+    conn = db.connect()
+    assert conn.prepared == set()
+    assert run_statement(db, conn, stmt, 41) == 42
+    assert server_prepared(conn) == {'test_echo'}
+    conn.close()
+
+
+@pytest.mark.parametrize('reset', ['DEALLOCATE ALL', 'DEALLOCATE test_echo', 'DISCARD ALL'])
+def test_statement_dropped_behind_the_catalog_is_prepared_again(db, stmt, reset):
+    conn = db.connect()
+    conn.autocommit = True
+    assert run_statement(db, conn, stmt) == 2
+    with conn.cursor() as cur:
+        cur.execute(reset)
+    assert server_prepared(conn) == set()
+
+    assert run_statement(db, conn, stmt, 41) == 42
+    assert conn.prepared == {'test_echo'}
+    assert server_prepared(conn) == {'test_echo'}
+    conn.close()
+
+
+def test_statement_dropped_at_transaction_start_is_prepared_again(db, stmt):
+    conn = db.connect()
+    assert run_statement(db, conn, stmt) == 2
+    conn.commit()
+    with conn.cursor() as cur:
+        cur.execute('DEALLOCATE ALL')
+    conn.commit()
+
+    # EXECUTE открывал транзакцию: откат ничего не теряет, запрос выполняется повторно
+    assert run_statement(db, conn, stmt, 41) == 42
+    conn.commit()
+    conn.close()
+
+
+def test_statement_dropped_inside_a_transaction_fails_once(db, stmt, clean_database):
+    conn = db.connect()
+    assert run_statement(db, conn, stmt) == 2
+    conn.commit()
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO users (email, password_hash, name) VALUES ('tx@example.com', '', 'tx')")
+        cur.execute('DEALLOCATE test_echo')
+
+    # Повтор потерял бы запись транзакции - ошибка уходит вызывающему
+    with pytest.raises(psycopg2.errors.InvalidSqlStatementName):
+        run_statement(db, conn, stmt)
+    conn.rollback()
+    assert run_statement(db, conn, stmt, 41) == 42
+    conn.commit()
+    conn.close()
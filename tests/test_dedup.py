@@ -0,0 +1,151 @@
+import random
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from tests.support import load_function
+
+DESCRIPTION = ('Требуется продавец-консультант в магазин электроники. Консультирование покупателей, '
+               'выкладка товара, работа с кассой. Официальное трудоустройство, обучение за счет компании.')
+
+
+@pytest.fixture(scope='module')
+def dedup():
+    return load_function('admin', 'dedup')
+
+
+def flip(signature, bits):
+    value = signature & ((1 << 64) - 1)
+    for bit in bits:
+        value ^= 1 << bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def test_simhash_is_a_signed_64_bit_word_signature(dedup):
+    signature = dedup.simhash('Продавец', DESCRIPTION)
+
+    assert -(1 << 63) <= signature < 1 << 63
+    assert dedup.simhash('продавец', DESCRIPTION.upper()) == signature
+    assert dedup.simhash('', '') is None
+    assert dedup.simhash('Ёлка', '') == dedup.simhash('елка', '')
+
+
+def test_edits_stay_within_max_distance_and_other_jobs_do_not(dedup):
+    original = dedup.simhash('Продавец-консультант', DESCRIPTION)
+    edited = dedup.simhash('Продавец-консультант', DESCRIPTION.replace(' Официальное трудоустройство,', ''))
+    other = dedup.simhash('Водитель категории C', 'Перевозка грузов по области, ремонт за счет компании, '
+                                                 'график 5/2, оплата два раза в месяц.')
+
+    assert dedup.hamming(original, edited) <= dedup.MAX_DISTANCE
+    assert dedup.hamming(original, other) > dedup.MAX_DISTANCE + 4
+
+
+def test_bands_cover_the_signature_with_wide_keys(dedup):
+    assert sum(dedup.BAND_WIDTHS) == 64
+    assert min(dedup.BAND_WIDTHS) >= 16
+    signature = flip(0, [0, 21, 22, 42, 43, 63])
+    assert dedup.bands(signature) == [(0, 1 | 1 << 21), (1, 1 | 1 << 20), (2, 1 | 1 << 20)]
+
+
+def test_probes_find_every_signature_within_max_distance(dedup):
+    masks = set(dedup.PROBE_MASKS)
+    rng = random.Random(37)
+    for _ in range(3000):
+        signature = rng.getrandbits(64) - (1 << 63)
+        distance = rng.randint(0, dedup.MAX_DISTANCE)
+        near = flip(signature, rng.sample(range(64), distance))
+        assert any(a ^ b in masks for (_, a), (_, b) in zip(dedup.bands(signature), dedup.bands(near)))
+
+    # Худший случай - различия поровну по полосам: 3 + 3 + 2
+    signature = rng.getrandbits(64) - (1 << 63)
+    near = flip(signature, [0, 1, 2, 22, 23, 24, 43, 44])
+    assert [bin(a ^ b).count('1') for (_, a), (_, b) in zip(dedup.bands(signature), dedup.bands(near))] == [3, 3, 2]
+    assert any(a ^ b in masks for (_, a), (_, b) in zip(dedup.bands(signature), dedup.bands(near)))
+
+
+@pytest.fixture
+def vacancies(clean_database):
+    """Создает вакансии с заданными подписями; возвращает их id по порядку создания"""
+    conn = clean_database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO users (email, password_hash, name) VALUES ('dedup@example.com', '', 'd') RETURNING id")
+        user_id = cur.fetchone()[0]
+    started = datetime(2026, 1, 1)
+
+    def create(count):
+        ids = [str(uuid.uuid4()) for _ in range(count)]
+        with conn, conn.cursor() as cur:
+            cur.execute('SELECT COUNT(*) FROM vacancies')
+            offset = cur.fetchone()[0]
+            for position, vacancy_id in enumerate(ids):
+                cur.execute("""
+                    INSERT INTO vacancies (id, user_id, title, description, salary, city, phone, created_at)
+                    VALUES (%s, %s, 't', 'd', '1', 'Киров', '1', %s)
+                """, (vacancy_id, user_id, started + timedelta(seconds=offset + position)))
+        return ids
+
+    def index(signatures):
+        with conn, conn.cursor() as cur:
+            return dedup_module._index(cur, signatures)
+
+    dedup_module = load_function('admin', 'dedup')
+    yield create, index, conn
+    conn.close()
+
+
+def duplicate_of(conn, ids):
+    with conn, conn.cursor() as cur:
+        cur.execute('SELECT id::text, duplicate_of::text FROM vacancies WHERE id = ANY(%s::uuid[])', (ids,))
+        return dict(cur.fetchall())
+
+
+def test_near_duplicates_join_the_earliest_vacancy(dedup, vacancies):
+    create, index, conn = vacancies
+    first, second, third, unrelated = create(4)
+    rng = random.Random(1)
+    base = rng.getrandbits(64) - (1 << 63)
+
+    assert index({first: base}) == {first: None}
+    assert index({second: flip(base, [5, 30, 60])}) == {second: first}
+    # Расстояние 8 до первой: в одной полосе 2 различия - находится через варианты полосы
+    assert index({third: flip(base, [0, 1, 2, 22, 23, 24, 43, 44])}) == {third: first}
+    assert index({unrelated: flip(base, list(range(0, 64, 4)))}) == {unrelated: None}
+    assert duplicate_of(conn, [first, second, third, unrelated]) == {
+        first: None, second: first, third: first, unrelated: None}
+
+
+def test_older_vacancy_indexed_later_becomes_the_root(dedup, vacancies):
+    create, index, conn = vacancies
+    old, young, copy = create(3)
+    base = random.Random(2).getrandbits(64) - (1 << 63)
+
+    index({young: base})
+    assert index({copy: flip(base, [1, 2])}) == {copy: young}
+
+    # Более ранняя вакансия (например, после бэкфилла) забирает кластер вместе с его дубликатами
+    assert index({old: flip(base, [40])}) == {old: None}
+    assert duplicate_of(conn, [old, young, copy]) == {old: None, young: old, copy: old}
+
+
+def test_lookup_reads_few_candidates_among_many_vacancies(dedup, vacancies):
+    create, index, conn = vacancies
+    rng = random.Random(3)
+    ids = create(3000)
+    signatures = {vacancy_id: rng.getrandbits(64) - (1 << 63) for vacancy_id in ids}
+    index(signatures)
+
+    probe = rng.getrandbits(64) - (1 << 63)
+    planted = [flip(probe, rng.sample(range(64), distance)) for distance in range(dedup.MAX_DISTANCE + 1)]
+    planted_ids = create(len(planted))
+    index(dict(zip(planted_ids, planted)))
+
+    query_id = create(1)[0]
+    with conn, conn.cursor() as cur:
+        cur.execute('DELETE FROM vacancy_simhash_bands WHERE vacancy_id = %s', (query_id,))
+        candidates = dedup._candidates(cur, [(query_id, band, value) for band, value in dedup.bands(probe)])
+    found = {candidate_id for _, candidate_id, _, _ in candidates}
+
+    # Все подписи в пределах MAX_DISTANCE найдены; случайных - единицы из 3000 (в среднем 718 * N / 2^21)
+    assert set(planted_ids) <= found
+    assert len(found - set(planted_ids)) < 20
@@ -0,0 +1,211 @@
+import hashlib
+import itertools
+
+import pytest
+
+from tests.benchmarks.stress_robokassa_webhook import Context
+from tests.support import load_function
+
+PASSWORD_2 = 'password2'
+
+
+@pytest.fixture
+def expiry(clean_database):
+    return load_function('admin', 'expiry')
+
+
+@pytest.fixture
+def user_id(clean_database):
+    conn = clean_database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO users (email, password_hash, name) VALUES ('ex@example.com', '', 'ex') RETURNING id")
+        created = str(cur.fetchone()[0])
+    conn.close()
+    return created
+
+
+def seed(database, user_id, orders=0, transactions=0, age_minutes=120, items_per_order=2):
+    """pending-заказы с позициями и pending-пополнения, созданные age_minutes назад"""
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO orders (order_number, user_name, user_email, amount, robokassa_inv_id, status, user_id,
+                                created_at, updated_at)
+            SELECT 'EX-' || n, 'ex', 'ex@example.com', 150.00, n, 'pending', %s,
+                   CURRENT_TIMESTAMP - %s * INTERVAL '1 minute', CURRENT_TIMESTAMP - %s * INTERVAL '1 minute'
+            FROM generate_series(1, %s) AS n
+            RETURNING id
+        """, (user_id, age_minutes, age_minutes, orders))
+        for (order_id,) in cur.fetchall():
+            cur.execute("""
+                INSERT INTO order_items (order_id, product_name, product_price)
+                SELECT %s, 'item ' || n, 75.00 FROM generate_series(1, %s) AS n
+            """, (order_id, items_per_order))
+        cur.execute("""
+            INSERT INTO transactions (user_id, amount, type, payment_system, status, created_at, updated_at)
+            SELECT %s, 500, 'deposit', 'pally', 'pending',
+                   CURRENT_TIMESTAMP - %s * INTERVAL '1 minute', CURRENT_TIMESTAMP - %s * INTERVAL '1 minute'
+            FROM generate_series(1, %s)
+            RETURNING id::text
+        """, (user_id, age_minutes, age_minutes, transactions))
+        transaction_ids = [row[0] for row in cur.fetchall()]
+    conn.close()
+    return transaction_ids
+
+
+def statuses(database, table):
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute(f'SELECT status, COUNT(*) FROM {table} GROUP BY status')
+        result = dict(cur.fetchall())
+    conn.close()
+    return result
+
+
+def count(database, sql, params=()):
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        value = cur.fetchone()[0]
+    conn.close()
+    return value
+
+
+def sweep(database, expiry, **kwargs):
+    params = {'expire_after_minutes': 60, 'batch_size': 100, 'time_budget': 30, **kwargs}
+    conn = database.connect()
+    try:
+        return expiry.sweep(conn, **params)
+    finally:
+        conn.close()
+
+
+def test_only_old_pending_rows_expire(expiry, user_id, clean_database):
+    seed(clean_database, user_id, orders=3, transactions=2)
+    seed(clean_database, user_id, transactions=1, age_minutes=5)
+
+    stats = sweep(clean_database, expiry, batch_size=2)
+
+    assert (stats['orders_expired'], stats['transactions_expired']) == (3, 2)
+    assert stats['remaining'] == {'orders': 0, 'transactions': 0}
+    assert statuses(clean_database, 'orders') == {'expired': 3}
+    assert statuses(clean_database, 'transactions') == {'expired': 2, 'pending': 1}
+
+
+def test_row_locked_by_a_webhook_is_skipped_and_expires_next_pass(expiry, user_id, clean_database):
+    transaction_ids = seed(clean_database, user_id, transactions=3)
+    webhook = clean_database.connect()
+    with webhook.cursor() as cur:
+        cur.execute('SELECT 1 FROM transactions WHERE id = %s FOR UPDATE', (transaction_ids[0],))
+
+    # Проход не ждет блокировки: остальные истекают, занятая остается pending
+    stats = sweep(clean_database, expiry)
+    assert stats['transactions_expired'] == 2
+    assert stats['remaining']['transactions'] == 1
+
+    webhook.rollback()
+    webhook.close()
+    stats = sweep(clean_database, expiry)
+    assert stats['transactions_expired'] == 1
+    assert statuses(clean_database, 'transactions') == {'expired': 3}
+
+
+def test_exhausted_budget_leaves_the_rest_for_the_next_call(expiry, user_id, clean_database, monkeypatch):
+    seed(clean_database, user_id, orders=5, transactions=4)
+    # Часы: бюджета хватает ровно на одну пачку
+    clock = itertools.chain([0.0, 0.0], itertools.repeat(100.0))
+    monkeypatch.setattr(expiry.time, 'monotonic', lambda: next(clock))
+
+    stats = sweep(clean_database, expiry, batch_size=2, time_budget=1)
+    monkeypatch.undo()
+
+    assert (stats['batches'], stats['orders_expired'], stats['transactions_expired']) == (1, 2, 0)
+    assert stats['remaining'] == {'orders': 3, 'transactions': 4}
+
+    stats = sweep(clean_database, expiry, batch_size=2)
+    assert (stats['orders_expired'], stats['transactions_expired']) == (3, 4)
+    assert stats['remaining'] == {'orders': 0, 'transactions': 0}
+
+
+def test_archive_moves_order_items_together_with_orders(expiry, user_id, clean_database):
+    seed(clean_database, user_id, orders=3, transactions=2, items_per_order=2)
+    sweep(clean_database, expiry)
+    conn = clean_database.connect()
+    with conn, conn.cursor() as cur:
+        # Одна строка истекла давно, остальные - только что
+        cur.execute("UPDATE orders SET updated_at = CURRENT_TIMESTAMP - INTERVAL '2 days' WHERE order_number = 'EX-1'")
+        cur.execute("UPDATE transactions SET updated_at = CURRENT_TIMESTAMP - INTERVAL '2 days'")
+    conn.close()
+
+    stats = sweep(clean_database, expiry, archive_after_minutes=24 * 60)
+
+    assert (stats['orders_archived'], stats['order_items_archived'], stats['transactions_archived']) == (1, 2, 2)
+    assert count(clean_database, "SELECT COUNT(*) FROM orders_archive WHERE order_number = 'EX-1'") == 1
+    assert count(clean_database, """
+        SELECT COUNT(*) FROM order_items_archive a JOIN orders_archive o ON o.id = a.order_id
+        WHERE o.order_number = 'EX-1' AND a.archived_at IS NOT NULL
+    """) == 2
+    assert count(clean_database, 'SELECT COUNT(*) FROM orders') == 2
+    assert count(clean_database, 'SELECT COUNT(*) FROM order_items') == 4
+    assert count(clean_database, 'SELECT COUNT(*) FROM transactions') == 0
+    assert count(clean_database, 'SELECT COUNT(*) FROM transactions_archive') == 2
+
+
+@pytest.fixture
+def payments(clean_database):
+    module = load_function('payments')
+    yield module
+    module.db.POOL.close()
+
+
+@pytest.fixture
+def robokassa_webhook(clean_database, monkeypatch):
+    monkeypatch.setenv('ROBOKASSA_PASSWORD_2', PASSWORD_2)
+    module = load_function('robokassa-webhook')
+    yield module
+    module.db.POOL.close()
+
+
+def robokassa_callback(webhook, inv_id, out_sum):
+    signature = hashlib.md5(f'{out_sum}:{inv_id}:{PASSWORD_2}'.encode()).hexdigest()
+    return webhook.handler({
+        'httpMethod': 'POST',
+        'headers': {},
+        'body': f'OutSum={out_sum}&InvId={inv_id}&SignatureValue={signature}',
+    }, Context())
+
+
+def test_late_payment_for_expired_rows_is_still_credited(expiry, payments, robokassa_webhook, user_id,
+                                                         clean_database):
+    transaction_id = seed(clean_database, user_id, orders=1, transactions=1)[0]
+    sweep(clean_database, expiry)
+
+    assert payments.complete_transaction(transaction_id, 'late-1')['outcome'] == 'credited'
+    assert robokassa_callback(robokassa_webhook, 1, '150.00')['body'] == 'OK1'
+
+    assert statuses(clean_database, 'transactions') == {'completed': 1}
+    assert statuses(clean_database, 'orders') == {'paid': 1}
+    assert count(clean_database, 'SELECT SUM(amount) FROM balance_ledger WHERE user_id = %s', (user_id,)) == 650
+
+
+def test_payment_for_archived_rows_is_not_credited(expiry, payments, robokassa_webhook, user_id, clean_database):
+    transaction_id = seed(clean_database, user_id, orders=1, transactions=1)[0]
+    sweep(clean_database, expiry)
+    conn = clean_database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("UPDATE orders SET updated_at = CURRENT_TIMESTAMP - INTERVAL '2 days'")
+        cur.execute("UPDATE transactions SET updated_at = CURRENT_TIMESTAMP - INTERVAL '2 days'")
+    conn.close()
+    sweep(clean_database, expiry, archive_after_minutes=24 * 60)
+
+    # Строки в архиве webhook-и не ищут: пополнение отвечает 404, Robokassa получает OK,
+    # а уведомление закрывается в robokassa_inbox с исходом not_found
+    result = payments.complete_transaction(transaction_id, 'late-1')
+    assert result['outcome'] == 'not_found'
+    assert payments.webhook_response(result)['statusCode'] == 404
+    assert robokassa_callback(robokassa_webhook, 1, '150.00')['body'] == 'OK1'
+    assert count(clean_database, 'SELECT outcome FROM robokassa_inbox WHERE inv_id = 1') == 'not_found'
+
+    assert count(clean_database, 'SELECT COUNT(*) FROM balance_ledger') == 0
+    assert count(clean_database, 'SELECT status FROM transactions_archive') == 'expired'
+    assert count(clean_database, 'SELECT status FROM orders_archive') == 'expired'
@@ -0,0 +1,181 @@
+import gzip
+import socket
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tests.support import FUNCTIONS, StubServer, load_function
+
+HOST = '127.0.0.1'
+PAYLOAD = 'Вакансия: продавец-консультант. '.encode() * 200
+
+
+def test_copies_are_identical():
+    copies = {(path / 'http_client.py').read_bytes() for path in FUNCTIONS.values() if (path / 'http_client.py').exists()}
+    assert len(copies) == 1
+
+
+@pytest.fixture
+def http_client():
+    return load_function('auth', 'http_client')
+
+
+@pytest.fixture
+def client(http_client):
+    created = http_client.HttpClient()
+    yield created
+    created.close()
+
+
+class RawServer:
+    """
+    HTTP-сервер на сокетах для обрывов соединения: reply(n) для n-го запроса возвращает
+    'keep' (ответить), 'close' (ответить и закрыть соединение) или 'drop' (прочитать
+    запрос и закрыть соединение без ответа). Запросы пишутся в requests как
+    (номер соединения, метод, путь).
+    """
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.requests = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._sock = socket.create_server((HOST, 0))
+        self.url = f'http://{HOST}:{self._sock.getsockname()[1]}'
+
+    def __enter__(self) -> 'RawServer':
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._sock.close()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            with self._lock:
+                self.connections += 1
+                number = self.connections
+            threading.Thread(target=self._serve, args=(conn, number), daemon=True).start()
+
+    def _serve(self, conn: socket.socket, number: int) -> None:
+        with conn, conn.makefile('rb') as reader:
+            while True:
+                line = reader.readline()
+                if not line:
+                    return
+                method, path, _ = line.decode().split(' ', 2)
+                length = 0
+                while True:
+                    header = reader.readline()
+                    if header in (b'\r\n', b''):
+                        break
+                    name, _, value = header.decode().partition(':')
+                    if name.strip().lower() == 'content-length':
+                        length = int(value)
+                reader.read(length)
+                with self._lock:
+                    self.requests.append((number, method, path))
+                    action = self.reply(len(self.requests))
+                if action == 'drop':
+                    conn.shutdown(socket.SHUT_RDWR)
+                    return
+                conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+                if action == 'close':
+                    conn.shutdown(socket.SHUT_RDWR)
+                    return
+
+
+def test_keep_alive_connection_is_reused(client):
+    with StubServer(lambda path: (200, b'ok')) as server:
+        for _ in range(3):
+            assert client.get(server.url + '/ping').text() == 'ok'
+
+    stats = client.stats()[HOST]
+    assert (stats['calls'], stats['reused_connections'], stats['errors']) == (3, 2, 0)
+
+
+def test_compressed_bodies_are_decoded(client):
+    raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    bodies = {
+        '/gzip': (gzip.compress(PAYLOAD), 'gzip'),
+        '/deflate': (zlib.compress(PAYLOAD), 'deflate'),
+        '/raw-deflate': (raw.compress(PAYLOAD) + raw.flush(), 'deflate'),
+        '/plain': (PAYLOAD, ''),
+    }
+
+    def respond(path):
+        body, encoding = bodies[path]
+        return 200, body, {'Content-Encoding': encoding} if encoding else {}
+
+    with StubServer(respond) as server:
+        for path in bodies:
+            assert client.get(server.url + path).body == PAYLOAD
+            with client.stream('GET', server.url + path, chunk_size=64) as response:
+                assert b''.join(response.iter_chunks()) == PAYLOAD
+
+
+def test_idempotent_requests_retry_with_growing_backoff(http_client, client, monkeypatch):
+    monkeypatch.setattr(http_client.random, 'uniform', lambda low, high: high)
+    statuses = iter([503, 503, 200])
+
+    with StubServer(lambda path: (next(statuses), b'')) as server:
+        assert client.get(server.url + '/feed').status == 200
+        started = [at for at, _ in server.requests]
+
+    gaps = [later - earlier for earlier, later in zip(started, started[1:])]
+    assert len(gaps) == 2
+    assert gaps[0] >= http_client.BACKOFF_BASE * 2
+    assert gaps[1] >= http_client.BACKOFF_BASE * 4
+    assert client.stats()[HOST]['retries'] == 2
+
+
+def test_retries_stop_after_max_retries_and_skip_non_idempotent_requests(http_client, client, monkeypatch):
+    monkeypatch.setattr(http_client.random, 'uniform', lambda low, high: 0)
+
+    with StubServer(lambda path: (503, b'')) as server:
+        assert client.get(server.url + '/feed').status == 503
+        assert len(server.requests) == http_client.MAX_RETRIES + 1
+        assert client.post(server.url + '/pay', data={'amount': 1}).status == 503
+        assert len(server.requests) == http_client.MAX_RETRIES + 2
+
+
+def test_post_is_not_resent_when_the_server_drops_it_after_receiving(http_client, client):
+    with RawServer(lambda number: 'drop' if number == 2 else 'keep') as server:
+        client.get(server.url + '/ping')
+        with pytest.raises(http_client.HttpError):
+            client.post(server.url + '/pay', data={'amount': 1})
+
+    assert server.requests == [(1, 'GET', '/ping'), (1, 'POST', '/pay')]
+
+
+def test_get_gets_one_free_retry_on_a_fresh_connection(client):
+    with RawServer(lambda number: 'drop' if number == 2 else 'keep') as server:
+        client.get(server.url + '/ping')
+        assert client.get(server.url + '/feed').text() == 'ok'
+
+    assert server.requests == [(1, 'GET', '/ping'), (1, 'GET', '/feed'), (2, 'GET', '/feed')]
+    assert client.stats()[HOST]['retries'] == 0
+
+
+def test_connection_closed_while_idle_is_not_used_for_post(client):
+    with RawServer(lambda number: 'close' if number == 1 else 'keep') as server:
+        client.get(server.url + '/ping')
+        assert client.post(server.url + '/pay', data={'amount': 1}).text() == 'ok'
+
+    assert server.requests == [(1, 'GET', '/ping'), (2, 'POST', '/pay')]
+    assert client.stats()[HOST]['reused_connections'] == 0
+
+
+def test_stats_are_exact_under_concurrent_calls(client):
+    calls = 400
+    with StubServer(lambda path: (200, b'ok')) as server, ThreadPoolExecutor(16) as pool:
+        list(pool.map(lambda _: client.get(server.url + '/ping'), range(calls)))
+
+    stats = client.stats()[HOST]
+    assert (stats['calls'], stats['errors']) == (calls, 0)
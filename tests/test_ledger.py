@@ -0,0 +1,102 @@
+from decimal import Decimal
+
+import pytest
+
+from tests.benchmarks.stress_balance_ledger import hot, mixed, seed_users
+from tests.support import load_function
+
+
+@pytest.fixture
+def ledger(clean_database):
+    return load_function('admin', 'ledger')
+
+
+def balance(database, ledger, user_id):
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute(f"SELECT {ledger.balance_sql('%s::uuid')}", (user_id,))
+        value = cur.fetchone()[0]
+    conn.close()
+    return value
+
+
+def credit(conn, ledger, user_id, amount, commit=True):
+    with conn.cursor() as cur:
+        assert ledger.append(cur, user_id, amount, 'test')
+    if commit:
+        conn.commit()
+
+
+def compact(database, ledger):
+    conn = database.connect()
+    try:
+        return ledger.compact(conn)
+    finally:
+        conn.close()
+
+
+def test_transaction_open_across_compaction_keeps_the_balance_exact(ledger, clean_database):
+    user_id = seed_users(clean_database, 1)[0]
+    early, late = clean_database.connect(), clean_database.connect()
+
+    # early получает xid раньше late, но фиксируется после прохода компактора
+    credit(early, ledger, user_id, 100, commit=False)
+    credit(late, ledger, user_id, 10)
+    assert balance(clean_database, ledger, user_id) == Decimal('10')
+
+    # xmin снимка компактора - xid early: ни одна из записей не сворачивается
+    assert compact(clean_database, ledger)['entries'] == 0
+    assert balance(clean_database, ledger, user_id) == Decimal('10')
+
+    early.commit()
+    assert balance(clean_database, ledger, user_id) == Decimal('110')
+    assert compact(clean_database, ledger)['entries'] == 2
+    assert balance(clean_database, ledger, user_id) == Decimal('110')
+
+    # Транзакция, начатая до прохода, пишет уже после него
+    with early.cursor() as cur:
+        cur.execute('SELECT 1')
+    assert compact(clean_database, ledger)['entries'] == 0
+    credit(early, ledger, user_id, 5)
+    assert balance(clean_database, ledger, user_id) == Decimal('115')
+    assert compact(clean_database, ledger)['entries'] == 1
+    assert balance(clean_database, ledger, user_id) == Decimal('115')
+
+    early.close()
+    late.close()
+
+
+def test_second_compactor_skips_while_one_is_running(ledger, clean_database):
+    running = clean_database.connect()
+    with running.cursor() as cur:
+        cur.execute('SELECT pg_advisory_xact_lock(%s)', (ledger.COMPACT_LOCK_ID,))
+
+    assert compact(clean_database, ledger) == {'skipped': True, 'users': 0, 'entries': 0}
+    running.rollback()
+    assert compact(clean_database, ledger)['skipped'] is False
+    running.close()
+
+
+def test_concurrent_credits_are_neither_lost_nor_folded_twice(clean_database):
+    payments = load_function('payments')
+    ledger = load_function('admin', 'ledger')
+    try:
+        result = mixed(clean_database, payments, ledger, users=10, transactions=300, adjustments=100,
+                       threads=12, compact_every_ms=2)
+    finally:
+        payments.db.POOL.close()
+
+    assert result['outcomes']['credited'] == 300
+    assert result['outcomes']['adjusted'] == 100
+    assert result['compactor_passes'] > 1
+    assert result['ledger_entries'] == result['folded_entries'] == 400
+    assert result['tail_after_final_pass'] == 0
+    assert result['wrong_balances'] == 0
+    assert result['changed_by_final_pass'] == 0
+
+
+def test_hot_user_balance_counts_every_commit(ledger, clean_database):
+    result = hot(clean_database, ledger, writers=8, seconds=0.5)
+
+    assert result['commits'] > 0
+    assert result['balance_exact']
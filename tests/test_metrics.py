@@ -0,0 +1,42 @@
+import pytest
+
+from tests.support import FUNCTIONS, load_function
+
+SCRAPE = {'httpMethod': 'GET', 'queryStringParameters': {'path': 'metrics'}, 'headers': {}}
+
+
+def test_copies_are_identical():
+    copies = {(path / 'metrics.py').read_bytes() for path in FUNCTIONS.values()}
+    assert len(copies) == 1
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    def load(token):
+        monkeypatch.setenv('METRICS_TOKEN', token)
+        metrics = load_function('auth', 'metrics')
+        return metrics.instrument('ping')(lambda event, context: {'statusCode': 200, 'body': 'pong'})
+    return load
+
+
+def scrape(handler, headers):
+    return handler({**SCRAPE, 'headers': headers}, None)
+
+
+def test_metrics_are_refused_without_a_configured_token(handler):
+    instrumented = handler('')
+
+    assert scrape(instrumented, {})['statusCode'] == 403
+    assert scrape(instrumented, {'Authorization': 'Bearer '})['statusCode'] == 403
+    assert scrape(instrumented, {'Authorization': 'Bearer anything'})['statusCode'] == 403
+
+
+def test_metrics_need_the_configured_token(handler):
+    instrumented = handler('secret')
+    instrumented({'httpMethod': 'GET', 'headers': {}}, None)
+
+    assert scrape(instrumented, {})['statusCode'] == 401
+    assert scrape(instrumented, {'Authorization': 'Bearer wrong'})['statusCode'] == 401
+    response = scrape(instrumented, {'authorization': 'Bearer secret'})
+    assert response['statusCode'] == 200
+    assert 'function_requests_total{' in response['body']
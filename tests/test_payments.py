@@ -0,0 +1,88 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tests.benchmarks.stress_payment_webhooks import replay
+from tests.support import StubServer, load_function
+
+
+@pytest.fixture
+def payments(clean_database):
+    module = load_function('payments')
+    yield module
+    module.db.POOL.close()
+
+
+def test_each_transaction_is_credited_exactly_once(payments, clean_database):
+    result = replay(clean_database, payments, users=10, transactions=150, threads=16)
+
+    assert result['statuses'] == {200: result['events'] - 1, 404: 1}
+    assert result['transaction_statuses'] == {'completed': 150}
+    assert result['not_credited'] == 0
+    assert result['credited_twice'] == 0
+    assert result['wrong_amount'] == 0
+    assert result['wrong_balances'] == 0
+
+
+def test_simultaneous_duplicates_credit_once(payments, clean_database):
+    conn = clean_database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO users (email, password_hash, name) VALUES ('dup@example.com', '', 'd') RETURNING id")
+        user_id = cur.fetchone()[0]
+        cur.execute("INSERT INTO transactions (user_id, amount, type, payment_system, status)"
+                    " VALUES (%s, 500, 'deposit', 'pally', 'pending') RETURNING id", (user_id,))
+        transaction_id = str(cur.fetchone()[0])
+
+    deliveries = 16
+    barrier = threading.Barrier(deliveries)
+
+    def deliver(_):
+        barrier.wait()
+        return payments.complete_transaction(transaction_id, 'p1')['outcome']
+
+    with ThreadPoolExecutor(deliveries) as pool:
+        outcomes = sorted(pool.map(deliver, range(deliveries)))
+
+    assert outcomes == ['credited'] + ['duplicate'] * (deliveries - 1)
+    with conn, conn.cursor() as cur:
+        cur.execute('SELECT COUNT(*), SUM(amount) FROM balance_ledger WHERE reference = %s', (transaction_id,))
+        assert cur.fetchone() == (1, 500)
+    conn.close()
+
+
+def test_create_payment_reuses_one_connection_and_holds_none_during_pally_call(clean_database, monkeypatch):
+    held_during_call = []
+
+    def pally(path):
+        stats = payments.db.POOL.stats()
+        held_during_call.append(stats['opened'] - stats['idle'])
+        return 200, json.dumps({'success': True, 'data': {'url': 'https://pally.example/pay'}}).encode()
+
+    with StubServer(pally) as server:
+        monkeypatch.setenv('PALLY_API_KEY', 'test')
+        monkeypatch.setenv('PALLY_API_URL', server.url)
+        payments = load_function('payments')
+        conn = clean_database.connect()
+        with conn, conn.cursor() as cur:
+            cur.execute("INSERT INTO users (email, password_hash, name) VALUES ('pay@example.com', '', 'p') RETURNING id")
+            user_id = str(cur.fetchone()[0])
+        conn.close()
+
+        calls = 20
+        for _ in range(calls):
+            response = payments.handler({
+                'httpMethod': 'POST',
+                'queryStringParameters': {'path': 'create-payment'},
+                'headers': {},
+                'body': json.dumps({'user_id': user_id, 'amount': 100, 'payment_system': 'pally'}),
+            }, None)
+            assert json.loads(response['body'])['payment_url'] == 'https://pally.example/pay'
+        stats = payments.db.POOL.stats()
+        payments.db.POOL.close()
+
+    # Запись транзакции и ссылки - два коротких запроса на одном соединении пула
+    assert stats['opened'] == 1
+    assert stats['reused'] == 2 * calls - 1
+    assert held_during_call == [0] * calls
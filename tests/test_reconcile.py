@@ -0,0 +1,153 @@
+import io
+import json
+from decimal import Decimal
+
+import pytest
+
+from tests.benchmarks.bench_reconcile import run
+from tests.support import load_function
+
+
+@pytest.fixture(scope='module')
+def reconcile():
+    return load_function('payments', 'reconcile')
+
+
+ARRAY = ('[12345678901234567890, -0.000125, 1.5e3, {"InvId": 7, "OutSum": "150.00", "tags": [1, 22, 333]},'
+         ' "a, ] b", true, null, 98765]')
+
+
+@pytest.mark.parametrize('chunk', [1, 2, 3, 5, 7, 11, 64])
+def test_json_array_items_survive_any_chunk_boundary(reconcile, monkeypatch, chunk):
+    monkeypatch.setattr(reconcile, 'READ_CHUNK', chunk)
+    stream = io.StringIO(ARRAY)
+    assert stream.read(1) == '['
+
+    assert list(reconcile.iter_json_array(stream)) == json.loads(ARRAY)
+
+
+def test_number_split_at_chunk_end_is_read_whole(reconcile, monkeypatch):
+    # Первый кусок заканчивается на "12": без дочитывания получилось бы 12 и 345
+    monkeypatch.setattr(reconcile, 'READ_CHUNK', 3)
+    stream = io.StringIO('[12345, 6]')
+    stream.read(1)
+
+    assert list(reconcile.iter_json_array(stream)) == [12345, 6]
+
+
+@pytest.mark.parametrize('text, expected', [('[]', []), ('[ \n ]', []), ('[1]', [1])])
+def test_short_arrays(reconcile, text, expected):
+    stream = io.StringIO(text)
+    stream.read(1)
+    assert list(reconcile.iter_json_array(stream)) == expected
+
+
+def test_truncated_array_is_an_error(reconcile):
+    stream = io.StringIO('[{"a": 1}, {"b": ')
+    stream.read(1)
+    with pytest.raises(json.JSONDecodeError):
+        list(reconcile.iter_json_array(stream))
+
+
+@pytest.mark.parametrize('text', [
+    'order_id,amount\na1,10.00\nb2,"1 234,50"\n',
+    '{"order_id": "a1", "amount": "10.00"}\n\n{"order_id": "b2", "amount": "1 234,50"}\n',
+    '  [{"order_id": "a1", "amount": "10.00"}, {"order_id": "b2", "amount": "1 234,50"}]',
+])
+def test_statement_format_is_detected_by_first_character(reconcile, text):
+    rows = list(reconcile.iter_statement(io.StringIO(text)))
+    assert [(row['order_id'], row['amount']) for row in rows] == [('a1', '10.00'), ('b2', '1 234,50')]
+
+
+def statement(*rows):
+    return [(key, None if amount is None else Decimal(amount), '') for key, amount in rows]
+
+
+def database(*rows):
+    return [(key, Decimal(amount), f'{status}:{int(status in ("completed", "paid"))}') for key, amount, status in rows]
+
+
+def test_match_partition_reports_every_mismatch_type(reconcile):
+    mismatches = list(reconcile.match_partition(
+        statement(
+            ('ok', '10'),
+            ('changed', '10.01'),
+            ('extra', '5'),
+            ('twice', '20'), ('twice', '20'),
+            ('twice-unknown', '7'), ('twice-unknown', '8'),
+            ('pending', '30'),
+            ('no-amount', None),
+        ),
+        database(
+            ('ok', '10', 'completed'),
+            ('changed', '10', 'completed'),
+            ('dropped', '40', 'completed'),
+            ('dropped-pending', '50', 'pending'),
+            ('twice', '20', 'completed'),
+            ('pending', '30', 'pending'),
+            ('no-amount', '60', 'completed'),
+        ),
+    ))
+
+    assert sorted((m['type'], m['key']) for m in mismatches) == [
+        ('amount_mismatch', 'changed'),
+        ('duplicate_in_statement', 'twice'),
+        ('duplicate_in_statement', 'twice-unknown'),
+        ('missing_in_db', 'extra'),
+        ('missing_in_db', 'twice-unknown'),
+        ('missing_in_statement', 'dropped'),
+        ('not_settled', 'pending'),
+    ]
+    by_key = {(m['type'], m['key']): m for m in mismatches}
+    assert by_key['amount_mismatch', 'changed']['db_amount'] == Decimal('10')
+    assert by_key['duplicate_in_statement', 'twice']['count'] == 2
+    assert by_key['missing_in_db', 'twice-unknown']['statement_amounts'] == [Decimal('7'), Decimal('8')]
+    assert by_key['duplicate_in_statement', 'twice-unknown']['count'] == 2
+    assert by_key['not_settled', 'pending']['db_status'] == 'pending'
+
+
+def test_minor_units_are_converted_and_keys_normalized(reconcile, tmp_path):
+    parts = reconcile.Partitions(str(tmp_path), 'statement', 4)
+    skipped = reconcile.partition_statement([
+        {'order_id': ' A1 ', 'amount': '15000'},
+        {'order_id': '', 'amount': '100'},
+        {'order_id': 'b2', 'amount': '1 234,50'},
+        {'order_id': 'c3', 'amount': 'n/a'},
+    ], parts, 'order_id', 'amount', minor_units=True)
+    parts.close()
+
+    rows = sorted(row for part in range(parts.count) for row in parts.read(part))
+    assert skipped == 1
+    assert rows == [('a1', Decimal('150'), ''), ('b2', Decimal('12.345'), ''), ('c3', None, '')]
+
+
+def test_minor_units_statement_matches_the_database(reconcile, clean_database):
+    conn = clean_database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO users (email, password_hash, name) VALUES ('r@example.com', '', 'r') RETURNING id")
+        user_id = cur.fetchone()[0]
+        cur.execute("""
+            INSERT INTO transactions (user_id, amount, type, payment_system, status)
+            VALUES (%s, 150.00, 'deposit', 'yoomoney', 'completed'), (%s, 99.90, 'deposit', 'yoomoney', 'completed')
+            RETURNING id::text
+        """, (user_id, user_id))
+        first, second = [row[0] for row in cur.fetchall()]
+    output = io.StringIO()
+    text = f'label,withdraw_amount\n{first.upper()},15000\n{second},9900\n'
+
+    summary = reconcile.reconcile(conn, io.StringIO(text), output, 'yoomoney', 'label', 'withdraw_amount',
+                                  minor_units=True, partitions=4)
+    conn.close()
+
+    assert summary['mismatches'] == {'amount_mismatch': 1}
+    assert json.loads(output.getvalue()) == {
+        'type': 'amount_mismatch', 'key': second, 'statement_amount': '99', 'db_amount': '99.90'}
+
+
+@pytest.mark.parametrize('provider, fmt', [('pally', 'csv'), ('pally', 'jsonl'), ('robokassa', 'json')])
+def test_reconcile_finds_exactly_the_injected_mismatches(clean_database, provider, fmt):
+    result = run(clean_database, provider, rows=3000, injected=10, fmt=fmt, partitions=8)
+
+    assert result['statement_rows'] == 3000 + 10
+    assert result['mismatches'] == result['expected']
+    assert result['expected']['not_settled'] == 3
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from tests.support import load_function, round_trips
+
+
+@pytest.fixture
+def robokassa(clean_database, monkeypatch):
+    monkeypatch.setenv('ROBOKASSA_MERCHANT_LOGIN', 'merchant')
+    monkeypatch.setenv('ROBOKASSA_PASSWORD_1', 'password1')
+    module = load_function('robokassa')
+    yield module
+    module.db.POOL.close()
+
+
+def create_order(robokassa, cart_size=2):
+    cart = [{'id': i, 'name': f'item {i}', 'price': 10.5, 'quantity': 1} for i in range(cart_size)]
+    response = robokassa.handler({
+        'httpMethod': 'POST',
+        'headers': {},
+        'body': json.dumps({'amount': 10.5 * cart_size, 'user_name': 'u', 'user_email': 'u@example.com',
+                            'cart_items': cart, 'success_url': 'https://example.com/s',
+                            'fail_url': 'https://example.com/f'}),
+    }, None)
+    assert response['statusCode'] == 200, response
+    return json.loads(response['body'])
+
+
+def inv_ids(database):
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute('SELECT robokassa_inv_id FROM orders ORDER BY id')
+        ids = [row[0] for row in cur.fetchall()]
+    conn.close()
+    return ids
+
+
+def test_invoice_block_follows_sequence_increment(robokassa, clean_database):
+    with round_trips(robokassa.db) as counts:
+        for _ in range(45):
+            create_order(robokassa)
+
+    assert inv_ids(clean_database) == list(range(100000, 100045))
+    # По запросу на заказ, nextval на каждый блок из 20 номеров и PREPARE при первом заказе
+    assert robokassa.INVOICE_IDS.block == 20
+    assert counts['queries'] == 45 + 3 + 1
+
+
+def test_changed_increment_never_hands_out_a_number_twice(robokassa, clean_database):
+    conn = clean_database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute('ALTER SEQUENCE orders_robokassa_inv_id_seq INCREMENT BY 5')
+    conn.close()
+
+    # Два теплых инстанса берут блоки из одной последовательности вперемешку
+    first = robokassa.InvoiceIds(robokassa.INVOICE_SEQUENCE)
+    second = robokassa.InvoiceIds(robokassa.INVOICE_SEQUENCE)
+    conn = clean_database.connect()
+    with conn, conn.cursor() as cur:
+        taken = [ids.take(cur) for _ in range(12) for ids in (first, second)]
+    conn.close()
+
+    assert first.block == second.block == 5
+    assert len(set(taken)) == len(taken)
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import time
+
+import pytest
+
+from tests.benchmarks.stress_robokassa_webhook import Context, run
+from tests.support import load_function
+
+PASSWORD_2 = 'password2'
+
+
+@pytest.fixture
+def webhook(clean_database, monkeypatch):
+    monkeypatch.setenv('ROBOKASSA_PASSWORD_2', PASSWORD_2)
+    monkeypatch.setenv('ROBOKASSA_DRAIN_TOKEN', 'drain-token')
+    module = load_function('robokassa-webhook')
+    yield module
+    module.db.POOL.close()
+
+
+@pytest.fixture
+def user_id(clean_database):
+    conn = clean_database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO users (email, password_hash, name) VALUES ('rk@example.com', '', 'rk') RETURNING id")
+        created = str(cur.fetchone()[0])
+        cur.execute("""
+            INSERT INTO orders (order_number, user_name, user_email, amount, robokassa_inv_id, status, user_id)
+            VALUES ('RK-1', 'rk', 'rk@example.com', 150.00, 1, 'pending', %s)
+        """, (created,))
+    conn.close()
+    return created
+
+
+def callback(webhook, inv_id, out_sum):
+    signature = hashlib.md5(f'{out_sum}:{inv_id}:{PASSWORD_2}'.encode()).hexdigest()
+    return webhook.handler({
+        'httpMethod': 'POST',
+        'headers': {},
+        'body': f'OutSum={out_sum}&InvId={inv_id}&SignatureValue={signature}',
+    }, Context())
+
+
+def drain(webhook, headers):
+    return webhook.handler({'httpMethod': 'GET', 'queryStringParameters': {'drain': '1'}, 'headers': headers}, None)
+
+
+def order_state(database, inv_id=1):
+    conn = database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute('SELECT status FROM orders WHERE robokassa_inv_id = %s', (inv_id,))
+        status = cur.fetchone()[0]
+        cur.execute('SELECT outcome, last_error FROM robokassa_inbox WHERE inv_id = %s', (inv_id,))
+        inbox = cur.fetchone()
+        cur.execute("SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM balance_ledger WHERE reference = 'RK-1'")
+        ledger = cur.fetchone()
+    conn.close()
+    return status, inbox, ledger
+
+
+def test_callback_is_applied_before_ok(webhook, user_id, clean_database):
+    response = callback(webhook, 1, '150.00')
+
+    assert (response['statusCode'], response['body']) == (200, 'OK1')
+    assert order_state(clean_database) == ('paid', ('paid', None), (1, 150))
+
+
+def test_repeated_callback_credits_once(webhook, user_id, clean_database):
+    for _ in range(3):
+        assert callback(webhook, 1, '150.00')['body'] == 'OK1'
+
+    assert order_state(clean_database) == ('paid', ('paid', None), (1, 150))
+
+
+def test_out_sum_different_from_order_amount_is_not_credited(webhook, user_id, clean_database):
+    response = callback(webhook, 1, '1.00')
+
+    assert response['statusCode'] == 200
+    status, (outcome, last_error), ledger = order_state(clean_database)
+    assert (status, outcome, ledger) == ('pending', 'amount_mismatch', (0, 0))
+    assert last_error == 'OutSum 1.00 != order amount 150.00'
+
+
+def test_locked_orders_defer_the_callback_to_the_next_drain(webhook, user_id, clean_database):
+    locker = clean_database.connect()
+    with locker.cursor() as cur:
+        cur.execute('LOCK TABLE orders IN EXCLUSIVE MODE')
+        started = time.monotonic()
+        response = callback(webhook, 1, '150.00')
+        elapsed = time.monotonic() - started
+    locker.commit()
+    locker.close()
+
+    # Ответ не ждет блокировку дольше ROBOKASSA_INBOX_LOCK_TIMEOUT; запись остается в очереди
+    assert response['body'] == 'OK1'
+    assert elapsed < webhook.INBOX_LOCK_TIMEOUT + 1
+    assert order_state(clean_database) == ('pending', (None, None), (0, 0))
+
+    stats = json.loads(drain(webhook, {'X-Drain-Token': 'drain-token'})['body'])
+    assert (stats['claimed'], stats['paid'], stats['credited']) == (1, 1, 1)
+    assert order_state(clean_database) == ('paid', ('paid', None), (1, 150))
+
+
+def test_drain_requires_token(webhook, clean_database, monkeypatch):
+    assert drain(webhook, {})['statusCode'] == 403
+    assert drain(webhook, {'X-Drain-Token': 'wrong'})['statusCode'] == 403
+    assert drain(webhook, {'x-drain-token': 'drain-token'})['statusCode'] == 200
+
+    monkeypatch.delenv('ROBOKASSA_DRAIN_TOKEN')
+    assert drain(webhook, {'X-Drain-Token': ''})['statusCode'] == 403
+
+
+@pytest.mark.parametrize('lock_window', [False, True])
+def test_each_order_is_credited_exactly_once_under_load(webhook, clean_database, lock_window):
+    result = run(clean_database, webhook, 'current', orders=200, threads=16, lock_window=lock_window)
+
+    assert result['statuses'] == {200: 400}
+    assert result['paid'] == 200
+    assert result['not_credited'] == 0
+    assert result['credited_twice'] == 0
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from tests.support import load_function
+
+
+@pytest.fixture
+def vk_auth():
+    module = load_function('vk-auth')
+    yield module
+    module.db.POOL.close()
+
+
+def sweep(vk_auth, headers=None):
+    response = vk_auth.handler({
+        'httpMethod': 'POST',
+        'queryStringParameters': {'action': 'sweep'},
+        'headers': headers or {},
+        'body': '',
+    }, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+@pytest.mark.parametrize('configured, headers', [
+    ('', {}),
+    ('', {'X-Sweep-Token': ''}),
+    ('s3cret-token', {}),
+    ('s3cret-token', {'X-Sweep-Token': 'wrong'}),
+])
+def test_sweep_requires_shared_secret(vk_auth, monkeypatch, configured, headers):
+    monkeypatch.setenv('SWEEP_TOKEN', configured)
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    # До базы дело не доходит: без DATABASE_URL соединение дало бы 500
+    assert sweep(vk_auth, headers)[0] == 403
+
+
+def test_sweep_deletes_expired_tokens(vk_auth, clean_database, monkeypatch):
+    monkeypatch.setenv('SWEEP_TOKEN', 's3cret-token')
+    conn = clean_database.connect()
+    with conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO refresh_tokens (user_id, token_hash, expires_at)
+            SELECT gen_random_uuid(), md5(i::text), NOW() + (CASE WHEN i % 2 = 0 THEN -1 ELSE 1 END) * INTERVAL '1 day'
+            FROM generate_series(1, 10) i
+        """)
+
+    status, stats = sweep(vk_auth, {'x-sweep-token': 's3cret-token'})
+    assert (status, stats['deleted']) == (200, 5)
+    with conn, conn.cursor() as cur:
+        cur.execute('SELECT count(*) FROM refresh_tokens')
+        assert cur.fetchone()[0] == 5
+    conn.close()